@@ -0,0 +1,231 @@
+"""
+文件说明：CAN接收调度器
+每个 (设备句柄, CAN通道) 只运行一个调度线程，由它独占调用 CAN_GetMsg，
+收到的报文按ID查表分发到各订阅者队列（UDS应答、界面监视、日志等），
+订阅者在报文到达时立即被唤醒，不再各自轮询设备缓冲区而互相"抢"报文。
+
+用法：
+    with get_dispatcher(DevHandle, CANIndex).subscribe([0x71B]) as sub:
+        CAN_SendMsg(DevHandle, CANIndex, byref(msg), 1)
+        for response in sub.iter_frames(timeout=1.0):
+            ...
+"""
+import collections
+import threading
+import time
+from ctypes import byref
+
+from usb2can import CAN_MSG
+from CANPoller import RxBatchBuffer, RxStats, AdaptivePoller, get_msg_func
+
+
+class Subscription:
+    """
+    订阅者队列
+    ids 为 None 时接收该通道的全部报文；队列满后丢弃最旧的报文并计入 dropped
+    raw_batches 为 True 时（仅限全部报文订阅）队列元素为每次接收的 ctypes 报文数组，
+    可直接交给 can_numpy.decode 批量解码，此时 maxlen 和 dropped 按数组计
+    队列中的报文对象由所有订阅者共享，订阅者只读不写
+    """
+
+    def __init__(self, dispatcher, ids=None, maxlen=4096, raw_batches=False):
+        if raw_batches and ids is not None:
+            raise ValueError("raw_batches 只能用于全部报文订阅(ids=None)")
+        self.dispatcher = dispatcher
+        self.ids = frozenset(ids) if ids is not None else None
+        self.raw_batches = raw_batches
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+
+    def _put(self, msgs):
+        with self._cond:
+            self._queue.extend(msgs)
+            overflow = len(self._queue) - self.maxlen
+            if overflow > 0:
+                for _ in range(overflow):
+                    self._queue.popleft()
+                self.dropped += overflow
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """取一帧报文，timeout 秒内没有报文返回None"""
+        with self._cond:
+            if not self._queue and not self._cond.wait_for(lambda: self._queue, timeout):
+                return None
+            return self._queue.popleft()
+
+    def get_batch(self, timeout=None):
+        """取出队列中当前全部报文（列表），timeout 秒内没有报文返回空列表"""
+        with self._cond:
+            if not self._queue and not self._cond.wait_for(lambda: self._queue, timeout):
+                return []
+            batch = list(self._queue)
+            self._queue.clear()
+            return batch
+
+    def iter_frames(self, timeout):
+        """在 timeout 秒内逐帧返回到达的报文，报文到达即唤醒"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            msg = self.get(remaining)
+            if msg is None:
+                return
+            yield msg
+
+    def clear(self):
+        with self._cond:
+            self._queue.clear()
+
+    def close(self):
+        self.dispatcher.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CANDispatcher(threading.Thread):
+    """
+    单通道接收调度线程
+    路由表为 {ID: (订阅者, ...)}，订阅变化时整体替换，接收循环读取时无需加锁
+    """
+
+    def __init__(self, device_handle, can_channel, msg_type=CAN_MSG, buffer_size=1024,
+                 latency_target=0.001, cpu_target=0.05):
+        super().__init__(daemon=True)
+        self.device_handle = device_handle
+        self.can_channel = can_channel
+        self.msg_type = msg_type
+        self.buffers = RxBatchBuffer(msg_type, buffer_size)
+        self.stats = RxStats()
+        self.poller = AdaptivePoller(latency_target, cpu_target)
+        self.running = True
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._monitors = ()
+
+    def subscribe(self, ids=None, maxlen=4096, raw_batches=False):
+        """
+        订阅报文
+        :param ids: 关心的报文ID列表，None 表示全部报文
+        :param raw_batches: 按接收批次获取 ctypes 报文数组（用于NumPy批量解码）
+        :return: Subscription，使用完毕后调用 close()（或使用 with 语句）
+        """
+        sub = Subscription(self, ids, maxlen, raw_batches)
+        with self._lock:
+            if sub.ids is None:
+                self._monitors = self._monitors + (sub,)
+            else:
+                routes = dict(self._routes)
+                for msg_id in sub.ids:
+                    routes[msg_id] = routes.get(msg_id, ()) + (sub,)
+                self._routes = routes
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub.ids is None:
+                self._monitors = tuple(s for s in self._monitors if s is not sub)
+            else:
+                routes = dict(self._routes)
+                for msg_id in sub.ids:
+                    remaining = tuple(s for s in routes.get(msg_id, ()) if s is not sub)
+                    if remaining:
+                        routes[msg_id] = remaining
+                    else:
+                        routes.pop(msg_id, None)
+                self._routes = routes
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats.update(self.poller.snapshot())
+        return stats
+
+    def _dispatch(self, batch):
+        routes = self._routes
+        monitors = self._monitors
+        if monitors:
+            frames = None
+            for sub in monitors:
+                if sub.raw_batches:
+                    sub._put((batch,))
+                    continue
+                if frames is None:
+                    frames = list(batch)
+                sub._put(frames)
+        if not routes:
+            return
+        # 每个订阅者每轮只唤醒一次
+        targets = {}
+        for msg in batch:
+            subs = routes.get(msg.ID)
+            if subs:
+                for sub in subs:
+                    targets.setdefault(sub, []).append(msg)
+        for sub, msgs in targets.items():
+            sub._put(msgs)
+
+    def run(self):
+        get_msg = get_msg_func(self.msg_type)
+        buffers = self.buffers
+        rx_ref = byref(buffers.rx_buffer)
+        poller = self.poller
+        while self.running:
+            poll_start = time.perf_counter()
+            CanNum = get_msg(self.device_handle, self.can_channel, rx_ref, buffers.rx_size)
+            if CanNum > 0:
+                self.stats.add_frames(CanNum)
+                self.stats.add_batch()
+                self._dispatch(buffers.snapshot(CanNum))
+            elif CanNum < 0:
+                self.stats.add_error()
+            poller.after_poll(CanNum, poll_start)
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(device_handle, can_channel, msg_type=CAN_MSG, **kwargs):
+    """
+    获取 (设备句柄, CAN通道) 对应的调度器，不存在时创建并启动
+    同一通道只能使用一种报文类型（CAN_MSG 或 CANFD_MSG）
+    """
+    key = (int(device_handle), int(can_channel))
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher = CANDispatcher(device_handle, can_channel, msg_type, **kwargs)
+            _dispatchers[key] = dispatcher
+            dispatcher.start()
+        elif dispatcher.msg_type is not msg_type:
+            raise ValueError(f"CAN通道{can_channel}已按{dispatcher.msg_type.__name__}接收，不能再按{msg_type.__name__}订阅")
+        return dispatcher
+
+
+def stop_dispatcher(device_handle, can_channel, timeout=1.0):
+    """停止指定通道的调度器（关闭设备前调用）"""
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.pop((int(device_handle), int(can_channel)), None)
+    if dispatcher is not None:
+        dispatcher.stop()
+        dispatcher.join(timeout)
+
+
+def stop_all_dispatchers(timeout=1.0):
+    with _dispatchers_lock:
+        dispatchers = list(_dispatchers.values())
+        _dispatchers.clear()
+    for dispatcher in dispatchers:
+        dispatcher.stop()
+        dispatcher.join(timeout)
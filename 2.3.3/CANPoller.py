@@ -0,0 +1,184 @@
+"""
+文件说明：CAN接收轮询公共组件（不依赖Qt，可在GUI线程和后台线程中复用）
+    RxBatchBuffer：预分配的接收缓冲区，轮询过程中不再重复分配
+    RxStats：接收统计，帧/秒、批次/秒、丢帧数
+    AdaptivePoller：自适应轮询，有报文时连续轮询，空闲时指数退避等待
+"""
+import threading
+import time
+
+from usb2can import CAN_MSG, CAN_GetMsgWithSize
+from usb2canfd import CANFD_MSG, CANFD_GetMsg
+
+
+def get_msg_func(msg_type):
+    """
+    根据报文类型返回读取函数，统一为 func(DevHandle, CANIndex, pBuffer, BufferSize)
+    """
+    if msg_type is CANFD_MSG:
+        return CANFD_GetMsg
+    return CAN_GetMsgWithSize
+
+
+class RxBatchBuffer:
+    """
+    预分配的接收缓冲区
+    rx_buffer 每次轮询时复用，作为 CAN_GetMsg 的目标数组，snapshot 把读到的报文拷贝出来交给订阅者
+    """
+
+    def __init__(self, msg_type=CAN_MSG, rx_size=1024):
+        self.msg_type = msg_type
+        self.rx_size = rx_size
+        self.rx_buffer = (msg_type * rx_size)()
+
+    def snapshot(self, count):
+        """把 rx_buffer 前 count 帧拷贝为一个紧凑数组（单次内存拷贝）"""
+        return (self.msg_type * count).from_buffer_copy(self.rx_buffer)
+
+
+class RxStats:
+    """接收统计，计数器线程安全，速率在 update_rates() 调用时按区间计算"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self.frames_per_sec = 0.0
+        self.batches_per_sec = 0.0
+        self._last_time = time.perf_counter()
+        self._last_frames = 0
+        self._last_batches = 0
+
+    def add_frames(self, count):
+        with self.lock:
+            self.frames += count
+
+    def add_batch(self):
+        with self.lock:
+            self.batches += 1
+
+    def add_dropped(self, count):
+        with self.lock:
+            self.dropped += count
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def update_rates(self):
+        """按距上次调用的时间间隔刷新帧/秒和批次/秒，返回统计快照"""
+        now = time.perf_counter()
+        with self.lock:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                self.frames_per_sec = (self.frames - self._last_frames) / elapsed
+                self.batches_per_sec = (self.batches - self._last_batches) / elapsed
+            self._last_time = now
+            self._last_frames = self.frames
+            self._last_batches = self.batches
+        return self.snapshot()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "frames": self.frames,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "frames_per_sec": self.frames_per_sec,
+                "batches_per_sec": self.batches_per_sec,
+            }
+
+
+class AdaptivePoller:
+    """
+    自适应轮询策略
+    有报文时连续轮询（不休眠），连续 spin_polls 次空轮询后开始短等待，
+    等待时间从 floor 开始按2倍指数退避，最长不超过 ceiling，收到报文后立即恢复连续轮询。
+        floor   = max(min_sleep, 按 cpu_target 估算的最小等待时间)
+        ceiling = min(max_sleep, latency_target)
+    空闲时CPU占用约为 单次轮询耗时/(单次轮询耗时+等待时间)，因此满足 cpu_target 所需的
+    最小等待时间由实测的轮询耗时推算；若与 latency_target 冲突，以延迟目标优先。
+    """
+
+    def __init__(self, latency_target=0.001, cpu_target=0.05, spin_polls=200,
+                 min_sleep=0.0001, max_sleep=0.005):
+        """
+        :param latency_target: 空闲时允许的最大唤醒延迟（秒）
+        :param cpu_target: 空闲时期望的CPU占用比例（0~1）
+        :param spin_polls: 连续空轮询多少次后开始等待
+        :param min_sleep: 退避等待下限（秒）
+        :param max_sleep: 退避等待上限（秒）
+        """
+        self.latency_target = latency_target
+        self.cpu_target = cpu_target
+        self.spin_polls = spin_polls
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.poll_cost = 0.0          # 单次轮询耗时（指数滑动平均）
+        self.current_sleep = 0.0      # 当前退避等待时间
+        self._empty_polls = 0
+        self._slept = False           # 上一次空轮询后是否休眠过
+        self._last_empty_poll = None  # 上一次空轮询读取返回的时间
+        self.wake_count = 0
+        self.wake_latency_last = 0.0
+        self.wake_latency_max = 0.0
+        self._wake_latency_sum = 0.0
+        self.idle_sleep_time = 0.0    # 累计休眠时间
+        self.idle_poll_time = 0.0     # 累计空轮询耗时
+
+    def _floor(self):
+        floor = self.min_sleep
+        if 0 < self.cpu_target < 1:
+            floor = max(floor, self.poll_cost * (1 - self.cpu_target) / self.cpu_target)
+        return min(floor, self._ceiling())
+
+    def _ceiling(self):
+        return min(self.max_sleep, self.latency_target)
+
+    def after_poll(self, count, poll_start):
+        """
+        每次 CAN_GetMsg 之后调用，根据本次是否收到报文决定是否等待
+        :param count: 本次读到的报文数
+        :param poll_start: 本次轮询开始时间（time.perf_counter()）
+        """
+        now = time.perf_counter()
+        cost = now - poll_start
+        self.poll_cost = cost if self.poll_cost == 0.0 else self.poll_cost * 0.9 + cost * 0.1
+        if count > 0:
+            if self._slept and self._last_empty_poll is not None:
+                # 从上一次空轮询到本次读到报文的时间，即空闲后报文的最大响应延迟
+                latency = poll_start - self._last_empty_poll
+                self.wake_count += 1
+                self.wake_latency_last = latency
+                self._wake_latency_sum += latency
+                if latency > self.wake_latency_max:
+                    self.wake_latency_max = latency
+            self._empty_polls = 0
+            self._slept = False
+            self.current_sleep = 0.0
+            return
+        self._empty_polls += 1
+        self.idle_poll_time += cost
+        self._last_empty_poll = now
+        if self._empty_polls > self.spin_polls:
+            if self.current_sleep == 0.0:
+                self.current_sleep = self._floor()
+            else:
+                self.current_sleep = min(self.current_sleep * 2, self._ceiling())
+            time.sleep(self.current_sleep)
+            self.idle_sleep_time += self.current_sleep
+            self._slept = True
+
+    def snapshot(self):
+        idle_total = self.idle_poll_time + self.idle_sleep_time
+        return {
+            "wake_latency_last": self.wake_latency_last,
+            "wake_latency_avg": self._wake_latency_sum / self.wake_count if self.wake_count else 0.0,
+            "wake_latency_max": self.wake_latency_max,
+            "poll_cost": self.poll_cost,
+            "current_sleep": self.current_sleep,
+            "idle_cpu": self.idle_poll_time / idle_total if idle_total > 0 else 0.0,
+        }
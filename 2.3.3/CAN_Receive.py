@@ -1,32 +1,95 @@
 # can_receiver.py
+import time
 from PyQt5.QtCore import QThread, pyqtSignal
-from time import sleep
-from ctypes import byref
 from usb2can import CAN_MSG
+from CANPoller import RxStats
+from CANDispatcher import get_dispatcher
 
 class CANReceiver(QThread):
     message_received = pyqtSignal(object)  # 接收的消息对象
+    batch_received = pyqtSignal(object)    # 批量模式：一次唤醒或一个时间窗口内的报文列表
+    stats_updated = pyqtSignal(dict)       # 接收统计：帧/秒、批次/秒、丢帧数
 
-    def __init__(self, device_handle, can_channel, msg_type, parent=None):
-        import threading
-        self.lock = threading.Lock()
+    def __init__(self, device_handle, can_channel, msg_type, parent=None,
+                 batch_mode=False, batch_window_ms=0, buffer_size=1024,
+                 max_pending=8192, stats_interval=1.0,
+                 adaptive=True, latency_target_ms=1.0, cpu_target=0.05):
+        """
+        报文由通道调度器（CANDispatcher）统一读取，本线程作为"全部报文"订阅者
+        :param batch_mode: False-逐帧发送 message_received（兼容旧用法），True-按批发送 batch_received
+        :param batch_window_ms: 批量模式下的时间窗口：收到报文后继续累积该窗口内到达的报文，合并为一批发送，
+                                0 表示每次唤醒发送一批
+        :param buffer_size: 调度器单次 CAN_GetMsg 的接收缓冲区大小（帧）
+        :param max_pending: 订阅队列最多缓存的帧数，超出部分计为丢帧
+        :param stats_interval: stats_updated 信号的发送间隔（秒）
+        :param adaptive: True-空闲时自适应退避等待，False-保持连续轮询
+        :param latency_target_ms: 空闲时允许的最大唤醒延迟（毫秒）
+        :param cpu_target: 空闲时期望的CPU占用比例
+        调度器参数（buffer_size/adaptive/latency_target_ms/cpu_target）只在该通道的调度器首次创建时生效
+        """
         super().__init__(parent)
         self.device_handle = device_handle
         self.can_channel = can_channel
         self.msg_type = msg_type
+        self.batch_mode = batch_mode
+        self.batch_window_ms = batch_window_ms
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.stats_interval = stats_interval
+        self.latency_target = latency_target_ms / 1000.0 if adaptive else 0.0
+        self.cpu_target = cpu_target
+        self.stats = RxStats()
+        self.dispatcher = None
+        self.subscription = None
         self.running = True
 
     def stop(self):
         self.running = False
 
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        if self.subscription:
+            stats["dropped"] = self.subscription.dropped
+        if self.dispatcher:
+            dispatcher_stats = self.dispatcher.get_stats()
+            stats["errors"] = dispatcher_stats.pop("errors")
+            for key in ("frames", "batches", "dropped", "frames_per_sec", "batches_per_sec"):
+                dispatcher_stats.pop(key)
+            stats.update(dispatcher_stats)
+        return stats
+
     def run(self):
-        from usb2can import CAN_GetMsg, CAN_MSG
-        while self.running:
-            CanMsgBuffer = (self.msg_type * 1024)()
-            CanNum = CAN_GetMsg(self.device_handle, self.can_channel, byref(CanMsgBuffer))
-            if CanNum > 0:
-                for i in range(CanNum):
-                    with self.lock:
-                        self.message_received.emit(CanMsgBuffer[i])
-            # 移除延迟以提高实时性
-    
\ No newline at end of file
+        self.dispatcher = get_dispatcher(self.device_handle, self.can_channel, self.msg_type,
+                                         buffer_size=self.buffer_size,
+                                         latency_target=self.latency_target,
+                                         cpu_target=self.cpu_target)
+        self.subscription = self.dispatcher.subscribe(None, self.max_pending)
+        window = self.batch_window_ms / 1000.0
+        last_stats = time.perf_counter()
+        try:
+            while self.running:
+                # 报文到达即唤醒，超时只用于检查 running 标志
+                batch = self.subscription.get_batch(0.1)
+                if batch and self.batch_mode and window > 0:
+                    # 累积一个时间窗口内到达的报文，合并为一批
+                    deadline = time.perf_counter() + window
+                    while self.running:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        batch += self.subscription.get_batch(remaining)
+                if batch:
+                    self.stats.add_frames(len(batch))
+                    if self.batch_mode:
+                        self.stats.add_batch()
+                        self.batch_received.emit(batch)
+                    else:
+                        for msg in batch:
+                            self.message_received.emit(msg)
+                now = time.perf_counter()
+                if now - last_stats >= self.stats_interval:
+                    self.stats.update_rates()
+                    self.stats_updated.emit(self.get_stats())
+                    last_stats = now
+        finally:
+            self.subscription.close()
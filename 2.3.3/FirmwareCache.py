@@ -0,0 +1,196 @@
+"""
+文件说明：按内容寻址的固件磁盘缓存
+产线上同一个镜像每天刷写到大量ECU，每次启动工具都要重新解析 HEX/S-record 文件和压缩镜像。
+本缓存把这些结果按内容的 SHA-256 保存在磁盘上，重复刷写时直接映射使用：
+    load_firmware：按文件内容缓存解析得到的段表和段数据，命中时各段为缓存文件映射的 memoryview，不再解析
+    entry        ：按 (镜像SHA-256, 压缩方法) 缓存镜像长度和压缩后的数据，
+                   由 UDS_service.download 的 cache 参数在压缩下载时使用，压缩下载在进程之间也只压缩一次
+每个缓存项是缓存目录下的一个子目录，使用时更新目录的修改时间，总大小超过 max_bytes 时删除最久未使用的项（LRU）。
+文件先写临时文件再改名，多个进程共用缓存目录时不会读到写了一半的文件。
+0x36 块的切分和帧编码不缓存：IsoTpFrameFormat.encode 按列批量编码一个块的耗时低于从缓存文件映射同样多的报文。
+内存完整性检查的校验值（FirmwareDigest）也不缓存：它在传输数据时逐块累计，按所选算法覆盖实际刷写的整个区域。
+
+用法：
+    cache = FirmwareCache()
+    image = cache.load_firmware("app.hex")
+    UDS_OTA(dev, ch, compression=COMPRESSION_ZLIB, cache=cache).transfer_data(image)
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from FirmwareCompression import COMPRESSION_NONE, CompressedImage, compress_image
+from FirmwareImage import (DEFAULT_BIN_ADDRESS, INTEL_HEX_EXTENSIONS, SRECORD_EXTENSIONS, MemorySegment, SegmentedImage,
+                           as_buffer, load_firmware, map_file)
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("USB2XXX_FIRMWARE_CACHE", Path.home() / ".usb2xxx" / "cache"))
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024  # 缓存目录的大小上限（字节）
+
+
+def file_digest(path):
+    """文件内容的 SHA-256（十六进制），映射文件计算，不读入内存"""
+    return hashlib.sha256(map_file(path)).hexdigest()
+
+
+def _write_atomic(path, content):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        if isinstance(content, (list, tuple)):
+            for part in content:
+                f.write(part)
+        else:
+            f.write(content)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _map_data(directory):
+    """映射缓存项的 data.bin，文件不存在（被其它进程清除）时返回None"""
+    try:
+        return map_file(directory / "data.bin")
+    except OSError:
+        return None
+
+
+class CacheEntry:
+    """
+    一个镜像（按内容和压缩方法）的缓存项
+    length: 原始镜像长度；transferred: 0x36 传输的字节数
+    compressed: 压缩下载时为 CompressedImage（数据映射自缓存文件），否则为None
+    """
+
+    def __init__(self, directory, meta, compressed=None):
+        self.directory = directory
+        self.digest = meta["sha256"]
+        self.method = meta["method"]
+        self.length = meta["length"]
+        self.transferred = meta["transferred"]
+        self.compressed = compressed
+
+
+class FirmwareCache:
+    """
+    :param directory: 缓存目录，None 时为 USB2XXX_FIRMWARE_CACHE 环境变量或 ~/.usb2xxx/cache
+    :param max_bytes: 缓存总大小上限，超过时删除最久未使用的缓存项
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = Path(directory) if directory is not None else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def load_firmware(self, path, base_address=DEFAULT_BIN_ADDRESS):
+        """
+        加载固件文件，HEX/S-record 的解析结果按文件内容缓存：段表保存在 segments.json，段数据按顺序保存在 data.bin，
+        命中时各段为 data.bin 映射的 memoryview，不再解析；.bin 文件本身已是映射加载，不缓存
+        :param base_address: .bin 文件的下载地址
+        """
+        extension = os.path.splitext(str(path))[1].lower()
+        if extension not in INTEL_HEX_EXTENSIONS + SRECORD_EXTENSIONS:
+            return load_firmware(path, base_address)
+        directory = self.directory / f"file-{file_digest(path)}{extension}"
+        meta = _read_json(directory / "segments.json")
+        data = _map_data(directory) if meta is not None else None
+        if data is not None:
+            if len(data) == sum(size for _, size in meta["segments"]):
+                self.touch(directory)
+                image = SegmentedImage()
+                offset = 0
+                for address, size in meta["segments"]:
+                    image.segments.append(MemorySegment(address, data[offset:offset + size]))
+                    image._starts.append(address)
+                    offset += size
+                image.start_address = meta["start_address"]
+                return image
+        image = load_firmware(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_atomic(directory / "data.bin", [segment.data for segment in image])
+        _write_atomic(directory / "segments.json", json.dumps({
+            "segments": [(segment.address, len(segment.data)) for segment in image],
+            "start_address": image.start_address,
+        }).encode("utf-8"))
+        self.evict()
+        return image
+
+    def entry(self, data, method=COMPRESSION_NONE, digest=None):
+        """
+        取出镜像的缓存项，没有时（压缩后）创建
+        :param digest: 已知的镜像 SHA-256（十六进制），None 时计算
+        """
+        data = as_buffer(data)
+        digest = digest or hashlib.sha256(data).hexdigest()
+        directory = self.directory / f"image-{digest}-{method:X}"
+        meta = _read_json(directory / "image.json")
+        if meta is not None and meta["length"] == len(data):
+            compressed = None
+            if method != COMPRESSION_NONE:
+                compressed_data = _map_data(directory)
+                if compressed_data is None or len(compressed_data) != meta["transferred"]:
+                    meta = None
+                else:
+                    compressed = CompressedImage(compressed_data, method, len(data), bytes.fromhex(digest), 0.0,
+                                                 cached=True)
+            if meta is not None:
+                self.touch(directory)
+                return CacheEntry(directory, meta, compressed)
+        meta = {"sha256": digest, "method": method, "length": len(data)}
+        compressed = None
+        directory.mkdir(parents=True, exist_ok=True)
+        if method != COMPRESSION_NONE:
+            compressed = compress_image(data, method)
+            meta["transferred"] = len(compressed.data)
+            _write_atomic(directory / "data.bin", compressed.data)
+        else:
+            meta["transferred"] = len(data)
+        _write_atomic(directory / "image.json", json.dumps(meta).encode("utf-8"))
+        self.evict()
+        return CacheEntry(directory, meta, compressed)
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """[(目录, 大小, 最近使用时间)]"""
+        entries = []
+        if not self.directory.is_dir():
+            return entries
+        for directory in self.directory.iterdir():
+            if not directory.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in directory.iterdir())
+                entries.append((directory, size, directory.stat().st_mtime))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """总大小超过 max_bytes 时按最近使用时间从旧到新删除缓存项"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for directory, size, _ in entries[:-1]:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(directory, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
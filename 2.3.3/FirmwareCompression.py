@@ -0,0 +1,124 @@
+"""
+文件说明：固件压缩（UDS 0x34 dataFormatIdentifier 的压缩方法）
+    compress_image：按压缩方法压缩固件镜像，结果按 (镜像SHA-256, 压缩方法, 压缩级别) 缓存，
+                    同一镜像重复刷写（多个ECU、失败重试）时只压缩一次
+    decompress    ：按压缩方法解压（模拟ECU和校验使用）
+dataFormatIdentifier 高4位为压缩方法、低4位为加密方法，压缩方法ID由bootloader定义，
+默认 0x1 为 zlib（deflate），0x2 为 LZMA；bootloader 使用其它ID时用 register_compression_method 注册。
+按 ISO 14229-1，0x34 的 memorySize 为解压后的长度，0x36 传输的是压缩后的数据。
+
+用法：
+    image = compress_image(firmware, COMPRESSION_ZLIB)
+    request_download(dev, ch, address, len(firmware), data_format=image.data_format)
+    ... 0x36 传输 image.data ...
+"""
+import collections
+import hashlib
+import lzma
+import threading
+import time
+import zlib
+
+from FirmwareImage import as_buffer
+
+COMPRESSION_NONE = 0x0
+COMPRESSION_ZLIB = 0x1
+COMPRESSION_LZMA = 0x2
+
+COMPRESSION_CACHE_SIZE = 8  # 缓存的压缩结果个数，超过时淘汰最久未使用的
+
+_methods = {
+    COMPRESSION_ZLIB: ("zlib", lambda data, level: zlib.compress(data, level), zlib.decompress),
+    COMPRESSION_LZMA: ("lzma", lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def register_compression_method(method_id, name, compress, decompress):
+    """
+    注册压缩方法
+    :param method_id: dataFormatIdentifier 高4位的压缩方法ID（1~15）
+    :param compress: compress(data, level) -> bytes
+    :param decompress: decompress(data) -> bytes
+    """
+    if not 0 < method_id <= 0xF:
+        raise ValueError(f"压缩方法ID必须为1~15，当前为{method_id}")
+    _methods[method_id] = (name, compress, decompress)
+
+
+def compression_method_name(method_id):
+    if method_id == COMPRESSION_NONE:
+        return "none"
+    return _methods[method_id][0] if method_id in _methods else f"0x{method_id:X}"
+
+
+class CompressedImage:
+    """
+    压缩后的固件镜像
+    data: 压缩后的数据；original_size: 原始长度；sha256: 原始镜像的SHA-256
+    data_format: 0x34 请求的 dataFormatIdentifier（压缩方法在高4位）
+    compress_time: 压缩耗时（秒）；cached: 是否取自缓存（本次未压缩）
+    """
+
+    def __init__(self, data, method, original_size, sha256, compress_time, cached=False):
+        self.data = data
+        self.method = method
+        self.original_size = original_size
+        self.sha256 = sha256
+        self.compress_time = compress_time
+        self.cached = cached
+
+    @property
+    def data_format(self):
+        return (self.method & 0x0F) << 4
+
+    @property
+    def ratio(self):
+        """压缩后长度 / 原始长度"""
+        return len(self.data) / self.original_size if self.original_size else 1.0
+
+    def __repr__(self):
+        return (f"CompressedImage({compression_method_name(self.method)}, {self.original_size} -> {len(self.data)}字节, "
+                f"{self.ratio:.1%}, 压缩{self.compress_time * 1000:.1f}ms{', 缓存' if self.cached else ''})")
+
+
+def compress_image(data, method=COMPRESSION_ZLIB, level=9):
+    """
+    压缩固件镜像，同一镜像、方法和级别的结果取自缓存
+    :return: CompressedImage；method 为 COMPRESSION_NONE 时 data 为原始数据（不复制）
+    """
+    data = as_buffer(data)
+    digest = hashlib.sha256(data).digest()
+    key = (digest, method, level)
+    with _cache_lock:
+        image = _cache.get(key)
+        if image is not None:
+            _cache.move_to_end(key)
+            return CompressedImage(image.data, method, image.original_size, digest, image.compress_time, cached=True)
+    if method == COMPRESSION_NONE:
+        return CompressedImage(data, method, len(data), digest, 0.0)
+    if method not in _methods:
+        raise ValueError(f"未注册的压缩方法 0x{method:X}")
+    start = time.perf_counter()
+    compressed = _methods[method][1](data, level)
+    image = CompressedImage(compressed, method, len(data), digest, time.perf_counter() - start)
+    with _cache_lock:
+        _cache[key] = image
+        while len(_cache) > COMPRESSION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return image
+
+
+def decompress(data, method):
+    """按压缩方法解压，method 为 COMPRESSION_NONE 时原样返回"""
+    if method == COMPRESSION_NONE:
+        return bytes(data)
+    if method not in _methods:
+        raise ValueError(f"未注册的压缩方法 0x{method:X}")
+    return _methods[method][2](bytes(data))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,194 @@
+"""
+文件说明：差分刷写（只擦除和下载与上次刷写相比有变化的扇区）
+    FirmwareStore：按ECU保存最近一次刷写成功的镜像（起始地址 + 数据），作为下次差分的基准
+    plan_delta   ：按扇区比较新旧镜像，得到需要擦除的扇区范围和需要下载的数据段（DeltaPlan）
+刷写流程（UDS_service.delta_download）：
+    刷写前删除保存的镜像 -> 每个变化的数据段 0x31 擦除 + 0x34/0x36/0x37 下载 -> 全部成功后保存新镜像
+刷写失败或被中断时ECU中的内容未知，下次没有基准镜像，自动按完整刷写处理。
+ECU被其它工具刷写过时保存的镜像与ECU不一致，需要 FirmwareStore.forget 或 delta_download(..., full=True)。
+
+用法：
+    store = FirmwareStore()
+    plan = plan_delta(store.load(ecu_id), new_image, 0x08000000)
+    for address, erase_size, data in plan.regions: ...
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from FirmwareImage import FLASH_SECTOR_SIZE, as_buffer
+
+DELTA_SECTOR_SIZE = FLASH_SECTOR_SIZE  # 默认扇区大小（字节），须与ECU flash的擦除粒度一致
+
+DEFAULT_STORE_DIR = Path(os.environ.get("USB2XXX_FLASH_STORE", Path.home() / ".usb2xxx" / "flashed"))
+
+
+def ecu_key(ecu_id):
+    """ECU标识转换为文件名：整数（应答ID）按十六进制，其余按字符串"""
+    if isinstance(ecu_id, int):
+        return f"{ecu_id:03X}"
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(ecu_id))
+
+
+class FlashedImage:
+    """保存的镜像：address 起始地址；data 镜像数据；sha256 数据的SHA-256（十六进制）"""
+
+    def __init__(self, address, data, sha256=None):
+        self.address = address
+        self.data = data
+        self.sha256 = sha256 or hashlib.sha256(data).hexdigest()
+
+    def __repr__(self):
+        return f"FlashedImage(0x{self.address:08X}, {len(self.data)}字节, {self.sha256[:16]})"
+
+
+class FirmwareStore:
+    """
+    按ECU保存最近一次刷写成功的镜像，每个ECU两个文件：<key>.bin 镜像数据，<key>.json 起始地址和SHA-256
+    读取时校验SHA-256，文件损坏时视为没有基准镜像
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory is not None else DEFAULT_STORE_DIR
+        self._lock = threading.Lock()
+
+    def _paths(self, ecu_id):
+        key = ecu_key(ecu_id)
+        return self.directory / f"{key}.bin", self.directory / f"{key}.json"
+
+    def load(self, ecu_id):
+        """返回 FlashedImage，没有保存的镜像或校验失败返回None"""
+        bin_path, meta_path = self._paths(ecu_id)
+        with self._lock:
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                data = bin_path.read_bytes()
+            except (OSError, ValueError):
+                return None
+        if hashlib.sha256(data).hexdigest() != meta.get("sha256"):
+            return None
+        return FlashedImage(meta.get("address", 0), data, meta["sha256"])
+
+    def save(self, ecu_id, address, data):
+        """保存刷写成功的镜像，先写临时文件再替换，避免留下不完整的文件"""
+        data = as_buffer(data)
+        image = FlashedImage(address, data)
+        bin_path, meta_path = self._paths(ecu_id)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for path, content in ((bin_path, data),
+                                  (meta_path, json.dumps({"address": address, "size": len(data),
+                                                          "sha256": image.sha256}).encode("utf-8"))):
+                tmp = path.with_suffix(path.suffix + ".tmp")
+                tmp.write_bytes(content)
+                os.replace(tmp, path)
+        return image
+
+    def forget(self, ecu_id):
+        """删除保存的镜像（刷写开始前调用，刷写失败时下次按完整刷写处理）"""
+        with self._lock:
+            for path in self._paths(ecu_id):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+class DeltaPlan:
+    """
+    差分刷写计划
+    regions: [(地址, 擦除长度, 数据)]，相邻的变化扇区合并为一段，地址和擦除长度按扇区对齐，
+             数据为该段的新镜像数据（新镜像比旧镜像短时，多出的旧扇区只擦除不下载，数据为空）
+    full: True 表示没有可用的基准镜像（或起始地址不同），按完整刷写
+    """
+
+    def __init__(self, address, size, sector_size, full):
+        self.address = address
+        self.size = size
+        self.sector_size = sector_size
+        self.full = full
+        self.regions = []
+        self.sectors_total = 0
+        self.sectors_changed = 0
+
+    @property
+    def erase_ranges(self):
+        return [(address, size) for address, size, _ in self.regions]
+
+    @property
+    def segments(self):
+        """需要下载的 [(地址, 数据)]"""
+        return [(address, data) for address, _, data in self.regions if data]
+
+    @property
+    def download_bytes(self):
+        return sum(len(data) for _, data in self.segments)
+
+    @property
+    def erase_bytes(self):
+        return sum(size for _, size in self.erase_ranges)
+
+    @property
+    def skipped_bytes(self):
+        return self.size - self.download_bytes
+
+    @property
+    def unchanged(self):
+        return not self.regions
+
+    def __repr__(self):
+        if self.full:
+            return f"DeltaPlan(完整刷写 {self.size}字节)"
+        return (f"DeltaPlan({self.sectors_changed}/{self.sectors_total}扇区变化, {len(self.segments)}段, "
+                f"下载{self.download_bytes}/{self.size}字节)")
+
+
+def _full_plan(address, new, sector_size):
+    plan = DeltaPlan(address, len(new), sector_size, True)
+    plan.sectors_total = plan.sectors_changed = -(-len(new) // sector_size)
+    if new:
+        plan.regions.append((address, plan.sectors_total * sector_size, new))
+    return plan
+
+
+def plan_delta(old, new, address, sector_size=DELTA_SECTOR_SIZE):
+    """
+    按扇区比较新旧镜像
+    :param old: 上次刷写的镜像（FlashedImage / bytes / None），None 或起始地址不同时返回完整刷写计划
+    :param new: 新镜像
+    :param address: 新镜像的起始地址，须按扇区对齐
+    :return: DeltaPlan
+    """
+    if address % sector_size:
+        raise ValueError(f"起始地址 0x{address:08X} 未按扇区大小 0x{sector_size:X} 对齐")
+    new = as_buffer(new)
+    if isinstance(old, FlashedImage):
+        if old.address != address:
+            return _full_plan(address, new, sector_size)
+        old = old.data
+    if old is None:
+        return _full_plan(address, new, sector_size)
+    old_view, new_view = memoryview(old), memoryview(new)
+    plan = DeltaPlan(address, len(new), sector_size, False)
+    span = max(len(old), len(new))
+    plan.sectors_total = -(-span // sector_size)
+    run_start = None
+    for offset in range(0, span + sector_size, sector_size):
+        if offset < span:
+            old_sector = old_view[offset:offset + sector_size]
+            new_sector = new_view[offset:offset + sector_size]
+            changed = old_sector != new_sector
+            if changed:
+                plan.sectors_changed += 1
+                if run_start is None:
+                    run_start = offset
+                continue
+        if run_start is not None:
+            end = min(offset, span)
+            erase_end = -(-end // sector_size) * sector_size
+            plan.regions.append((address + run_start, erase_end - run_start, new[run_start:min(end, len(new))]))
+            run_start = None
+    return plan
@@ -0,0 +1,121 @@
+"""
+文件说明：固件完整性校验值（0x31 内存完整性检查例程的参数）
+    ImageDigest：按下载顺序逐块累计的校验值，下载流程在切分每个 0x36 块时顺便更新，不需要再读一遍镜像
+    image_digest：一次计算整个镜像的校验值
+支持的算法（结果按大端字节序附加在 0x31 请求的例程ID之后）：
+    crc32 ：CRC-32（IEEE 802.3，与 zlib.crc32 相同），4字节
+    crc16 ：CRC-16/CCITT-FALSE（多项式 0x1021，初值 0xFFFF），2字节
+    sha256：SHA-256，32字节
+三种算法都用C实现的查表/硬件加速版本：zlib.crc32（zlib的多表实现）、binascii.crc_hqx（查表）、hashlib（OpenSSL，支持
+SHA 指令时使用硬件指令），按块更新与一次计算整个镜像的结果相同。bootloader 使用其它算法时用 register_digest_algorithm 注册。
+多段镜像按段地址从低到高的顺序累计，压缩下载时累计的是原始（解压后）数据；刷写计划中只擦除不下载的空白区用
+update_fill 按擦除值累计，校验值与整个镜像的相同。
+
+用法：
+    digest = ImageDigest(DIGEST_CRC32)
+    download(dev, ch, address, firmware, digest=digest)
+    check_memory_integrity(dev, ch, digest=digest.digest())
+"""
+import binascii
+import hashlib
+import zlib
+
+from FirmwareImage import as_buffer, as_segments
+
+DIGEST_CRC32 = "crc32"
+DIGEST_CRC16 = "crc16"
+DIGEST_SHA256 = "sha256"
+
+
+class _Crc32:
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, "big")
+
+
+class _Crc16:
+    """CRC-16/CCITT-FALSE：binascii.crc_hqx 为多项式 0x1021、不反转的查表实现，初值取 0xFFFF"""
+
+    def __init__(self):
+        self.value = 0xFFFF
+
+    def update(self, data):
+        self.value = binascii.crc_hqx(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(2, "big")
+
+
+_algorithms = {
+    DIGEST_CRC32: _Crc32,
+    DIGEST_CRC16: _Crc16,
+    DIGEST_SHA256: hashlib.sha256,
+}
+
+
+def register_digest_algorithm(name, factory):
+    """
+    注册校验算法
+    :param factory: 无参数调用返回累加器，累加器有 update(data) 和 digest() -> bytes 方法（与 hashlib 相同）
+    """
+    _algorithms[name] = factory
+
+
+def digest_algorithms():
+    return tuple(_algorithms)
+
+
+class ImageDigest:
+    """
+    按下载顺序累计的校验值，可同时累计多个算法
+    :param algorithms: 算法名，或算法名的列表
+    length 为已累计的字节数
+    """
+
+    def __init__(self, algorithms=DIGEST_CRC32):
+        if isinstance(algorithms, str):
+            algorithms = (algorithms,)
+        for name in algorithms:
+            if name not in _algorithms:
+                raise ValueError(f"不支持的校验算法 {name}，可选: {', '.join(_algorithms)}")
+        self.algorithms = tuple(algorithms)
+        self._accumulators = [_algorithms[name]() for name in self.algorithms]
+        self.length = 0
+
+    def update(self, data):
+        for accumulator in self._accumulators:
+            accumulator.update(data)
+        self.length += len(data)
+
+    def update_fill(self, value, size):
+        """累计 size 个字节值为 value 的字节（未下载的空白区），按 64K 分块，不生成整个区域的数据"""
+        chunk = bytes([value]) * min(size, 0x10000)
+        while size > 0:
+            self.update(chunk[:size] if size < len(chunk) else chunk)
+            size -= len(chunk)
+
+    def digest(self, algorithm=None):
+        """algorithm 的校验值（bytes），None 时为第一个算法"""
+        index = 0 if algorithm is None else self.algorithms.index(algorithm)
+        return self._accumulators[index].digest()
+
+    def hexdigest(self, algorithm=None):
+        return self.digest(algorithm).hex().upper()
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={self.hexdigest(name)}" for name in self.algorithms)
+        return f"ImageDigest({self.length}字节, {values})"
+
+
+def image_digest(data, algorithm=DIGEST_CRC32):
+    """整个镜像的校验值（bytes），data 为 SegmentedImage 时按段地址顺序累计各段数据"""
+    digest = ImageDigest(algorithm)
+    for _, segment in as_segments(data):
+        digest.update(as_buffer(segment))
+    return digest.digest()
@@ -0,0 +1,425 @@
+"""
+文件说明：固件文件解析（Intel HEX / Motorola S-record / bin）
+    SegmentedImage：按地址分段的稀疏内存镜像，只保存有数据的段，段与段之间的空隙不占内存也不下载
+    parse_intel_hex：逐行解析 Intel HEX（记录类型 00~05），地址连续的数据记录追加到同一段
+    parse_srecord  ：逐行解析 S19/S28/S37（S1/S2/S3 数据记录，S7/S8/S9 起始地址）
+    load_firmware  ：按扩展名选择解析方式，.bin 按 base_address 作为一个段
+    map_file       ：把 .bin 文件映射为只读 memoryview（mmap），不读入内存，按需由操作系统分页加载
+    as_buffer      ：固件数据统一为 memoryview，bytes/bytearray/mmap/memoryview 不拷贝
+    as_segments    ：bytes 或 SegmentedImage 统一为 [(地址, 数据)]，供刷写流程逐段下载
+    plan_segments  ：逐段刷写计划，每段只擦除其覆盖的扇区，空隙很小的相邻段填充后合并为一次下载，大的空隙跳过
+    blank_runs     ：查找数据中不短于阈值的擦除值（0xFF）连续区，指定阈值时刷写计划按这些空白区切分下载，空白区只擦除不下载
+解析按行流式进行，不把整个文件读入内存；每条记录校验和错误、格式错误或数据重叠时抛出 ValueError（含行号）。
+固件数据从打开文件到切块、编码帧都以 memoryview 传递，不转换为 Python 列表，也不在各层之间复制。
+
+用法：
+    image = load_firmware("app.hex")
+    for segment in image:
+        download(dev, ch, segment.address, segment.data)
+"""
+import binascii
+import bisect
+import mmap
+import os
+
+DEFAULT_BIN_ADDRESS = 0x08000000  # .bin 文件没有地址信息时的下载地址
+FLASH_SECTOR_SIZE = 0x800  # 默认flash扇区大小（擦除粒度）
+SEGMENT_MERGE_GAP = 0x100  # 相邻段的空隙不超过此长度时填充后合并下载，省去一次 0x34/0x37
+FLASH_ERASED_VALUE = 0xFF  # flash擦除后的字节值
+BLANK_RUN_THRESHOLD = 0x400  # 启用空白区跳过时推荐的阈值：不短于此长度的擦除值连续区不下载比多一次 0x34/0x37 更快
+
+INTEL_HEX_EXTENSIONS = (".hex", ".ihex", ".ihx")
+SRECORD_EXTENSIONS = (".s19", ".s28", ".s37", ".srec", ".mot")
+
+
+class MemorySegment:
+    """地址连续的一段数据：address 起始地址；data 数据（解析得到的为 bytearray，映射的 .bin 文件为 memoryview）"""
+
+    __slots__ = ("address", "data")
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+    @property
+    def end(self):
+        return self.address + len(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"MemorySegment(0x{self.address:08X}~0x{self.end:08X}, {len(self.data)}字节)"
+
+
+def _extend(segment, data):
+    """在段末尾追加数据，映射的只读段先复制为 bytearray"""
+    if not isinstance(segment.data, bytearray):
+        segment.data = bytearray(segment.data)
+    segment.data += data
+
+
+class SegmentedImage:
+    """
+    稀疏内存镜像，段按地址排序，相邻（首尾相接）的段自动合并
+    start_address: 文件中的程序入口地址（Intel HEX 03/05 记录、S7/S8/S9 记录），没有时为None
+    len(image) 为数据字节数（不含空隙）
+    """
+
+    def __init__(self):
+        self.segments = []
+        self.start_address = None
+        self._starts = []  # 各段起始地址，用于二分查找
+
+    def add(self, address, data):
+        """
+        写入数据：接在最后一段末尾时直接追加（解析顺序文件时的常见情况），否则按地址插入
+        与已有数据重叠时抛出 ValueError
+        """
+        if not data:
+            return
+        segments = self.segments
+        if segments:
+            last = segments[-1]
+            if address == last.end:
+                _extend(last, data)
+                return
+            if address > last.end:
+                segments.append(MemorySegment(address, bytearray(data)))
+                self._starts.append(address)
+                return
+        index = bisect.bisect_right(self._starts, address)
+        end = address + len(data)
+        if index > 0 and segments[index - 1].end > address:
+            raise ValueError(f"数据 0x{address:08X}~0x{end:08X} 与 {segments[index - 1]} 重叠")
+        if index < len(segments) and segments[index].address < end:
+            raise ValueError(f"数据 0x{address:08X}~0x{end:08X} 与 {segments[index]} 重叠")
+        if index > 0 and segments[index - 1].end == address:
+            segment = segments[index - 1]
+            _extend(segment, data)
+        else:
+            segment = MemorySegment(address, bytearray(data))
+            segments.insert(index, segment)
+            self._starts.insert(index, address)
+            index += 1
+        if index < len(segments) and segments[index].address == segment.end:
+            _extend(segment, segments.pop(index).data)
+            del self._starts[index]
+
+    @property
+    def start(self):
+        return self.segments[0].address if self.segments else 0
+
+    @property
+    def end(self):
+        return self.segments[-1].end if self.segments else 0
+
+    def __len__(self):
+        return sum(len(segment.data) for segment in self.segments)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def tobytes(self, fill=0xFF):
+        """从第一段起始地址到最后一段结束地址的连续数据，空隙填充 fill"""
+        out = bytearray([fill]) * (self.end - self.start)
+        for segment in self.segments:
+            offset = segment.address - self.start
+            out[offset:offset + len(segment.data)] = segment.data
+        return bytes(out)
+
+    def __repr__(self):
+        return f"SegmentedImage({len(self.segments)}段, {len(self)}字节, " + ", ".join(map(repr, self.segments[:4])) + (
+            ", ..." if len(self.segments) > 4 else "") + ")"
+
+
+def _open_lines(source):
+    """source 为路径时按二进制逐行读取，否则视为可迭代的行（文件对象、行列表）"""
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb")
+    return source
+
+
+def _record(line, number, start_char):
+    """去掉行首标记（Intel HEX 为 ':'，S-record 为 'S' 和类型字符）和行尾空白后按十六进制解码，空行返回None"""
+    if isinstance(line, str):
+        line = line.encode("ascii")
+    line = line.strip()
+    if not line:
+        return None
+    if line[:1] != start_char:
+        raise ValueError(f"第{number}行：不是有效的记录 {line[:16]!r}")
+    try:
+        return binascii.unhexlify(line[1:] if start_char == b":" else line[2:])
+    except binascii.Error:
+        raise ValueError(f"第{number}行：十六进制格式错误") from None
+
+
+def parse_intel_hex(source, image=None):
+    """
+    解析 Intel HEX
+    :param source: 文件路径，或逐行迭代的文件对象（文本或二进制）
+    :param image: 写入的 SegmentedImage，None 时新建
+    :return: SegmentedImage
+    """
+    image = SegmentedImage() if image is None else image
+    f = _open_lines(source)
+    base = 0
+    try:
+        for number, line in enumerate(f, 1):
+            record = _record(line, number, b":")
+            if record is None:
+                continue
+            if len(record) < 5 or record[0] != len(record) - 5:
+                raise ValueError(f"第{number}行：记录长度错误")
+            if sum(record) & 0xFF:
+                raise ValueError(f"第{number}行：校验和错误")
+            record_type = record[3]
+            if record_type == 0x00:
+                image.add(base + ((record[1] << 8) | record[2]), record[4:-1])
+            elif record_type == 0x01:
+                break
+            elif record_type == 0x02:
+                base = int.from_bytes(record[4:6], "big") << 4
+            elif record_type == 0x04:
+                base = int.from_bytes(record[4:6], "big") << 16
+            elif record_type == 0x03:
+                image.start_address = (int.from_bytes(record[4:6], "big") << 4) + int.from_bytes(record[6:8], "big")
+            elif record_type == 0x05:
+                image.start_address = int.from_bytes(record[4:8], "big")
+            else:
+                raise ValueError(f"第{number}行：未知的记录类型 {record_type:02X}")
+    finally:
+        if f is not source:
+            f.close()
+    return image
+
+
+# S-record 类型 -> 地址字节数
+_SRECORD_DATA = {0x31: 2, 0x32: 3, 0x33: 4}     # S1 / S2 / S3
+_SRECORD_START = {0x39: 2, 0x38: 3, 0x37: 4}    # S9 / S8 / S7
+
+
+def parse_srecord(source, image=None):
+    """
+    解析 Motorola S-record（S19 / S28 / S37）
+    S0 头记录、S5/S6 计数记录忽略；S7/S8/S9 为程序入口地址
+    :param source: 文件路径，或逐行迭代的文件对象（文本或二进制）
+    :param image: 写入的 SegmentedImage，None 时新建
+    :return: SegmentedImage
+    """
+    image = SegmentedImage() if image is None else image
+    f = _open_lines(source)
+    try:
+        for number, line in enumerate(f, 1):
+            if isinstance(line, str):
+                line = line.encode("ascii")
+            record = _record(line, number, b"S")
+            if record is None:
+                continue
+            if len(record) < 3 or record[0] != len(record) - 1:
+                raise ValueError(f"第{number}行：记录长度错误")
+            if (sum(record) & 0xFF) != 0xFF:
+                raise ValueError(f"第{number}行：校验和错误")
+            record_type = line.lstrip()[1]
+            if record_type in _SRECORD_DATA:
+                size = _SRECORD_DATA[record_type]
+                image.add(int.from_bytes(record[1:1 + size], "big"), record[1 + size:-1])
+            elif record_type in _SRECORD_START:
+                size = _SRECORD_START[record_type]
+                image.start_address = int.from_bytes(record[1:1 + size], "big")
+            elif record_type not in (0x30, 0x35, 0x36):
+                raise ValueError(f"第{number}行：未知的记录类型 S{chr(record_type)}")
+    finally:
+        if f is not source:
+            f.close()
+    return image
+
+
+def load_firmware(path, base_address=DEFAULT_BIN_ADDRESS):
+    """
+    按扩展名加载固件文件
+    :param base_address: .bin 等没有地址信息的文件的下载地址
+    :return: SegmentedImage
+    """
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension in INTEL_HEX_EXTENSIONS:
+        return parse_intel_hex(path)
+    if extension in SRECORD_EXTENSIONS:
+        return parse_srecord(path)
+    image = SegmentedImage()
+    data = map_file(path)
+    if data:
+        image.segments.append(MemorySegment(base_address, data))
+        image._starts.append(base_address)
+    return image
+
+
+def map_file(path):
+    """
+    把文件只读映射到内存，返回 memoryview（切片不复制）；空文件返回空的 memoryview
+    映射在最后一个引用它的 memoryview 释放后关闭
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def as_buffer(data):
+    """
+    固件数据统一为按字节访问的 memoryview：支持缓冲区协议的对象（bytes/bytearray/mmap/memoryview/ctypes数组）
+    不复制，列表等其它序列转换为 bytes
+    """
+    try:
+        view = memoryview(data)
+    except TypeError:
+        return memoryview(bytes(data))
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+
+def as_segments(firmware, address=DEFAULT_BIN_ADDRESS):
+    """
+    统一为 [(地址, 数据)]
+    :param firmware: SegmentedImage（按其中各段的地址），[(地址, 数据)] 列表（如 SegmentPlan.segments），
+                     或 bytes 等连续数据（下载到 address）
+    """
+    if isinstance(firmware, SegmentedImage):
+        return [(segment.address, segment.data) for segment in firmware.segments]
+    if isinstance(firmware, list) and firmware and isinstance(firmware[0], tuple):
+        return list(firmware)
+    return [(address, firmware)]
+
+
+def blank_runs(data, erased_value=FLASH_ERASED_VALUE, threshold=BLANK_RUN_THRESHOLD):
+    """
+    查找 data 中长度不小于 threshold 的 erased_value 连续区
+    每隔 threshold 字节检查一个字节，只有检查点为擦除值时才向前后扩展，扩展按 threshold 长度的块比较，
+    非空白数据只检查 1/threshold 的字节
+    :return: [(起始偏移, 结束偏移)]，按偏移从小到大
+    """
+    if threshold < 1:
+        raise ValueError("空白区阈值必须大于0")
+    view = as_buffer(data)
+    size = len(view)
+    fill = bytes([erased_value])
+    blank = fill * threshold
+    runs = []
+    index = threshold - 1
+    while index < size:
+        if view[index] != erased_value:
+            index += threshold
+            continue
+        low = max(index - threshold + 1, runs[-1][1] if runs else 0)
+        start = low + len(bytes(view[low:index]).rstrip(fill))
+        end = index + 1
+        while end < size:
+            chunk = view[end:end + threshold]
+            if chunk == blank[:len(chunk)]:
+                end += len(chunk)
+                continue
+            end += len(chunk) - len(bytes(chunk).lstrip(fill))
+            break
+        if end - start >= threshold:
+            runs.append((start, end))
+        # end 处不是擦除值，下一个空白区最早从 end+1 开始
+        index = end + threshold - 1
+    return runs
+
+
+class SegmentPlan:
+    """
+    逐段刷写计划
+    erase_ranges: [(地址, 长度)]，各段覆盖的扇区，按扇区对齐，相邻或重叠的合并为一个范围（同一扇区只擦除一次）
+    segments: [(地址, 数据)]，每段一次 0x34/0x36/0x37
+    blank_ranges: [(地址, 长度)]，段内只擦除不下载的擦除值连续区，erased_value 为其字节值
+    padded_bytes: 合并相邻段时填充的字节数；skipped_bytes: 段与段之间跳过（不下载）的空隙字节数；
+    blank_bytes: 空白区省去下载的字节数
+    """
+
+    def __init__(self, sector_size, erased_value=FLASH_ERASED_VALUE):
+        self.sector_size = sector_size
+        self.erased_value = erased_value
+        self.erase_ranges = []
+        self.segments = []
+        self.blank_ranges = []
+        self.padded_bytes = 0
+        self.skipped_bytes = 0
+
+    @property
+    def download_bytes(self):
+        return sum(len(data) for _, data in self.segments)
+
+    @property
+    def erase_bytes(self):
+        return sum(size for _, size in self.erase_ranges)
+
+    @property
+    def blank_bytes(self):
+        return sum(size for _, size in self.blank_ranges)
+
+    def layout(self):
+        """
+        按地址顺序的 [(地址, 数据)]，空白区的数据为 None（长度见 blank_ranges），
+        供需要按flash中的实际内容累计校验值的流程使用
+        """
+        items = list(self.segments) + [(address, None) for address, _ in self.blank_ranges]
+        return sorted(items, key=lambda item: item[0])
+
+    def __repr__(self):
+        return (f"SegmentPlan({len(self.segments)}段, 下载{self.download_bytes}字节(填充{self.padded_bytes}), "
+                f"擦除{len(self.erase_ranges)}处共{self.erase_bytes}字节, 跳过空隙{self.skipped_bytes}字节, "
+                f"跳过空白{self.blank_bytes}字节)")
+
+
+def plan_segments(firmware, address=DEFAULT_BIN_ADDRESS, sector_size=FLASH_SECTOR_SIZE, max_gap=SEGMENT_MERGE_GAP,
+                  erased_value=FLASH_ERASED_VALUE, blank_threshold=0):
+    """
+    逐段刷写计划：空隙不超过 max_gap 的相邻段用 erased_value 填充空隙后合并为一段（max_gap 为0时不合并），
+    每段擦除其覆盖的扇区，段之间更大的空隙既不擦除也不下载；
+    段内不短于 blank_threshold 的 erased_value 连续区擦除后即为该值，按这些空白区把段切分为多次下载
+    （blank_threshold 为0或None时不切分，默认不切分；启用时推荐 BLANK_RUN_THRESHOLD）
+    :param firmware: SegmentedImage，或 bytes 等连续数据（下载到 address）
+    :param erased_value: 目标flash擦除后的字节值
+    :return: SegmentPlan
+    """
+    plan = SegmentPlan(sector_size, erased_value)
+    merged = []  # [[地址, [数据...], 结束地址]]
+    for segment_address, data in as_segments(firmware, address):
+        if not len(data):
+            continue
+        if merged:
+            gap = segment_address - merged[-1][2]
+            if gap <= max_gap:
+                if gap:
+                    merged[-1][1].append(bytes([erased_value]) * gap)
+                    plan.padded_bytes += gap
+                merged[-1][1].append(data)
+                merged[-1][2] = segment_address + len(data)
+                continue
+            plan.skipped_bytes += gap
+        merged.append([segment_address, [data], segment_address + len(data)])
+    for segment_address, parts, end in merged:
+        data = parts[0] if len(parts) == 1 else b"".join(parts)
+        offset = 0
+        if blank_threshold:
+            view = as_buffer(data)
+            for start, stop in blank_runs(view, erased_value, blank_threshold):
+                if start > offset:
+                    plan.segments.append((segment_address + offset, view[offset:start]))
+                plan.blank_ranges.append((segment_address + start, stop - start))
+                offset = stop
+            if offset:
+                data = view[offset:]
+        if len(data):
+            plan.segments.append((segment_address + offset, data))
+        start = segment_address - segment_address % sector_size
+        end = -(-end // sector_size) * sector_size
+        if plan.erase_ranges and plan.erase_ranges[-1][0] + plan.erase_ranges[-1][1] >= start:
+            previous = plan.erase_ranges[-1][0]
+            plan.erase_ranges[-1] = (previous, end - previous)
+        else:
+            plan.erase_ranges.append((start, end - start))
+    return plan
@@ -1,16 +1,20 @@
 import os
 from PyQt5.QtWidgets import QFileDialog
+from FirmwareImage import load_firmware
 
 class FirmwareLoader:
     def __init__(self, console):
         self.console = console
 
     def load_hex_file(self, file_path):
-        """加载 .hex 文件并返回固件数据(跳过解析直接读取二进制)"""
+        """加载 .hex / .s19 / .s28 / .s37 文件，返回按地址分段的固件镜像（FirmwareImage.SegmentedImage）"""
         try:
-            self.console.log_message("警告：跳过hex文件解析，直接读取二进制内容", "WARNING")
-            with open(file_path, 'rb') as file:
-                return file.read()
+            image = load_firmware(file_path)
+            self.console.log_message(f"解析完成：{image}", "INFO")
+            return image
         except FileNotFoundError:
             self.console.log_message("文件未找到，请检查路径是否正确", "ERROR")
-            return None
\ No newline at end of file
+            return None
+        except ValueError as e:
+            self.console.log_message(f"固件文件格式错误：{e}", "ERROR")
+            return None
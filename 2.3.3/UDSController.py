@@ -5,6 +5,8 @@ from Crypto.Cipher import AES
 from PyQt5.QtCore import QThread, pyqtSignal, QObject, QMutex, QWaitCondition
 
 KEY_CMAC = bytes([0xF9,0xA7,0xBE,0xB7,0xE3,0x46,0x15,0xB0,0xE2,0xD9,0xF3,0xE3,0x07,0xF2,0xCD,0x93])
+# 本控制器刷写的ECU的应用程序地址（没有地址信息的固件下载到此处），与 UDS_OTA 使用的 DEFAULT_BIN_ADDRESS 不同
+FIRMWARE_ADDRESS = 0x00080000
 
 
 class UDSRequestWorker(QObject):
@@ -132,24 +134,27 @@ class UDSController:
             self.console.log("发送密钥失败")
         return result
 
-    def firmware_update(self, data_block, progress_callback=None):
-        total_blocks = (len(data_block) + 6) // 7
-        block_index = 0
-        memory_address = 0x00080000
-
-        if request_download(self.usb_handler.DevHandles[0], self.can_controller.CANChannel,
-                            memory_address=memory_address, length=len(data_block)):
-            while block_index * 7 < len(data_block):
-                start = block_index * 7
-                end = min(start + 7, len(data_block))
-                current_block = data_block[start:end]
-                transfer_data(self.usb_handler.DevHandles[0], self.can_controller.CANChannel, block_index + 1, current_block)
-                block_index += 1
-                if progress_callback:
-                    progress_callback(int(block_index / total_blocks * 100))
-            request_transfer_exit(self.usb_handler.DevHandles[0], self.can_controller.CANChannel)
-            return True
-        return False
+    def firmware_update(self, data_block, progress_callback=None, block_size=None, memory_address=FIRMWARE_ADDRESS,
+                        sector_size=FLASH_SECTOR_SIZE):
+        """
+        刷写固件：每段先擦除其覆盖的扇区，再按段下载（见 flash_segments），块大小按ECU在 0x74 应答中给出的最大块长度
+        （block_size 可指定，测试用）
+        :param data_block: 固件数据，SegmentedImage（FirmwareImage.load_firmware）时按各段地址逐段刷写，
+                           bytes/.bin 等没有地址信息的数据刷写到 memory_address（默认 FIRMWARE_ADDRESS）
+        :param progress_callback: progress_callback(百分比)，按已传输的字节数计算，百分比变化时调用
+        :param sector_size: ECU flash的擦除粒度
+        """
+        last_percent = [-1]
+
+        def on_progress(sent, total):
+            percent = sent * 100 // total if total else 100
+            if progress_callback and percent != last_percent[0]:
+                last_percent[0] = percent
+                progress_callback(percent)
+
+        return flash_segments(self.usb_handler.DevHandles[0], self.can_controller.CANChannel, data_block,
+                              memory_address, sector_size, block_size=block_size, progress_callback=on_progress,
+                              console=self.console)
 
     def enter_programming_mode(self, progress_callback=None):
         def on_result(result):
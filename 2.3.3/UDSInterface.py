@@ -19,8 +19,13 @@ from UDS_OTA_Module import OTAWorker
 from time import sleep
 from ctypes import byref
 from CAN_Receive import CANReceiver
+from CANDispatcher import get_dispatcher, stop_dispatcher
 from usb2can import CAN_MSG
 import UDS_OTA
+from FirmwareCache import FirmwareCache
+from FirmwareImage import INTEL_HEX_EXTENSIONS, SRECORD_EXTENSIONS, map_file
+
+FIRMWARE_FILE_FILTER = "Firmware Files (*.bin *.hex *.s19 *.s28 *.s37 *.srec);;All Files (*)"
 
 
 class CloseDialog(QDialog):
@@ -69,6 +74,7 @@ class UDSInterface(QMainWindow):
         # 初始化组件
         self.console = UDSConsole()
         self.controller = UDSController(self.console)
+        self.firmware_cache = FirmwareCache()  # HEX/S-record 解析结果的磁盘缓存，重复刷写同一固件时不再解析
         self.can_receiver = None
 
         # 连接信号
@@ -333,6 +339,7 @@ class UDSInterface(QMainWindow):
                 del self.can_receiver
             except Exception as e:
                 self.console.error(f"关闭 CAN 接收器失败：{str(e)}")  # 这一行需要正确缩进
+        stop_dispatcher(self.controller.usb_handler.DevHandles[0], self.controller.can_controller.CANChannel)
 
         if self.controller.disconnect_device():
             self.console.log("设备已成功断开")
@@ -344,8 +351,8 @@ class UDSInterface(QMainWindow):
             return
         device_handle = self.controller.usb_handler.DevHandles[0]
         can_channel = self.controller.can_controller.CANChannel
-        self.can_receiver = CANReceiver(device_handle, can_channel, CAN_MSG)
-        self.can_receiver.message_received.connect(self.handle_received_message)
+        self.can_receiver = CANReceiver(device_handle, can_channel, CAN_MSG, batch_mode=True, batch_window_ms=50)
+        self.can_receiver.batch_received.connect(self.handle_received_batch)
         self.can_receiver.start()
 
     def handle_received_message(self, msg):
@@ -355,6 +362,16 @@ class UDSInterface(QMainWindow):
         self.recv_text.append(f"ID: {hex(msg.ID)} | DLC: {msg.DataLen} | 数据: {formatted_data}")
         self.recv_text.verticalScrollBar().setValue(self.recv_text.verticalScrollBar().maximum())
 
+    def handle_received_batch(self, batch):
+        """批量显示接收到的报文，一个批次只刷新一次界面"""
+        lines = []
+        for msg in batch:
+            formatted_data = ' '.join([f"{b:02X}" for b in msg.Data[:msg.DataLen]])
+            lines.append(f"ID: {hex(msg.ID)} | DLC: {msg.DataLen} | 数据: {formatted_data}")
+        self.console.debug(f"【接收】本批次 {len(batch)} 帧")
+        self.recv_text.append('\n'.join(lines))
+        self.recv_text.verticalScrollBar().setValue(self.recv_text.verticalScrollBar().maximum())
+
     def set_ui_to_disconnected_state(self):
         buttons = [
             self.default_session_btn, self.extended_session_btn,
@@ -391,7 +408,7 @@ class UDSInterface(QMainWindow):
             dlc = int(self.can_dlc_input.text())
             data_bytes = [int(le.text() or "00", 16) for le in self.can_data_inputs]
 
-            from usb2can import CAN_MSG, CAN_SendMsg, CAN_GetMsg
+            from usb2can import CAN_MSG, CAN_SendMsg
 
             msg = CAN_MSG()
             msg.ID = can_id
@@ -399,22 +416,21 @@ class UDSInterface(QMainWindow):
             for i in range(dlc):
                 msg.Data[i] = data_bytes[i]
 
-            ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-            if ret >= 0:
-                self.console.log(f"成功发送报文 ID={hex(can_id)}, DLC={dlc}, Data={[hex(b) for b in data_bytes[:dlc]]}")
-            else:
-                self.console.error(f"发送失败，错误码: {ret}")
+            # 先订阅再发送，应答由通道调度器分发，不与接收线程争抢
+            with get_dispatcher(device_handle, can_channel).subscribe() as subscription:
+                ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
+                if ret >= 0:
+                    self.console.log(f"成功发送报文 ID={hex(can_id)}, DLC={dlc}, Data={[hex(b) for b in data_bytes[:dlc]]}")
+                else:
+                    self.console.error(f"发送失败，错误码: {ret}")
+                responses = subscription.get_batch(0.1)
 
-            CanMsgBuffer = (type(msg) * 1024)()
-            CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-            if CanNum > 0:
-                for i in range(CanNum):
-                    data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-                    self.console.log(f"收到响应 ID={hex(CanMsgBuffer[i].ID)}, 数据={[hex(x) for x in data]}")
-            elif CanNum == 0:
-                self.console.log("未收到响应")
+            if responses:
+                for response in responses:
+                    data = [response.Data[j] for j in range(response.DataLen)]
+                    self.console.log(f"收到响应 ID={hex(response.ID)}, 数据={[hex(x) for x in data]}")
             else:
-                self.console.log("接收报文失败")
+                self.console.log("未收到响应")
 
         except Exception as e:
             self.console.error(f"输入错误: {str(e)}")
@@ -451,11 +467,12 @@ class UDSInterface(QMainWindow):
         self.controller.read_did(did)
 
     def firmware_update(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择固件文件")
+        file_path, _ = QFileDialog.getOpenFileName(self, "选择固件文件", "", FIRMWARE_FILE_FILTER)
         if file_path:
             try:
-                with open(file_path, 'rb') as f:
-                    firmware_data = list(f.read())
+                firmware_data, firmware_size = self.load_firmware_file(file_path)
+                if firmware_data is None:
+                    return
                 self.console.log("开始固件更新流程...")
 
                 def update_progress(percent):
@@ -482,24 +499,23 @@ class UDSInterface(QMainWindow):
         
         self.console.log("尝试进入编程会话...")
         try:
-            from usb2can import CAN_GetMsg  # 确保导入CAN_GetMsg
-            result = UDS_service.send_diagnostic_session_control(
-                device_handle, can_channel, 0x02, self.console
-            )
-            
-            # 获取最后接收到的消息
-            CanMsgBuffer = (CAN_MSG * 1024)()
-            CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
+            # 订阅服务执行期间收到的全部报文
+            with get_dispatcher(device_handle, can_channel).subscribe() as subscription:
+                result = UDS_service.send_diagnostic_session_control(
+                    device_handle, can_channel, 0x02, self.console
+                )
+                responses = subscription.get_batch(0)
+            CanNum = len(responses)
             
             # 记录所有接收到的消息
             if CanNum > 0:
-                for i in range(CanNum):
-                    data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-                    self.console.debug(f"接收到的响应 {i+1}/{CanNum}: ID={hex(CanMsgBuffer[i].ID)}, 数据={[hex(x) for x in data]}")
+                for i, response in enumerate(responses):
+                    data = [response.Data[j] for j in range(response.DataLen)]
+                    self.console.debug(f"接收到的响应 {i+1}/{CanNum}: ID={hex(response.ID)}, 数据={[hex(x) for x in data]}")
 
             if CanNum > 0:
-                for i in range(CanNum):
-                    data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
+                for response in responses:
+                    data = [response.Data[j] for j in range(response.DataLen)]
                     
                     # 解析响应数据
                     if len(data) >= 3 and data[1] == 0x50:  # 正响应
@@ -581,9 +597,10 @@ class UDSInterface(QMainWindow):
 
     def load_firmware_file(self, file_path):
         """
-        加载固件文件（支持 .bin 和 .hex 格式）
+        加载固件文件（支持 .bin、Intel HEX 和 S19/S28/S37 格式）
         :param file_path: 文件路径
-        :return: 固件数据 (bytes) 和文件大小 (int)
+        :return: 固件数据和数据字节数；.bin 为映射文件的只读 memoryview（不读入内存），
+                 HEX/S-record 为按地址分段的 SegmentedImage（不含段间空隙）
         """
         if not os.path.exists(file_path):
             self.console.error(f"错误：文件不存在 - {file_path}")
@@ -592,21 +609,17 @@ class UDSInterface(QMainWindow):
         try:
             # 判断文件类型
             if file_path.endswith('.bin'):
-                with open(file_path, 'rb') as f:
-                    firmware_data = list(f.read())
+                firmware_data = map_file(file_path)
                 self.console.log(f"成功读取 .bin 文件，大小: {len(firmware_data)} 字节")
-                return bytes(firmware_data), len(firmware_data)
-
-            elif file_path.endswith('.hex'):
-                # 跳过hex解析，直接读取二进制内容
-                self.console.warning("跳过hex文件解析，直接读取二进制内容")
-                with open(file_path, 'rb') as f:
-                    firmware_data = f.read()
-                self.console.log(f"成功读取 .hex 文件(作为二进制)，大小: {len(firmware_data)} 字节")
                 return firmware_data, len(firmware_data)
 
+            elif file_path.lower().endswith(INTEL_HEX_EXTENSIONS + SRECORD_EXTENSIONS):
+                image = self.firmware_cache.load_firmware(file_path)
+                self.console.log(f"成功解析 {os.path.basename(file_path)}: {image}")
+                return image, len(image)
+
             else:
-                self.console.error("不支持的文件格式，请选择 .bin 或 .hex 文件")
+                self.console.error("不支持的文件格式，请选择 .bin、.hex 或 .s19/.s28/.s37 文件")
                 return None, 0
 
         except Exception as e:
@@ -620,7 +633,7 @@ class UDSInterface(QMainWindow):
             QMessageBox.warning(self, "警告", "请先连接设备再启动OTA更新！")
             return
 
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择固件文件", "", "Binary Files (*.bin *.hex);;All Files (*)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "选择固件文件", "", FIRMWARE_FILE_FILTER)
         if not file_path:
             self.console.log("固件更新已取消")
             return
@@ -650,7 +663,7 @@ class UDSInterface(QMainWindow):
             self.uds_ota = UDS_OTA_Handler.UDS_OTA_Handler(device_handle, can_channel, console=self.console)
             self.uds_ota.progress_monitor.progress_signal.connect(self.update_progress_bar)
             self.uds_ota.progress_monitor.log_signal.connect(self.update_log)
-            success = self.uds_ota.perform_ota_update(firmware_data=file_path)
+            success = self.uds_ota.perform_ota_update(firmware_data=firmware_data)
 
             if success:
                 self.console.log("OTA更新成功")
@@ -36,15 +36,42 @@ def calculate_key_from_seed(seed, level):
     IV_L = hash_digest[16:]   # 高16字节作为IV_L
 
     cipher = AES.new(KEY_L, AES.MODE_CFB, IV_L[:16], segment_size=128)
-    ciphertext = cipher.encrypt(seed)
+    ciphertext = cipher.encrypt(bytes(seed))
 
     return ciphertext[:4]
 
 class UDS_OTA:
-    def __init__(self, device_handle, can_channel, console=None):
+    def __init__(self, device_handle, can_channel, console=None, compression=COMPRESSION_NONE, delta=False,
+                 store=None, sector_size=DELTA_SECTOR_SIZE, cache=None, integrity=None,
+                 memory_address=DEFAULT_BIN_ADDRESS, erased_value=FLASH_ERASED_VALUE,
+                 blank_threshold=0):
+        """
+        :param compression: 压缩方法ID（FirmwareCompression），非0时固件压缩后下载，ECU的bootloader须支持该方法
+        :param delta: True 时差分刷写，只擦除和下载与上次刷写的镜像相比有变化的扇区（见 delta_download）
+        :param store: 保存上次刷写的单段镜像（差分刷写的基准）的 FirmwareStore，完整刷写也会更新，None 时使用默认目录
+        :param sector_size: ECU flash的擦除粒度（逐段擦除和差分刷写的比较单位）
+        :param memory_address: 没有地址信息的固件（bytes、.bin）的下载地址，SegmentedImage 按各段地址刷写
+        :param cache: FirmwareCache，重复刷写同一镜像时使用磁盘缓存的压缩结果
+        :param integrity: 内存完整性检查附带的校验算法（FirmwareDigest：crc32 / crc16 / sha256），在传输数据时逐块累计，
+                          None 时 0x31 请求不带校验值
+        :param erased_value: ECU flash擦除后的字节值
+        :param blank_threshold: 不短于此长度的 erased_value 连续区擦除后不再下载（见 flash_segments），0（默认）时完整下载。
+                                只在目标ECU擦除后确为 erased_value，且 bootloader 不要求整个区域都经 0x36 写入
+                                （不检查下载地址连续、不只按下载的数据计算校验值）时启用，推荐 BLANK_RUN_THRESHOLD
+        """
         self.device = device_handle
         self.channel = can_channel
         self.console = console
+        self.compression = compression
+        self.delta = delta
+        self.store = store
+        self.sector_size = sector_size
+        self.memory_address = memory_address
+        self.erased_value = erased_value
+        self.blank_threshold = blank_threshold
+        self.cache = cache
+        self.integrity = integrity
+        self.digest = None  # 最近一次 transfer_data 累计的 ImageDigest
         self.progress = 0
 
     def _log(self, message):
@@ -59,7 +86,11 @@ class UDS_OTA:
     def initialize_can(self):
         """
         使用 usb2can 初始化 CAN 控制器
+        CANFD 连接（set_transport 选择了 CANFD 帧格式）的通道由调用方按所需的仲裁段/数据段波特率用 CANFD_Init 初始化，
+        这里不再按普通CAN重新初始化
         """
+        if get_transport(self.device, self.channel).frame_format.fd:
+            return True
         # 创建 CAN 初始化配置
         can_config = CAN_INIT_CONFIG()
     
@@ -75,7 +106,7 @@ class UDS_OTA:
         can_config.CAN_TXFP = 1  # 发送优先级管理：发送请求顺序决定
     
         # 调用 CAN 初始化函数
-        ret = CAN_Init(self.device_handle, self.can_channel, byref(can_config))
+        ret = CAN_Init(self.device, self.channel, byref(can_config))
         if ret != CAN_SUCCESS:
             return False
         return True
@@ -88,26 +119,22 @@ class UDS_OTA:
         """进入扩展会话，支持物理/功能寻址"""
         if self.console: self.console.debug(f"进入扩展会话({addressing_type})...")
         session_type = 0x03 if addressing_type == 'physical' else 0x83
-        ret = send_diagnostic_session_control(self.device, self.channel, session_type, addressing_type, self.console)
-        # 检查确认响应
-        if ret and self._check_response(0x50):
-            return ret
+        with subscribe_responses(self.device, self.channel) as sub:
+            ret = send_diagnostic_session_control(self.device, self.channel, session_type, addressing_type, self.console)
+            # 检查确认响应（抑制正响应时没有 0x50 应答）
+            if ret and (session_type & 0x80 or self._check_response(0x50, sub)):
+                return ret
         return False
 
-    def _check_response(self, expected_response):
-        import time
-        start_time = time.time()
-        timeout = 2.0
-        while time.time() - start_time < timeout:
-            CanMsgBuffer = (CAN_MSG * 1024)()
-            CanNum = CAN_GetMsg(self.device, self.channel, byref(CanMsgBuffer))
-            if CanNum > 0:
-                for i in range(CanNum):
-                    response = CanMsgBuffer[i]
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if len(data) >= 2 and data[1] == expected_response:
-                        return True
-            time.sleep(0.1)
+    def _check_response(self, expected_response, sub):
+        """
+        在订阅队列中等待指定的应答
+        :param sub: 发送请求之前通过 subscribe_responses 建立的订阅
+        """
+        for response in sub.iter_frames(2.0):
+            data = frame_data(response)
+            if len(data) >= 2 and data[1] == expected_response:
+                return True
         return False
     def wakeup(self):        # 发送唤醒信号
         if self.console: self.console.debug("发送唤醒信号...")
@@ -183,20 +210,9 @@ class UDS_OTA:
                 return False
             self.update_progress(27)
 
-            # 擦除APP内存 (0x31)
-            if not self.erase_memory():
-                self._log("内存擦除失败")
-                return False
+            # 擦除 (0x31) -> 请求下载 (0x34) -> 传输数据 (0x36) -> 请求退出传输 (0x37)
+            # 在 transfer_data 中按段进行：每段只擦除其覆盖的扇区（差分刷写时只擦除有变化的扇区）
             self.update_progress(30)
-
-            # 请求下载 (0x34)
-            if not request_download(self.device, self.channel, 0x08000000, len(firmware_data)):
-                self._log("请求下载失败")
-                return False
-            # 这里假设最大块大小确认后更新进度，具体根据实际情况调整
-            self.update_progress(30 + (80 - 30) * 0.1)
-
-            # 传输数据 (0x36)
             if not self.transfer_data(firmware_data):
                 self._log("数据传输失败")
                 return False
@@ -244,7 +260,7 @@ class UDS_OTA:
             self._log(f"当前进度: {self.progress}%")
             return False
 
-    def _check_program_compatibility(self):
+    def _check_program_compatibility(self, addressing_type='physical'):
         # 这里需要实现检查程序兼容性的逻辑
         if self.console: self.console.debug("检查程序兼容性...")
         msg = CAN_MSG()
@@ -255,11 +271,12 @@ class UDS_OTA:
         # 填充其他数据
         for i in range(2, 8):
             msg.Data[i] = 0x00
-        ret = CAN_SendMsg(self.device, self.channel, byref(msg), 1)
-        if ret != 0:
-            if self.console: self.console.error("发送程序兼容性检查请求失败")
-            return False
-        return self._check_response(0x71)
+        with subscribe_responses(self.device, self.channel) as sub:
+            ret = send_single_frame(self.device, self.channel, msg)
+            if ret < 0:
+                if self.console: self.console.error("发送程序兼容性检查请求失败")
+                return False
+            return self._check_response(0x71, sub)
 
     def _clear_all_dtc(self):
         if self.console: self.console.debug("清除所有DTC...")
@@ -273,16 +290,17 @@ class UDS_OTA:
         msg.Data[4] = 0xFF
         for i in range(5, 8):
             msg.Data[i] = 0x00
-        ret = CAN_SendMsg(self.device, self.channel, byref(msg), 1)
-        if ret != 0:
-            if self.console: self.console.error("发送清除所有DTC请求失败")
-            return False
-        return self._check_response(0x54)
+        with subscribe_responses(self.device, self.channel) as sub:
+            ret = send_single_frame(self.device, self.channel, msg)
+            if ret < 0:
+                if self.console: self.console.error("发送清除所有DTC请求失败")
+                return False
+            return self._check_response(0x54, sub)
 
     def enter_programming_session(self):
         """进入编程会话"""
         if self.console: self.console.debug("进入编程会话...")
-        ret = send_diagnostic_session_control(self.device, self.channel, 0x02, self.console)
+        ret = send_diagnostic_session_control(self.device, self.channel, 0x02, console=self.console)
         self.update_progress(7)  # 更新进度
         return ret
         
@@ -299,37 +317,28 @@ class UDS_OTA:
         for i in range(4, 8):
             msg.Data[i] = 0x00
             
-        # 发送请求
-        ret = CAN_SendMsg(self.device, self.channel, byref(msg), 1)
-        if ret != 0:
-            if self.console: self.console.error("发送编程条件检查请求失败")
-            return False
-        
-        # 添加响应接收逻辑
-        import time
-        start_time = time.time()
-        timeout = 2.0
-        while time.time() - start_time < timeout:
-            CanMsgBuffer = (CAN_MSG * 1024)()
-            CanNum = CAN_GetMsg(self.device, self.channel, byref(CanMsgBuffer))
-            if CanNum > 0:
-                for i in range(CanNum):
-                    response = CanMsgBuffer[i]
-                    if response.ID == 0x71b:  # 过滤目标ECU响应
-                        data = [response.Data[j] for j in range(response.DataLen)]
-                        if self.console: 
-                            console.debug(f"收到编程条件检查响应: {[hex(x) for x in data]}")
-                        # 检查正响应 (71 + 31 + 01)
-                        if len(data) >= 3 and data[1] == 0x71 and data[2] == 0x31 and data[3] == 0x01:
-                            self.update_progress(10)
-                            return True
-                        # 检查负响应 (7F + 31 + NRC)
-                        elif len(data) >= 4 and data[1] == 0x7F and data[2] == 0x31:
-                            nrc = data[3]
-                            if self.console: 
-                                console.error(f"编程条件检查失败，NRC: {hex(nrc)}")
-                            return False
-            time.sleep(0.1)
+        # 发送请求（先订阅目标ECU应答）
+        with subscribe_responses(self.device, self.channel, [0x71B]) as sub:
+            ret = send_single_frame(self.device, self.channel, msg)
+            if ret < 0:
+                if self.console: self.console.error("发送编程条件检查请求失败")
+                return False
+
+            # 添加响应接收逻辑，报文到达即处理
+            for response in sub.iter_frames(2.0):
+                data = frame_data(response)
+                if self.console: 
+                    console.debug(f"收到编程条件检查响应: {[hex(x) for x in data]}")
+                # 检查正响应 (71 + 31 + 01)
+                if len(data) >= 3 and data[1] == 0x71 and data[2] == 0x31 and data[3] == 0x01:
+                    self.update_progress(10)
+                    return True
+                # 检查负响应 (7F + 31 + NRC)
+                elif len(data) >= 4 and data[1] == 0x7F and data[2] == 0x31:
+                    nrc = data[3]
+                    if self.console: 
+                        console.error(f"编程条件检查失败，NRC: {hex(nrc)}")
+                    return False
         
         if self.console: self.console.error("编程条件检查超时")
         return False
@@ -347,63 +356,46 @@ class UDS_OTA:
         return ret
     
     def write_fingerprint_data(self):
-        """写入指纹数据"""
+        """写入指纹数据（0x2E F184，超过单帧长度，经连接的ISO-TP实现按多帧发送）"""
         if self.console: self.console.debug("写入指纹数据...")
-        msg = CAN_MSG()
-        msg.ID = 0x7DF
-        msg.DataLen = 12
-        msg.Data[0] = 0x0C
-        msg.Data[1] = 0x2E
-        msg.Data[2] = 0xF1
-        msg.Data[3] = 0x84
-        msg.Data[4] = 0x41  # 示例数据
-        msg.Data[5] = 0x42
-        msg.Data[6] = 0x43
-        msg.Data[7] = 0x44
-        msg.Data[8] = 0x45
-        msg.Data[9] = 0x46
-        msg.Data[10] = 0x20
-        for i in range(11, 12):
-            msg.Data[i] = 0x00
-            
-        ret = CAN_SendMsg(self.device, self.channel, byref(msg), 1)
+        payload = bytes([0x2E, 0xF1, 0x84,
+                         0x41, 0x42, 0x43, 0x44, 0x45, 0x46, 0x20])  # 示例数据
+        response = get_transport(self.device, self.channel).request(payload, console=self.console, tx_id=0x7DF)
         self.update_progress(40)
-        return ret == 0
-    
-    def erase_memory(self):
-        """擦除内存"""
-        if self.console: self.console.debug("擦除内存...")
-        msg = CAN_MSG()
-        msg.ID = 0x7DF
-        msg.DataLen = 8
-        msg.Data[0] = 0x04
-        msg.Data[1] = 0x31
-        msg.Data[2] = 0x01
-        msg.Data[3] = 0xFF
-        for i in range(4, 8):
-            msg.Data[i] = 0x00
-            
-        ret = CAN_SendMsg(self.device, self.channel, byref(msg), 1)
-        self.update_progress(45)
-        return ret == 0
+        return bool(response)
     
-    def transfer_data(self, firmware_data):
-        """传输数据"""
+    def transfer_data(self, firmware_data, block_size=None):
+        """
+        擦除并传输数据：SegmentedImage 逐段擦除其覆盖的扇区后逐段下载，段之间大的空隙和段内的空白区跳过（见 flash_segments）
+        :param block_size: 每个 0x36 请求的数据字节数，None 时按ECU在 0x74 应答中给出的最大块长度
+        """
         if self.console: self.console.debug("传输数据...")
-        
-        # 1. 请求下载(0x34)
-        if not request_download(self.device, self.channel, 0x08000000, len(firmware_data)):
-            return False
-            
-        # 2. 传输数据(0x36)
-        block_size = 1024  # 每次传输1KB
-        for i in range(0, len(firmware_data), block_size):
-            block = firmware_data[i:i+block_size]
-            if not transfer_data(self.device, self.channel, i//block_size + 1, block):
-                return False
-                
-        # 3. 请求退出传输(0x37)
-        ret = request_transfer_exit(self.device, self.channel)
+        self.digest = ImageDigest(self.integrity) if self.integrity else None
+
+        if self.delta:
+            # 每个有变化的扇区段：擦除(0x31) -> 请求下载(0x34) -> 传输数据(0x36) -> 请求退出传输(0x37)
+            ret = delta_download(self.device, self.channel, self.memory_address, firmware_data, store=self.store,
+                                 sector_size=self.sector_size, block_size=block_size, console=self.console,
+                                 compression=self.compression, cache=self.cache, digest=self.digest,
+                                 erased_value=self.erased_value, blank_threshold=self.blank_threshold)
+            stats = get_last_delta_stats()
+            if stats is not None:
+                self._log(f"差分刷写: {stats}")
+        else:
+            # 完整刷写后ECU内容不再与保存的镜像一致；单段镜像刷写成功后保存，作为下次差分刷写的基准
+            store = self.store if self.store is not None else FirmwareStore()
+            store.forget(ECU_RESPONSE_ID)
+            # 擦除各段覆盖的扇区(0x31) -> 每段 请求下载(0x34) -> 传输数据(0x36) -> 请求退出传输(0x37)
+            ret = flash_segments(self.device, self.channel, firmware_data, self.memory_address, self.sector_size,
+                                 block_size=block_size, console=self.console, compression=self.compression,
+                                 cache=self.cache, digest=self.digest, erased_value=self.erased_value,
+                                 blank_threshold=self.blank_threshold)
+            plan = get_last_segment_plan()
+            if plan is not None and (len(plan.segments) > 1 or plan.blank_bytes):
+                self._log(f"逐段刷写: {plan}")
+            segments = as_segments(firmware_data, self.memory_address)
+            if ret and len(segments) == 1:
+                store.save(ECU_RESPONSE_ID, segments[0][0], as_buffer(segments[0][1]))
         self.update_progress(70)
         return ret
     
@@ -414,7 +406,7 @@ class UDS_OTA:
         return control_communication(self.device, self.channel, channel, control_type, addressing_type, self.console)
 
     def check_memory_integrity(self):
-        return check_memory_integrity(self.device, self.channel, self.console)
+        return check_memory_integrity(self.device, self.channel, self.console, digest=self.digest)
 
     def ecu_reset(self, reset_type=0x01):
         return ecu_reset(self.device, self.channel, reset_type, self.console)
@@ -10,9 +10,14 @@ import isotp
 
 from PyQt5.QtCore import QObject, pyqtSignal
 from usb2can import CAN_INIT_CONFIG, CAN_Init, CAN_SUCCESS
+import usb_device
 import os
 from Crypto.Cipher import AES
 import UDS_service
+from FirmwareCompression import COMPRESSION_NONE, compress_image
+from FirmwareDelta import DELTA_SECTOR_SIZE, FirmwareStore, plan_delta
+from FirmwareDigest import ImageDigest
+from FirmwareImage import FLASH_ERASED_VALUE, as_buffer, as_segments, plan_segments
 
 # 新增：引入安全算法相关的常量和函数
 SECURITY_COEFFICIENTS = bytes([0x22, 0x4D, 0x08, 0x31])   # Coef1-4
@@ -46,17 +51,56 @@ class OTAProgressMonitor(QObject):
     log_signal = pyqtSignal(str)
 
 class UDS_OTA_Handler:
-    def __init__(self, device_handle, can_channel, console=None):
+    def __init__(self, device_handle, can_channel, console=None, bus=None, block_size=None, fd=False,
+                 compression=COMPRESSION_NONE, delta=False, store=None, sector_size=DELTA_SECTOR_SIZE, integrity=None,
+                 erased_value=FLASH_ERASED_VALUE, blank_threshold=0):
+        """
+        :param bus: python-can 总线对象，None 时按后端创建（模拟后端使用 usb_sim.SimCanBus）
+        :param block_size: 每个 0x36 请求的数据字节数（测试用），None 时按ECU在 0x74 应答中给出的最大块长度
+        :param fd: True 时 ISO-TP 按CANFD发送（每帧64字节，BRS），ECU须支持CANFD刷写
+        :param compression: 压缩方法ID（FirmwareCompression），非0时固件压缩后下载，ECU的bootloader须支持该方法
+        :param delta: True 时差分刷写，与上次刷写成功的镜像按扇区比较，只擦除和下载有变化的扇区
+        :param store: 保存上次刷写的单段镜像（差分刷写的基准）的 FirmwareStore，完整刷写也会更新，None 时使用默认目录
+        :param sector_size: ECU flash的擦除粒度（逐段擦除和差分刷写的比较单位）
+        :param integrity: 内存完整性检查附带的校验算法（FirmwareDigest：crc32 / crc16 / sha256），在传输数据时逐块累计，
+                          None 时 0x31 请求不带校验值
+        :param erased_value: ECU flash擦除后的字节值
+        :param blank_threshold: 不短于此长度的 erased_value 连续区擦除后不再下载，0（默认）时完整下载。
+                                只在目标ECU擦除后确为 erased_value，且 bootloader 不要求整个区域都经 0x36 写入
+                                （不检查下载地址连续、不只按下载的数据计算校验值）时启用，推荐 BLANK_RUN_THRESHOLD
+        """
         self.device_handle = device_handle
         self.can_channel = can_channel
         self.console = console or print
         self.progress_monitor = OTAProgressMonitor()
         self.ota_update_progress = 0.0
+        self.block_size = block_size
+        self.max_block_length = None  # 最近一次 0x74 应答中的 maxNumberOfBlockLength
+        self.compression = compression
+        self.delta = delta
+        self.store = store if store is not None else FirmwareStore()
+        self.sector_size = sector_size
+        self.erased_value = erased_value
+        self.blank_threshold = blank_threshold
+        self.delta_stats = None  # 最近一次差分刷写的 UDS_service.DeltaStats
+        self.integrity = integrity
+        self.digest = None  # 最近一次刷写累计的 ImageDigest
+        self.isotp_params = {'tx_data_min_length': 8, 'tx_padding': 0}
+        if fd:
+            self.isotp_params.update({'can_fd': True, 'tx_data_length': 64, 'bitrate_switch': True,
+                                      'tx_padding': UDS_service.ISOTP_FD_PADDING})
 
         # 初始化CAN总线
+        if bus is not None:
+            self.canbus = bus
+            return
         try:
-            from ldxn import CANalystIIBus
-            self.canbus = CANalystIIBus(self.device_handle, self.can_channel, 500000)
+            if usb_device.USB2XXX_BACKEND == "sim":
+                from usb_sim import SimCanBus
+                self.canbus = SimCanBus(self.can_channel)
+            else:
+                from ldxn import CANalystIIBus
+                self.canbus = CANalystIIBus(self.device_handle, self.can_channel, 500000)
         except Exception as e:
             self._log(f"Failed to initialize CAN bus: {e}")
             raise
@@ -120,7 +164,10 @@ class UDS_OTA_Handler:
             return None
 
     def perform_ota_update(self, firmware_data):
-        """执行完整的OTA更新流程"""
+        """
+        执行完整的OTA更新流程
+        :param firmware_data: 固件数据（下载到第一个APP分区的起始地址），或 SegmentedImage（按各段地址逐段下载）
+        """
         self.ota_update_progress = 0.0
         
         self._log("Performing OTA update...")
@@ -134,10 +181,9 @@ class UDS_OTA_Handler:
             # 初始化地址和参数
             physical_addr = isotp.Address(txid=0x713, rxid=0x71B)
             functional_addr = isotp.Address(txid=0x7DF, rxid=0x71B)
-            isotp_params = {'tx_data_min_length': 8, 'tx_padding': 0}
 
-            isotp_physical_stack = isotp.CanStack(bus=self.canbus, address=physical_addr, params=isotp_params)
-            isotp_functional_stack = isotp.CanStack(bus=self.canbus, address=functional_addr, params=isotp_params)
+            isotp_physical_stack = isotp.CanStack(bus=self.canbus, address=physical_addr, params=self.isotp_params)
+            isotp_functional_stack = isotp.CanStack(bus=self.canbus, address=functional_addr, params=self.isotp_params)
 
             # Step 1: 进入扩展会话模式
             if self.into_extended_session_mode(isotp_physical_stack, isotp_functional_stack, 0x03, "physical") != 0:
@@ -209,44 +255,68 @@ class UDS_OTA_Handler:
             self.current_update_progress(self.ota_update_progress)
             self.testWaitForTimeout(10)
 
-            # Step 9: 擦除APP内存
-            if self.erase_APP_memory(isotp_physical_stack) != 0:
-                self._log("Erase APP memory failed")
-                return False
+            # Step 9: 擦除APP内存：每段只擦除其覆盖的扇区，段之间大的空隙跳过；差分刷写时只擦除有变化的扇区（只支持单段镜像）
+            segments = as_segments(firmware_data, data_transfer_info.app_start_addr[0][0])
+            ecu_id = UDS_service.ECU_RESPONSE_ID
+            plan = self.delta_stats = None
+            baseline = None  # 校验成功后保存的镜像 (地址, 数据)，作为下次差分刷写的基准；多段镜像不保存
+            blanks = {}  # 只擦除不下载的空白区 {地址: 长度}
+            self.digest = ImageDigest(self.integrity) if self.integrity else None
+            if self.delta and len(segments) == 1:
+                app_address, firmware_data = segments[0]
+                firmware_data = as_buffer(firmware_data)
+                if self.digest is not None:
+                    # 只下载有变化的扇区，校验值按整个镜像计算
+                    self.digest.update(firmware_data)
+                plan = plan_delta(self.store.load(ecu_id), firmware_data, app_address, self.sector_size)
+                self.delta_stats = UDS_service.DeltaStats(plan)
+                self._log(f"Delta plan: {plan}")
+                baseline = (app_address, firmware_data)
+                # ECU内容在刷写过程中与保存的镜像不再一致，校验成功后再保存
+                self.store.forget(ecu_id)
+                start = time.perf_counter()
+                for address, erase_size, _ in plan.regions:
+                    if self.erase_memory_range(isotp_physical_stack, address, erase_size) != 0:
+                        self._log(f"Erase 0x{address:08X} failed")
+                        return False
+                self.delta_stats.erase_time = time.perf_counter() - start
+                segments = []
+                for address, data in plan.segments:
+                    pieces = plan_segments(data, address, self.sector_size, 0, self.erased_value, self.blank_threshold)
+                    self.delta_stats.blank_bytes += pieces.blank_bytes
+                    segments += pieces.segments
+            else:
+                # 完整刷写后ECU内容不再与保存的镜像一致，校验成功后再保存
+                self.store.forget(ecu_id)
+                if len(segments) == 1:
+                    baseline = (segments[0][0], as_buffer(segments[0][1]))
+                segment_plan = plan_segments(segments, sector_size=self.sector_size, erased_value=self.erased_value,
+                                             blank_threshold=self.blank_threshold)
+                self._log(f"Segment plan: {segment_plan}")
+                if self.erase_APP_memory(isotp_physical_stack, segment_plan.erase_ranges) != 0:
+                    self._log("Erase APP memory failed")
+                    return False
+                blanks = dict(segment_plan.blank_ranges)
+                segments = segment_plan.layout()
             self._log("Erase APP memory success")
             self.increase_progress()
             self.current_update_progress(self.ota_update_progress)
             self.testWaitForTimeout(100)
 
-            # Step 10: 请求下载
-            if self.request_download(isotp_physical_stack, 0x44, len(firmware_data)) != 0:
-                self._log("Request download failed")
-                return False
-            self._log("Request download success")
-            self.increase_progress()
-            self.current_update_progress(self.ota_update_progress)
-            self.testWaitForTimeout(10)
-
-            # Step 11: 数据传输
-            block_size = 1024  # 每次传输1KB
-            for i in range(0, len(firmware_data), block_size):
-                block = firmware_data[i:i+block_size]
-                if self.transfer_data(isotp_physical_stack, i//block_size + 1, block) != 0:
-                    self._log("Transfer data failed")
+            # Step 10~12: 每个数据段 请求下载 -> 数据传输 -> 结束传输
+            start = time.perf_counter()
+            for address, data in segments:
+                if data is None:
+                    # 空白区擦除后即为擦除值，不下载，校验值按擦除值累计
+                    if self.digest is not None:
+                        self.digest.update_fill(self.erased_value, blanks[address])
+                    continue
+                if self.download_segment(isotp_physical_stack, address, data) != 0:
                     return False
-                self.testWaitForTimeout(0.1)  # 改为100微秒（0.1毫秒）
-            
-            self._log("Transfer data success")
-            self.increase_progress()
-            self.current_update_progress(self.ota_update_progress)
-            self.testWaitForTimeout(10)
-
-            # Step 12: 结束传输
-            if self.exit_transfer(isotp_physical_stack) != 0:
-                self._log("Exit transfer failed")
-                return False
-            self._log("Exit transfer success")
-            self.increase_progress()
+            if plan is not None:
+                self.delta_stats.transfer_time = time.perf_counter() - start
+            for _ in range(3):
+                self.increase_progress()
             self.current_update_progress(self.ota_update_progress)
             self.testWaitForTimeout(10)
 
@@ -255,6 +325,10 @@ class UDS_OTA_Handler:
                 self._log("Check memory integrity failed")
                 return False
             self._log("Check memory integrity success")
+            if baseline is not None:
+                self.store.save(ecu_id, *baseline)
+            if plan is not None:
+                self._log(f"Delta flashing: {self.delta_stats}")
             self.increase_progress()
             self.current_update_progress(self.ota_update_progress)
             self.testWaitForTimeout(10)
@@ -414,55 +488,140 @@ class UDS_OTA_Handler:
         self._log("Failed to write fingerprint data")
         return 1
 
-    def erase_APP_memory(self, isotp_physical_stack):
+    def erase_APP_memory(self, isotp_physical_stack, ranges=None):
         """
         Rewrites erase_APP_memory() based on the provided CAPL code.
         Performs memory erase using RoutineControl (0x31) for each app section.
+        :param ranges: [(起始地址, 长度)]，None 时为 data_transfer_info 中的全部APP分区
         """
+        if ranges is None:
+            ranges = [tuple(section[:2]) for section in data_transfer_info.app_start_addr[:data_transfer_info.app_section]]
         rev_overall = 0 # Initialize overall return value
 
-        for i in range(data_transfer_info.app_section):
-            start_addr = data_transfer_info.app_start_addr[i][0]
-            size = data_transfer_info.app_start_addr[i][1]
-
-            # Construct erase_data as per CAPL: 4 bytes for address, 4 bytes for size
-            erase_data_payload = bytearray([
-                (start_addr >> 24) & 0xFF,
-                (start_addr >> 16) & 0xFF,
-                (start_addr >> 8) & 0xFF,
-                start_addr & 0xFF,
-                (size >> 24) & 0xFF,
-                (size >> 16) & 0xFF,
-                (size >> 8) & 0xFF,
-                size & 0xFF
-            ])
-    
-            request_data = bytearray([
-                0x31,
-                0x01,
-                (0xFF00 >> 8) & 0xFF,  # RoutineIdentifier high byte
-                0xFF00 & 0xFF          # RoutineIdentifier low byte
-            ]) + erase_data_payload
-
-            #DIAG_output_show(f"erase addr: {hex(start_addr)}, size: {size}")
-
-            response = self.send_uds_request(isotp_physical_stack, request_data, "physical")
-            if response is None or response[0] != 0x71: # Check for positive response to 0x31
-                #DIAG_output_show(f"Erase APP memory failed for section {i}: No positive response or timeout.")
-                rev_overall = 1 # Set overall return to error
+        for start_addr, size in ranges:
+            rev_overall = self.erase_memory_range(isotp_physical_stack, start_addr, size)
+            if rev_overall != 0:
                 break # Exit loop on first error
-            else:
-                if len(response) < 5 or response[4] != 0x00:
-                   # DIAG_output_show(f"Erase error for section {i}. Routine status: {response[4] if len(response) > 4 else 'N/A'}")
-                    rev_overall = 1 # Set overall return to error
-                    break # Exit loop on first error
-                else:
-                    break
-                    #DIAG_output_show(f"Erase APP memory for section {i} successful.")
         return rev_overall
+
+    def erase_memory_range(self, isotp_physical_stack, start_addr, size):
+        """擦除 start_addr 起 size 字节（31服务 FF00 例程），成功返回0"""
+        # Construct erase_data as per CAPL: 4 bytes for address, 4 bytes for size
+        erase_data_payload = bytearray([
+            (start_addr >> 24) & 0xFF,
+            (start_addr >> 16) & 0xFF,
+            (start_addr >> 8) & 0xFF,
+            start_addr & 0xFF,
+            (size >> 24) & 0xFF,
+            (size >> 16) & 0xFF,
+            (size >> 8) & 0xFF,
+            size & 0xFF
+        ])
+
+        request_data = bytearray([
+            0x31,
+            0x01,
+            (0xFF00 >> 8) & 0xFF,  # RoutineIdentifier high byte
+            0xFF00 & 0xFF          # RoutineIdentifier low byte
+        ]) + erase_data_payload
+
+        #DIAG_output_show(f"erase addr: {hex(start_addr)}, size: {size}")
+
+        response = self.send_uds_request(isotp_physical_stack, request_data, "physical")
+        if response is None or response[0] != 0x71: # Check for positive response to 0x31
+            #DIAG_output_show(f"Erase failed: No positive response or timeout.")
+            return 1
+        if len(response) < 5 or response[4] != 0x00:
+            # DIAG_output_show(f"Erase error. Routine status: {response[4] if len(response) > 4 else 'N/A'}")
+            return 1
+        return 0
+
+    def download_segment(self, isotp_physical_stack, address, data):
+        """
+        下载一个数据段：请求下载(34服务) -> 数据传输(36服务) -> 结束传输(37服务)，成功返回0
+        压缩下载时 memorySize 为原始长度，0x36 传输压缩后的数据；块大小按ECU在 0x74 应答中给出的最大块长度
+        """
+        # 差分刷写时校验值已按整个镜像累计；压缩下载时传输的是压缩数据，累计原始数据
+        digest = self.digest if self.delta_stats is None else None
+        transfer_data = as_buffer(data)
+        data_format = 0x00
+        if self.compression != COMPRESSION_NONE:
+            if digest is not None:
+                digest.update(transfer_data)
+                digest = None
+            image = compress_image(transfer_data, self.compression)
+            self._log(f"Compressed firmware: {len(data)} -> {len(image.data)} bytes "
+                      f"({image.ratio:.1%}, {image.compress_time * 1000:.1f} ms{', cached' if image.cached else ''})")
+            transfer_data = image.data
+            data_format = image.data_format
+        if self.request_download(isotp_physical_stack, 0x44, len(data), memory_address=address,
+                                 data_format=data_format) != 0:
+            self._log("Request download failed")
+            return 1
+        self._log(f"Request download success: 0x{address:08X}, {len(data)} bytes")
+
+        block_size = UDS_service.transfer_block_size(self.max_block_length, self.block_size)
+        for i in range(0, len(transfer_data), block_size):
+            block = transfer_data[i:i+block_size]
+            if digest is not None:
+                digest.update(block)
+            if self.transfer_data(isotp_physical_stack, i//block_size + 1, block) != 0:
+                self._log("Transfer data failed")
+                return 1
+            self.testWaitForTimeout(0.1)  # 改为100微秒（0.1毫秒）
+        self._log("Transfer data success")
+        if self.delta_stats is not None:
+            self.delta_stats.sent += len(transfer_data)
+
+        if self.exit_transfer(isotp_physical_stack) != 0:
+            self._log("Exit transfer failed")
+            return 1
+        self._log("Exit transfer success")
+        return 0
+
+    def request_download(self, isotp_physical_stack, address_and_length_format, memory_size,
+                         memory_address=None, data_format=0x00):
+        """
+        请求下载(34服务)，成功时从 0x74 正响应中取出 maxNumberOfBlockLength 保存到 self.max_block_length
+        :param address_and_length_format: addressAndLengthFormatIdentifier，高4位长度字节数、低4位地址字节数
+        :param memory_address: 下载起始地址，None 时使用第一个APP分区的起始地址
+        """
+        if memory_address is None:
+            memory_address = data_transfer_info.app_start_addr[0][0]
+        address_len = address_and_length_format & 0x0F
+        size_len = address_and_length_format >> 4
+        request_data = (bytearray([0x34, data_format, address_and_length_format])
+                        + memory_address.to_bytes(address_len, "big") + memory_size.to_bytes(size_len, "big"))
+        response = self.send_uds_request(isotp_physical_stack, request_data, "physical")
+        max_block_length = UDS_service.parse_request_download_response(response)
+        if max_block_length is None:
+            self._log("Request download failed")
+            return 1
+        self.max_block_length = max_block_length
+        self._log(f"Max block length: {max_block_length}")
+        return 0
+
+    def transfer_data(self, isotp_physical_stack, block_sequence_counter, block):
+        """传输数据(36服务)"""
+        request_data = bytearray([0x36, block_sequence_counter & 0xFF]) + block
+        response = self.send_uds_request(isotp_physical_stack, request_data, "physical")
+        if response and response[0] == 0x76:
+            return 0
+        return 1
+
+    def exit_transfer(self, isotp_physical_stack):
+        """请求退出传输(37服务)"""
+        response = self.send_uds_request(isotp_physical_stack, bytearray([0x37]), "physical")
+        if response and response[0] == 0x77:
+            return 0
+        return 1
+
     def check_memory_integrity(self, isotp_physical_stack):
-        """检查内存完整性(31服务)"""
+        """检查内存完整性(31服务)，设置了校验算法时附加传输数据时累计的校验值"""
         request_data = bytearray([0x31, 0x01, 0x02, 0x01])
+        if self.digest is not None:
+            request_data += self.digest.digest()
+            self._log(f"Integrity digest: {self.digest}")
         response = self.send_uds_request(isotp_physical_stack, request_data, "physical")
         if response and response[0] == 0x71 and len(response) >= 5 and response[4] == 0x00:
             self._log("Memory integrity check passed")
@@ -1,13 +1,25 @@
-
 from usb2can import *
 from usb2lin import *
 from usb_device import *
+from can_uds import *
+from usb2canfd import (CANFD_MSG, CANFD_SendMsg, CANFD_SetSchedule, CANFD_StartSchedule, CANFD_MSG_FLAG_BRS,
+                       CANFD_MSG_FLAG_FDF)
+import struct
+import threading
 import time
+import zlib
 from time import sleep
 from ctypes import *
+from CANDispatcher import get_dispatcher
+from FirmwareCompression import COMPRESSION_NONE, compress_image, compression_method_name
+from FirmwareDelta import DELTA_SECTOR_SIZE, FirmwareStore, plan_delta
+from FirmwareDigest import ImageDigest
+from FirmwareImage import (BLANK_RUN_THRESHOLD, DEFAULT_BIN_ADDRESS, FLASH_ERASED_VALUE, FLASH_SECTOR_SIZE,
+                           SEGMENT_MERGE_GAP, SegmentPlan, as_buffer, as_segments, plan_segments)
 
 PHYSICAL_ADDRESSING_ID = 0x7DF
 FUNCTIONAL_ADDRESSING_ID = 0x713
+ECU_RESPONSE_ID = 0x71B  # 目标ECU应答ID
 
 addressing_type = 'physical'  # 'physical' or 'functional'
 if addressing_type == 'physical':
@@ -15,145 +27,1243 @@ if addressing_type == 'physical':
 else:
     CAN_ID = FUNCTIONAL_ADDRESSING_ID
 
-def request_download(device_handle, can_channel, memory_address, length):
+NRC_RESPONSE_PENDING = 0x78  # requestCorrectlyReceived-ResponsePending
+
+
+class ECUTiming:
     """
-    发起 UDS 0x34 请求下载服务
+    ECU应答时间参数（ISO 14229-2 P2/P2*）
+    p2: 请求发出后等待首个应答的最长时间（秒）
+    p2_star: 收到 NRC 0x78 后每次延长的等待时间（秒）
+    margin: 由ECU上报的 P2server/P2*server 换算客户端超时时附加的余量（秒）
     """
-    msg = CAN_MSG()
-    msg.ID = CAN_ID
-    msg.DataLen = 8
-    msg.Data[0] = 0x04  # 数据长度（不包含长度自身）
-    msg.Data[1] = 0x34  # UDS 服务 ID
-    msg.Data[2] = 0x44  # 模式（Download to ECU）
-
-    # 内存地址（假设为 32-bit 地址）
-    msg.Data[3] = (memory_address >> 24) & 0xFF
-    msg.Data[4] = (memory_address >> 16) & 0xFF
-    msg.Data[5] = (memory_address >> 8) & 0xFF
-    msg.Data[6] = memory_address & 0xFF
-
-    # 数据长度
-    msg.Data[7] = length & 0xFF
-
-    # 填充剩余字节为0
-    for i in range(8):
-        if i > 7:
-            msg.Data[i] = 0x00
-
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
-        print("发送请求下载失败！")
-        return False
-    sleep(0.5)
 
-    # 接收响应
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-    if CanNum > 0 and CanMsgBuffer[0].Data[1] == 0x7F:
-        print("NRC 错误:", hex(CanMsgBuffer[0].Data[3]))
-        return False
-    return True
+    def __init__(self, p2=0.15, p2_star=5.0, margin=0.05):
+        self.p2 = p2
+        self.p2_star = p2_star
+        self.margin = margin
+
+    def update_from_session_response(self, payload):
+        """
+        根据 0x50 正响应中的 P2server_max(ms) 和 P2*server_max(10ms) 更新超时
+        payload: [0x50, 会话类型, P2高, P2低, P2*高, P2*低]
+        """
+        if len(payload) >= 6:
+            self.p2 = ((payload[2] << 8) | payload[3]) / 1000.0 + self.margin
+            self.p2_star = ((payload[4] << 8) | payload[5]) * 10 / 1000.0 + self.margin
+
+
+# 每个ECU（按应答ID区分）的时间参数，未配置的ECU使用默认值
+ECU_TIMINGS = {}
+
+
+def set_ecu_timing(response_id, p2=0.15, p2_star=5.0, margin=0.05):
+    """配置指定ECU的 P2/P2* 超时（秒）"""
+    ECU_TIMINGS[response_id] = ECUTiming(p2, p2_star, margin)
+    return ECU_TIMINGS[response_id]
+
+
+def get_ecu_timing(response_id=ECU_RESPONSE_ID):
+    """获取指定ECU的时间参数，不存在时按默认值创建"""
+    timing = ECU_TIMINGS.get(response_id)
+    if timing is None:
+        timing = ECU_TIMINGS[response_id] = ECUTiming()
+    return timing
+
 
-def transfer_data(device_handle, can_channel, block_sequence_counter, data_block):
+class UDSResponse:
     """
-    发送 UDS 0x36 传输数据块（支持多帧传输）
+    一次UDS请求的应答
+    payload: 应答数据（从服务ID开始，不含PCI），超时为None
+    elapsed: 从请求发出到收到最终应答的时间（秒）
+    pending_count: 期间收到 NRC 0x78 的次数
+    sent_at: 请求第一帧提交给适配器的时间（time.perf_counter()），由传输类填写
+    suppressed: 请求置位了子功能 bit7（suppressPosRspMsgIndicationBit），ECU不回正响应，P2 内没有应答即为成功
     """
-    block_size = len(data_block)
-    max_data_per_frame = 7  # 单帧最多 7 字节数据
 
-    # === 首帧 FF ===
-    first_frame = CAN_MSG()
-    first_frame.ID = 0x7DF
-    first_frame.DataLen = 8  # 固定为 8 字节
-    first_frame.Data[0] = 0x10 | ((block_size >> 8) & 0x0F)  # FF 帧头 + 高位长度
-    first_frame.Data[1] = block_size & 0xFF                  # 低位长度
-    first_frame.Data[2] = 0x36                               # UDS 服务码
-    first_frame.Data[3] = block_sequence_counter             # 块序号
-
-    # 填充剩余字节为0
-    for i in range(4, 8):
-        first_frame.Data[i] = 0x00
+    def __init__(self, service_id, payload=None, response_id=None, elapsed=0.0, pending_count=0):
+        self.service_id = service_id
+        self.payload = payload
+        self.response_id = response_id
+        self.elapsed = elapsed
+        self.pending_count = pending_count
+        self.sent_at = None
+        self.suppressed = False
+
+    @property
+    def timed_out(self):
+        return self.payload is None
+
+    @property
+    def positive(self):
+        return self.payload is not None and self.payload[0] == self.service_id + 0x40
+
+    @property
+    def negative(self):
+        return self.payload is not None and self.payload[0] == 0x7F
+
+    @property
+    def nrc(self):
+        return self.payload[2] if self.negative and len(self.payload) > 2 else None
+
+    def __bool__(self):
+        return self.positive or (self.suppressed and self.timed_out)
+
+    def __repr__(self):
+        data = ' '.join(f"{x:02X}" for x in self.payload) if self.payload else None
+        return f"UDSResponse(0x{self.service_id:02X}, [{data}], {self.elapsed * 1000:.1f}ms)"
+
+
+_last_response = threading.local()
+
+
+def get_last_response():
+    """
+    返回当前线程最近一次服务请求的 UDSResponse（含实测应答时间），下一次请求会覆盖，须在其之前读取
+    结果只有成功/失败的服务（0x10/0x11/0x28/0x85）直接返回 UDSResponse（只有正响应为真）；
+    返回种子、块长度、例程结果等数据的服务返回值不变，应答时间由此获取
+    """
+    return getattr(_last_response, "value", None)
+
+
+def _frame_size(msg):
+    """报文的数据字节数，CAN_MSG 为 DataLen，CANFD_MSG 为 DLC"""
+    return msg.DLC if isinstance(msg, CANFD_MSG) else msg.DataLen
+
+
+def frame_data(msg):
+    """报文的数据字节（列表），CAN_MSG 和 CANFD_MSG 通用"""
+    return [msg.Data[j] for j in range(_frame_size(msg))]
+
+
+def _frame_payload(msg):
+    """
+    取出单帧应答中的UDS数据（去掉PCI）
+    多帧应答只取首帧中的数据，用于判断应答类型
+    CANFD 单帧超过7字节时长度字段为0，实际长度在第2字节
+    """
+    size = _frame_size(msg)
+    pci = msg.Data[0]
+    if pci >> 4 == 0:
+        length = pci & 0x0F
+        start = 1
+        if length == 0 and size > 8:
+            length = msg.Data[1]
+            start = 2
+        length = min(length, size - start)
+        return [msg.Data[j] for j in range(start, start + length)]
+    if pci >> 4 == 1:
+        return [msg.Data[j] for j in range(2, size)]
+    return None
+
+
+def iter_uds_responses(sub, service_id, start, timing=None, console=None):
+    """
+    依次返回订阅队列中属于 service_id 的应答（UDSResponse），报文到达即返回
+    首个应答最多等待 P2；收到 NRC 0x78 后截止时间延长为 P2*，不作为应答返回
+    :param start: 请求发出的时间（time.perf_counter()）
+    """
+    timing = timing or get_ecu_timing()
+    deadline = start + timing.p2
+    pending_count = 0
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        msg = sub.get(remaining)
+        if msg is None:
+            return
+        payload = _frame_payload(msg)
+        if not payload:
+            continue
+        if payload[0] == 0x7F and len(payload) > 2 and payload[1] == service_id:
+            if payload[2] == NRC_RESPONSE_PENDING:
+                pending_count += 1
+                deadline = time.perf_counter() + timing.p2_star
+                if console: console.debug(f"服务0x{service_id:02X}应答等待中(NRC 0x78)，延长至P2*={timing.p2_star}秒")
+                continue
+        elif payload[0] != service_id + 0x40:
+            continue
+        yield UDSResponse(service_id, payload, msg.ID, time.perf_counter() - start, pending_count)
+
+
+def wait_uds_response(sub, service_id, start, timing=None, console=None):
+    """
+    等待 service_id 的最终应答（正响应或除 0x78 以外的负响应）
+    :return: UDSResponse，超时时 payload 为None；同时记录为当前线程的最近一次应答
+    """
+    response = next(iter_uds_responses(sub, service_id, start, timing, console), None)
+    if response is None:
+        response = UDSResponse(service_id, None, None, time.perf_counter() - start)
+    _last_response.value = response
+    if console: console.debug(f"服务0x{service_id:02X}应答耗时: {response.elapsed * 1000:.1f}ms")
+    return response
+
+
+def subscribe_responses(device_handle, can_channel, ids=None, msg_type=None):
+    """
+    订阅应答报文，必须在发送请求之前调用，避免应答先于订阅到达
+    报文统一由通道调度器读取和分发，多个模块同时等待应答时不会互相抢走报文
+    :param ids: 应答报文ID列表，None 表示接收全部报文
+    :param msg_type: CAN_MSG，或 CANFD_MSG（通道已用 CANFD_Init 初始化），None 时按连接的ISO-TP实现的报文类型
+    """
+    if msg_type is None:
+        msg_type = get_transport(device_handle, can_channel).frame_format.msg_type
+    return get_dispatcher(device_handle, can_channel, msg_type).subscribe(ids)
+
+
+def send_single_frame(device_handle, can_channel, msg):
+    """
+    按连接的ISO-TP实现的报文格式发送单帧请求 msg（CAN_MSG，Data[0] 为单帧PCI）：
+    普通CAN通过 CAN_SendMsg 发送，CANFD 连接按 CANFD_MSG 重新编码后通过 CANFD_SendMsg 发送，
+    应答用 subscribe_responses（默认报文类型）订阅
+    :return: 发送函数的返回值，小于0为失败
+    """
+    frame_format = get_transport(device_handle, can_channel).frame_format
+    return frame_format.send(device_handle, can_channel, msg.ID, bytes(msg.Data[:msg.DataLen]))
+
+
+# ISO 15765-2 流控帧状态
+FC_CONTINUE_TO_SEND = 0x0
+FC_WAIT = 0x1
+FC_OVERFLOW = 0x2
+
+ISOTP_N_BS = 1.0               # 发送首帧或一个块的最后一帧后等待流控帧的最长时间（秒）
+ISOTP_MAX_WAIT_FRAMES = 10     # 连续收到 WAIT 流控帧的最大次数（N_WFTmax）
+ISOTP_MAX_BATCH_FRAMES = 64    # STmin 为0时一次 CAN_SendMsg 提交的最多连续帧数，1 表示逐帧提交
+ISOTP_MAX_SCHEDULE_FRAMES = 255  # 适配器调度表一个表的最多帧数（CAN_SetSchedule 的 pMsgNum 为单字节）
+ISOTP_SCHEDULE_PRECISION_MS = 1  # 调度表的时间精度（CAN_StartSchedule 的 TimePrecMs）
+
+_CAN_MSG_LAYOUT = struct.Struct("<IIBBB8sB")  # 与 CAN_MSG 的内存布局一致（20字节）
+_CANFD_MSG_LAYOUT = struct.Struct("<IBBBBI64s")  # 与 CANFD_MSG 的内存布局一致（76字节）
+
+CANFD_DLC_SIZES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)  # DLC 0~15 对应的数据字节数
+ISOTP_FD_PADDING = 0xCC        # CANFD 帧按合法长度取整后的填充字节（ISO 15765-2 推荐值）
+ISOTP_MAX_MESSAGE_LENGTH = 0xFFF  # 首帧12位长度能表示的最大报文长度
+ISOTP_MAX_LONG_MESSAGE_LENGTH = 0xFFFFFFFF  # 32位长度首帧（ISO 15765-2:2016，须ECU支持）的最大报文长度
+MIN_BLOCK_LENGTH = 3  # 0x36 请求的最小长度：服务ID + 块序号 + 至少1字节数据
+
+
+def stmin_seconds(stmin):
+    """流控帧 STmin 换算为秒：0x00~0x7F 为毫秒，0xF1~0xF9 为100~900微秒，保留值按最大值127毫秒处理"""
+    if stmin <= 0x7F:
+        return stmin / 1000.0
+    if 0xF1 <= stmin <= 0xF9:
+        return (stmin - 0xF0) / 10000.0
+    return 0.127
+
+
+class IsoTpTransferStats:
+    """
+    一次 ISO-TP 报文发送的统计
+    frames: 发送的CAN帧数（首帧+连续帧，单帧为1）
+    flow_controls: 收到的流控帧数（含 WAIT）
+    waits: 收到 WAIT 的次数
+    usb_transactions: CAN_SendMsg / 调度表函数的调用次数，每次调用为一次USB传输
+    scheduled_frames: 装入适配器调度表、由适配器控制帧间隔发送的连续帧数
+    block_size / stmin: 接收方最后一次流控帧给出的 BS 和 STmin 原始值
+    started: 第一帧提交给适配器的时间（time.perf_counter()）
+    elapsed: 从发送第一帧到最后一帧发送完成的时间（秒）
+    """
 
-    # 填充首帧剩余空间（最多放 4 字节数据）
-    offset = 0
-    for i in range(4):
-        if offset + i < block_size:
-            first_frame.Data[4 + i] = data_block[offset + i]
+    def __init__(self, length):
+        self.length = length
+        self.started = 0.0
+        self.frames = 0
+        self.flow_controls = 0
+        self.waits = 0
+        self.usb_transactions = 0
+        self.scheduled_frames = 0
+        self.block_size = 0
+        self.stmin = 0
+        self.elapsed = 0.0
+
+    @property
+    def frames_per_s(self):
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return (f"IsoTpTransferStats({self.length}字节, {self.frames}帧, {self.usb_transactions}次USB传输, "
+                f"{self.frames_per_s:.0f}帧/秒, 调度表{self.scheduled_frames}帧, "
+                f"BS={self.block_size}, STmin=0x{self.stmin:02X}, WAIT={self.waits})")
+
+
+_last_transfer = threading.local()
+
+
+def get_last_transfer_stats():
+    """返回当前线程最近一次 ISO-TP 发送的 IsoTpTransferStats"""
+    return getattr(_last_transfer, "value", None)
+
+
+def _wait_until(deadline):
+    """等待到 deadline（time.perf_counter()），sleep 精度不够的最后1毫秒忙等，保证亚毫秒级 STmin"""
+    remaining = deadline - time.perf_counter()
+    if remaining > 0.002:
+        sleep(remaining - 0.001)
+    while time.perf_counter() < deadline:
+        pass
+
+
+def canfd_dlc_size(length):
+    """数据字节数向上取整为CANFD合法长度：0~8，12，16，20，24，32，48，64"""
+    for size in CANFD_DLC_SIZES:
+        if size >= length:
+            return size
+    raise ValueError(f"CANFD帧数据长度{length}超过64字节")
+
+
+def _wait_flow_control(sub, timeout):
+    """等待接收方的流控帧，返回 (状态, BS, STmin)，超时返回None；期间收到的其它报文忽略"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return None
+        msg = sub.get(remaining)
+        if msg is None:
+            return None
+        if _frame_size(msg) >= 3 and msg.Data[0] >> 4 == 0x3:
+            return msg.Data[0] & 0x0F, msg.Data[1], msg.Data[2]
+
+
+class IsoTpFrameFormat:
+    """
+    ISO-TP 帧格式，send_isotp_message 按它编码和提交报文
+    普通CAN：每帧固定8字节，不足部分填充 padding，通过 CAN_SendMsg 提交
+    CANFD  ：每帧最多 tx_dl 字节（TX_DL，12~64），单帧最多 tx_dl-2 字节数据；首帧和除最后一帧以外的连续帧
+             占满 tx_dl 字节，单帧和最后一个连续帧按CANFD合法长度（DLC）向上取整后填充 padding，
+             brs 为 True 时数据段切换到数据波特率，通过 CANFD_SendMsg 提交
+    """
+
+    def __init__(self, fd=False, tx_dl=8, brs=False, padding=0x00):
+        if fd and tx_dl not in CANFD_DLC_SIZES[9:]:
+            raise ValueError(f"CANFD ISO-TP 的 TX_DL 必须为 12~64 中的合法长度，当前为{tx_dl}")
+        self.fd = fd
+        self.tx_dl = tx_dl if fd else 8
+        self.brs = fd and brs
+        self.padding = padding
+        self.msg_type = CANFD_MSG if fd else CAN_MSG
+        self.max_single_frame = self.tx_dl - 2 if fd else 7
+        self.flags = (CANFD_MSG_FLAG_FDF | (CANFD_MSG_FLAG_BRS if brs else 0)) if fd else 0
+        self._pad = bytes([padding])
+        self._send = CANFD_SendMsg if fd else CAN_SendMsg
+        self._set_schedule = CANFD_SetSchedule if fd else CAN_SetSchedule
+        self._start_schedule = CANFD_StartSchedule if fd else CAN_StartSchedule
+
+    def __repr__(self):
+        if not self.fd:
+            return "IsoTpFrameFormat(CAN)"
+        return f"IsoTpFrameFormat(CANFD, TX_DL={self.tx_dl}, BRS={self.brs}, padding=0x{self.padding:02X})"
+
+    def single_frame_header(self, length):
+        """单帧PCI：7字节以内为1字节，CANFD 超过7字节时为 0x00 + 长度"""
+        return bytes([length]) if length <= 7 else bytes([0x00, length])
+
+    def _pack(self, tx_id, data):
+        if not self.fd:
+            return _CAN_MSG_LAYOUT.pack(tx_id, 0, 0, 0, 8, data.ljust(8, self._pad), 0)
+        size = canfd_dlc_size(max(len(data), 8))
+        return _CANFD_MSG_LAYOUT.pack(tx_id, size, self.flags, 0, 0, 0, data.ljust(size, self._pad))
+
+    def encode(self, tx_id, payload):
+        """
+        把一条请求编码为 IsoTpMessage：单帧，或首帧 + 全部连续帧（连续帧按发送顺序编码在一个数组中，
+        发送时按流控帧给出的块大小逐段提交，不再重新编码）
+        """
+        payload = bytes(payload)
+        length = len(payload)
+        if length <= self.max_single_frame:
+            return IsoTpMessage(self, tx_id, payload, self.frame(tx_id, self.single_frame_header(length) + payload))
+        # 超过 4095 字节时使用32位长度的首帧
+        if length <= 0xFFF:
+            header = bytes([0x10 | (length >> 8), length & 0xFF])
         else:
-            break
+            header = bytes([0x10, 0x00]) + length.to_bytes(4, "big")
+        offset = self.tx_dl - len(header)
+        chunk = self.tx_dl - 1
+        consecutive, _ = self.consecutive_frames(tx_id, 1, payload, offset, (length - offset + chunk - 1) // chunk)
+        return IsoTpMessage(self, tx_id, payload, self.frame(tx_id, header + payload[:offset]), consecutive)
+
+    def frame(self, tx_id, data):
+        """编码一帧报文（长度为1的报文数组）"""
+        return (self.msg_type * 1).from_buffer_copy(self._pack(tx_id, data))
+
+    def send(self, device_handle, can_channel, tx_id, data):
+        """编码并发送一帧报文，返回 CAN_SendMsg/CANFD_SendMsg 的返回值"""
+        return self._send(device_handle, can_channel, byref(self.frame(tx_id, data)), 1)
+
+    def consecutive_frames(self, tx_id, sn, payload, offset, count):
+        """
+        把 count 个连续帧编码到一个连续的报文数组中，返回 (数组, 下一个序号)
+        不逐帧组包：先按满帧模板填充整个数组，再按列（每帧的第 k 个数据字节）用步长切片一次写入全部帧的
+        序号字节和数据字节，最后一帧不满时单独编码（DLC取整和填充）
+        """
+        if count == 0:
+            return (self.msg_type * 0)(), sn
+        chunk = self.tx_dl - 1
+        item_size = sizeof(self.msg_type)
+        data_offset = self.msg_type.Data.offset
+        frames = (self.msg_type * count).from_buffer_copy(self._pack(tx_id, bytes(self.tx_dl)) * count)
+        buffer = memoryview(frames).cast("B")
+        # 序号字节：0x20 | SN，SN 从 sn 开始循环使用 0~F
+        sequence = bytes(0x20 | ((sn + i) & 0x0F) for i in range(16))
+        buffer[data_offset::item_size] = (sequence * (count // 16 + 1))[:count]
+        payload = payload[offset:offset + count * chunk]
+        full = len(payload) // chunk
+        for k in range(chunk):
+            start = data_offset + 1 + k
+            buffer[start:start + full * item_size:item_size] = payload[k:full * chunk:chunk]
+        if full < count:
+            last = bytes([0x20 | ((sn + full) & 0x0F)]) + payload[full * chunk:]
+            buffer[full * item_size:] = self._pack(tx_id, last)
+        return frames, (sn + count) & 0x0F
+
+    def submit(self, device_handle, can_channel, frames, stats):
+        """一次 CAN_SendMsg/CANFD_SendMsg 提交整个报文数组，适配器只接收了一部分时从剩余的报文继续提交"""
+        count = len(frames)
+        item_size = sizeof(self.msg_type)
+        sent = 0
+        while sent < count:
+            ret = self._send(device_handle, can_channel, byref(frames, sent * item_size), count - sent)
+            stats.usb_transactions += 1
+            if ret <= 0:
+                return False
+            sent += ret
+        stats.frames += count
+        return True
+
+    def schedule(self, device_handle, can_channel, frames, interval_ms, stats):
+        """
+        把报文数组装入适配器的调度表（1个表，发送1次）并启动，由适配器按每帧 interval_ms 毫秒的间隔依次发送，
+        函数在装入和启动后立即返回
+        :return: 设备返回值，CAN_SUCCESS 为已启动，CAN_ERR_NOT_SUPPORT 为适配器不支持调度表
+        """
+        count = len(frames)
+        for msg in frames:
+            msg.TimeStamp = interval_ms  # 调度表中 TimeStamp 为本帧之后的发送间隔（毫秒）
+        msg_num = (c_ubyte * 1)(count)
+        send_times = (c_ushort * 1)(1)
+        ret = self._set_schedule(device_handle, can_channel, byref(frames), byref(msg_num), byref(send_times), 1)
+        stats.usb_transactions += 1
+        if ret != CAN_SUCCESS:
+            return ret
+        ret = self._start_schedule(device_handle, can_channel, 0, ISOTP_SCHEDULE_PRECISION_MS, 1)
+        stats.usb_transactions += 1
+        if ret == CAN_SUCCESS:
+            stats.frames += count
+            stats.scheduled_frames += count
+        return ret
+
+
+CAN_FRAME_FORMAT = IsoTpFrameFormat()
+
+
+class IsoTpMessage:
+    """
+    已编码好的一条 ISO-TP 报文（IsoTpFrameFormat.encode），可以在上一条请求等待应答时提前编码
+    first: 单帧或首帧（长度为1的报文数组）；consecutive: 全部连续帧，单帧报文为None
+    """
+
+    def __init__(self, frame_format, tx_id, payload, first, consecutive=None):
+        self.frame_format = frame_format
+        self.tx_id = tx_id
+        self.payload = payload
+        self.length = len(payload)
+        self.first = first
+        self.consecutive = consecutive
+
+    def window(self, index, count):
+        """第 index 个起的 count 个连续帧（共享内存的报文数组，不拷贝）"""
+        msg_type = self.frame_format.msg_type
+        return (msg_type * count).from_buffer(self.consecutive, index * sizeof(msg_type))
+
+_schedule_unsupported = set()  # 不支持调度表的连接 (设备句柄, CAN通道, 是否CANFD)
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(first_frame), 1)
-    if ret < 0:
-        print("发送首帧失败！")
-        return False
 
-    offset += 4  # 已发送 4 字节
-    cf_index = 1  # 连续帧索引（1~F）
+def send_isotp_message(device_handle, can_channel, payload, sub, tx_id=CAN_ID, console=None, frame_format=None,
+                       device_pacing=False):
+    """
+    按 ISO 15765-2 发送一条UDS请求，单帧放得下时用单帧，否则用首帧+连续帧
+    多帧发送时每个块之前等待接收方的流控帧：
+        CTS   按 BS 发送一个块的连续帧（BS=0 表示不再有流控帧），相邻两帧的发送间隔不小于 STmin
+        WAIT  继续等待下一个流控帧，最多 ISOTP_MAX_WAIT_FRAMES 次
+    STmin 为0时一个块的连续帧编码到一个报文数组中，每 ISOTP_MAX_BATCH_FRAMES 帧一次 CAN_SendMsg 提交，
+    省去逐帧提交的USB传输；STmin 不为0时逐帧提交，由主机控制帧间隔
+        OVFLW 接收方缓冲区不足，放弃发送
+    等待流控帧超过 ISOTP_N_BS 秒同样放弃发送
+    device_pacing 为 True 且 STmin 为 1~127 毫秒时，一个块的连续帧装入适配器调度表（CAN_SetSchedule），
+    由适配器按 STmin 精确控制帧间隔，主机只等待整个表发完；适配器不支持调度表时该连接改为主机控制帧间隔。
+    100~900 微秒的 STmin 低于调度表的时间精度，仍由主机控制
+    :param payload: 请求数据，或已编码好的 IsoTpMessage（此时忽略 tx_id 和 frame_format）
+    :param sub: 订阅了接收方应答ID的订阅队列，必须在调用之前订阅
+    :param frame_format: IsoTpFrameFormat，None 表示普通CAN（8字节）
+    :param device_pacing: 是否由适配器调度表控制连续帧间隔
+    :return: IsoTpTransferStats，发送失败返回None；同时记录为当前线程最近一次发送的统计
+    """
+    if isinstance(payload, IsoTpMessage):
+        message = payload
+    else:
+        message = (frame_format or CAN_FRAME_FORMAT).encode(tx_id, payload)
+    fmt = message.frame_format
+    length = message.length
+    stats = IsoTpTransferStats(length)
+    _last_transfer.value = stats
+    start = stats.started = time.perf_counter()
+    if message.consecutive is None:
+        if not fmt.submit(device_handle, can_channel, message.first, stats):
+            return None
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    # === 首帧 FF ===
+    if not fmt.submit(device_handle, can_channel, message.first, stats):
+        if console: console.error("发送首帧失败")
+        return None
 
     # === 连续帧 CF ===
-    while offset < block_size:
-        cf = CAN_MSG()
-        cf.ID = 0x7DF
-        cf.DataLen = 8
-        cf.Data[0] = 0x20 | (cf_index & 0x0F)  # CF 帧头
-
-        # 填入最多 7 字节数据
-        for i in range(7):
-            if offset + i < block_size:
-                cf.Data[1 + i] = data_block[offset + i]
+    schedule_key = (int(device_handle), int(can_channel), fmt.fd)
+    total = len(message.consecutive)
+    index = 0
+    waits = 0
+    while index < total:
+        fc = _wait_flow_control(sub, ISOTP_N_BS)
+        if fc is None:
+            if console: console.error("等待流控帧超时")
+            return None
+        status, block_size, stmin = fc
+        stats.flow_controls += 1
+        if status == FC_WAIT:
+            stats.waits += 1
+            waits += 1
+            if waits > ISOTP_MAX_WAIT_FRAMES:
+                if console: console.error(f"接收方连续 {waits} 次要求等待，放弃发送")
+                return None
+            continue
+        if status != FC_CONTINUE_TO_SEND:
+            if console: console.error(f"接收方拒绝接收 {length} 字节（流控状态 {status}）")
+            return None
+        waits = 0
+        stats.block_size = block_size
+        stats.stmin = stmin
+        gap = stmin_seconds(stmin)
+        window = total - index
+        if block_size:
+            window = min(window, block_size)
+        paced = device_pacing and 0 < stmin <= 0x7F and schedule_key not in _schedule_unsupported
+        batch = ISOTP_MAX_SCHEDULE_FRAMES if paced else ISOTP_MAX_BATCH_FRAMES if gap == 0 else 1
+        next_send = time.perf_counter()
+        while window:
+            if gap:
+                _wait_until(next_send)
+            count = min(window, batch)
+            frames = message.window(index, count)
+            if paced:
+                ret = fmt.schedule(device_handle, can_channel, frames, stmin, stats)
+                if ret == CAN_ERR_NOT_SUPPORT:
+                    if console: console.debug("适配器不支持调度表，改为由主机控制连续帧间隔")
+                    _schedule_unsupported.add(schedule_key)
+                    paced = False
+                    batch = 1
+                    continue
+                if ret != CAN_SUCCESS:
+                    if console: console.error(f"调度表发送连续帧失败，错误码: {ret}")
+                    return None
+                # 等这个表按间隔发完（多等一个间隔作为最后一帧的传输时间）再装入下一个表或等待应答
+                next_send = time.perf_counter() + (count + 1) * gap
             else:
+                if not fmt.submit(device_handle, can_channel, frames, stats):
+                    if console: console.error("发送连续帧失败")
+                    return None
+                next_send = time.perf_counter() + gap
+            index += count
+            window -= count
+        if paced:
+            _wait_until(next_send)
+    stats.elapsed = time.perf_counter() - start
+    if console: console.debug(f"ISO-TP 发送完成: {stats}")
+    return stats
+
+
+class PythonIsoTpTransport:
+    """
+    主机端ISO-TP：由 send_isotp_message 分帧并按流控帧控制发送节奏，应答由通道调度器接收
+    :param tx_id: 请求ID；response_id: 目标ECU应答ID
+    :param device_pacing: STmin 不为0时由适配器调度表控制连续帧间隔，适配器不支持时自动改为主机控制
+    :param long_messages: ECU支持32位长度首帧时为 True，0x36 块可超过 4095 字节
+    """
+    name = "python"
+    frame_format = CAN_FRAME_FORMAT
+
+    def __init__(self, device_handle, can_channel, tx_id=CAN_ID, response_id=ECU_RESPONSE_ID, device_pacing=True,
+                 long_messages=False):
+        self.device_handle = device_handle
+        self.can_channel = can_channel
+        self.tx_id = tx_id
+        self.response_id = response_id
+        self.device_pacing = device_pacing
+        self.max_message_length = ISOTP_MAX_LONG_MESSAGE_LENGTH if long_messages else ISOTP_MAX_MESSAGE_LENGTH
+
+    def prepare(self, payload, tx_id=None):
+        """预先编码一条请求的全部帧，返回的 IsoTpMessage 可直接传给 request"""
+        return self.frame_format.encode(self.tx_id if tx_id is None else tx_id, payload)
+
+    def request(self, payload, timing=None, console=None, tx_id=None, on_sent=None):
+        """
+        发送一条UDS请求并等待最终应答
+        :param payload: 请求数据，或 prepare() 编码好的 IsoTpMessage
+        :param tx_id: 本次请求使用的请求ID，None 表示使用 self.tx_id
+        :param on_sent: 请求发送完成、开始等待应答之前调用的函数（无参数），用于在ECU处理请求期间准备下一条请求
+        :return: UDSResponse，请求发送失败返回None
+        """
+        message = payload if isinstance(payload, IsoTpMessage) else self.prepare(payload, tx_id)
+        with subscribe_responses(self.device_handle, self.can_channel, [self.response_id],
+                                 message.frame_format.msg_type) as sub:
+            stats = send_isotp_message(self.device_handle, self.can_channel, message, sub, console=console,
+                                       device_pacing=self.device_pacing)
+            if stats is None:
+                return None
+            sent = time.perf_counter()
+            if on_sent:
+                on_sent()
+            response = wait_uds_response(sub, message.payload[0], sent, timing or get_ecu_timing(self.response_id),
+                                         console)
+            response.sent_at = stats.started
+            return response
+
+
+class CanFdIsoTpTransport(PythonIsoTpTransport):
+    """
+    主机端ISO-TP over CANFD（ISO 15765-2:2016）：每帧最多 tx_dl 字节，BRS 时数据段按数据波特率发送，
+    同样的 0x36 块所需的帧数约为普通CAN的1/9。通道须先用 CANFD_Init 初始化，应答按 CANFD_MSG 接收
+    :param tx_dl: 每帧最大数据字节数（TX_DL），12~64 中的合法长度
+    :param brs: 是否切换数据段波特率
+    :param padding: 按DLC取整后的填充字节
+    """
+    name = "canfd"
+
+    def __init__(self, device_handle, can_channel, tx_id=CAN_ID, response_id=ECU_RESPONSE_ID, tx_dl=64, brs=True,
+                 padding=ISOTP_FD_PADDING, device_pacing=True, long_messages=False):
+        super().__init__(device_handle, can_channel, tx_id, response_id, device_pacing, long_messages)
+        self.frame_format = IsoTpFrameFormat(True, tx_dl, brs, padding)
+
+
+class AdapterIsoTpTransport:
+    """
+    适配器固件ISO-TP：请求通过 CAN_UDS_Request 整条交给适配器，分帧、流控、BS/STmin 都在适配器中完成，
+    应答通过 CAN_UDS_Response 整条取回，每条请求/应答只需各一次USB传输
+    NRC 0x78 在主机端处理：收到后以 P2* 为超时再次读取应答
+    :param flag: CAN_UDS_ADDR.Flag，bit0-扩展帧 bit1-CANFD bit2-BRS
+    :param max_dlc: 每帧最大数据字节数，普通CAN为8
+    :param response_buffer_size: 应答缓冲区大小，ECU的应答（如32位长度首帧的长DID）可能超过 4095 字节时加大
+    frame_format 只用于不经过适配器ISO-TP的单帧请求（send_single_frame）和应答订阅，与 flag 的CAN/CANFD一致
+    """
+    name = "adapter"
+    RESPONSE_BUFFER_SIZE = 4095  # 普通CAN ISO-TP 的最大报文长度
+    max_message_length = ISOTP_MAX_MESSAGE_LENGTH
+
+    def __init__(self, device_handle, can_channel, tx_id=CAN_ID, response_id=ECU_RESPONSE_ID, flag=0, max_dlc=8,
+                 response_buffer_size=RESPONSE_BUFFER_SIZE):
+        self.device_handle = device_handle
+        self.can_channel = can_channel
+        self.tx_id = tx_id
+        self.response_id = response_id
+        self.addr = CAN_UDS_ADDR()
+        self.addr.ReqID = tx_id
+        self.addr.ResID = response_id
+        self.addr.Flag = flag
+        self.addr.AddrFormats = 0
+        self.addr.AddrExt = 0
+        self.addr.MaxDLC = max_dlc
+        self.frame_format = IsoTpFrameFormat(True, max(max_dlc, 12), bool(flag & 0x04)) if flag & 0x02 else CAN_FRAME_FORMAT
+        self._response_buffer = (c_ubyte * response_buffer_size)()
+
+    def prepare(self, payload, tx_id=None):
+        """分帧在适配器中完成，主机端只需把请求数据放入 CAN_UDS_Request 的缓冲区"""
+        return (c_ubyte * len(payload)).from_buffer_copy(payload)
+
+    def request(self, payload, timing=None, console=None, tx_id=None, on_sent=None):
+        """
+        发送一条UDS请求并等待最终应答
+        :param payload: 请求数据，或 prepare() 准备好的 c_ubyte 数组
+        :param tx_id: 本次请求使用的请求ID，None 表示使用 self.tx_id
+        :param on_sent: 请求交给适配器之后、读取应答之前调用的函数（无参数）
+        :return: UDSResponse，请求发送失败或接收应答出错（如应答超过应答缓冲区）返回None
+        """
+        request = payload if isinstance(payload, Array) else self.prepare(payload)
+        service_id = request[0]
+        timing = timing or get_ecu_timing(self.response_id)
+        self.addr.ReqID = self.tx_id if tx_id is None else tx_id
+        start = time.perf_counter()
+        ret = CAN_UDS_Request(self.device_handle, self.can_channel, byref(self.addr), byref(request), len(request))
+        if ret != CAN_UDS_OK:
+            if console: console.error(f"适配器发送UDS请求失败，错误码: {ret}")
+            return None
+        response = UDSResponse(service_id)
+        response.sent_at = start
+        if on_sent:
+            on_sent()
+        timeout = timing.p2
+        while True:
+            ret = CAN_UDS_Response(self.device_handle, self.can_channel, byref(self.addr), byref(self._response_buffer),
+                                   max(1, int(timeout * 1000)))
+            if ret == CAN_UDS_TIMEOUT_A:
                 break
+            if ret <= 0:
+                if console: console.error(f"适配器接收UDS应答失败，错误码: {ret}")
+                return None
+            data = list(self._response_buffer[:ret])
+            if data[0] == 0x7F and len(data) > 2 and data[1] == service_id and data[2] == NRC_RESPONSE_PENDING:
+                response.pending_count += 1
+                timeout = timing.p2_star
+                if console: console.debug(f"服务0x{service_id:02X}应答等待中(NRC 0x78)，延长至P2*={timing.p2_star}秒")
+                continue
+            if data[0] == service_id + 0x40 or (data[0] == 0x7F and len(data) > 1 and data[1] == service_id):
+                response.payload = data
+                response.response_id = self.response_id
+                break
+        response.elapsed = time.perf_counter() - start
+        _last_response.value = response
+        if console: console.debug(f"服务0x{service_id:02X}应答耗时: {response.elapsed * 1000:.1f}ms")
+        return response
 
-        ret = CAN_SendMsg(device_handle, can_channel, byref(cf), 1)
-        if ret < 0:
-            print("发送连续帧失败！")
-            return False
 
-        offset += 7
-        cf_index = (cf_index + 1) % 16  # 索引循环使用 0~F
+TRANSPORTS = {
+    "python": PythonIsoTpTransport,
+    "canfd": CanFdIsoTpTransport,
+    "adapter": AdapterIsoTpTransport,
+}
 
-    return True
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def set_transport(device_handle, can_channel, transport="python", **kwargs):
+    """
+    选择连接（设备句柄 + CAN通道）发送UDS请求使用的ISO-TP实现
+    :param transport: "python"-主机端ISO-TP（默认），"canfd"-主机端ISO-TP over CANFD，
+                      "adapter"-适配器固件ISO-TP（CAN_UDS_Request/Response）
+    :param kwargs: 传给传输类的参数，如 tx_id、response_id、device_pacing、long_messages；canfd 的 tx_dl、brs、padding；
+                   adapter 的 flag、max_dlc（flag=0x06、max_dlc=64 即为适配器实现的CANFD+BRS）
+    """
+    instance = TRANSPORTS[transport](device_handle, can_channel, **kwargs)
+    with _transports_lock:
+        _transports[(int(device_handle), int(can_channel))] = instance
+    return instance
+
+
+def get_transport(device_handle, can_channel):
+    """获取连接使用的ISO-TP实现，没有设置过时使用主机端ISO-TP"""
+    key = (int(device_handle), int(can_channel))
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = _transports[key] = PythonIsoTpTransport(device_handle, can_channel)
+        return transport
+
+
+def parse_request_download_response(payload):
+    """
+    解析 0x74 正响应中的 maxNumberOfBlockLength
+    payload: [0x74, lengthFormatIdentifier(高4位为长度字节数), maxNumberOfBlockLength...]
+    :return: 每个 0x36 请求的最大长度（含服务ID和块序号），格式不正确或小于 MIN_BLOCK_LENGTH（放不下1字节数据）返回None
+    """
+    if not payload or payload[0] != 0x74 or len(payload) < 2:
+        return None
+    size = payload[1] >> 4
+    if size == 0 or len(payload) < 2 + size:
+        return None
+    max_block_length = int.from_bytes(bytes(payload[2:2 + size]), "big")
+    return max_block_length if max_block_length >= MIN_BLOCK_LENGTH else None
+
+
+def transfer_block_size(max_block_length, override=None, max_message_length=ISOTP_MAX_MESSAGE_LENGTH):
+    """
+    每个 0x36 请求携带的数据字节数：ECU给出的 maxNumberOfBlockLength 减去服务ID和块序号，
+    maxNumberOfBlockLength 超过ISO-TP能传输的最大报文长度 max_message_length 时按 max_message_length 计
+    :param override: 指定块大小（测试用），不为None时直接使用
+    """
+    if override is not None:
+        return override
+    if max_block_length < MIN_BLOCK_LENGTH:
+        raise ValueError(f"maxNumberOfBlockLength {max_block_length} 小于 {MIN_BLOCK_LENGTH}")
+    return min(max_block_length, max_message_length) - 2
+
+
+def request_download(device_handle, can_channel, memory_address, length, timing=None, data_format=0x00,
+                     console=None):
+    """
+    发起 UDS 0x34 请求下载服务（地址和长度各4字节，addressAndLengthFormatIdentifier=0x44）
+    :param data_format: dataFormatIdentifier，高4位压缩方法、低4位加密方法，0x00 表示原始数据
+    :return: ECU 在 0x74 正响应中给出的 maxNumberOfBlockLength（含服务ID和块序号），失败返回 False
+    """
+    payload = (bytes([0x34, data_format, 0x44]) + (memory_address & 0xFFFFFFFF).to_bytes(4, "big")
+               + (length & 0xFFFFFFFF).to_bytes(4, "big"))
+    response = get_transport(device_handle, can_channel).request(payload, timing, console)
+    if response is None:
+        print("发送请求下载失败！")
+        return False
+    if response.negative:
+        print("NRC 错误:", hex(response.nrc))
+        return False
+    max_block_length = parse_request_download_response(response.payload)
+    if max_block_length is None:
+        print("请求下载应答无效:", response)
+        return False
+    if console: console.debug(f"ECU 最大块长度: {max_block_length} 字节")
+    return max_block_length
 
-def request_transfer_exit(device_handle, can_channel):
+def transfer_data(device_handle, can_channel, block_sequence_counter, data_block, timing=None, console=None):
+    """
+    发送 UDS 0x36 传输数据块并等待 0x76 应答
+    数据块经连接的ISO-TP实现（get_transport）发送：主机端ISO-TP遵守ECU流控帧给出的 BS/STmin（见 send_isotp_message），
+    本次发送的帧数、帧速率等统计可通过 get_last_transfer_stats() 获取；适配器ISO-TP由适配器完成分帧和流控
+    :param block_sequence_counter: 块序号，超过 0xFF 时取低8位
+    """
+    payload = bytes([0x36, block_sequence_counter & 0xFF]) + bytes(data_block)
+    return _transfer_data_ok(get_transport(device_handle, can_channel).request(payload, timing, console))
+
+
+def _transfer_data_ok(response):
+    if response is None:
+        print("发送数据块失败！")
+        return False
+    if response.negative:
+        print("传输数据 NRC 错误:", hex(response.nrc))
+        return False
+    return response.positive
+
+def request_transfer_exit(device_handle, can_channel, timing=None):
     """
     发送 UDS 0x37 请求退出传输
     """
-    msg = CAN_MSG()
-    msg.ID = 0x7DF
-    msg.DataLen = 8
-    msg.Data[0] = 0x01
-    msg.Data[1] = 0x37
-    for i in range(2, 8):
-        msg.Data[i] = 0x00  # 填充剩余字节
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
+    response = get_transport(device_handle, can_channel).request(bytes([0x37]), timing)
+    if response is None:
         print("发送退出传输失败！")
         return False
+    if response.negative:
+        print("退出传输 NRC 错误:", hex(response.nrc))
+        return False
+    return True
+
+class DownloadStats:
+    """
+    一次下载（download）的统计
+    block_idle: 每个块的总线空闲时间（秒），即收到上一个块的 0x76（第一个块为 0x74）应答后，
+                主机切分数据、组包、编码帧直到本块第一帧提交给适配器所用的时间
+    crc32: 已准备的数据块的累计 CRC32（全部成功时为整个传输数据的 CRC32）
+    transferred: 0x36 传输的字节数，压缩下载时为压缩后的长度
+    compression: 压缩下载时为 CompressedImage，否则为None
+    transfer_time: 0x36 数据传输阶段的耗时（秒）
+    first_frame: 从调用 download 到第一个 0x36 块的第一帧提交的时间（秒），包含压缩和 0x34 请求
+    """
+
+    def __init__(self, length, block_size, pipelined, transferred=None, compression=None):
+        self.length = length
+        self.block_size = block_size
+        self.pipelined = pipelined
+        self.transferred = length if transferred is None else transferred
+        self.compression = compression
+        self.blocks = 0
+        self.block_idle = []
+        self.crc32 = 0
+        self.elapsed = 0.0
+        self.transfer_time = 0.0
+        self.first_frame = 0.0
+
+    @property
+    def ratio(self):
+        """传输字节数 / 原始长度"""
+        return self.transferred / self.length if self.length else 1.0
+
+    @property
+    def time_saved(self):
+        """
+        压缩节省的时间估计（秒）：按本次传输速率传输原始数据所需的时间减去实际传输时间，
+        本次进行了压缩（未命中缓存）时再减去压缩耗时
+        """
+        if self.compression is None or not self.transferred:
+            return 0.0
+        saved = self.transfer_time * (self.length / self.transferred - 1)
+        if not self.compression.cached:
+            saved -= self.compression.compress_time
+        return saved
+
+    @property
+    def idle_total(self):
+        return sum(self.block_idle)
+
+    @property
+    def idle_mean(self):
+        return self.idle_total / len(self.block_idle) if self.block_idle else 0.0
+
+    @property
+    def idle_max(self):
+        return max(self.block_idle) if self.block_idle else 0.0
+
+    @property
+    def bytes_per_s(self):
+        return self.length / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        text = (f"DownloadStats({self.length}字节, {self.blocks}块, {'流水线' if self.pipelined else '逐块'}, "
+                f"{self.bytes_per_s / 1024:.1f}KB/s, 块间空闲 平均{self.idle_mean * 1e6:.0f}us "
+                f"最大{self.idle_max * 1e6:.0f}us 合计{self.idle_total * 1000:.1f}ms, CRC32={self.crc32:08X}")
+        if self.compression is not None:
+            text += (f", {compression_method_name(self.compression.method)}压缩 {self.transferred}字节({self.ratio:.1%}), "
+                     f"节省约{self.time_saved:.2f}s")
+        return text + ")"
+
+
+_last_download = threading.local()
+
+
+def get_last_download_stats():
+    """返回当前线程最近一次 download 的 DownloadStats"""
+    return getattr(_last_download, "value", None)
+
+
+class _BlockPipeline:
+    """
+    按块准备 0x36 请求：切分数据、累计CRC、由传输类预先编码帧（主机端ISO-TP为整条报文的全部帧）
+    digest 不为None时同时把每块数据累计到完整性校验值（ImageDigest）
+    """
+
+    def __init__(self, transport, data, block_size, stats, digest=None):
+        self.transport = transport
+        self.view = memoryview(data)
+        self.block_size = block_size
+        self.stats = stats
+        self.digest = digest
+        self.ready = None  # 已准备好的下一块 (偏移, 请求)
+
+    def prepare(self, offset, block_sequence_counter):
+        block = self.view[offset:offset + self.block_size]
+        self.stats.crc32 = zlib.crc32(block, self.stats.crc32)
+        if self.digest is not None:
+            self.digest.update(block)
+        return self.transport.prepare(bytes([0x36, block_sequence_counter]) + block)
+
+    def prepare_next(self, offset, block_sequence_counter):
+        """在当前块等待应答期间调用，提前准备下一块"""
+        if offset < len(self.view):
+            self.ready = (offset, self.prepare(offset, block_sequence_counter))
+
+    def take(self, offset, block_sequence_counter):
+        """取出 offset 处的请求，未提前准备时现在准备"""
+        ready = self.ready
+        self.ready = None
+        if ready is not None and ready[0] == offset:
+            return ready[1]
+        return self.prepare(offset, block_sequence_counter)
+
+
+def download(device_handle, can_channel, memory_address, data, block_size=None, progress_callback=None,
+             timing=None, console=None, pipelined=True, compression=COMPRESSION_NONE, cache=None, digest=None):
+    """
+    完整的下载流程：0x34 请求下载 -> 按ECU给出的最大块长度分块 0x36 传输 -> 0x37 退出传输
+    块序号从1开始，0xFF 之后回到 0x00
+    pipelined 为 True 时，块 N 发送完成、ECU处理并应答期间准备块 N+1（切分、组包、编码全部帧、累计CRC），
+    收到块 N 的 0x76 后立即提交块 N+1，缩短块与块之间的总线空闲时间；统计见 get_last_download_stats()
+    :param block_size: 每个 0x36 请求的数据字节数（测试用），None 时按 0x74 应答中的最大块长度
+    :param progress_callback: progress_callback(已传输字节数, 总字节数)，每个块应答后调用
+    :param pipelined: False 时收到应答后才准备下一块（用于对比）
+    :param compression: 压缩方法ID（FirmwareCompression），非0时镜像压缩后传输（同一镜像只压缩一次），
+                        0x34 的 dataFormatIdentifier 高4位为该ID，memorySize 仍为原始长度；
+                        此时 progress_callback 的字节数为压缩后的字节数
+    :param cache: FirmwareCache，不为None时压缩结果取自磁盘缓存（跨进程、跨次刷写只压缩一次）
+    :param digest: ImageDigest（FirmwareDigest），不为None时切分每个块时累计其数据，下载完成后即为
+                   check_memory_integrity 的校验值；压缩下载时 0x36 传输的是压缩数据，改为在压缩前一次累计原始数据
+    :return: 全部成功返回 True
+    """
+    data = as_buffer(data)
+    length = len(data)
+    start = time.perf_counter()
+    image = None
+    if compression != COMPRESSION_NONE:
+        if digest is not None:
+            digest.update(data)
+            digest = None
+        image = cache.entry(data, compression).compressed if cache is not None else compress_image(data, compression)
+        data = image.data
+        if console: console.debug(f"压缩镜像: {image}")
+    total = len(data)
+    max_block_length = request_download(device_handle, can_channel, memory_address, length, timing,
+                                        image.data_format if image else 0x00, console)
+    if not max_block_length:
+        return False
+    ready_at = transfer_start = time.perf_counter()
+    transport = get_transport(device_handle, can_channel)
+    block_size = transfer_block_size(max_block_length, block_size, transport.max_message_length)
+    if console: console.debug(f"下载 {total} 字节到 0x{memory_address:08X}，块大小 {block_size} 字节")
+    stats = DownloadStats(length, block_size, pipelined, total, image)
+    _last_download.value = stats
+    pipeline = _BlockPipeline(transport, data, block_size, stats, digest)
+    block_sequence_counter = 1
+    for offset in range(0, total, block_size):
+        request = pipeline.take(offset, block_sequence_counter)
+        next_counter = (block_sequence_counter + 1) & 0xFF
+        on_sent = None
+        if pipelined:
+            def on_sent(offset=offset + block_size, counter=next_counter):
+                pipeline.prepare_next(offset, counter)
+        response = transport.request(request, timing, console, on_sent=on_sent)
+        if response is not None and response.sent_at is not None:
+            stats.block_idle.append(response.sent_at - ready_at)
+            if not stats.blocks:
+                stats.first_frame = response.sent_at - start
+        ready_at = time.perf_counter()
+        if not _transfer_data_ok(response):
+            if console: console.error(f"块 {block_sequence_counter:#04x}（偏移 {offset}）传输失败")
+            return False
+        stats.blocks += 1
+        block_sequence_counter = next_counter
+        if progress_callback:
+            progress_callback(min(offset + block_size, total), total)
+    ret = request_transfer_exit(device_handle, can_channel, timing)
+    stats.transfer_time = time.perf_counter() - transfer_start
+    stats.elapsed = time.perf_counter() - start
+    if console: console.debug(f"下载完成: {stats}")
+    return ret
+
+
+def download_segments(device_handle, can_channel, firmware, memory_address=DEFAULT_BIN_ADDRESS, block_size=None,
+                      progress_callback=None, timing=None, console=None, pipelined=True,
+                      compression=COMPRESSION_NONE, cache=None, digest=None):
+    """
+    逐段下载（不擦除，擦除见 flash_segments）：firmware 为 SegmentedImage（FirmwareImage）或 [(地址, 数据)] 时
+    每个段按段地址各做一次 download（0x34/0x36/0x37），段之间的空隙不传输；为 bytes 等连续数据时下载到 memory_address；
+    为 SegmentPlan 时下载其中的各段，空白区不下载
+    :param digest: ImageDigest，按段地址顺序累计各段数据，SegmentPlan 的空白区按擦除值累计
+    :param progress_callback: progress_callback(已传输字节数, 总字节数)，按全部段的原始数据计
+    :return: 全部成功返回 True
+    """
+    blanks = {}
+    if isinstance(firmware, SegmentPlan):
+        blanks = dict(firmware.blank_ranges)
+        segments = firmware.layout()
+    else:
+        segments = as_segments(firmware, memory_address)
+    total = sum(len(data) for _, data in segments if data is not None)
+    done = 0
+    for address, data in segments:
+        if data is None:
+            if digest is not None:
+                digest.update_fill(firmware.erased_value, blanks[address])
+            continue
+        callback = None
+        if progress_callback:
+            def callback(sent, segment_total, done=done, segment_size=len(data)):
+                progress_callback(done + segment_size * sent // segment_total, total)
+        if len(segments) > 1 and console: console.debug(f"下载段 0x{address:08X}，{len(data)} 字节")
+        if not download(device_handle, can_channel, address, data, block_size, callback, timing, console,
+                        pipelined, compression, cache, digest):
+            return False
+        done += len(data)
+    return True
+
+
+def erase_memory(device_handle, can_channel, memory_address, size, timing=None, console=None):
+    """
+    擦除内存：UDS 0x31 01 FF00 例程，参数为4字节地址 + 4字节长度
+    :return: 正响应且例程状态为 0x00 返回 True
+    """
+    payload = (bytes([0x31, 0x01, 0xFF, 0x00]) + (memory_address & 0xFFFFFFFF).to_bytes(4, "big")
+               + (size & 0xFFFFFFFF).to_bytes(4, "big"))
+    if console: console.debug(f"擦除 0x{memory_address:08X} 起 {size} 字节")
+    response = get_transport(device_handle, can_channel).request(payload, timing, console)
+    if response is None:
+        print("发送擦除请求失败！")
+        return False
+    if response.negative:
+        print("擦除 NRC 错误:", hex(response.nrc))
+        return False
+    return response.positive and len(response.payload) > 4 and response.payload[4] == 0x00
+
+
+_last_segment_plan = threading.local()
+
+
+def get_last_segment_plan():
+    """返回当前线程最近一次 flash_segments 的 SegmentPlan"""
+    return getattr(_last_segment_plan, "value", None)
+
+
+def flash_segments(device_handle, can_channel, firmware, memory_address=DEFAULT_BIN_ADDRESS,
+                   sector_size=FLASH_SECTOR_SIZE, max_gap=SEGMENT_MERGE_GAP, block_size=None, progress_callback=None,
+                   timing=None, console=None, compression=COMPRESSION_NONE, cache=None, digest=None,
+                   erased_value=FLASH_ERASED_VALUE, blank_threshold=0):
+    """
+    逐段刷写：按 plan_segments（FirmwareImage）先擦除各段覆盖的扇区（0x31 FF00），再逐段 download（0x34/0x36/0x37）。
+    段之间大于 max_gap 的空隙不擦除也不下载，不超过 max_gap 的空隙填充 erased_value 后与相邻段合并下载；
+    段内不短于 blank_threshold 的 erased_value 连续区（空白区）擦除后即为该值，只擦除不下载，
+    段在空白区处切分为多次下载（blank_threshold 为0时不切分，默认不切分，确认目标ECU适用后按ECU指定，推荐 BLANK_RUN_THRESHOLD）。
+    全部擦除完成后才开始下载，两个段落在同一扇区时不会擦掉已下载的前一段
+    :param firmware: SegmentedImage 按各段地址刷写；bytes 等连续数据刷写到 memory_address
+    :param sector_size: ECU flash的擦除粒度
+    :param erased_value: ECU flash擦除后的字节值，与之不符时应把 blank_threshold 设为0
+    :param progress_callback: progress_callback(已下载字节数, 需下载的总字节数)
+    :param digest: ImageDigest，按flash中各段的内容（含合并时的填充和空白区）累计
+    :return: 全部成功返回 True；计划（含省去下载的空白区字节数 blank_bytes）见 get_last_segment_plan()
+    """
+    plan = plan_segments(firmware, memory_address, sector_size, max_gap, erased_value, blank_threshold)
+    _last_segment_plan.value = plan
+    if console: console.debug(f"逐段刷写计划: {plan}")
+    for address, size in plan.erase_ranges:
+        if not erase_memory(device_handle, can_channel, address, size, timing, console):
+            if console: console.error(f"擦除 0x{address:08X} 起 {size} 字节失败")
+            return False
+    return download_segments(device_handle, can_channel, plan, memory_address, block_size,
+                             progress_callback, timing, console, compression=compression, cache=cache, digest=digest)
+
+
+class DeltaStats:
+    """
+    一次差分刷写（delta_download）的统计
+    plan: DeltaPlan；sent: 0x36 传输的字节数（压缩下载时为压缩后的长度）
+    blank_bytes: 有变化的扇区中擦除后即为擦除值、省去下载的空白区字节数
+    erase_time / transfer_time: 擦除和下载（0x34~0x37）的耗时（秒）
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.sent = 0
+        self.blank_bytes = 0
+        self.erase_time = 0.0
+        self.transfer_time = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def time_saved(self):
+        """
+        节省的时间估计（秒）：按本次的擦除和下载速率，完整刷写所需的时间减去实际耗时；
+        没有下载任何数据（镜像未变化）时无法估计速率，返回0
+        """
+        plan = self.plan
+        if plan.full or not plan.download_bytes:
+            return 0.0
+        saved = self.transfer_time * (plan.size / plan.download_bytes - 1)
+        if plan.erase_bytes:
+            erase_total = plan.sectors_total * plan.sector_size
+            saved += self.erase_time * (erase_total / plan.erase_bytes - 1)
+        return saved
+
+    def __repr__(self):
+        return (f"DeltaStats({self.plan}, 传输{self.sent}字节, 跳过空白{self.blank_bytes}字节, 擦除{self.erase_time:.2f}s, "
+                f"下载{self.transfer_time:.2f}s, 节省约{self.time_saved:.2f}s)")
+
+
+_last_delta = threading.local()
+
+
+def get_last_delta_stats():
+    """返回当前线程最近一次 delta_download 的 DeltaStats"""
+    return getattr(_last_delta, "value", None)
+
+
+def delta_download(device_handle, can_channel, memory_address, data, ecu_id=ECU_RESPONSE_ID, store=None,
+                   sector_size=DELTA_SECTOR_SIZE, full=False, block_size=None, progress_callback=None,
+                   timing=None, console=None, compression=COMPRESSION_NONE, cache=None, digest=None,
+                   erased_value=FLASH_ERASED_VALUE, blank_threshold=0):
+    """
+    差分刷写：与 store 中保存的该ECU上次刷写的镜像按扇区比较，只擦除和下载有变化的扇区，
+    每个变化段依次 0x31 擦除 -> download（0x34/0x36/0x37）；全部成功后保存新镜像作为下次的基准。
+    blank_threshold 不为0时，变化段中不短于 blank_threshold 的 erased_value 连续区擦除后即为该值，不下载（见 flash_segments）。
+    没有基准镜像或 full 为 True 时擦除并下载整个镜像。统计见 get_last_delta_stats()
+    data 为只有一个段的 SegmentedImage 时按段地址下载；多段镜像不做差分，按 flash_segments 逐段擦除和下载
+    :param ecu_id: 保存镜像使用的ECU标识，默认为目标ECU的应答ID
+    :param store: FirmwareStore，None 时使用默认目录
+    :param sector_size: ECU flash的擦除粒度，memory_address 须按其对齐
+    :param progress_callback: progress_callback(已下载字节数, 需下载的总字节数)，按原始数据计
+    :param digest: ImageDigest，累计整个镜像（不只是下载的扇区）的数据，用于校验刷写后的整个APP区
+    :return: 全部成功返回 True
+    """
+    segments = as_segments(data, memory_address)
+    if len(segments) > 1:
+        # 多段镜像不做差分，逐段擦除和下载；ECU内容不再与保存的镜像一致
+        if console: console.debug(f"镜像有 {len(segments)} 个段，按完整刷写")
+        (store if store is not None else FirmwareStore()).forget(ecu_id)
+        return flash_segments(device_handle, can_channel, data, memory_address, sector_size, block_size=block_size,
+                              progress_callback=progress_callback, timing=timing, console=console,
+                              compression=compression, cache=cache, digest=digest, erased_value=erased_value,
+                              blank_threshold=blank_threshold)
+    if segments:
+        memory_address, data = segments[0]
+    data = as_buffer(data)
+    if digest is not None:
+        digest.update(data)
+    store = store if store is not None else FirmwareStore()
+    start = time.perf_counter()
+    plan = plan_delta(None if full else store.load(ecu_id), data, memory_address, sector_size)
+    stats = DeltaStats(plan)
+    _last_delta.value = stats
+    if console: console.debug(f"差分刷写计划: {plan}")
+    if plan.unchanged:
+        stats.elapsed = time.perf_counter() - start
+        if console: console.debug("镜像与上次刷写相同，无需刷写")
+        return True
+    # ECU内容在刷写过程中与保存的镜像不再一致，成功后再保存
+    store.forget(ecu_id)
+    total = plan.download_bytes
+    done = 0
+    for address, erase_size, segment in plan.regions:
+        t = time.perf_counter()
+        if not erase_memory(device_handle, can_channel, address, erase_size, timing, console):
+            if console: console.error(f"擦除 0x{address:08X} 失败")
+            return False
+        stats.erase_time += time.perf_counter() - t
+        if not segment:
+            continue
+        pieces = plan_segments(segment, address, sector_size, 0, erased_value, blank_threshold)
+        stats.blank_bytes += pieces.blank_bytes
+        for piece_address, piece in pieces.segments:
+            t = time.perf_counter()
+            callback = None
+            if progress_callback:
+                def callback(sent, piece_total, done=done + piece_address - address, piece_size=len(piece)):
+                    progress_callback(done + piece_size * sent // piece_total, total)
+            ok = download(device_handle, can_channel, piece_address, piece, block_size, callback, timing, console,
+                          compression=compression, cache=cache)
+            stats.transfer_time += time.perf_counter() - t
+            last = get_last_download_stats()
+            if last is not None:
+                stats.sent += last.transferred
+            if not ok:
+                return False
+        done += len(segment)
+    store.save(ecu_id, memory_address, data)
+    stats.elapsed = time.perf_counter() - start
+    if console: console.debug(f"差分刷写完成: {stats}")
     return True
 
-def receive_can_message(device_handle, can_channel):
+
+def receive_can_message(device_handle, can_channel, timeout=0.1):
     """
     接收CAN消息
     :param device_handle: 设备句柄
     :param can_channel: CAN通道
+    :param timeout: 等待报文的最长时间（秒）
     :return: 接收到的消息
     """
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-    if CanNum > 0:
-        for i in range(CanNum):
-            print(f"Received message ID: {CanMsgBuffer[i].ID}")
-            print(f"Data: {[hex(CanMsgBuffer[i].Data[j]) for j in range(CanMsgBuffer[i].DataLen)]}")
-    elif CanNum == 0:
-        print("No message received.")
+    with subscribe_responses(device_handle, can_channel) as sub:
+        messages = sub.get_batch(timeout)
+    if messages:
+        for message in messages:
+            print(f"Received message ID: {message.ID}")
+            print(f"Data: {[hex(x) for x in frame_data(message)]}")
     else:
-        print("Error receiving message.")
+        print("No message received.")
+    return messages
 
 
-def send_diagnostic_session_control(device_handle, can_channel, session_type=0x01, addressing_type='physical', console=None):
+def send_diagnostic_session_control(device_handle, can_channel, session_type=0x01, addressing_type='physical', console=None, timing=None):
     """
     发送诊断会话控制请求   0x10
     addressing_type: 'physical' 物理寻址(默认), 'functional' 功能寻址
+    正响应中携带的 P2server/P2*server 会更新该ECU的超时参数
+    应答ID除按寻址类型推算的ID外，也接受连接的目标ECU应答ID（get_transport(...).response_id）
+    :return: 收到应答时为 UDSResponse（只有正响应为真，含应答时间 elapsed），发送失败或超时返回 False；
+             会话类型 bit7 置位（抑制正响应）时 P2 内没有负响应返回 suppressed 的 UDSResponse（为真）
     """
     msg = CAN_MSG()
     # 根据寻址类型选择CAN ID
@@ -165,70 +1275,64 @@ def send_diagnostic_session_control(device_handle, can_channel, session_type=0x0
     for i in range(3, 8):
         msg.Data[i] = 0x00  # 填充剩余字节
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
-        if console: console.error("发送诊断会话控制失败")
-        return False
-    else:
-        timeout = 1.0  # 统一超时时间为1秒
-    if console: console.debug(f"发送诊断会话控制成功，会话类型: {hex(session_type)}，超时: {timeout}秒，等待响应...")
-
-    # 修改为循环接收响应，增加超时机制
-    start_time = time.time()
-    # 统一超时时间为1秒
-    timeout = 1.0
-    success = False
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                data = [response.Data[j] for j in range(response.DataLen)]
-                if console: 
-                    console.debug(f"收到响应 ID: {hex(response.ID)}，数据: {[hex(x) for x in data]}")
-                # 根据寻址类型验证响应ID
-                # 原物理寻址响应ID逻辑，可根据实际情况调整
-                expected_physical_id = msg.ID + 0x8  
-                # 原功能寻址响应ID范围，可根据实际情况调整
-                functional_id_range = range(0x7E8, 0x7F0) 
-
-                # 新增配置项，可在文件开头定义全局变量，这里为示例方便直接写在此处
-                CUSTOM_PHYSICAL_RESPONSE_IDS = [0x3c1]  # 可根据实际情况添加更多ID
-                CUSTOM_FUNCTIONAL_RESPONSE_IDS = []  
-
-                is_valid_id = (
-                    (addressing_type == 'physical' and (response.ID == expected_physical_id or response.ID in CUSTOM_PHYSICAL_RESPONSE_IDS)) or 
-                    (addressing_type == 'functional' and (response.ID in functional_id_range or response.ID in CUSTOM_FUNCTIONAL_RESPONSE_IDS))
-                )
-                # 详细日志：记录响应ID验证状态
-                if console: 
-                    console.debug(f"响应ID验证: 寻址类型={addressing_type}, 预期物理ID={hex(expected_physical_id)}, 实际ID={hex(response.ID)}, 有效={is_valid_id}")
-                if is_valid_id:
-                    # 检查正响应 (50 + 会话类型)
-                    if len(data) >= 3 and data[1] == 0x50 and data[2] == session_type:
-                        success = True
-                        if console: console.debug("诊断会话控制成功")
-                        return success
-                    # 检查负响应 (7F + 服务ID + NRC)
-                    elif len(data) >= 4 and data[1] == 0x7F and data[2] == 0x10:
-                        nrc = data[3]
-                        if console: console.error(f"诊断会话控制失败，NRC: {hex(nrc)}")
-                        # 物理寻址时收到负响应立即返回失败
-                        if addressing_type == 'physical':
-                            return False
-                        # 功能寻址时继续等待其他ECU响应
-                        continue
-                        # 功能寻址继续等待其他ECU响应
-        # 固定轮询间隔为0.1秒
-        time.sleep(0.1)
-        remaining_time = timeout - (time.time() - start_time)
-        if console: console.debug(f"等待响应中，剩余时间: {remaining_time:.2f}秒")
+    timing = timing or get_ecu_timing()
+    target_id = get_transport(device_handle, can_channel).response_id
+    with subscribe_responses(device_handle, can_channel) as sub:
+        ret = send_single_frame(device_handle, can_channel, msg)
+        if ret < 0:
+            if console: console.error("发送诊断会话控制失败")
+            return False
+        start = time.perf_counter()
+        if console: console.debug(f"发送诊断会话控制成功，会话类型: {hex(session_type)}，P2: {timing.p2}秒，等待响应...")
+
+        # 应答到达即处理，P2（或0x78后的P2*）内没有有效应答则失败
+        for response in iter_uds_responses(sub, 0x10, start, timing, console):
+            _last_response.value = response
+            data = response.payload
+            if console: 
+                console.debug(f"收到响应 ID: {hex(response.response_id)}，数据: {[hex(x) for x in data]}，耗时: {response.elapsed * 1000:.1f}ms")
+            # 根据寻址类型验证响应ID
+            # 原物理寻址响应ID逻辑，可根据实际情况调整
+            expected_physical_id = msg.ID + 0x8  
+            # 原功能寻址响应ID范围，可根据实际情况调整
+            functional_id_range = range(0x7E8, 0x7F0) 
+
+            # 新增配置项，可在文件开头定义全局变量，这里为示例方便直接写在此处
+            CUSTOM_PHYSICAL_RESPONSE_IDS = [0x3c1]  # 可根据实际情况添加更多ID
+            CUSTOM_FUNCTIONAL_RESPONSE_IDS = []  
+
+            is_valid_id = response.response_id == target_id or (
+                (addressing_type == 'physical' and (response.response_id == expected_physical_id or response.response_id in CUSTOM_PHYSICAL_RESPONSE_IDS)) or 
+                (addressing_type == 'functional' and (response.response_id in functional_id_range or response.response_id in CUSTOM_FUNCTIONAL_RESPONSE_IDS))
+            )
+            # 详细日志：记录响应ID验证状态
+            if console: 
+                console.debug(f"响应ID验证: 寻址类型={addressing_type}, 预期物理ID={hex(expected_physical_id)}, 实际ID={hex(response.response_id)}, 有效={is_valid_id}")
+            if is_valid_id:
+                # 检查正响应 (50 + 会话类型)
+                if response.positive and len(data) >= 2 and data[1] == session_type:
+                    get_ecu_timing(response.response_id).update_from_session_response(data)
+                    if console: console.debug("诊断会话控制成功")
+                    return response
+                # 检查负响应 (7F + 服务ID + NRC)
+                elif response.negative:
+                    if console: console.error(f"诊断会话控制失败，NRC: {hex(response.nrc)}")
+                    # 物理寻址时收到负响应立即返回失败（负响应的 UDSResponse 为假）
+                    if addressing_type == 'physical':
+                        return response
+                    # 功能寻址时继续等待其他ECU响应
+                    continue
+    if session_type & 0x80:
+        # 抑制正响应：P2 内没有负响应即为成功
+        response = UDSResponse(0x10, elapsed=time.perf_counter() - start)
+        response.suppressed = True
+        _last_response.value = response
+        return response
     if console: console.error("诊断会话控制超时未收到响应")
-    return success
+    return False
 
 
-def request_security_access(device_handle, can_channel, level=0x01, console=None):
+def request_security_access(device_handle, can_channel, level=0x01, console=None, timing=None):
     """
     请求安全访问  0x27
     """
@@ -240,81 +1344,55 @@ def request_security_access(device_handle, can_channel, level=0x01, console=None
     msg.Data[2] = level  # 安全等级
     for i in range(3, 8):  # 填充剩余5字节为0
         msg.Data[i] = 0x00
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
-        if console: console.error("请求安全访问失败！")
+    response = _send_and_wait(device_handle, can_channel, msg, 0x27, "请求安全访问失败！", timing, console)
+    if response is None:
         return False
-
-    sleep(0.5)  # 等待响应
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-    if CanNum > 0:
-        for i in range(CanNum):
-            data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-            if console:
-                console.debug(f"收到响应 ID: {hex(CanMsgBuffer[i].ID)}")
-                console.debug(f"数据内容: {[hex(x) for x in data]}")
-            if data[1] == 0x7F and data[2] == 0x27:
-                nrc = data[3]
-                if console: console.debug(f"NRC 错误码: {hex(nrc)}")
-                return False
-            elif len(data) > 2 and data[1] == 0x67 and data[2] == level:
-                seed = data[3:] if len(data) > 3 else []
-                if console: 
-                    console.debug(f"收到种子: {[hex(x) for x in seed]}")
-                    console.debug(f"种子长度: {len(seed)}字节")
-                return seed  # 返回种子数据
-            elif len(data) > 1 and data[1] == 0x7F:
-                if console: console.warning(f"收到NRC错误响应: {[hex(x) for x in data]}")
-                return False
-    else:
+    if response.timed_out:
         if console: console.debug("未收到有效响应")
+        return None
+    data = response.payload
+    if console:
+        console.debug(f"收到响应 ID: {hex(response.response_id)}")
+        console.debug(f"数据内容: {[hex(x) for x in data]}")
+    if response.negative:
+        if console: console.debug(f"NRC 错误码: {hex(response.nrc)}")
+        return False
+    if len(data) > 1 and data[1] == level:
+        seed = data[2:]
+        if console: 
+            console.debug(f"收到种子: {[hex(x) for x in seed]}")
+            console.debug(f"种子长度: {len(seed)}字节")
+        return seed  # 返回种子数据
     return None
 
 
-def send_security_key(device_handle, can_channel, level, key, console=None):
+def send_security_key(device_handle, can_channel, level, key, console=None, timing=None):
     """
     发送安全访问密钥
+    :param level: 请求种子时的安全等级，发送密钥的子功能为 level + 1
+    :param key: 密钥，超过单帧长度时按多帧发送
     """
-    msg = CAN_MSG()
-    msg.ID = 0x7DF
-    msg.DataLen = 8
-    msg.Data[0] = 0x02 + len(key)  # 数据长度
-    msg.Data[1] = 0x27             # UDS服务ID
-    msg.Data[2] = level | 0x01     # 响应子功能，+1 表示发送密钥
-    for i in range(len(key)):
-        msg.Data[3 + i] = key[i]
-    
-    # 填充剩余字节为0
-    for i in range(3 + len(key), 8):
-        msg.Data[i] = 0x00
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
+    payload = bytes([0x27, level + 1]) + bytes(key)
+    response = get_transport(device_handle, can_channel).request(payload, timing, console, tx_id=0x7DF)
+    if response is None:
         print("发送密钥失败！")
         return False
-
-    sleep(0.5)
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-    if CanNum > 0:
-        for i in range(CanNum):
-            data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-            if console:
-                console.debug(f"收到响应 ID: {hex(CanMsgBuffer[i].ID)}")
-                console.debug(f"数据内容: {[hex(x) for x in data]}")
-
-            if data[1] == 0x7F and data[2] == 0x27:
-                nrc = data[3]
-                if console: console.debug(f"NRC 错误码: {hex(nrc)}")
-                return False
-            elif data[1] == 0x67 and (data[2] & 0xFE) == (level | 0x01):
-                if console: console.debug("密钥验证成功")
-                return True
-    else:
+    if response.timed_out:
         if console: console.debug("未收到响应")
+        return False
+    data = response.payload
+    if console:
+        console.debug(f"收到响应 ID: {hex(response.response_id)}")
+        console.debug(f"数据内容: {[hex(x) for x in data]}")
+    if response.negative:
+        if console: console.debug(f"NRC 错误码: {hex(response.nrc)}")
+        return False
+    if len(data) > 1 and data[1] == level + 1:
+        if console: console.debug("密钥验证成功")
+        return True
     return False
 
-def read_data_by_identifier(device_handle, can_channel, did=0xF190, console=None):
+def read_data_by_identifier(device_handle, can_channel, did=0xF190, console=None, timing=None):
     """
     发送 UDS 0x22 服务，读取指定 DID 数据
     :param device_handle: 设备句柄
@@ -331,26 +1409,35 @@ def read_data_by_identifier(device_handle, can_channel, did=0xF190, console=None
     for i in range(4, 8):
         msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
+    response = _send_and_wait(device_handle, can_channel, msg, 0x22, "Read data by identifier failed!", timing, console)
+    if response is None:
         print("Read data by identifier failed!")
         return False
 
-    sleep(0.5)
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-
-    if CanNum > 0:
-        for i in range(CanNum):
-            data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-            if console: console.debug(f"收到响应 ID={hex(CanMsgBuffer[i].ID)}，数据={[hex(x) for x in data]}")
-    else:
+    if response.timed_out:
         if console: console.debug("未收到响应")
+    elif console:
+        console.debug(f"收到响应 ID={hex(response.response_id)}，数据={[hex(x) for x in response.payload]}")
 
     return True
 
 
-def control_dtc_setting(device_handle, can_channel, sub_function, addressing_type='functional', console=None):
+def _send_and_wait(device_handle, can_channel, msg, service_id, error_message, timing=None, console=None,
+                   suppressible=False):
+    """
+    经连接的ISO-TP实现发送单帧请求 msg 并等待目标ECU的应答，发送失败返回None
+    :param suppressible: 请求带子功能，子功能 bit7 置位时ECU不回正响应（UDSResponse.suppressed）
+    """
+    payload = bytes(msg.Data[1:1 + msg.Data[0]])
+    response = get_transport(device_handle, can_channel).request(payload, timing, console, tx_id=msg.ID)
+    if response is None and console:
+        console.error(error_message)
+    if response is not None and suppressible and payload[1] & 0x80:
+        response.suppressed = True
+    return response
+
+
+def control_dtc_setting(device_handle, can_channel, sub_function, addressing_type='functional', console=None, timing=None):
     """控制DTC设置(85服务)"""
     if console: console.debug(f"控制DTC设置: 子功能0x{sub_function:02X}")
     msg = CAN_MSG()
@@ -362,30 +1449,12 @@ def control_dtc_setting(device_handle, can_channel, sub_function, addressing_typ
     for i in range(3, 8):
         msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret != 0:
-        if console: console.error("发送DTC控制请求失败")
-        return False
-
-    # 等待响应
-    import time
-    start_time = time.time()
-    timeout = 2.0
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                if response.ID == 0x71b:
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if data[1] == 0xC5:  # 85服务正响应
-                        return True
-        time.sleep(0.1)
-    return False
+    response = _send_and_wait(device_handle, can_channel, msg, 0x85, "发送DTC控制请求失败", timing, console,
+                              suppressible=True)
+    return response if response is not None else False  # 只有85服务正响应为真
 
 
-def control_communication(device_handle, can_channel, channel, control_type, addressing_type='functional', console=None):
+def control_communication(device_handle, can_channel, channel, control_type, addressing_type='functional', console=None, timing=None):
     """控制通信(28服务)"""
     if console: console.debug(f"控制通信: 通道0x{channel:02X}, 类型0x{control_type:02X}")
     msg = CAN_MSG()
@@ -398,67 +1467,32 @@ def control_communication(device_handle, can_channel, channel, control_type, add
     for i in range(4, 8):
         msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret != 0:
-        if console: console.error("发送通信控制请求失败")
-        return False
-
-    # 等待响应
-    import time
-    start_time = time.time()
-    timeout = 2.0
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                if response.ID == 0x71b:
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if data[1] == 0x68:  # 28服务正响应
-                        return True
-        time.sleep(0.1)
-    return False
-
+    response = _send_and_wait(device_handle, can_channel, msg, 0x28, "发送通信控制请求失败", timing, console,
+                              suppressible=True)
+    return response if response is not None else False  # 只有28服务正响应为真
 
-def check_memory_integrity(device_handle, can_channel, console=None):
-    """检查内存完整性(31服务)"""
-    if console: console.debug("检查内存完整性...")
-    msg = CAN_MSG()
-    msg.ID = 0x713
-    msg.DataLen = 8
-    msg.Data[0] = 0x04
-    msg.Data[1] = 0x31
-    msg.Data[2] = 0x01
-    msg.Data[3] = 0x02
-    msg.Data[4] = 0x03
-    for i in range(5, 8):
-        msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret != 0:
-        if console: console.error("发送内存完整性检查请求失败")
+def check_memory_integrity(device_handle, can_channel, console=None, timing=None, digest=None):
+    """
+    检查内存完整性(31服务)
+    :param digest: 主机计算的校验值（bytes，或 ImageDigest 取其第一个算法），附加在例程ID之后由ECU比较，
+                   None 时不带参数（超过单帧长度时按多帧发送）
+    :return: 正响应且例程状态（routineStatus，例程ID之后的第一个字节）为 0x00 返回 True
+    """
+    if isinstance(digest, ImageDigest):
+        digest = digest.digest()
+    if console: console.debug(f"检查内存完整性... {digest.hex().upper() if digest else ''}")
+    payload = bytes([0x31, 0x01, 0x02, 0x03]) + bytes(digest or b"")
+    response = get_transport(device_handle, can_channel).request(payload, timing, console, tx_id=0x713)
+    if response is None and console:
+        console.error("发送内存完整性检查请求失败")
+    if response is None:
         return False
+    # 31服务正响应且状态成功：[0x71, 0x01, 0x02, 0x03, routineStatus]
+    return response.positive and len(response.payload) > 4 and response.payload[4] == 0x00
+
 
-    # 等待响应
-    import time
-    start_time = time.time()
-    timeout = 1.0
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                if response.ID == 0x71b:
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if data[1] == 0x71 and data[4] == 0x00:  # 31服务正响应且状态成功
-                        return 0
-        time.sleep(0.1)
-    return 1
-
-
-def ecu_reset(device_handle, can_channel, reset_type=0x01, console=None):
+def ecu_reset(device_handle, can_channel, reset_type=0x01, console=None, timing=None):
     """ECU重置(11服务)"""
     if console: console.debug(f"执行ECU重置: 类型0x{reset_type:02X}")
     msg = CAN_MSG()
@@ -470,30 +1504,12 @@ def ecu_reset(device_handle, can_channel, reset_type=0x01, console=None):
     for i in range(3, 8):
         msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret != 0:
-        if console: console.error("发送ECU重置请求失败")
-        return False
-
-    # 等待响应
-    import time
-    start_time = time.time()
-    timeout = 1.0
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                if response.ID == 0x71b:
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if data[1] == 0x51:  # 11服务正响应
-                        return True
-        time.sleep(0.1)
-    return False
+    response = _send_and_wait(device_handle, can_channel, msg, 0x11, "发送ECU重置请求失败", timing, console,
+                              suppressible=True)
+    return response if response is not None else False  # 只有11服务正响应为真
 
 
-def enter_default_session(device_handle, can_channel, addressing_type='functional', console=None):
+def enter_default_session(device_handle, can_channel, addressing_type='functional', console=None, timing=None):
     """进入默认会话(10服务)"""
     if console: console.debug("进入默认会话...")
     msg = CAN_MSG()
@@ -506,62 +1522,9 @@ def enter_default_session(device_handle, can_channel, addressing_type='functiona
     for i in range(3, 8):
         msg.Data[i] = 0x00
 
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret != 0:
-        if console: console.error("发送默认会话请求失败")
-        return False
-
-    # 等待响应
-    import time
-    start_time = time.time()
-    timeout = 0.01
-    while time.time() - start_time < timeout:
-        CanMsgBuffer = (CAN_MSG * 1024)()
-        CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-        if CanNum > 0:
-            for i in range(CanNum):
-                response = CanMsgBuffer[i]
-                if response.ID == 0x71b:
-                    data = [response.Data[j] for j in range(response.DataLen)]
-                    if data[1] == 0x50:  # 10服务正响应
-                        return True
-        time.sleep(0.1)
-    return False
-
-def read_data_by_identifier(device_handle, can_channel, did=0xF190, console=None):
-    """
-    发送 UDS 0x22 服务，读取指定 DID 数据
-    :param device_handle: 设备句柄
-    :param can_channel: CAN通道
-    :param did: 要读取的 DID
-    """
-    msg = CAN_MSG()
-    msg.ID = 0x7DF
-    msg.DataLen = 8
-    msg.Data[0] = 0x04
-    msg.Data[1] = 0x22
-    msg.Data[2] = (did >> 8) & 0xFF
-    msg.Data[3] = did & 0xFF
-    for i in range(4, 8):
-        msg.Data[i] = 0x00
-
-    ret = CAN_SendMsg(device_handle, can_channel, byref(msg), 1)
-    if ret < 0:
-        print("Read data by identifier failed!")
-        return False
-
-    sleep(0.5)
-    CanMsgBuffer = (CAN_MSG * 1024)()
-    CanNum = CAN_GetMsg(device_handle, can_channel, byref(CanMsgBuffer))
-
-    if CanNum > 0:
-        for i in range(CanNum):
-            data = [CanMsgBuffer[i].Data[j] for j in range(CanMsgBuffer[i].DataLen)]
-            if console: console.debug(f"收到响应 ID={hex(CanMsgBuffer[i].ID)}，数据={[hex(x) for x in data]}")
-    else:
-        if console: console.debug("未收到响应")
-
-    return True
+    response = _send_and_wait(device_handle, can_channel, msg, 0x10, "发送默认会话请求失败", timing, console,
+                              suppressible=True)
+    return response if response is not None else False  # 只有10服务正响应为真
 
 
 def read_ecu_version(device_handle, can_channel, console=None):
@@ -572,4 +1535,3 @@ def read_ecu_version(device_handle, can_channel, console=None):
     if result and console:
         console.log("ECU 版本号请求已发送")
     return result
-
@@ -0,0 +1,73 @@
+"""
+文件说明：连续帧批量提交基准测试
+在模拟后端上用 UDS_OTA.transfer_data 下载固件，分别把 UDS_service.ISOTP_MAX_BATCH_FRAMES 设为 1（逐帧提交）
+和若干批量大小，比较 CAN_SendMsg 调用次数（即USB传输次数）、每次传输的平均帧数和吞吐量。
+模拟后端的每次收发调用计 --usb-latency-ms 的USB传输耗时，与一次提交的帧数无关。
+结果与 baseline_batch.json 比较，字节/秒低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_batch.py
+    python benchmarks/bench_batch.py --sizes 256K --batches 1,16,64 --usb-latency-ms 0.5
+    python benchmarks/bench_batch.py --update-baseline
+"""
+import argparse
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_batch.json"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="连续帧批量提交基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="64K,256K", help="固件大小列表")
+    parser.add_argument("--batches", default="1,8,64", help="每次 CAN_SendMsg 提交的最多帧数列表，1 为逐帧提交")
+    parser.add_argument("--usb-latency-ms", type=float, default=0.25, help="每次USB传输的耗时（毫秒）")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, usb_latency_ms=args.usb_latency_ms)
+    import UDS_service
+    from bench_ota import run_case
+
+    batches = [int(b) for b in args.batches.split(",")]
+    results = {}
+    print(f"{'case':<16}{'verified':>9}{'frames':>9}{'usb tx':>9}{'frames/tx':>10}{'tx saved':>10}"
+          f"{'KB/s':>10}{'speedup':>9}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        unbatched = None
+        for batch in batches:
+            UDS_service.ISOTP_MAX_BATCH_FRAMES = batch
+            r = run_case("uds_ota", size)
+            if unbatched is None:
+                unbatched = r
+            r["frames_per_tx"] = r["frames"] / r["usb_tx"] if r["usb_tx"] else 0.0
+            r["usb_tx_saved"] = unbatched["usb_tx"] - r["usb_tx"]
+            r["speedup"] = r["bytes_per_s"] / unbatched["bytes_per_s"]
+            case = f"batch{batch}/{format_size(size)}"
+            results[case] = r
+            print(f"{case:<16}{'Y' if r['verified'] else 'N':>9}{r['frames']:>9}{r['usb_tx']:>9}"
+                  f"{r['frames_per_tx']:>10.1f}{r['usb_tx_saved']:>10}{r['bytes_per_s'] / 1024:>10.1f}"
+                  f"{r['speedup']:>8.2f}x")
+
+    settings = {"latency_ms": args.latency_ms, "usb_latency_ms": args.usb_latency_ms}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.1f} KB/s -> {current / 1024:.1f} KB/s")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+文件说明：空白区（擦除值连续区）跳过下载基准测试
+    scan    ：FirmwareImage.blank_runs 在镜像中查找不短于阈值的 0xFF 连续区的速度（MB/s）
+    download：在模拟后端上按真实总线速率（默认 500k）用 UDS_service.flash_segments 刷写含大片 0xFF 的镜像，比较：
+              full ：blank_threshold=0，每个字节都下载（之前的做法）
+              blank：blank_threshold=BLANK_RUN_THRESHOLD（或 --threshold），空白区只擦除不下载，段在空白区处切分为多次 0x34/0x36/0x37
+测试镜像按 bench_compression.firmware_like 生成代码数据，其中每隔一段插入按扇区对齐的 0xFF 保留区（约占 --blank-ratio），
+并在代码中散布短于阈值的 0xFF 填充（对齐填充、未用的向量表项），这些短填充不应被切分。
+刷写前虚拟ECU的flash先填满随机数据，verified 表示刷写后读出的整个镜像范围与镜像一致（空白区确实被擦除），
+且随下载累计的 CRC32 与整个镜像的 CRC32 相同。
+结果与 baseline_blank.json 比较，download 耗时超过或 scan 速度低于基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_blank.py
+    python benchmarks/bench_blank.py --sizes 256K --blank-ratio 0.6 --threshold 0x200
+    python benchmarks/bench_blank.py --update-baseline
+"""
+import argparse
+import random
+import sys
+import time
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_blank.json"
+APP_ADDRESS = 0x08000000
+RESERVED_SIZE = 0x2000  # 每个 0xFF 保留区的长度
+
+
+def test_image(size, blank_ratio, sector_size):
+    """size 字节的镜像：代码数据与按扇区对齐的 0xFF 保留区交替，代码中每 1K 左右有一处 4~64 字节的 0xFF 填充"""
+    from bench_compression import firmware_like
+    rng = random.Random(size)
+    reserved = int(size * blank_ratio) // RESERVED_SIZE
+    code = bytearray(firmware_like(size - reserved * RESERVED_SIZE, 0))
+    for offset in range(0, len(code) - 64, 1024):
+        fill = rng.randint(4, 64)
+        code[offset:offset + fill] = b"\xFF" * fill
+    piece = len(code) // (reserved + 1) // sector_size * sector_size
+    image = bytearray()
+    for index in range(reserved + 1):
+        image += code[index * piece:(index + 1) * piece if index < reserved else len(code)]
+        if index < reserved:
+            image += b"\xFF" * RESERVED_SIZE
+    return bytes(image)
+
+
+def run_scan(data, threshold, repeat):
+    from FirmwareImage import blank_runs
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runs = blank_runs(data, 0xFF, threshold)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return runs, best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="空白区跳过下载基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="256K", help="镜像大小列表（download）")
+    parser.add_argument("--scan-size", default="16M", help="scan 的镜像大小")
+    parser.add_argument("--blank-ratio", type=float, default=0.4, help="0xFF 保留区占镜像的比例")
+    parser.add_argument("--threshold", type=lambda s: int(s, 0), default=None, help="空白区阈值，默认 BLANK_RUN_THRESHOLD")
+    parser.add_argument("--sector-size", type=lambda s: int(s, 0), default=0x800, help="扇区大小")
+    parser.add_argument("--repeat", type=int, default=3, help="scan 的计时轮数，取最快一轮")
+    parser.add_argument("--bitrate", type=int, default=500000, help="虚拟总线波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许偏离基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate)
+    import usb_device
+    import UDS_service
+    from bench_ota import PATHS, run_case
+    from FirmwareDigest import ImageDigest, image_digest
+    from FirmwareImage import BLANK_RUN_THRESHOLD
+
+    threshold = args.threshold if args.threshold is not None else BLANK_RUN_THRESHOLD
+    results = {}
+    failed = False
+
+    size = parse_size(args.scan_size)
+    data = test_image(size, args.blank_ratio, args.sector_size)
+    runs, elapsed = run_scan(data, threshold, args.repeat)
+    blank = sum(end - start for start, end in runs)
+    case = f"scan/{format_size(size)}"
+    results[case] = {"runs": len(runs), "blank_bytes": blank, "elapsed_s": elapsed, "mb_per_s": size / elapsed / 1e6}
+    print(f"{'case':<18}{'runs':>7}{'blank':>10}{'s':>9}{'MB/s':>9}")
+    print(f"{case:<18}{len(runs):>7}{blank:>10}{elapsed:>9.4f}{size / elapsed / 1e6:>9.1f}")
+
+    ecu = usb_device.USB2XXXLib.ecus[0]
+    print(f"\n{'case':<18}{'verified':>9}{'segments':>9}{'sent':>9}{'blank':>9}{'wall s':>8}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        data = test_image(size, args.blank_ratio, args.sector_size)
+        for case_name, case_threshold in (("full", 0), ("blank", threshold)):
+            ecu._flash_log[:] = [(APP_ADDRESS, len(data), random.Random(0).randbytes(len(data)))]
+            digest = ImageDigest()
+            PATHS["blank"] = lambda dev, ch, firmware: UDS_service.flash_segments(
+                dev, ch, firmware, APP_ADDRESS, args.sector_size, digest=digest, blank_threshold=case_threshold)
+            try:
+                r = run_case("blank", size, data=data)
+            finally:
+                del PATHS["blank"]
+            plan = UDS_service.get_last_segment_plan()
+            r["verified"] = (ecu.read_memory(APP_ADDRESS, len(data)) == data
+                             and digest.digest() == image_digest(data))
+            r.update({"segments": len(plan.segments), "sent_bytes": plan.download_bytes,
+                      "blank_bytes": plan.blank_bytes})
+            failed |= not (r["ok"] and r["verified"])
+            case = f"{case_name}/{format_size(size)}"
+            results[case] = r
+            print(f"{case:<18}{'Y' if r['ok'] and r['verified'] else 'N':>9}{r['segments']:>9}{r['sent_bytes']:>9}"
+                  f"{r['blank_bytes']:>9}{r['wall_s']:>8.2f}")
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate, "sector_size": args.sector_size,
+                "blank_ratio": args.blank_ratio, "threshold": threshold}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    if failed:
+        print("刷写失败，或虚拟ECU的flash内容、累计的校验值与镜像不一致")
+    downloads = {case: r for case, r in results.items() if "wall_s" in r}
+    regressions = [(case, f"{reference:.2f}s", f"{current:.2f}s") for case, reference, current in
+                   compare_baseline(downloads, baseline, "wall_s", args.tolerance, higher_is_better=False)]
+    scans = {case: r for case, r in results.items() if "mb_per_s" in r}
+    regressions += [(case, f"{reference:.1f} MB/s", f"{current:.1f} MB/s") for case, reference, current in
+                    compare_baseline(scans, baseline, "mb_per_s", args.tolerance)]
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference} -> {current}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
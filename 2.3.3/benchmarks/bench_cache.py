@@ -0,0 +1,131 @@
+"""
+文件说明：固件缓存基准测试
+比较 FirmwareCache 对重复刷写同一镜像的效果，每种情况都先清空进程内的压缩缓存，模拟每次刷写重新启动工具：
+    download：在模拟后端上用 UDS_service.download 压缩下载（默认 zlib），不使用缓存（none）、缓存为空（cold）、
+              压缩结果命中磁盘缓存（warm）时，从调用 download 到第一个 0x36 块第一帧提交的时间（first ms，
+              包含压缩和 0x34 请求）和下载总耗时
+    hex     ：加载 Intel HEX 文件，直接解析（none）、解析后写入缓存（cold）、解析结果命中缓存（warm）的耗时
+verified 表示虚拟ECU收到的数据（或加载得到的段）与镜像一致。
+warm 按 --repeat 轮取最快一轮（毫秒级的耗时受线程调度影响较大）。
+结果与 baseline_cache.json 比较，warm 的首帧时间或加载耗时超过基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_cache.py
+    python benchmarks/bench_cache.py --sizes 1M,4M --compression 1
+    python benchmarks/bench_cache.py --update-baseline
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_cache.json"
+MODES = ("none", "cold", "warm")
+
+
+def run_download(cache, data, compression):
+    import FirmwareCompression
+    import UDS_service
+    from bench_ota import PATHS, run_case
+
+    FirmwareCompression._cache.clear()
+    PATHS["download"] = lambda device_handle, channel, data: UDS_service.download(
+        device_handle, channel, 0x08000000, data, compression=compression, cache=cache)
+    try:
+        result = run_case("download", len(data), data=data)
+    finally:
+        del PATHS["download"]
+    stats = UDS_service.get_last_download_stats()
+    result.update({"first_frame_ms": stats.first_frame * 1000, "transferred": stats.transferred})
+    return result
+
+
+def run_load(path, cache):
+    from FirmwareImage import load_firmware
+    start = time.perf_counter()
+    image = cache.load_firmware(path) if cache is not None else load_firmware(path)
+    return image, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="固件缓存基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="1M", help="固件大小列表")
+    parser.add_argument("--compression", type=int, default=1, help="压缩方法ID（FirmwareCompression）")
+    parser.add_argument("--repeat", type=int, default=5, help="warm 的计时轮数，取最快一轮")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms)
+    from FirmwareCache import FirmwareCache
+    from bench_compression import firmware_like
+    from bench_firmware_parse import test_segments, write_intel_hex
+
+    results = {}
+    failed = False
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    print(f"{'case':<20}{'verified':>9}{'sent':>9}{'first ms':>10}{'wall s':>8}")
+    for size in sizes:
+        data = firmware_like(size)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FirmwareCache(directory)
+            for mode in MODES:
+                runs = [run_download(None if mode == "none" else cache, data, args.compression)
+                        for _ in range(args.repeat if mode == "warm" else 1)]
+                r = min(runs, key=lambda run: run["first_frame_ms"])
+                failed |= not (r["ok"] and r["verified"])
+                case = f"download/{mode}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<20}{'Y' if r['ok'] and r['verified'] else 'N':>9}{r['transferred']:>9}"
+                      f"{r['first_frame_ms']:>10.1f}{r['wall_s']:>8.2f}")
+
+    print(f"\n{'case':<20}{'verified':>9}{'load s':>9}")
+    for size in sizes:
+        segments = test_segments(size)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "image.hex")
+            with open(path, "wb") as f:
+                write_intel_hex(segments, f, 32)
+            cache = FirmwareCache(os.path.join(directory, "cache"))
+            for mode in MODES:
+                loads = [run_load(path, None if mode == "none" else cache)
+                         for _ in range(args.repeat if mode == "warm" else 1)]
+                image, elapsed = min(loads, key=lambda run: run[1])
+                verified = [(s.address, bytes(s.data)) for s in image] == segments
+                failed |= not verified
+                case = f"hex/{mode}/{format_size(size)}"
+                results[case] = {"verified": verified, "load_s": elapsed}
+                print(f"{case:<20}{'Y' if verified else 'N':>9}{elapsed:>9.4f}")
+                del image, loads
+
+    settings = {"latency_ms": args.latency_ms, "compression": args.compression}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    if failed:
+        print("下载失败或数据与镜像不一致")
+    warm = {case: r for case, r in results.items() if "/warm/" in case}
+    regressions = []
+    for metric in ("first_frame_ms", "load_s"):
+        metric_results = {case: r for case, r in warm.items() if metric in r}
+        for case, reference, current in compare_baseline(metric_results, baseline, metric, args.tolerance,
+                                                         higher_is_better=False):
+            regressions.append((case, metric, reference, current))
+    for case, metric, reference, current in regressions:
+        print(f"性能回归 {case} {metric}: {reference:.4f} -> {current:.4f}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+文件说明：CANFD刷写与普通CAN刷写的吞吐量对比
+在模拟后端上按真实总线速率（默认标称 500k、数据段 2M）用同一个固件镜像运行数据下载阶段（0x34/0x36/0x37），
+比较普通CAN（8字节帧）与CANFD（64字节帧，BRS开/关）的帧数、总线时间和吞吐量：
+    can        ：uds_ota，主机端ISO-TP，普通CAN
+    canfd      ：uds_ota_canfd，主机端ISO-TP over CANFD，64字节帧，BRS
+    canfd_nobrs：同 canfd，不切换数据段波特率（数据段按标称波特率）
+    adapter_fd ：uds_ota_adapter_fd，适配器固件ISO-TP，CANFD+BRS
+speedup 为相对 can 的吞吐量倍数。结果与 baseline_canfd.json 比较，字节/秒低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_canfd.py
+    python benchmarks/bench_canfd.py --sizes 1M --bitrate 500000 --data-bitrate 5000000
+    python benchmarks/bench_canfd.py --update-baseline
+"""
+import argparse
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_canfd.json"
+MODES = ("can", "canfd", "canfd_nobrs", "adapter_fd")
+
+
+def run_mode(mode, size):
+    import UDS_service
+    from bench_ota import PATHS, run_case, canfd_channel, run_uds_ota
+    if mode == "can":
+        return run_case("uds_ota", size)
+    if mode == "canfd":
+        return run_case("uds_ota_canfd", size)
+    if mode == "adapter_fd":
+        return run_case("uds_ota_adapter_fd", size)
+
+    def run_nobrs(device_handle, channel, data):
+        with canfd_channel(device_handle, channel):
+            UDS_service.set_transport(device_handle, channel, "canfd", brs=False)
+            try:
+                return run_uds_ota(device_handle, channel, data)
+            finally:
+                UDS_service.set_transport(device_handle, channel, "python")
+
+    PATHS["uds_ota_canfd_nobrs"] = run_nobrs
+    try:
+        return run_case("uds_ota_canfd_nobrs", size)
+    finally:
+        del PATHS["uds_ota_canfd_nobrs"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CANFD刷写与普通CAN刷写的吞吐量对比（模拟后端）")
+    parser.add_argument("--sizes", default="64K,256K", help="固件大小列表")
+    parser.add_argument("--modes", default=",".join(MODES), help="对比的方式：" + ",".join(MODES))
+    parser.add_argument("--bitrate", type=int, default=500000, help="标称波特率")
+    parser.add_argument("--data-bitrate", type=int, default=2000000, help="CANFD数据段波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate, args.data_bitrate)
+    modes = [m.strip() for m in args.modes.split(",")]
+    results = {}
+    print(f"{'case':<20}{'verified':>9}{'frames':>9}{'bytes/frame':>12}{'KB/s':>10}{'s/100KB':>9}{'speedup':>9}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        reference = None
+        for mode in modes:
+            r = run_mode(mode, size)
+            if mode == "can":
+                reference = r
+            r["bytes_per_frame"] = size / r["frames"] if r["frames"] else 0.0
+            r["s_per_100kb"] = r["wall_s"] / (size / 102400)
+            r["speedup"] = r["bytes_per_s"] / reference["bytes_per_s"] if reference else 0.0
+            case = f"{mode}/{format_size(size)}"
+            results[case] = r
+            print(f"{case:<20}{'Y' if r['verified'] else 'N':>9}{r['frames']:>9}{r['bytes_per_frame']:>12.1f}"
+                  f"{r['bytes_per_s'] / 1024:>10.1f}{r['s_per_100kb']:>9.2f}{r['speedup']:>8.2f}x")
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate, "data_bitrate": args.data_bitrate}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.1f} KB/s -> {current / 1024:.1f} KB/s")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+文件说明：基准测试公共组件
+    use_sim_backend：在导入 usb_device 之前选择模拟后端（usb_sim），不需要连接适配器
+    Profiler       ：按类别统计被测线程的耗时
+                     sleep  固定等待（time.sleep）
+                     wait   等待应答（Subscription.get / get_batch）
+                     lib    USB2XXX库函数调用（模拟后端下不含虚拟ECU的处理时间）
+                     ecu    虚拟ECU处理请求的时间（测试替身本身的开销）
+                     python 其余时间，即报文编码、分块和流程控制等Python开销
+    load_baseline / save_baseline / compare_baseline：基线结果的保存与回归比较
+
+基准测试脚本放在本目录下，从 2.3.3 目录运行，例如：
+    python benchmarks/bench_ota.py --sizes 64K,1M
+"""
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+SOURCE_DIR = BENCH_DIR.parent
+
+if str(SOURCE_DIR) not in sys.path:
+    sys.path.insert(0, str(SOURCE_DIR))
+
+
+def use_sim_backend(latency_ms=1.0, bitrate=0, data_bitrate=0, usb_latency_ms=0.0):
+    """选择模拟后端，必须在导入 usb_device / usb2can / UDS 模块之前调用"""
+    os.environ["USB2XXX_BACKEND"] = "sim"
+    os.environ["USB2XXX_SIM_LATENCY_MS"] = str(latency_ms)
+    os.environ["USB2XXX_SIM_BITRATE"] = str(bitrate)
+    os.environ["USB2XXX_SIM_DATA_BITRATE"] = str(data_bitrate)
+    os.environ["USB2XXX_SIM_USB_LATENCY_MS"] = str(usb_latency_ms)
+
+
+def parse_size(text):
+    """'64K' / '4M' / '1000' 转换为字节数"""
+    text = text.strip().upper()
+    units = {"K": 1024, "M": 1024 * 1024}
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    if size % (1024 * 1024) == 0:
+        return f"{size // (1024 * 1024)}M"
+    if size % 1024 == 0:
+        return f"{size // 1024}K"
+    return str(size)
+
+
+class Profiler:
+    """
+    在 with 块内替换 time.sleep、订阅等待函数和函数库对象的方法，只统计进入 with 块的线程的调用，
+    退出时全部恢复。调度线程等后台线程的轮询和等待不计入。
+    :param lib: 函数库对象（usb_device.USB2XXXLib），其公开方法计入 lib
+    :param modules: 以 from time import sleep 方式引用了 sleep 的模块
+    :param ecus: 虚拟ECU列表，其 deliver 计入 ecu
+    """
+
+    def __init__(self, lib=None, modules=(), ecus=()):
+        self.lib = lib
+        self.modules = modules
+        self.ecus = ecus
+        self.times = {"sleep": 0.0, "wait": 0.0, "lib": 0.0, "ecu": 0.0, "ecu_in_lib": 0.0}
+        self.calls = {"sleep": 0, "wait": 0, "lib": 0, "ecu": 0}
+        self.wall = 0.0
+        self._patches = []
+        self._thread = None
+        self._in_lib = False
+        self._start = 0.0
+
+    def _timed(self, key, func):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() != profiler._thread:
+                return func(*args, **kwargs)
+            if key == "sleep" and profiler._in_lib:
+                return func(*args, **kwargs)
+            outer = key == "lib" and not profiler._in_lib
+            if outer:
+                profiler._in_lib = True
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if outer:
+                    profiler._in_lib = False
+                if key != "lib" or outer:
+                    profiler.times[key] += elapsed
+                    profiler.calls[key] += 1
+                if key == "ecu" and profiler._in_lib:
+                    profiler.times["ecu_in_lib"] += elapsed
+        return wrapper
+
+    def _patch(self, obj, name, key, restore_by_delete=False):
+        original = getattr(obj, name)
+        self._patches.append((obj, name, original, restore_by_delete))
+        setattr(obj, name, self._timed(key, original))
+
+    def __enter__(self):
+        from CANDispatcher import Subscription
+        self._thread = threading.get_ident()
+        sleep = time.sleep
+        self._patch(time, "sleep", "sleep")
+        for module in self.modules:
+            if getattr(module, "sleep", None) is sleep:
+                self._patch(module, "sleep", "sleep")
+        self._patch(Subscription, "get", "wait")
+        self._patch(Subscription, "get_batch", "wait")
+        if self.lib is not None:
+            for name in dir(type(self.lib)):
+                if name[:1].isupper() and callable(getattr(self.lib, name)):
+                    self._patch(self.lib, name, "lib", restore_by_delete=True)
+        for ecu in self.ecus:
+            self._patch(ecu, "deliver", "ecu", restore_by_delete=True)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall = time.perf_counter() - self._start
+        for obj, name, original, restore_by_delete in reversed(self._patches):
+            if restore_by_delete:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._patches = []
+
+    def result(self):
+        """各类别耗时（秒）和调用次数"""
+        lib = self.times["lib"] - self.times["ecu_in_lib"]
+        accounted = self.times["sleep"] + self.times["wait"] + lib + self.times["ecu"]
+        return {
+            "wall_s": self.wall,
+            "sleep_s": self.times["sleep"],
+            "wait_s": self.times["wait"],
+            "lib_s": lib,
+            "ecu_s": self.times["ecu"],
+            "python_s": max(0.0, self.wall - accounted),
+            "sleep_calls": self.calls["sleep"],
+            "wait_calls": self.calls["wait"],
+            "lib_calls": self.calls["lib"],
+        }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def load_baseline(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, settings):
+    data = {
+        "environment": environment(),
+        "settings": settings,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def compare_baseline(results, baseline, metric, tolerance=0.2, higher_is_better=True):
+    """
+    与基线比较
+    :param results: {用例名: {metric: 值, ...}}
+    :param higher_is_better: True-metric 越大越好（吞吐量），False-越小越好（耗时）
+    :return: 回归列表 [(用例名, 基线值, 当前值)]，比基线差超过 tolerance 比例即为回归
+    """
+    regressions = []
+    if not baseline:
+        return regressions
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference or metric not in reference or metric not in result:
+            continue
+        if higher_is_better:
+            regressed = result[metric] < reference[metric] * (1 - tolerance)
+        else:
+            regressed = result[metric] > reference[metric] * (1 + tolerance)
+        if regressed:
+            regressions.append((name, reference[metric], result[metric]))
+    return regressions
@@ -0,0 +1,111 @@
+"""
+文件说明：压缩下载基准测试
+在模拟后端上按真实总线速率（默认 500k）用 UDS_OTA.transfer_data 下载同一个固件镜像，比较原始数据下载和
+压缩下载（zlib / LZMA，dataFormatIdentifier 高4位为压缩方法），虚拟ECU在 0x37 时解压后与原始镜像比较。
+固件为按固定种子生成的类代码数据（指令字 + 常量表 + 未使用区域 0xFF），伪随机数据无法压缩，不适合本测试。
+每种压缩方法连续下载两次：第一次包含压缩耗时（cold），第二次压缩结果取自缓存（cached）。
+输出压缩率、压缩耗时、下载耗时、相对原始下载实际节省的时间和 DownloadStats 给出的节省估计。
+结果与 baseline_compression.json 比较，字节/秒（按原始长度计）低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --sizes 256K --methods zlib --bitrate 1000000
+    python benchmarks/bench_compression.py --update-baseline
+"""
+import argparse
+import random
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_compression.json"
+
+
+def firmware_like(size, blank_ratio=0.2):
+    """类代码固件：少量指令字按随机组合重复、穿插常量表，末尾 blank_ratio 比例为 0xFF"""
+    rng = random.Random(size)
+    opcodes = [rng.randbytes(4) for _ in range(64)]
+    code_size = int(size * (1 - blank_ratio))
+    out = bytearray()
+    while len(out) < code_size:
+        if rng.random() < 0.05:
+            out += rng.randbytes(rng.randrange(16, 128))  # 常量表
+        else:
+            out += b"".join(rng.choice(opcodes) for _ in range(rng.randrange(4, 32)))
+    del out[code_size:]
+    out += b"\xFF" * (size - code_size)
+    return bytes(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压缩下载基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="128K", help="固件大小列表")
+    parser.add_argument("--methods", default="zlib,lzma", help="压缩方法：zlib,lzma")
+    parser.add_argument("--bitrate", type=int, default=500000, help="虚拟总线波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate)
+    import UDS_service
+    import FirmwareCompression
+    from bench_ota import PATHS, run_case
+    from UDS_OTA import UDS_OTA
+
+    method_ids = {"none": FirmwareCompression.COMPRESSION_NONE, "zlib": FirmwareCompression.COMPRESSION_ZLIB,
+                  "lzma": FirmwareCompression.COMPRESSION_LZMA}
+    results = {}
+    print(f"{'case':<20}{'verified':>9}{'sent':>9}{'ratio':>8}{'compress':>10}{'wall s':>8}{'KB/s':>9}"
+          f"{'saved s':>9}{'est s':>8}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        data = firmware_like(size)
+        FirmwareCompression.clear_cache()
+        raw = None
+        for method in ["none"] + [m.strip() for m in args.methods.split(",")]:
+            compression = method_ids[method]
+            PATHS["compressed"] = lambda dev, ch, image: UDS_OTA(dev, ch, compression=compression).transfer_data(image)
+            for run in (("raw",) if method == "none" else ("cold", "cached")):
+                r = run_case("compressed", size, data=data)
+                stats = UDS_service.get_last_download_stats()
+                if raw is None:
+                    raw = r
+                image = stats.compression
+                r.update({
+                    "sent_bytes": stats.transferred,
+                    "ratio": stats.ratio,
+                    "compress_s": 0.0 if image is None or image.cached else image.compress_time,
+                    "saved_s": raw["wall_s"] - r["wall_s"],
+                    "estimated_saved_s": stats.time_saved,
+                })
+                case = f"{method}/{run}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<20}{'Y' if r['verified'] else 'N':>9}{r['sent_bytes']:>9}{r['ratio']:>8.1%}"
+                      f"{r['compress_s'] * 1000:>8.1f}ms{r['wall_s']:>8.2f}{r['bytes_per_s'] / 1024:>9.1f}"
+                      f"{r['saved_s']:>9.2f}{r['estimated_saved_s']:>8.2f}")
+            del PATHS["compressed"]
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    failed = False
+    for case, r in results.items():
+        if not r["verified"]:
+            print(f"{case}: 虚拟ECU解压后的数据与原始镜像不一致")
+            failed = True
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.1f} KB/s -> {current / 1024:.1f} KB/s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+文件说明：USB2XXX库函数单次调用开销基准测试
+使用真实库文件（不需要连接适配器，设备句柄无效时库函数立即返回错误码），比较 CAN_SendMsg、CAN_GetMsg、
+CAN_GetMsgWithSize 几种调用方式每次调用的耗时（纳秒）：
+    before ：修改前的调用路径，封装函数每次从未声明原型的 CDLL 对象上按属性名取函数，参数为 Python int
+    bound  ：现在的调用路径，经 usb2can 封装函数调用加载时绑定的函数指针（每帧调用的函数只声明 restype）
+    direct ：直接调用加载时绑定的函数指针，不经封装函数
+    typed  ：封装函数调用同时声明 restype 和 argtypes 的函数指针，与 bound 的差即 argtypes 参数转换的开销，
+             用于说明每帧调用的函数为什么不声明 argtypes
+saved 为 bound 相对 before 节省的比例（在测量误差范围内为0，绑定只省去一次字典查找）。
+结果与 baseline_ctypes.json 比较，bound 耗时超过基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_ctypes.py
+    python benchmarks/bench_ctypes.py --calls 500000 --repeat 7
+    python benchmarks/bench_ctypes.py --update-baseline
+"""
+import argparse
+import os
+import sys
+import timeit
+from ctypes import CDLL, byref, c_int, c_ubyte, c_uint, c_void_p
+
+from bench_common import BENCH_DIR, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_ctypes.json"
+
+# 任意无效的设备句柄，库函数找不到设备时直接返回错误码；最高位为1，与实际设备句柄的取值范围相同
+INVALID_HANDLE = 0x90000001
+
+
+def build_cases():
+    """返回 {用例名: {调用方式: 无参函数}}"""
+    os.environ.pop("USB2XXX_BACKEND", None)
+    import usb_device
+    from usb2can import CAN_MSG, CAN_SendMsg, CAN_GetMsg, CAN_GetMsgWithSize
+    handles = (c_uint * 20)()
+    # 先扫描一次设备，库内部的设备列表初始化后，无效句柄才会返回错误码
+    usb_device.USB_ScanDevice(byref(handles))
+    lib = usb_device.USB2XXXLib
+    untyped = CDLL(usb_device.resolve_lib_paths()[1])
+    typed = CDLL(usb_device.resolve_lib_paths()[1])
+    for name, argtypes in (("CAN_SendMsg", [c_uint, c_ubyte, c_void_p, c_uint]),
+                           ("CAN_GetMsg", [c_uint, c_ubyte, c_void_p]),
+                           ("CAN_GetMsgWithSize", [c_uint, c_ubyte, c_void_p, c_int])):
+        getattr(typed, name).restype = c_int
+        getattr(typed, name).argtypes = argtypes
+
+    # 修改前 usb2can 中的封装函数：每次调用从 CDLL 对象上按属性名取函数
+    def before_send(DevHandle, CANIndex, pCanSendMsg, SendMsgNum):
+        return untyped.CAN_SendMsg(DevHandle, CANIndex, pCanSendMsg, SendMsgNum)
+
+    def before_get(DevHandle, CANIndex, pCanGetMsg):
+        return untyped.CAN_GetMsg(DevHandle, CANIndex, pCanGetMsg)
+
+    def before_get_size(DevHandle, CANIndex, pCanGetMsg, BufferSize):
+        return untyped.CAN_GetMsgWithSize(DevHandle, CANIndex, pCanGetMsg, BufferSize)
+
+    def typed_send(DevHandle, CANIndex, pCanSendMsg, SendMsgNum):
+        return typed.CAN_SendMsg(DevHandle, CANIndex, pCanSendMsg, SendMsgNum)
+
+    def typed_get(DevHandle, CANIndex, pCanGetMsg):
+        return typed.CAN_GetMsg(DevHandle, CANIndex, pCanGetMsg)
+
+    def typed_get_size(DevHandle, CANIndex, pCanGetMsg, BufferSize):
+        return typed.CAN_GetMsgWithSize(DevHandle, CANIndex, pCanGetMsg, BufferSize)
+
+    handle = INVALID_HANDLE
+    msgs = (CAN_MSG * 1024)()
+    ref = byref(msgs)
+    bound_send, bound_get, bound_get_size = lib.CAN_SendMsg, lib.CAN_GetMsg, lib.CAN_GetMsgWithSize
+    return {
+        "CAN_SendMsg": {
+            "before": lambda: before_send(handle, 0, ref, 1),
+            "bound": lambda: CAN_SendMsg(handle, 0, ref, 1),
+            "direct": lambda: bound_send(handle, 0, ref, 1),
+            "typed": lambda: typed_send(handle, 0, ref, 1),
+        },
+        "CAN_GetMsg": {
+            "before": lambda: before_get(handle, 0, ref),
+            "bound": lambda: CAN_GetMsg(handle, 0, ref),
+            "direct": lambda: bound_get(handle, 0, ref),
+            "typed": lambda: typed_get(handle, 0, ref),
+        },
+        "CAN_GetMsgWithSize": {
+            "before": lambda: before_get_size(handle, 0, ref, 1024),
+            "bound": lambda: CAN_GetMsgWithSize(handle, 0, ref, 1024),
+            "direct": lambda: bound_get_size(handle, 0, ref, 1024),
+            "typed": lambda: typed_get_size(handle, 0, ref, 1024),
+        },
+    }
+
+
+def measure(func, calls, repeat):
+    """最快一轮的单次调用耗时（纳秒）"""
+    return min(timeit.repeat(func, number=calls, repeat=repeat)) / calls * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="USB2XXX库函数单次调用开销基准测试")
+    parser.add_argument("--calls", type=int, default=200000, help="每轮调用次数")
+    parser.add_argument("--repeat", type=int, default=7, help="轮数，取最快一轮")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    modes = ("before", "bound", "direct", "typed")
+    results = {}
+    print(f"{'function':<22}" + "".join(f"{m + ' ns':>12}" for m in modes) + f"{'saved':>9}")
+    for name, funcs in build_cases().items():
+        result = {m + "_ns": measure(funcs[m], args.calls, args.repeat) for m in modes}
+        result["saved_ratio"] = 1 - result["bound_ns"] / result["before_ns"]
+        results[name] = result
+        print(f"{name:<22}" + "".join(f"{result[m + '_ns']:>12.0f}" for m in modes)
+              + f"{result['saved_ratio']:>9.0%}")
+
+    settings = {"calls": args.calls, "repeat": args.repeat}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    regressions = compare_baseline(results, baseline, "bound_ns", args.tolerance, higher_is_better=False)
+    for name, reference, current in regressions:
+        print(f"调用开销回归 {name}: {reference:.0f} ns -> {current:.0f} ns")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+文件说明：差分刷写基准测试
+在模拟后端上按真实总线速率（默认 500k）用 UDS_OTA.transfer_data 刷写新版本固件，比较：
+    full  ：完整下载新版本（0x34/0x36/0x37 传输整个镜像）
+    cold  ：差分刷写，但没有保存的基准镜像（首次刷写），按完整刷写处理，刷写的是旧版本
+    delta ：差分刷写，基准为旧版本，只擦除和下载有变化的扇区
+新版本在旧版本上修改 --changes 处、每处 --change-bytes 字节，分散在镜像各处（类似改了几个函数和常量）。
+verified 表示虚拟ECU按擦除和下载顺序读出的flash内容与刷写的镜像一致。
+输出变化扇区数、0x36 传输的字节数、耗时、相对 full 实际节省的时间和 DeltaStats 给出的节省估计。
+结果与 baseline_delta.json 比较，耗时超过基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_delta.py
+    python benchmarks/bench_delta.py --sizes 256K --changes 8 --sector-size 0x1000
+    python benchmarks/bench_delta.py --update-baseline
+"""
+import argparse
+import random
+import sys
+import tempfile
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+from bench_compression import firmware_like
+
+BASELINE_FILE = BENCH_DIR / "baseline_delta.json"
+APP_ADDRESS = 0x08000000
+
+
+def patched(data, changes, change_bytes):
+    """在 data 的 changes 处均匀分布的位置各改写 change_bytes 字节"""
+    rng = random.Random(len(data) + changes)
+    out = bytearray(data)
+    for i in range(changes):
+        offset = min(len(out) * (2 * i + 1) // (2 * changes), len(out) - change_bytes)
+        out[offset:offset + change_bytes] = rng.randbytes(change_bytes)
+    return bytes(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="差分刷写基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="128K", help="固件大小列表")
+    parser.add_argument("--changes", type=int, default=3, help="新版本相对旧版本的修改处数")
+    parser.add_argument("--change-bytes", type=int, default=64, help="每处修改的字节数")
+    parser.add_argument("--sector-size", type=lambda s: int(s, 0), default=0x800, help="扇区大小")
+    parser.add_argument("--bitrate", type=int, default=500000, help="虚拟总线波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate)
+    import usb_device
+    import UDS_service
+    from FirmwareDelta import FirmwareStore
+    from bench_ota import PATHS, run_case
+    from UDS_OTA import UDS_OTA
+
+    ecu = usb_device.USB2XXXLib.ecus[0]
+    results = {}
+    print(f"{'case':<14}{'verified':>9}{'sectors':>10}{'sent':>9}{'wall s':>8}{'saved s':>9}{'est s':>8}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        old = firmware_like(size)
+        new = patched(old, args.changes, args.change_bytes)
+        with tempfile.TemporaryDirectory() as directory:
+            store = FirmwareStore(directory)
+            full = None
+            for case_name, image, delta in (("full", new, False), ("cold", old, True), ("delta", new, True)):
+                PATHS["delta"] = lambda dev, ch, data: UDS_OTA(dev, ch, delta=delta, store=store,
+                                                               sector_size=args.sector_size).transfer_data(data)
+                r = run_case("delta", size, data=image)
+                del PATHS["delta"]
+                r["verified"] = ecu.read_memory(APP_ADDRESS, size) == image
+                if delta:
+                    stats = UDS_service.get_last_delta_stats()
+                    r.update({
+                        "sectors": f"{stats.plan.sectors_changed}/{stats.plan.sectors_total}",
+                        "sent_bytes": stats.sent,
+                        "estimated_saved_s": stats.time_saved,
+                    })
+                else:
+                    r.update({"sectors": "-", "sent_bytes": UDS_service.get_last_download_stats().transferred,
+                              "estimated_saved_s": 0.0})
+                    full = r
+                r["saved_s"] = full["wall_s"] - r["wall_s"]
+                case = f"{case_name}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<14}{'Y' if r['verified'] else 'N':>9}{r['sectors']:>10}{r['sent_bytes']:>9}"
+                      f"{r['wall_s']:>8.2f}{r['saved_s']:>9.2f}{r['estimated_saved_s']:>8.2f}")
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate, "changes": args.changes,
+                "change_bytes": args.change_bytes, "sector_size": args.sector_size}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    failed = False
+    for case, r in results.items():
+        if not r["ok"] or not r["verified"]:
+            print(f"{case}: 刷写失败或虚拟ECU的flash内容与镜像不一致")
+            failed = True
+    regressions = compare_baseline(results, baseline, "wall_s", args.tolerance, higher_is_better=False)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference:.2f}s -> {current:.2f}s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+文件说明：完整性校验值计算基准测试
+    throughput：各算法（FirmwareDigest：crc32 / crc16 / sha256）按 0x36 块大小逐块累计（stream）和一次计算整个镜像
+                （oneshot）的速度（MB/s），以及逐字节查表的纯 Python CRC-16 实现（python_table，只测 --python-size 字节）作对照
+    download  ：在模拟后端上用 UDS_service.download 下载时同时累计校验值，与不累计时的下载耗时比较；
+                post ms 为下载完成后再读一遍镜像计算校验值所需的时间，即逐块累计省掉的时间
+verified 表示逐块累计的结果与一次计算整个镜像的结果一致。
+结果与 baseline_digest.json 比较，stream 的速度低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_digest.py
+    python benchmarks/bench_digest.py --sizes 16M --block-size 4094
+    python benchmarks/bench_digest.py --update-baseline
+"""
+import argparse
+import random
+import sys
+import time
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_digest.json"
+
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def python_crc16(data, crc=0xFFFF):
+    """逐字节查表的纯 Python CRC-16/CCITT-FALSE（对照用）"""
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return value, best
+
+
+def run_download(data, algorithm, block_size):
+    import UDS_service
+    from FirmwareDigest import ImageDigest
+    from bench_ota import PATHS, run_case
+
+    digest = ImageDigest(algorithm) if algorithm else None
+    PATHS["download"] = lambda device_handle, channel, data: UDS_service.download(
+        device_handle, channel, 0x08000000, data, block_size, digest=digest)
+    try:
+        result = run_case("download", len(data), data=data)
+    finally:
+        del PATHS["download"]
+    return result, digest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="完整性校验值计算基准测试")
+    parser.add_argument("--sizes", default="4M,16M", help="镜像大小列表（throughput）")
+    parser.add_argument("--download-size", default="1M", help="download 的镜像大小")
+    parser.add_argument("--python-size", default="256K", help="纯 Python 对照实现计算的字节数")
+    parser.add_argument("--block-size", type=int, default=0x400, help="每个 0x36 请求的数据字节数")
+    parser.add_argument("--repeat", type=int, default=3, help="计时轮数，取最快一轮")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend()
+    from FirmwareDigest import ImageDigest, digest_algorithms, image_digest
+
+    results = {}
+    failed = False
+    print(f"{'case':<22}{'verified':>9}{'s':>9}{'MB/s':>9}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        data = memoryview(random.Random(size).randbytes(size))
+        for algorithm in digest_algorithms():
+            expected, oneshot = measure(lambda: image_digest(data, algorithm), args.repeat)
+
+            def stream():
+                digest = ImageDigest(algorithm)
+                for offset in range(0, size, args.block_size):
+                    digest.update(data[offset:offset + args.block_size])
+                return digest.digest()
+
+            value, streamed = measure(stream, args.repeat)
+            verified = value == expected
+            failed |= not verified
+            for mode, elapsed in (("stream", streamed), ("oneshot", oneshot)):
+                case = f"{algorithm}/{mode}/{format_size(size)}"
+                results[case] = {"verified": verified, "elapsed_s": elapsed, "mb_per_s": size / elapsed / 1e6}
+                print(f"{case:<22}{'Y' if verified else 'N':>9}{elapsed:>9.4f}{size / elapsed / 1e6:>9.1f}")
+    python_size = parse_size(args.python_size)
+    data = random.Random(python_size).randbytes(python_size)
+    value, elapsed = measure(lambda: python_crc16(data), 1)
+    verified = value.to_bytes(2, "big") == image_digest(data, "crc16")
+    case = f"crc16/python_table/{format_size(python_size)}"
+    results[case] = {"verified": verified, "elapsed_s": elapsed, "mb_per_s": python_size / elapsed / 1e6}
+    print(f"{case:<22}{'Y' if verified else 'N':>9}{elapsed:>9.4f}{python_size / elapsed / 1e6:>9.1f}")
+
+    size = parse_size(args.download_size)
+    data = random.Random(size).randbytes(size)
+    print(f"\n{'case':<22}{'verified':>9}{'wall s':>9}{'post ms':>9}")
+    for algorithm in (None,) + digest_algorithms():
+        r, digest = run_download(data, algorithm, args.block_size)
+        post = 0.0
+        verified = r["ok"] and r["verified"]
+        if digest is not None:
+            expected, post = measure(lambda: image_digest(data, algorithm), args.repeat)
+            verified = verified and digest.digest() == expected
+        failed |= not verified
+        case = f"download/{algorithm or 'none'}/{format_size(size)}"
+        results[case] = {"verified": verified, "wall_s": r["wall_s"], "post_ms": post * 1000}
+        print(f"{case:<22}{'Y' if verified else 'N':>9}{r['wall_s']:>9.2f}{post * 1000:>9.2f}")
+
+    settings = {"block_size": args.block_size}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    if failed:
+        print("校验值与一次计算整个镜像的结果不一致或下载失败")
+    streamed = {case: r for case, r in results.items() if "/stream/" in case}
+    regressions = compare_baseline(streamed, baseline, "mb_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference:.1f} MB/s -> {current:.1f} MB/s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
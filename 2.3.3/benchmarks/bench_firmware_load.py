@@ -0,0 +1,152 @@
+"""
+文件说明：固件加载与编码的内存和耗时基准测试
+比较 .bin 固件从打开文件、按块切分到编码 ISO-TP 帧的两种做法，每种做法在单独的子进程中运行以测量峰值RSS：
+    legacy ：修改前的做法，list(f.read()) 把每个字节转换为 Python int，再转回 bytes，
+             每个块切片复制后逐帧组包编码连续帧
+    mapped ：FirmwareImage.map_file 把文件映射为只读 memoryview，块为 memoryview 切片，
+             连续帧由 IsoTpFrameFormat.encode 按列批量写入报文数组
+输出加载耗时、全部块的编码耗时和峰值RSS增量（子进程加载前后 ru_maxrss 之差，包含映射文件被读到的页）。
+结果与 baseline_firmware_load.json 比较，mapped 的总耗时或峰值RSS超过基线容差时返回非0退出码。
+不支持 resource 模块的平台（Windows）改为统计 tracemalloc 的 Python 分配峰值。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_firmware_load.py
+    python benchmarks/bench_firmware_load.py --sizes 16M --block-size 4094
+    python benchmarks/bench_firmware_load.py --update-baseline
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_firmware_load.json"
+MODES = ("legacy", "mapped")
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory():
+    """进程的峰值RSS（字节），不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def legacy_encode(frame_format, tx_id, payload):
+    """修改前 IsoTpFrameFormat.encode 的连续帧编码方式：逐帧切片、拼接、组包后再整体复制到报文数组"""
+    length = len(payload)
+    header = bytes([0x10 | (length >> 8), length & 0xFF])
+    offset = frame_format.tx_dl - len(header)
+    chunk = frame_format.tx_dl - 1
+    count = (length - offset + chunk - 1) // chunk
+    first = frame_format.frame(tx_id, header + payload[:offset])
+    parts = []
+    sn = 1
+    for _ in range(count):
+        parts.append(frame_format._pack(tx_id, bytes([0x20 | sn]) + payload[offset:offset + chunk]))
+        offset += chunk
+        sn = (sn + 1) & 0x0F
+    return first, (frame_format.msg_type * count).from_buffer_copy(b"".join(parts))
+
+
+def run_child(mode, path, block_size):
+    """子进程：加载 path 并编码全部块，返回结果字典"""
+    use_sim_backend()  # 只用到帧编码，不需要适配器
+    import UDS_service
+    from FirmwareImage import map_file
+    frame_format = UDS_service.CAN_FRAME_FORMAT
+    tracing = resource is None
+    if tracing:
+        import tracemalloc
+        tracemalloc.start()
+    before = peak_memory()
+    start = time.perf_counter()
+    if mode == "legacy":
+        with open(path, "rb") as f:
+            data = bytes(list(f.read()))
+    else:
+        data = map_file(path)
+    loaded = time.perf_counter()
+    frames = 0
+    for i, offset in enumerate(range(0, len(data), block_size)):
+        payload = bytes([0x36, (i + 1) & 0xFF]) + data[offset:offset + block_size]
+        if mode == "legacy":
+            _, consecutive = legacy_encode(frame_format, 0x713, payload)
+        else:
+            consecutive = frame_format.encode(0x713, payload).consecutive
+        frames += 1 + len(consecutive)
+    end = time.perf_counter()
+    if tracing:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peak = peak_memory() - before
+    return {"load_s": loaded - start, "encode_s": end - loaded, "total_s": end - start, "frames": frames,
+            "peak_bytes": peak, "peak_source": "tracemalloc" if tracing else "ru_maxrss"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="固件加载与编码的内存和耗时基准测试")
+    parser.add_argument("--sizes", default="1M,4M", help="固件大小列表")
+    parser.add_argument("--block-size", type=int, default=0x400, help="每个 0x36 请求的数据字节数")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许超过基线的比例")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], args.block_size)))
+        return 0
+
+    results = {}
+    print(f"{'case':<14}{'load s':>9}{'encode s':>10}{'total s':>9}{'peak MB':>9}{'peak/size':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [parse_size(s) for s in args.sizes.split(",")]:
+            path = os.path.join(directory, "firmware.bin")
+            with open(path, "wb") as f:
+                f.write(random.Random(size).randbytes(size))
+            for mode in MODES:
+                output = subprocess.run([sys.executable, __file__, "--child", mode, path,
+                                         "--block-size", str(args.block_size)],
+                                        check=True, capture_output=True, text=True).stdout
+                r = json.loads(output.strip().splitlines()[-1])
+                r["peak_ratio"] = r["peak_bytes"] / size
+                case = f"{mode}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<14}{r['load_s']:>9.3f}{r['encode_s']:>10.3f}{r['total_s']:>9.3f}"
+                      f"{r['peak_bytes'] / 1e6:>9.1f}{r['peak_ratio']:>10.2f}")
+
+    settings = {"block_size": args.block_size}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    mapped = {case: r for case, r in results.items() if case.startswith("mapped/")}
+    regressions = []
+    for metric in ("total_s", "peak_bytes"):
+        for case, reference, current in compare_baseline(mapped, baseline, metric, args.tolerance,
+                                                         higher_is_better=False):
+            regressions.append((case, metric, reference, current))
+    for case, metric, reference, current in regressions:
+        print(f"性能回归 {case} {metric}: {reference:.3f} -> {current:.3f}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
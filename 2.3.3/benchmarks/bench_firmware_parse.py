@@ -0,0 +1,139 @@
+"""
+文件说明：固件文件解析基准测试
+生成 Intel HEX 和 S37（S3 数据记录）测试文件，用 FirmwareImage.load_firmware 解析，输出解析速度（文件MB/s）、
+解析期间 Python 分配的内存峰值（tracemalloc）和峰值与镜像数据大小之比。
+测试镜像为两个段（APP 和末尾的标定数据区，中间留有空隙），解析结果须与原始数据逐段一致且不包含空隙。
+修改前的做法是把 HEX 文件的ASCII文本直接当作二进制下载，传输量约为数据的 2.2 倍。
+结果与 baseline_firmware_parse.json 比较，解析速度低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_firmware_parse.py
+    python benchmarks/bench_firmware_parse.py --sizes 8M --record-bytes 16
+    python benchmarks/bench_firmware_parse.py --update-baseline
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_common import BENCH_DIR, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_firmware_parse.json"
+APP_ADDRESS = 0x08000000
+CALIBRATION_GAP = 0x10000  # APP 段末尾到标定数据段的空隙
+
+
+def test_segments(size):
+    """[(地址, 数据)]：7/8 为APP段，1/8 为空隙之后的标定数据段"""
+    rng = random.Random(size)
+    app = rng.randbytes(size - size // 8)
+    calibration = rng.randbytes(size // 8)
+    return [(APP_ADDRESS, app), (APP_ADDRESS + len(app) + CALIBRATION_GAP, calibration)]
+
+
+def write_intel_hex(segments, f, record_bytes):
+    upper = None
+    for address, data in segments:
+        for offset in range(0, len(data), record_bytes):
+            current = address + offset
+            if current >> 16 != upper:
+                upper = current >> 16
+                record = bytes([2, 0, 0, 4]) + upper.to_bytes(2, "big")
+                f.write(b":" + (record + bytes([-sum(record) & 0xFF])).hex().upper().encode() + b"\n")
+            chunk = data[offset:offset + record_bytes]
+            chunk = chunk[:0x10000 - (current & 0xFFFF)]  # 不跨越64K边界
+            record = bytes([len(chunk)]) + (current & 0xFFFF).to_bytes(2, "big") + b"\x00" + chunk
+            f.write(b":" + (record + bytes([-sum(record) & 0xFF])).hex().upper().encode() + b"\n")
+    f.write(b":00000001FF\n")
+
+
+def write_srecord(segments, f, record_bytes):
+    f.write(b"S00600004844521B\n")
+    for address, data in segments:
+        for offset in range(0, len(data), record_bytes):
+            chunk = data[offset:offset + record_bytes]
+            record = bytes([len(chunk) + 5]) + (address + offset).to_bytes(4, "big") + chunk
+            f.write(b"S3" + (record + bytes([~sum(record) & 0xFF])).hex().upper().encode() + b"\n")
+    record = bytes([5]) + APP_ADDRESS.to_bytes(4, "big")
+    f.write(b"S7" + (record + bytes([~sum(record) & 0xFF])).hex().upper().encode() + b"\n")
+
+
+def measure(path, repeat):
+    from FirmwareImage import load_firmware
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = load_firmware(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    del image
+    tracemalloc.start()
+    image = load_firmware(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return image, best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="固件文件解析基准测试")
+    parser.add_argument("--sizes", default="1M,4M", help="镜像数据大小列表")
+    parser.add_argument("--record-bytes", type=int, default=32, help="每条记录的数据字节数")
+    parser.add_argument("--repeat", type=int, default=3, help="计时轮数，取最快一轮")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    print(f"{'case':<12}{'file MB':>9}{'segments':>9}{'verified':>9}{'parse s':>9}{'MB/s':>8}{'peak MB':>9}"
+          f"{'peak/data':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [parse_size(s) for s in args.sizes.split(",")]:
+            segments = test_segments(size)
+            for name, extension, writer in (("hex", ".hex", write_intel_hex), ("s37", ".s37", write_srecord)):
+                path = os.path.join(directory, f"image{extension}")
+                with open(path, "wb") as f:
+                    writer(segments, f, args.record_bytes)
+                file_size = os.path.getsize(path)
+                image, elapsed, peak = measure(path, args.repeat)
+                verified = [(s.address, bytes(s.data)) for s in image] == segments
+                failed |= not verified
+                case = f"{name}/{format_size(size)}"
+                results[case] = {
+                    "file_bytes": file_size,
+                    "segments": len(image.segments),
+                    "verified": verified,
+                    "parse_s": elapsed,
+                    "mb_per_s": file_size / elapsed / 1e6,
+                    "peak_bytes": peak,
+                    "peak_ratio": peak / size,
+                }
+                r = results[case]
+                print(f"{case:<12}{file_size / 1e6:>9.1f}{r['segments']:>9}{'Y' if verified else 'N':>9}"
+                      f"{elapsed:>9.3f}{r['mb_per_s']:>8.1f}{peak / 1e6:>9.1f}{r['peak_ratio']:>10.2f}")
+                del image
+
+    settings = {"record_bytes": args.record_bytes}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    if failed:
+        print("解析结果与原始数据不一致")
+    regressions = compare_baseline(results, baseline, "mb_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference:.1f} MB/s -> {current:.1f} MB/s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
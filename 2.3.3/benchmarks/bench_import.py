@@ -0,0 +1,82 @@
+"""
+文件说明：模块导入耗时基准测试
+每个模块在新的Python进程中用 -X importtime 导入若干次，取该模块累计导入耗时的中位数，
+同时检查导入后USB2XXX库文件是否已被加载（应为否：库文件在第一次调用设备函数时才加载）。
+结果与 baseline_import.json 比较，耗时超过基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --modules usb_device,UDS_service --repeat 10
+    python benchmarks/bench_import.py --update-baseline
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from bench_common import BENCH_DIR, SOURCE_DIR, load_baseline, save_baseline, compare_baseline
+
+DEFAULT_MODULES = "usb_device,usb2can,usb2canfd,UDS_service,CANDispatcher"
+BASELINE_FILE = BENCH_DIR / "baseline_import.json"
+
+_PROBE = "import {module}, usb_device; print('LOADED', usb_device.is_library_loaded())"
+
+
+def measure(module):
+    """在新进程中导入模块，返回 (累计导入耗时微秒, 库文件是否已加载)"""
+    env = dict(os.environ)
+    env.pop("USB2XXX_BACKEND", None)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+                          cwd=SOURCE_DIR, env=env, capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative = int(parts[1])
+    loaded = "LOADED True" in proc.stdout
+    return cumulative, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模块导入耗时基准测试")
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="模块列表")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块导入次数")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'module':<20}{'median ms':>10}{'min ms':>10}{'lib loaded':>12}")
+    for module in [m.strip() for m in args.modules.split(",")]:
+        samples = []
+        loaded = False
+        for _ in range(args.repeat):
+            cumulative, was_loaded = measure(module)
+            samples.append(cumulative / 1000.0)
+            loaded = loaded or was_loaded
+        results[module] = {"import_ms": statistics.median(samples), "min_ms": min(samples), "lib_loaded": loaded}
+        print(f"{module:<20}{results[module]['import_ms']:>10.2f}{results[module]['min_ms']:>10.2f}{str(loaded):>12}")
+
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, {"repeat": args.repeat})
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    failed = False
+    for module, result in results.items():
+        if result["lib_loaded"]:
+            print(f"{module}: 导入时加载了USB2XXX库文件")
+            failed = True
+    for module, reference, current in compare_baseline(results, baseline, "import_ms", args.tolerance,
+                                                        higher_is_better=False):
+        print(f"导入耗时回归 {module}: {reference:.2f} ms -> {current:.2f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+文件说明：OTA刷写吞吐量基准测试
+在模拟后端（usb_sim，虚拟适配器 + 虚拟ECU）上运行三条刷写路径的数据下载阶段（0x34/0x36/0x37），
+固件大小 64K ~ 4M，输出 字节/秒、帧/秒、CAN_SendMsg 调用次数（USB传输次数），
+以及固定等待、应答等待、库函数调用、Python编码各自的耗时。
+    uds_ota     ：UDS_OTA.transfer_data（UDS_service，主机端ISO-TP）
+    uds_ota_adapter：同 uds_ota，连接的ISO-TP改为适配器固件实现（CAN_UDS_Request/CAN_UDS_Response）
+    uds_ota_canfd：同 uds_ota，通道按CANFD初始化，主机端ISO-TP over CANFD（64字节帧，BRS）
+    uds_ota_adapter_fd：同 uds_ota_adapter，适配器按CANFD+BRS、每帧64字节分帧
+    controller  ：UDSController.firmware_update（UDS_service.download）
+    ota_handler ：UDS_OTA_Handler.perform_ota_update 的第10~12步（python-can + isotp）
+    ota_handler_fd：同 ota_handler，isotp 按CANFD发送（UDS_OTA_Handler(..., fd=True)）
+各路径的块大小按虚拟ECU在 0x74 应答中给出的最大块长度（--max-block-length，默认 0x402 即1KB数据）。
+verified 表示虚拟ECU收到的数据与固件一致。--block-size/--stmin 设置虚拟ECU流控帧中的 BS 和 STmin，
+用于观察发送端按流控帧限速后的帧速率。
+结果与 baseline_ota.json 比较，字节/秒低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_ota.py                         # 全部路径，64K/256K/1M/4M
+    python benchmarks/bench_ota.py --sizes 64K --paths uds_ota
+    python benchmarks/bench_ota.py --sizes 64K --block-size 8 --stmin 1
+    python benchmarks/bench_ota.py --sizes 1M --max-block-length 0x1002
+    python benchmarks/bench_ota.py --update-baseline       # 用本次结果更新基线
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+
+from bench_common import (BENCH_DIR, use_sim_backend, parse_size, format_size, Profiler,
+                          load_baseline, save_baseline, compare_baseline)
+
+DEFAULT_SIZES = "64K,256K,1M,4M"
+BASELINE_FILE = BENCH_DIR / "baseline_ota.json"
+
+
+def firmware(size):
+    """固定种子的伪随机固件数据"""
+    return random.Random(size).randbytes(size)
+
+
+def open_sim_device(channel):
+    from ctypes import byref, c_uint
+    from usb_device import USB_ScanDevice, USB_OpenDevice
+    from usb2can import CAN_INIT_CONFIG, CAN_Init
+    handles = (c_uint * 20)()
+    USB_ScanDevice(byref(handles))
+    USB_OpenDevice(handles[0])
+    CAN_Init(handles[0], channel, byref(CAN_INIT_CONFIG()))
+    return handles[0]
+
+
+def run_uds_ota(device_handle, channel, data):
+    from UDS_OTA import UDS_OTA
+    return UDS_OTA(device_handle, channel).transfer_data(data)
+
+
+def run_uds_ota_adapter(device_handle, channel, data, **options):
+    import UDS_service
+    UDS_service.set_transport(device_handle, channel, "adapter", **options)
+    try:
+        return run_uds_ota(device_handle, channel, data)
+    finally:
+        UDS_service.set_transport(device_handle, channel, "python")
+
+
+@contextlib.contextmanager
+def canfd_channel(device_handle, channel):
+    """把通道重新初始化为CANFD；通道的调度器只能按一种报文类型接收，前后都停止调度器，由用到时按需重建"""
+    from ctypes import byref
+    from usb2canfd import CANFD_INIT_CONFIG, CANFD_Init
+    from CANDispatcher import stop_dispatcher
+    stop_dispatcher(device_handle, channel)
+    CANFD_Init(device_handle, channel, byref(CANFD_INIT_CONFIG()))
+    try:
+        yield
+    finally:
+        stop_dispatcher(device_handle, channel)
+
+
+def run_uds_ota_canfd(device_handle, channel, data):
+    import UDS_service
+    with canfd_channel(device_handle, channel):
+        UDS_service.set_transport(device_handle, channel, "canfd")
+        try:
+            return run_uds_ota(device_handle, channel, data)
+        finally:
+            UDS_service.set_transport(device_handle, channel, "python")
+
+
+def run_uds_ota_adapter_fd(device_handle, channel, data):
+    with canfd_channel(device_handle, channel):
+        return run_uds_ota_adapter(device_handle, channel, data, flag=0x06, max_dlc=64)
+
+
+def run_controller(device_handle, channel, data):
+    from UDSController import UDSController
+    from UDSConsole import UDSConsole
+    controller = UDSController(UDSConsole())
+    controller.connect_device()
+    controller.can_controller.CANChannel = channel
+    return controller.firmware_update(data)
+
+
+def run_ota_handler(device_handle, channel, data, fd=False):
+    import isotp
+    import UDS_service
+    from usb_sim import SimCanBus
+    from UDS_OTA_Handler import UDS_OTA_Handler
+    bus = SimCanBus(channel)
+    try:
+        handler = UDS_OTA_Handler(device_handle, channel, bus=bus, fd=fd)
+        stack = isotp.CanStack(bus=bus, address=isotp.Address(txid=0x713, rxid=0x71B), params=handler.isotp_params)
+        # 与 perform_ota_update 第10~12步相同的请求和分块
+        if handler.request_download(stack, 0x44, len(data), 0x08000000) != 0:
+            return False
+        block_size = UDS_service.transfer_block_size(handler.max_block_length, handler.block_size)
+        for i in range(0, len(data), block_size):
+            if handler.transfer_data(stack, i // block_size + 1, data[i:i + block_size]) != 0:
+                return False
+            handler.testWaitForTimeout(0.1)
+        return handler.exit_transfer(stack) == 0
+    finally:
+        bus.shutdown()
+
+
+def run_ota_handler_fd(device_handle, channel, data):
+    return run_ota_handler(device_handle, channel, data, fd=True)
+
+
+PATHS = {
+    "uds_ota": run_uds_ota,
+    "uds_ota_adapter": run_uds_ota_adapter,
+    "uds_ota_canfd": run_uds_ota_canfd,
+    "uds_ota_adapter_fd": run_uds_ota_adapter_fd,
+    "controller": run_controller,
+    "ota_handler": run_ota_handler,
+    "ota_handler_fd": run_ota_handler_fd,
+}
+
+
+def run_case(name, size, channel=0, block_size=0, stmin=0, max_block_length=0x402, data=None):
+    """:param data: 固件数据，None 时使用 size 字节的伪随机数据"""
+    import usb_device
+    import UDS_service
+    import UDS_OTA
+    import UDS_OTA_Handler
+    lib = usb_device.USB2XXXLib
+    ecu = lib.ecus[channel]
+    ecu.memory.clear()
+    ecu.block_size = block_size
+    ecu.stmin = stmin
+    ecu.max_block_length = max_block_length
+    device_handle = open_sim_device(channel)
+    data = firmware(size) if data is None else data
+    rx_frames = ecu.stats["rx_frames"]
+    channel_state = lib.devices[device_handle].channels[channel]
+    tx_calls = channel_state.tx_calls
+    stmin_violations = ecu.stats["stmin_violations"]
+    cf_gap_total, cf_gaps = ecu.stats["cf_gap_total"], ecu.stats["cf_gaps"]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with Profiler(lib, (UDS_service, UDS_OTA, UDS_OTA_Handler), [ecu]) as profiler:
+            ok = PATHS[name](device_handle, channel, data)
+    frames = ecu.stats["rx_frames"] - rx_frames
+    result = profiler.result()
+    received = b"".join(ecu.image().values())
+    result.update({
+        "ok": bool(ok),
+        "verified": received == data,
+        "bytes": size,
+        "frames": frames,
+        "usb_tx": channel_state.tx_calls - tx_calls,
+        "stmin_violations": ecu.stats["stmin_violations"] - stmin_violations,
+        "cf_gap_ms": ((ecu.stats["cf_gap_total"] - cf_gap_total) * 1000 / (ecu.stats["cf_gaps"] - cf_gaps)
+                      if ecu.stats["cf_gaps"] > cf_gaps else 0.0),
+        "bytes_per_s": size / result["wall_s"],
+        "frames_per_s": frames / result["wall_s"],
+        "ms_per_kb": result["wall_s"] * 1000 / (size / 1024),
+    })
+    return result
+
+
+def print_table(results):
+    header = (f"{'case':<22}{'ok':>4}{'verified':>9}{'KB/s':>10}{'frames/s':>10}{'usb tx':>9}{'ms/KB':>8}"
+              f"{'wall s':>9}{'sleep':>8}{'wait':>8}{'lib':>8}{'ecu':>8}{'python':>8}")
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<22}{'Y' if r['ok'] else 'N':>4}{'Y' if r['verified'] else 'N':>9}"
+              f"{r['bytes_per_s'] / 1024:>10.1f}{r['frames_per_s']:>10.0f}{r['usb_tx']:>9}{r['ms_per_kb']:>8.2f}"
+              f"{r['wall_s']:>9.2f}{r['sleep_s']:>8.2f}{r['wait_s']:>8.2f}{r['lib_s']:>8.2f}"
+              f"{r['ecu_s']:>8.2f}{r['python_s']:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OTA刷写吞吐量基准测试（模拟后端）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="固件大小列表，如 64K,1M")
+    parser.add_argument("--paths", default=",".join(PATHS), help="刷写路径列表：" + ",".join(PATHS))
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--bitrate", type=int, default=0, help="虚拟总线波特率，0 表示不计传输时间")
+    parser.add_argument("--data-bitrate", type=int, default=0, help="CANFD数据段波特率（BRS），0 表示与 --bitrate 相同")
+    parser.add_argument("--usb-latency-ms", type=float, default=0.0, help="每次USB传输的耗时（毫秒）")
+    parser.add_argument("--block-size", type=int, default=0, help="虚拟ECU流控帧的 BS")
+    parser.add_argument("--stmin", type=lambda x: int(x, 0), default=0, help="虚拟ECU流控帧的 STmin 原始值，如 1 或 0xF5")
+    parser.add_argument("--max-block-length", type=lambda x: int(x, 0), default=0x402,
+                        help="虚拟ECU在 0x74 应答中给出的最大块长度（含服务ID和块序号）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate, args.data_bitrate, usb_latency_ms=args.usb_latency_ms)
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    paths = [p.strip() for p in args.paths.split(",")]
+    results = {}
+    for name in paths:
+        for size in sizes:
+            case = f"{name}/{format_size(size)}"
+            results[case] = run_case(name, size, block_size=args.block_size, stmin=args.stmin,
+                                     max_block_length=args.max_block_length)
+            print(f"{case}: {results[case]['wall_s']:.2f}s", file=sys.stderr)
+    print_table(results)
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate}
+    if args.data_bitrate:
+        settings["data_bitrate"] = args.data_bitrate
+    if args.usb_latency_ms:
+        settings["usb_latency_ms"] = args.usb_latency_ms
+    if args.max_block_length != 0x402:
+        settings["max_block_length"] = args.max_block_length
+    if args.block_size or args.stmin:
+        settings.update({"block_size": args.block_size, "stmin": args.stmin})
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.1f} KB/s -> {current / 1024:.1f} KB/s")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+文件说明：连续帧发送节奏（STmin）基准测试
+虚拟ECU在流控帧中给出 STmin（毫秒），用 UDS_OTA.transfer_data 下载固件，比较三种节奏控制方式：
+    host    ：主机控制帧间隔（sleep + 最后1毫秒忙等），每帧一次 CAN_SendMsg
+    device  ：一个块的连续帧装入适配器调度表（CAN_SetSchedule/CAN_StartSchedule），由适配器控制帧间隔
+    fallback：同 device，但适配器不支持调度表（模拟后端 schedule_supported=False），自动改为主机控制
+输出吞吐量、USB传输次数、虚拟ECU测得的相邻连续帧平均到达间隔及相对 STmin 的超出比例、STmin 违例次数。
+到达间隔含一帧的总线传输时间（500k 下约0.22毫秒），device 方式的超出部分即为这一帧的传输时间。
+结果与 baseline_pacing.json 比较，字节/秒低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_pacing.py
+    python benchmarks/bench_pacing.py --stmins 1,5 --block-size 16 --sizes 64K
+    python benchmarks/bench_pacing.py --update-baseline
+"""
+import argparse
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_pacing.json"
+MODES = ("host", "device", "fallback")
+
+
+def run_mode(mode, size, stmin, block_size):
+    import usb_device
+    import UDS_service
+    from bench_ota import PATHS, run_case, run_uds_ota
+
+    def run_paced(device_handle, channel, data):
+        UDS_service.set_transport(device_handle, channel, "python", device_pacing=mode != "host")
+        try:
+            return run_uds_ota(device_handle, channel, data)
+        finally:
+            UDS_service.set_transport(device_handle, channel, "python")
+
+    lib = usb_device.USB2XXXLib
+    lib.schedule_supported = mode != "fallback"
+    UDS_service._schedule_unsupported.clear()
+    PATHS["uds_ota_paced"] = run_paced
+    try:
+        return run_case("uds_ota_paced", size, block_size=block_size, stmin=stmin)
+    finally:
+        del PATHS["uds_ota_paced"]
+        lib.schedule_supported = True
+        UDS_service._schedule_unsupported.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="连续帧发送节奏（STmin）基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="16K", help="固件大小列表")
+    parser.add_argument("--stmins", default="1,2,5", help="虚拟ECU流控帧的 STmin 列表（毫秒）")
+    parser.add_argument("--block-size", type=int, default=0, help="虚拟ECU流控帧的 BS")
+    parser.add_argument("--modes", default=",".join(MODES), help="节奏控制方式：" + ",".join(MODES))
+    parser.add_argument("--bitrate", type=int, default=500000, help="虚拟总线波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate)
+    modes = [m.strip() for m in args.modes.split(",")]
+    results = {}
+    print(f"{'case':<22}{'verified':>9}{'KB/s':>9}{'usb tx':>9}{'gap ms':>9}{'over':>8}{'violations':>11}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        for stmin in [int(x) for x in args.stmins.split(",")]:
+            for mode in modes:
+                r = run_mode(mode, size, stmin, args.block_size)
+                r["overshoot"] = r["cf_gap_ms"] / stmin - 1 if r["cf_gap_ms"] else 0.0
+                case = f"{mode}/stmin{stmin}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<22}{'Y' if r['verified'] else 'N':>9}{r['bytes_per_s'] / 1024:>9.2f}{r['usb_tx']:>9}"
+                      f"{r['cf_gap_ms']:>9.3f}{r['overshoot']:>8.1%}{r['stmin_violations']:>11}")
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate, "block_size": args.block_size}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    failed = False
+    for case, r in results.items():
+        if r["stmin_violations"]:
+            print(f"{case}: 连续帧间隔小于 STmin {r['stmin_violations']} 次")
+            failed = True
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.2f} KB/s -> {current / 1024:.2f} KB/s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
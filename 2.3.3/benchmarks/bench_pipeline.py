@@ -0,0 +1,99 @@
+"""
+文件说明：流水线下载基准测试
+在模拟后端上用 UDS_service.download 下载固件，比较逐块准备（收到 0x76 后才切分、组包、编码下一块）
+和流水线准备（块 N 等待应答期间准备块 N+1）时每个块的总线空闲时间和吞吐量：
+    python ：主机端ISO-TP（普通CAN）
+    canfd  ：主机端ISO-TP over CANFD
+    adapter：适配器固件ISO-TP
+idle us 为块间总线空闲时间的平均值/最大值（微秒），即上一块应答收到到本块第一帧提交之间主机的处理时间。
+结果与 baseline_pipeline.json 比较，字节/秒低于基线超过容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 1M --transports python --max-block-length 0x1002
+    python benchmarks/bench_pipeline.py --update-baseline
+"""
+import argparse
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_pipeline.json"
+TRANSPORTS = ("python", "canfd", "adapter")
+
+
+def run_mode(transport, pipelined, size, max_block_length):
+    import UDS_service
+    from bench_ota import PATHS, run_case, canfd_channel
+
+    def run_download(device_handle, channel, data):
+        UDS_service.set_transport(device_handle, channel, transport)
+        try:
+            return UDS_service.download(device_handle, channel, 0x08000000, data, pipelined=pipelined)
+        finally:
+            UDS_service.set_transport(device_handle, channel, "python")
+
+    def run_download_fd(device_handle, channel, data):
+        with canfd_channel(device_handle, channel):
+            return run_download(device_handle, channel, data)
+
+    PATHS["download"] = run_download_fd if transport == "canfd" else run_download
+    try:
+        result = run_case("download", size, max_block_length=max_block_length)
+    finally:
+        del PATHS["download"]
+    stats = UDS_service.get_last_download_stats()
+    result.update({"blocks": stats.blocks, "idle_mean_us": stats.idle_mean * 1e6, "idle_max_us": stats.idle_max * 1e6,
+                   "idle_total_ms": stats.idle_total * 1000})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流水线下载基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="256K", help="固件大小列表")
+    parser.add_argument("--transports", default=",".join(TRANSPORTS), help="ISO-TP实现：" + ",".join(TRANSPORTS))
+    parser.add_argument("--max-block-length", type=lambda x: int(x, 0), default=0x402,
+                        help="虚拟ECU在 0x74 应答中给出的最大块长度")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--usb-latency-ms", type=float, default=0.0, help="每次USB传输的耗时（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许低于基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, usb_latency_ms=args.usb_latency_ms)
+    results = {}
+    print(f"{'case':<24}{'verified':>9}{'blocks':>8}{'KB/s':>9}{'idle us':>9}{'max us':>9}{'idle ms':>9}{'speedup':>9}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        for transport in [t.strip() for t in args.transports.split(",")]:
+            reference = None
+            for pipelined in (False, True):
+                r = run_mode(transport, pipelined, size, args.max_block_length)
+                if reference is None:
+                    reference = r
+                r["speedup"] = r["bytes_per_s"] / reference["bytes_per_s"]
+                case = f"{transport}/{'pipelined' if pipelined else 'serial'}/{format_size(size)}"
+                results[case] = r
+                print(f"{case:<24}{'Y' if r['verified'] else 'N':>9}{r['blocks']:>8}{r['bytes_per_s'] / 1024:>9.1f}"
+                      f"{r['idle_mean_us']:>9.0f}{r['idle_max_us']:>9.0f}{r['idle_total_ms']:>9.1f}"
+                      f"{r['speedup']:>8.2f}x")
+
+    settings = {"latency_ms": args.latency_ms, "usb_latency_ms": args.usb_latency_ms,
+                "max_block_length": args.max_block_length}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    regressions = compare_baseline(results, baseline, "bytes_per_s", args.tolerance)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference / 1024:.1f} KB/s -> {current / 1024:.1f} KB/s")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
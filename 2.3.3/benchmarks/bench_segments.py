@@ -0,0 +1,110 @@
+"""
+文件说明：多段镜像刷写基准测试
+在模拟后端上按真实总线速率（默认 500k）用 UDS_service.flash_segments 刷写一个多段镜像，比较：
+    padded   ：把镜像填充 0xFF 成从第一段到最后一段的连续数据，擦除整个范围后一次下载（多段刷写之前的做法，
+               不跳过空白区，否则填充的 0xFF 也不会下载，见 bench_blank.py）
+    segmented：flash_segments 逐段刷写，每段只擦除其覆盖的扇区，相距不超过 --max-gap 的段合并，大的空隙跳过
+测试镜像为APP（中间有几处对齐留下的小空隙）、APP之后 64K 处的标定数据，以及 CONFIG_ADDRESS 处的一小段配置数据。
+verified 表示虚拟ECU按擦除和下载顺序读出的各段内容与镜像一致。
+输出下载的段数、擦除和下载的字节数、耗时。结果与 baseline_segments.json 比较，耗时超过基线容差时返回非0退出码。
+
+用法（在 2.3.3 目录下）：
+    python benchmarks/bench_segments.py
+    python benchmarks/bench_segments.py --sizes 256K --sector-size 0x1000
+    python benchmarks/bench_segments.py --update-baseline
+"""
+import argparse
+import random
+import sys
+
+from bench_common import BENCH_DIR, use_sim_backend, parse_size, format_size, load_baseline, save_baseline, compare_baseline
+
+BASELINE_FILE = BENCH_DIR / "baseline_segments.json"
+APP_ADDRESS = 0x08000000
+CONFIG_ADDRESS = 0x08040000
+APP_HOLES = 3        # APP 中对齐留下的小空隙个数
+APP_HOLE_SIZE = 0x40
+
+
+def test_image(size):
+    """APP（APP_HOLES 处小空隙）+ 64K 之后的标定数据（size/8）+ CONFIG_ADDRESS 处 16 字节配置"""
+    from FirmwareImage import SegmentedImage
+    rng = random.Random(size)
+    image = SegmentedImage()
+    app_size = size - size // 8
+    piece = app_size // (APP_HOLES + 1)
+    address = APP_ADDRESS
+    for _ in range(APP_HOLES + 1):
+        image.add(address, rng.randbytes(piece))
+        address += piece + APP_HOLE_SIZE
+    image.add(image.end + 0x10000, rng.randbytes(size // 8))
+    image.add(CONFIG_ADDRESS, rng.randbytes(16))
+    return image
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多段镜像刷写基准测试（模拟后端）")
+    parser.add_argument("--sizes", default="128K", help="镜像数据大小列表")
+    parser.add_argument("--sector-size", type=lambda s: int(s, 0), default=0x800, help="扇区大小")
+    parser.add_argument("--max-gap", type=lambda s: int(s, 0), default=0x100, help="合并下载的最大空隙")
+    parser.add_argument("--bitrate", type=int, default=500000, help="虚拟总线波特率")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="虚拟ECU应答延迟（毫秒）")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许超过基线的比例")
+    args = parser.parse_args(argv)
+
+    use_sim_backend(args.latency_ms, args.bitrate)
+    import usb_device
+    import UDS_service
+    from bench_ota import PATHS, run_case
+    from FirmwareImage import SegmentedImage
+
+    ecu = usb_device.USB2XXXLib.ecus[0]
+    results = {}
+    print(f"{'case':<18}{'verified':>9}{'segments':>9}{'erased':>9}{'sent':>9}{'wall s':>8}")
+    for size in [parse_size(s) for s in args.sizes.split(",")]:
+        image = test_image(size)
+        padded = SegmentedImage()
+        padded.add(image.start, image.tobytes())
+        cases = (("padded", padded, 0, 0), ("segmented", image, args.max_gap, UDS_service.BLANK_RUN_THRESHOLD))
+        for case_name, firmware, max_gap, blank_threshold in cases:
+            ecu._flash_log.clear()
+            PATHS["segments"] = lambda dev, ch, data: UDS_service.flash_segments(
+                dev, ch, data, sector_size=args.sector_size, max_gap=max_gap, blank_threshold=blank_threshold)
+            r = run_case("segments", size, data=firmware)
+            del PATHS["segments"]
+            plan = UDS_service.get_last_segment_plan()
+            r["verified"] = all(ecu.read_memory(segment.address, len(segment.data)) == bytes(segment.data)
+                                for segment in image)
+            r.update({"segments": len(plan.segments), "erase_bytes": plan.erase_bytes,
+                      "sent_bytes": plan.download_bytes})
+            case = f"{case_name}/{format_size(size)}"
+            results[case] = r
+            print(f"{case:<18}{'Y' if r['ok'] and r['verified'] else 'N':>9}{r['segments']:>9}{r['erase_bytes']:>9}"
+                  f"{r['sent_bytes']:>9}{r['wall_s']:>8.2f}")
+
+    settings = {"latency_ms": args.latency_ms, "bitrate": args.bitrate, "sector_size": args.sector_size,
+                "max_gap": args.max_gap}
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        merged = dict(baseline["results"]) if baseline else {}
+        merged.update(results)
+        save_baseline(args.baseline, merged, settings)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+    if baseline and baseline.get("settings") != settings:
+        print(f"注意：基线测试条件 {baseline.get('settings')} 与本次 {settings} 不同")
+    failed = False
+    for case, r in results.items():
+        if not r["ok"] or not r["verified"]:
+            print(f"{case}: 刷写失败或虚拟ECU的flash内容与镜像不一致")
+            failed = True
+    regressions = compare_baseline(results, baseline, "wall_s", args.tolerance, higher_is_better=False)
+    for case, reference, current in regressions:
+        print(f"性能回归 {case}: {reference:.2f}s -> {current:.2f}s")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
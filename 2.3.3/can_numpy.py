@@ -0,0 +1,136 @@
+"""
+文件说明：CAN/CANFD接收缓冲区的NumPy零拷贝视图
+把 CAN_GetMsg / CANFD_GetMsg 填充的 ctypes 报文数组直接包装为NumPy结构化数组（共享内存，不拷贝），
+按列取出ID、时间戳、DLC、标志和数据矩阵，过滤、统计和记录可以整批进行，不再逐帧逐字节转换。
+依赖：numpy（仅本模块需要）
+
+用法：
+    CanNum = CAN_GetMsgWithSize(DevHandle, CANIndex, byref(CanMsgBuffer), len(CanMsgBuffer))
+    frames = decode(CanMsgBuffer, CanNum)
+    uds = frames.select([0x71B])
+    print(uds.id, uds.dlc, uds.data[:, :4])
+"""
+from ctypes import sizeof
+
+import numpy as np
+
+from usb2can import CAN_MSG
+from usb2canfd import CANFD_MSG, CANFD_MSG_FLAG_ID_MASK, CANFD_MSG_FLAG_IDE, CANFD_MSG_FLAG_RTR
+
+# CAN_MSG 没有标志字节，decode 时按以下位组合出 flags 列
+CAN_FLAG_REMOTE = 0x01
+CAN_FLAG_EXTERN = 0x02
+
+
+def struct_dtype(struct_type):
+    """按 ctypes 结构体的字段偏移和总大小生成对应的NumPy结构化dtype"""
+    names = []
+    formats = []
+    offsets = []
+    for name, ctype in struct_type._fields_:
+        names.append(name)
+        formats.append(np.dtype(ctype))
+        offsets.append(getattr(struct_type, name).offset)
+    return np.dtype({
+        "names": names,
+        "formats": formats,
+        "offsets": offsets,
+        "itemsize": sizeof(struct_type),
+    })
+
+
+CAN_MSG_DTYPE = struct_dtype(CAN_MSG)
+CANFD_MSG_DTYPE = struct_dtype(CANFD_MSG)
+
+_DTYPES = {
+    CAN_MSG: CAN_MSG_DTYPE,
+    CANFD_MSG: CANFD_MSG_DTYPE,
+}
+
+
+def as_structured(buffer, count=None):
+    """
+    零拷贝：把 ctypes 报文数组（CAN_MSG * N 或 CANFD_MSG * N）的前 count 帧包装为结构化数组
+    返回的数组与 buffer 共享内存，buffer 被下一次接收覆盖后内容随之改变
+    """
+    msg_type = buffer._type_
+    dtype = _DTYPES.get(msg_type)
+    if dtype is None:
+        dtype = _DTYPES[msg_type] = struct_dtype(msg_type)
+    if count is None:
+        count = len(buffer)
+    return np.frombuffer(buffer, dtype=dtype, count=count)
+
+
+class FrameColumns:
+    """
+    一批报文的列视图
+    id        : 报文ID（uint32，已去掉CANFD的IDE/RTR标志位）
+    timestamp : 时间戳（uint64，TimeStampHigh<<32 | TimeStamp，单位与SDK一致）
+    dlc       : 数据字节数（uint8）
+    flags     : CANFD为 Flags 字节（BRS/ESI/FDF/RXD）；CAN为 CAN_FLAG_REMOTE | CAN_FLAG_EXTERN 组合
+    extended  : 是否扩展帧（bool）
+    remote    : 是否远程帧（bool）
+    data      : 数据矩阵（N x 8 或 N x 64，uint8）
+    raw       : 原始结构化数组；data 和 raw 为零拷贝视图，其余列为计算结果
+    """
+
+    def __init__(self, raw, id, timestamp, dlc, flags, extended, remote, data):
+        self.raw = raw
+        self.id = id
+        self.timestamp = timestamp
+        self.dlc = dlc
+        self.flags = flags
+        self.extended = extended
+        self.remote = remote
+        self.data = data
+
+    def __len__(self):
+        return len(self.id)
+
+    def _subset(self, mask):
+        return FrameColumns(self.raw[mask], self.id[mask], self.timestamp[mask], self.dlc[mask],
+                            self.flags[mask], self.extended[mask], self.remote[mask], self.data[mask])
+
+    def select(self, ids):
+        """按报文ID过滤，返回新的 FrameColumns（数据为拷贝）"""
+        return self._subset(np.isin(self.id, np.asarray(list(ids), dtype=np.uint32)))
+
+    def id_counts(self):
+        """统计每个ID的帧数，返回 {ID: 帧数}"""
+        ids, counts = np.unique(self.id, return_counts=True)
+        return dict(zip(ids.tolist(), counts.tolist()))
+
+    def payload(self, index):
+        """取第 index 帧的有效数据（bytes）"""
+        return self.data[index, :self.dlc[index]].tobytes()
+
+
+def decode(buffer, count=None):
+    """把 ctypes 报文数组的前 count 帧按列解码为 FrameColumns"""
+    raw = as_structured(buffer, count)
+    timestamp = (raw["TimeStampHigh"].astype(np.uint64) << np.uint64(32)) | raw["TimeStamp"]
+    if buffer._type_ is CANFD_MSG:
+        raw_id = raw["ID"]
+        return FrameColumns(
+            raw,
+            raw_id & np.uint32(CANFD_MSG_FLAG_ID_MASK),
+            timestamp,
+            raw["DLC"],
+            raw["Flags"],
+            (raw_id & np.uint32(CANFD_MSG_FLAG_IDE)) != 0,
+            (raw_id & np.uint32(CANFD_MSG_FLAG_RTR)) != 0,
+            raw["Data"],
+        )
+    remote = raw["RemoteFlag"]
+    extern = raw["ExternFlag"]
+    return FrameColumns(
+        raw,
+        raw["ID"],
+        timestamp,
+        raw["DataLen"],
+        (remote != 0).astype(np.uint8) * CAN_FLAG_REMOTE | (extern != 0).astype(np.uint8) * CAN_FLAG_EXTERN,
+        extern != 0,
+        remote != 0,
+        raw["Data"],
+    )
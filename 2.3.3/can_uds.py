@@ -3,23 +3,17 @@
 更多帮助：www.toomoss.com
 """
 from ctypes import *
-import platform
 from usb_device import *
 
 # CAN UDS地址定义
 class CAN_UDS_ADDR(Structure):
     _fields_ = [
-        ("ReqID",c_uint),       # 请求报文ID，设置为用户提供的物理请求ID或功能请求ID
-        ("ReqID_PHYSICAL", c_uint), # 物理请求ID，值为 0x713
-        ("ReqID_FUNCTIONAL", c_uint), # 功能请求ID，值为 0x7DF
-        ("ReqID", c_uint),       # 根据寻址类型选择请求ID
-        ("ResID",c_uint),       # 应答报文ID，设置为用户提供的物理应答ID
-        ("ResID_PHYSICAL", c_uint), # 物理应答ID，值为 0x71B
-        ("ResID", c_uint),       # 应答报文ID
+        ("ReqID",c_uint),       # 请求报文ID，物理寻址或功能寻址的请求ID
+        ("ResID",c_uint),       # 应答报文ID
         ("Flag",c_ubyte),       # bit[0]-帧类型(0-标准帧，1-扩展帧),bit[1]-FDF(0-普通CAN帧，1-CANFD帧),bit[2]-BRS(0-CANFD帧不加速，1-CANFD帧加速)
         ("AddrFormats",c_ubyte),# 0-normal, 1-extended ,2-mixed。
         ("AddrExt",c_ubyte),    # 当AddrFormats不为normal时，该数据放到CAN数据域第1字节
-        ("MaxDLC",c_ubyte*8),   #普通CAN设置为8，CANFD帧可以最大设置为64
+        ("MaxDLC",c_ubyte),     # 每帧最大数据字节数，普通CAN设置为8，CANFD帧可以最大设置为64
     ]
 
 
@@ -42,3 +36,8 @@ def CAN_UDS_Request(DevHandle, CANIndex, pUDSAddr,pReqData,DataLen):
 
 def CAN_UDS_Response(DevHandle, CANIndex, pUDSAddr,pResData,TimeOutMs):
     return USB2XXXLib.CAN_UDS_Response(DevHandle, CANIndex, pUDSAddr,pResData,TimeOutMs)
+
+register_prototypes({
+    "CAN_UDS_Request": (c_int, [c_uint, c_ubyte, c_void_p, c_void_p, c_int]),
+    "CAN_UDS_Response": (c_int, [c_uint, c_ubyte, c_void_p, c_void_p, c_int]),
+})
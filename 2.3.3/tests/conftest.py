@@ -0,0 +1,50 @@
+"""
+测试公共设置：按 2.3.3 目录下的模块名直接导入，USB2XXX 使用模拟后端（usb_sim），不需要连接适配器
+从 2.3.3 目录运行：
+    python -m pytest -q
+"""
+import copy
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+
+if str(SOURCE_DIR) not in sys.path:
+    sys.path.insert(0, str(SOURCE_DIR))
+
+# 必须在导入 usb_device 之前设置
+os.environ.setdefault("USB2XXX_BACKEND", "sim")
+os.environ.setdefault("USB2XXX_SIM_LATENCY_MS", "0")
+
+# 测试可能修改的虚拟ECU设置，测试结束后恢复
+_ECU_SETTINGS = ("max_block_length", "block_size", "stmin", "fc_wait", "fc_wait_interval", "rx_buffer_size",
+                 "strict", "compression_methods", "latency", "service_latency", "pending", "pending_interval",
+                 "session", "security_level", "key_func", "dids")
+
+
+@pytest.fixture
+def sim():
+    """模拟适配器上打开的设备（通道0已初始化）及该通道上的虚拟ECU，测试结束后清空ECU的flash并恢复设置"""
+    from ctypes import byref, c_uint
+    import usb_device
+    import UDS_service
+    from usb2can import CAN_INIT_CONFIG, CAN_Init
+    handles = (c_uint * 20)()
+    usb_device.USB_ScanDevice(byref(handles))
+    usb_device.USB_OpenDevice(handles[0])
+    CAN_Init(handles[0], 0, byref(CAN_INIT_CONFIG()))
+    ecu = usb_device.USB2XXXLib.ecus[0]
+    saved = {name: copy.copy(getattr(ecu, name)) for name in _ECU_SETTINGS}
+    yield SimpleNamespace(device=handles[0], channel=0, ecu=ecu)
+    for name, value in saved.items():
+        setattr(ecu, name, value)
+    ecu.memory.clear()
+    ecu.erased.clear()
+    ecu._flash_log.clear()
+    ecu.routine_results.clear()
+    ecu.clear_scripts()
+    UDS_service.set_transport(handles[0], 0, "python")
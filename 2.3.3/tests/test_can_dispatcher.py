@@ -0,0 +1,81 @@
+"""CANDispatcher：按ID分发报文到订阅者"""
+import pytest
+
+import usb_device
+from CANDispatcher import get_dispatcher
+from usb2can import CAN_MSG
+from usb2canfd import CANFD_MSG
+from usb_sim import SimFrame
+
+
+def inject(*frames):
+    """其它节点在通道0的虚拟总线上发送报文：(ID, 数据)"""
+    bus = usb_device.USB2XXXLib.bus(0)
+    for msg_id, data in frames:
+        bus.transmit(None, SimFrame(msg_id, bytes(data)))
+
+
+def received(sub, count, timeout=1.0):
+    return [(msg.ID, bytes(msg.Data[:msg.DataLen])) for _, msg in zip(range(count), sub.iter_frames(timeout))]
+
+
+@pytest.fixture
+def dispatcher(sim):
+    return get_dispatcher(sim.device, sim.channel)
+
+
+def test_same_dispatcher_per_channel(sim, dispatcher):
+    assert get_dispatcher(sim.device, sim.channel) is dispatcher
+
+
+def test_other_message_type_is_rejected(sim, dispatcher):
+    with pytest.raises(ValueError, match="已按CAN_MSG接收"):
+        get_dispatcher(sim.device, sim.channel, CANFD_MSG)
+
+
+def test_frames_are_routed_by_id(dispatcher):
+    with dispatcher.subscribe([0x101]) as sub_a, dispatcher.subscribe([0x102, 0x103]) as sub_b:
+        inject((0x101, b"\x01"), (0x102, b"\x02"), (0x104, b"\x04"), (0x103, b"\x03"), (0x101, b"\x05"))
+        assert received(sub_a, 2) == [(0x101, b"\x01"), (0x101, b"\x05")]
+        assert received(sub_b, 2) == [(0x102, b"\x02"), (0x103, b"\x03")]
+        assert sub_a.get(0.05) is None and sub_b.get(0.05) is None
+
+
+def test_multiple_subscribers_of_one_id_each_get_the_frame(dispatcher):
+    with dispatcher.subscribe([0x101]) as first, dispatcher.subscribe([0x101]) as second, \
+            dispatcher.subscribe() as monitor:
+        inject((0x101, b"\x01"), (0x102, b"\x02"))
+        assert received(first, 1) == received(second, 1) == [(0x101, b"\x01")]
+        assert received(monitor, 2) == [(0x101, b"\x01"), (0x102, b"\x02")]
+
+
+def test_unsubscribed_queue_gets_no_more_frames(dispatcher):
+    first = dispatcher.subscribe([0x101])
+    with dispatcher.subscribe([0x101]) as second:
+        first.close()
+        inject((0x101, b"\x01"))
+        assert received(second, 1) == [(0x101, b"\x01")]
+        assert first.get(0.05) is None
+    assert 0x101 not in dispatcher._routes
+
+
+def test_full_queue_drops_oldest(dispatcher):
+    with dispatcher.subscribe([0x101], maxlen=2) as sub:
+        inject(*[(0x101, bytes([n])) for n in range(5)])
+        with dispatcher.subscribe([0x102]) as marker:
+            inject((0x102, b""))
+            received(marker, 1)  # 0x101 的报文已全部分发
+        assert received(sub, 5, 0.1) == [(0x101, b"\x03"), (0x101, b"\x04")]
+        assert sub.dropped == 3
+
+
+def test_raw_batches(dispatcher):
+    with dispatcher.subscribe(raw_batches=True) as sub:
+        inject((0x101, b"\x01"), (0x102, b"\x02"))
+        batches = []
+        while sum(len(batch) for batch in batches) < 2:
+            batches.append(sub.get(1.0))
+        assert all(isinstance(batch[0], CAN_MSG) for batch in batches)
+        assert [msg.ID for batch in batches for msg in batch] == [0x101, 0x102]
+    with pytest.raises(ValueError):
+        dispatcher.subscribe([0x101], raw_batches=True)
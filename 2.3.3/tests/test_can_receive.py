@@ -0,0 +1,65 @@
+"""CAN_Receive.CANReceiver：批量模式按时间窗口合并报文"""
+import threading
+import time
+
+import pytest
+from PyQt5.QtCore import Qt
+
+import usb_device
+from CAN_Receive import CANReceiver
+from usb2can import CAN_MSG
+from usb_sim import SimFrame
+
+
+def inject(ids):
+    """其它节点在通道0的虚拟总线上发送报文"""
+    bus = usb_device.USB2XXXLib.bus(0)
+    for msg_id in ids:
+        bus.transmit(None, SimFrame(msg_id, bytes(8)))
+
+
+@pytest.fixture
+def receiver(sim):
+    receivers = []
+
+    def start(**kwargs):
+        receiver = CANReceiver(sim.device, sim.channel, CAN_MSG, batch_mode=True, **kwargs)
+        batches = []
+        receiver.batch_received.connect(lambda batch: batches.append([msg.ID for msg in batch]),
+                                        Qt.DirectConnection)
+        thread = threading.Thread(target=receiver.run, daemon=True)
+        thread.start()
+        receivers.append((receiver, thread))
+        while receiver.subscription is None:
+            time.sleep(0.001)
+        return receiver, batches
+
+    yield start
+    for receiver, thread in receivers:
+        receiver.stop()
+        thread.join(1.0)
+
+
+def wait_for(batches, count, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while sum(len(batch) for batch in batches) < count and time.perf_counter() < deadline:
+        time.sleep(0.005)
+
+
+def test_frames_within_window_are_one_batch(receiver):
+    _, batches = receiver(batch_window_ms=300)
+    inject([0x101, 0x102])
+    time.sleep(0.05)
+    inject([0x103])
+    wait_for(batches, 3)
+    assert batches == [[0x101, 0x102, 0x103]]
+
+
+def test_without_window_each_wakeup_is_a_batch(receiver):
+    _, batches = receiver(batch_window_ms=0)
+    inject([0x101, 0x102])
+    wait_for(batches, 2)
+    time.sleep(0.05)
+    inject([0x103])
+    wait_for(batches, 3)
+    assert batches == [[0x101, 0x102], [0x103]]
@@ -0,0 +1,126 @@
+"""FirmwareCache：按内容寻址的解析结果和压缩结果缓存"""
+import os
+import random
+
+import pytest
+
+import FirmwareCache as firmware_cache
+from FirmwareCache import FirmwareCache
+from FirmwareCompression import COMPRESSION_NONE, COMPRESSION_ZLIB, decompress
+
+DATA = random.Random(0).randbytes(2000) + bytes(6000)
+
+
+def hex_file(path, segments):
+    """写入 Intel HEX 文件：[(地址, 数据)]，地址不超过 64K"""
+    lines = []
+    for address, data in segments:
+        for offset in range(0, len(data), 16):
+            chunk = data[offset:offset + 16]
+            record = bytes([len(chunk), (address + offset) >> 8 & 0xFF, (address + offset) & 0xFF, 0]) + chunk
+            lines.append(":" + (record + bytes([-sum(record) & 0xFF])).hex().upper())
+    lines.append(":00000001FF")
+    path.write_text("\n".join(lines))
+    return path
+
+
+def segments(image):
+    return [(segment.address, bytes(segment.data)) for segment in image]
+
+
+class TestLoadFirmware:
+
+    def test_parsed_once_then_mapped_from_cache(self, tmp_path, monkeypatch):
+        path = hex_file(tmp_path / "app.hex", [(0x0000, DATA[:100]), (0x1000, DATA[100:150])])
+        cache = FirmwareCache(tmp_path / "cache")
+        first = cache.load_firmware(path)
+
+        def parse_again(*args, **kwargs):
+            raise AssertionError("缓存命中时不应再解析")
+
+        monkeypatch.setattr(firmware_cache, "load_firmware", parse_again)
+        second = FirmwareCache(tmp_path / "cache").load_firmware(path)
+        assert segments(second) == segments(first) == [(0x0000, DATA[:100]), (0x1000, DATA[100:150])]
+
+    def test_changed_file_is_parsed_again(self, tmp_path):
+        path = hex_file(tmp_path / "app.hex", [(0x0000, b"\x01\x02")])
+        cache = FirmwareCache(tmp_path / "cache")
+        cache.load_firmware(path)
+        hex_file(path, [(0x0000, b"\x03\x04")])
+        assert segments(cache.load_firmware(path)) == [(0x0000, b"\x03\x04")]
+
+    def test_truncated_cache_file_is_rebuilt(self, tmp_path):
+        path = hex_file(tmp_path / "app.hex", [(0x0000, DATA[:64])])
+        cache = FirmwareCache(tmp_path / "cache")
+        cache.load_firmware(path)
+        data_file, = (tmp_path / "cache").glob("file-*/data.bin")
+        data_file.write_bytes(DATA[:10])
+        assert segments(cache.load_firmware(path)) == [(0x0000, DATA[:64])]
+
+    def test_bin_file_is_not_cached(self, tmp_path):
+        path = tmp_path / "app.bin"
+        path.write_bytes(DATA[:16])
+        cache = FirmwareCache(tmp_path / "cache")
+        assert segments(cache.load_firmware(path, 0x08000000)) == [(0x08000000, DATA[:16])]
+        assert cache.size() == 0
+
+
+class TestEntry:
+
+    def test_uncompressed(self, tmp_path):
+        entry = FirmwareCache(tmp_path).entry(DATA)
+        assert (entry.length, entry.transferred) == (len(DATA), len(DATA))
+        assert entry.compressed is None
+
+    def test_compressed_result_is_reused_across_instances(self, tmp_path):
+        first = FirmwareCache(tmp_path).entry(DATA, COMPRESSION_ZLIB)
+        second = FirmwareCache(tmp_path).entry(DATA, COMPRESSION_ZLIB)
+        assert second.compressed.cached
+        assert second.transferred == first.transferred < len(DATA)
+        assert decompress(bytes(second.compressed.data), COMPRESSION_ZLIB) == DATA
+        assert second.compressed.data_format == first.compressed.data_format
+
+    def test_methods_are_separate_entries(self, tmp_path):
+        cache = FirmwareCache(tmp_path)
+        assert cache.entry(DATA, COMPRESSION_NONE).directory != cache.entry(DATA, COMPRESSION_ZLIB).directory
+
+    def test_missing_compressed_data_is_recompressed(self, tmp_path):
+        cache = FirmwareCache(tmp_path)
+        entry = cache.entry(DATA, COMPRESSION_ZLIB)
+        (entry.directory / "data.bin").unlink()
+        again = cache.entry(DATA, COMPRESSION_ZLIB)
+        assert decompress(bytes(again.compressed.data), COMPRESSION_ZLIB) == DATA
+
+
+class TestEviction:
+
+    def test_least_recently_used_entries_are_removed(self, tmp_path):
+        cache = FirmwareCache(tmp_path, max_bytes=1 << 30)
+        entries = [cache.entry(DATA[:1000] + bytes([n]), COMPRESSION_ZLIB) for n in range(3)]
+        for age, entry in enumerate(entries):
+            os.utime(entry.directory, (1000 + age, 1000 + age))
+        cache.entry(DATA[:1000] + b"\x00", COMPRESSION_ZLIB)  # 命中，更新最近使用时间
+        cache.max_bytes = cache.size() - 1
+        cache.evict()
+        assert [entry.directory.exists() for entry in entries] == [True, False, True]
+
+    def test_newest_entry_is_kept_even_when_over_limit(self, tmp_path):
+        cache = FirmwareCache(tmp_path, max_bytes=1)
+        entry = cache.entry(DATA, COMPRESSION_ZLIB)
+        assert entry.directory.exists()
+        assert cache.size() > 1
+
+    def test_clear(self, tmp_path):
+        cache = FirmwareCache(tmp_path / "cache")
+        cache.entry(DATA)
+        cache.clear()
+        assert cache.size() == 0
+
+
+@pytest.mark.parametrize("method", [COMPRESSION_NONE, COMPRESSION_ZLIB])
+def test_download_with_cache(sim, tmp_path, method):
+    import UDS_service
+    cache = FirmwareCache(tmp_path)
+    for _ in range(2):
+        assert UDS_service.download(sim.device, sim.channel, 0x08000000, DATA, compression=method, cache=cache)
+        assert sim.ecu.read_memory(0x08000000, len(DATA)) == DATA
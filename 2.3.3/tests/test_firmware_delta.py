@@ -0,0 +1,168 @@
+"""FirmwareDelta：按扇区比较新旧镜像与保存上次刷写的镜像"""
+import random
+
+import pytest
+
+from FirmwareDelta import FirmwareStore, FlashedImage, plan_delta
+import UDS_service
+
+APP_ADDRESS = 0x08000000
+SECTOR = 0x100
+
+
+def regions(plan):
+    return [(address, size, bytes(data)) for address, size, data in plan.regions]
+
+
+OLD = random.Random(0).randbytes(SECTOR * 8)
+
+
+def changed(*sectors, data=OLD):
+    new = bytearray(data)
+    for sector in sectors:
+        new[sector * SECTOR + 5] ^= 0xFF
+    return bytes(new)
+
+
+class TestPlanDelta:
+
+    def test_identical_images(self):
+        plan = plan_delta(OLD, OLD, APP_ADDRESS, SECTOR)
+        assert plan.unchanged and not plan.full
+        assert (plan.sectors_total, plan.sectors_changed, plan.download_bytes) == (8, 0, 0)
+
+    def test_adjacent_changed_sectors_are_merged(self):
+        new = changed(1, 2, 5)
+        plan = plan_delta(OLD, new, APP_ADDRESS, SECTOR)
+        assert regions(plan) == [(APP_ADDRESS + SECTOR, 2 * SECTOR, new[SECTOR:3 * SECTOR]),
+                                 (APP_ADDRESS + 5 * SECTOR, SECTOR, new[5 * SECTOR:6 * SECTOR])]
+        assert plan.sectors_changed == 3
+        assert plan.skipped_bytes == 5 * SECTOR
+
+    def test_last_sector_changed(self):
+        new = changed(7)
+        assert regions(plan_delta(OLD, new, APP_ADDRESS, SECTOR)) == [
+            (APP_ADDRESS + 7 * SECTOR, SECTOR, new[7 * SECTOR:])]
+
+    def test_longer_new_image_with_partial_sector(self):
+        new = OLD + b"\x01" * 10
+        assert regions(plan_delta(OLD, new, APP_ADDRESS, SECTOR)) == [
+            (APP_ADDRESS + 8 * SECTOR, SECTOR, b"\x01" * 10)]
+
+    def test_shorter_new_image_erases_old_sectors_without_data(self):
+        new = OLD[:6 * SECTOR]
+        plan = plan_delta(OLD, new, APP_ADDRESS, SECTOR)
+        assert regions(plan) == [(APP_ADDRESS + 6 * SECTOR, 2 * SECTOR, b"")]
+        assert plan.segments == []
+        assert plan.erase_bytes == 2 * SECTOR
+
+    def test_no_old_image_is_full_plan(self):
+        plan = plan_delta(None, OLD, APP_ADDRESS, SECTOR)
+        assert plan.full
+        assert regions(plan) == [(APP_ADDRESS, len(OLD), OLD)]
+
+    def test_old_image_at_other_address_is_full_plan(self):
+        plan = plan_delta(FlashedImage(APP_ADDRESS + SECTOR, OLD), OLD, APP_ADDRESS, SECTOR)
+        assert plan.full
+
+    def test_flashed_image_at_same_address(self):
+        assert plan_delta(FlashedImage(APP_ADDRESS, OLD), changed(0), APP_ADDRESS, SECTOR).sectors_changed == 1
+
+    def test_unaligned_address(self):
+        with pytest.raises(ValueError, match="未按扇区大小"):
+            plan_delta(OLD, OLD, APP_ADDRESS + 1, SECTOR)
+
+
+class TestFirmwareStore:
+
+    def test_save_and_load(self, tmp_path):
+        store = FirmwareStore(tmp_path)
+        saved = store.save(0x71B, APP_ADDRESS, OLD)
+        loaded = store.load(0x71B)
+        assert (loaded.address, loaded.data, loaded.sha256) == (APP_ADDRESS, OLD, saved.sha256)
+        assert store.load(0x71C) is None
+
+    def test_corrupted_image_is_ignored(self, tmp_path):
+        store = FirmwareStore(tmp_path)
+        store.save("ecu/1", APP_ADDRESS, OLD)
+        (tmp_path / "ecu_1.bin").write_bytes(changed(0))
+        assert store.load("ecu/1") is None
+
+    def test_forget(self, tmp_path):
+        store = FirmwareStore(tmp_path)
+        store.save(0x71B, APP_ADDRESS, OLD)
+        store.forget(0x71B)
+        store.forget(0x71B)
+        assert store.load(0x71B) is None
+
+
+class TestDeltaDownload:
+
+    def test_only_changed_sectors_are_flashed(self, sim, tmp_path):
+        store = FirmwareStore(tmp_path)
+        assert UDS_service.delta_download(sim.device, sim.channel, APP_ADDRESS, OLD, store=store, sector_size=SECTOR)
+        assert UDS_service.get_last_delta_stats().plan.full
+        new = changed(3)
+        sim.ecu.erased.clear()
+        assert UDS_service.delta_download(sim.device, sim.channel, APP_ADDRESS, new, store=store, sector_size=SECTOR)
+        assert sim.ecu.erased == [(APP_ADDRESS + 3 * SECTOR, SECTOR)]
+        assert sim.ecu.read_memory(APP_ADDRESS, len(new)) == new
+        assert store.load(UDS_service.ECU_RESPONSE_ID).data == new
+
+
+class TestFullThenDelta:
+    """完整刷写后保存的基准须是刚刷写的镜像，否则下一次差分刷写会按旧镜像比较而漏刷扇区"""
+
+    def test_uds_ota(self, sim, tmp_path):
+        from UDS_OTA import UDS_OTA
+        store = FirmwareStore(tmp_path)
+        assert UDS_OTA(sim.device, sim.channel, delta=True, store=store, sector_size=SECTOR,
+                       memory_address=APP_ADDRESS).transfer_data(OLD)
+        full = changed(1, 2)
+        assert UDS_OTA(sim.device, sim.channel, store=store, sector_size=SECTOR,
+                       memory_address=APP_ADDRESS).transfer_data(full)
+        assert store.load(UDS_service.ECU_RESPONSE_ID).data == full
+        new = changed(2, data=full)
+        sim.ecu.erased.clear()
+        assert UDS_OTA(sim.device, sim.channel, delta=True, store=store, sector_size=SECTOR,
+                       memory_address=APP_ADDRESS).transfer_data(new)
+        assert sim.ecu.erased == [(APP_ADDRESS + 2 * SECTOR, SECTOR)]
+        assert sim.ecu.read_memory(APP_ADDRESS, len(new)) == new
+
+    def test_failed_full_flash_forgets_baseline(self, sim, tmp_path):
+        from UDS_OTA import UDS_OTA
+        store = FirmwareStore(tmp_path)
+        store.save(UDS_service.ECU_RESPONSE_ID, APP_ADDRESS, OLD)
+        sim.ecu.script(b"\x34", b"\x7F\x34\x22")
+        assert not UDS_OTA(sim.device, sim.channel, store=store, sector_size=SECTOR,
+                           memory_address=APP_ADDRESS).transfer_data(changed(1))
+        assert store.load(UDS_service.ECU_RESPONSE_ID) is None
+
+    def test_ota_handler(self, sim, tmp_path, monkeypatch):
+        import UDS_OTA_Handler
+        from usb_sim import SimCanBus
+        # 会话、安全访问等步骤替换为成功；擦除、下载和内存完整性检查在虚拟ECU上实际执行
+        for name in ("wakeup", "into_extended_session_mode", "check_programming_condition", "control_DTC_setting",
+                     "control_communication", "into_programming_session_mode", "unlock_security_access",
+                     "write_finger_print_data", "request_firmware_end", "ECU_reset", "testWaitForTimeout"):
+            monkeypatch.setattr(UDS_OTA_Handler.UDS_OTA_Handler, name, lambda *args, **kwargs: 0)
+        store = FirmwareStore(tmp_path)
+        bus = SimCanBus(sim.channel)
+        try:
+            def flash(data, delta):
+                handler = UDS_OTA_Handler.UDS_OTA_Handler(sim.device, sim.channel, console=lambda *args: None, bus=bus,
+                                                          delta=delta, store=store, sector_size=SECTOR)
+                return handler.perform_ota_update(data)
+
+            address = UDS_OTA_Handler.data_transfer_info.app_start_addr[0][0]
+            assert flash(OLD, delta=True)
+            full = changed(1, 2)
+            assert flash(full, delta=False)
+            assert store.load(UDS_service.ECU_RESPONSE_ID).data == full
+            new = changed(2, data=full)
+            sim.ecu.erased.clear()
+            assert flash(new, delta=True)
+            assert sim.ecu.erased == [(address + 2 * SECTOR, SECTOR)]
+            assert sim.ecu.read_memory(address, len(new)) == new
+        finally:
+            bus.shutdown()
@@ -0,0 +1,68 @@
+"""FirmwareDigest：按块累计的校验值"""
+import hashlib
+import random
+import zlib
+
+import pytest
+
+from FirmwareDigest import (DIGEST_CRC16, DIGEST_CRC32, DIGEST_SHA256, ImageDigest, digest_algorithms,
+                            image_digest, register_digest_algorithm)
+from FirmwareImage import SegmentedImage
+
+DATA = random.Random(0).randbytes(100000)
+
+
+@pytest.mark.parametrize("algorithm, value", [
+    (DIGEST_CRC32, 0xCBF43926.to_bytes(4, "big")),
+    (DIGEST_CRC16, 0x29B1.to_bytes(2, "big")),
+    (DIGEST_SHA256, hashlib.sha256(b"123456789").digest()),
+])
+def test_check_values(algorithm, value):
+    assert image_digest(b"123456789", algorithm) == value
+
+
+@pytest.mark.parametrize("algorithm", [DIGEST_CRC32, DIGEST_CRC16, DIGEST_SHA256])
+@pytest.mark.parametrize("block_size", [1, 7, 0x400, 0xFFF])
+def test_block_updates_match_whole_image(algorithm, block_size):
+    digest = ImageDigest(algorithm)
+    for offset in range(0, 5000, block_size):
+        digest.update(DATA[offset:min(offset + block_size, 5000)])
+    assert digest.length == 5000
+    assert digest.digest() == image_digest(DATA[:5000], algorithm)
+
+
+def test_multiple_algorithms():
+    digest = ImageDigest((DIGEST_CRC16, DIGEST_CRC32))
+    digest.update(DATA)
+    assert digest.digest() == image_digest(DATA, DIGEST_CRC16)
+    assert digest.digest(DIGEST_CRC32) == zlib.crc32(DATA).to_bytes(4, "big")
+    assert digest.hexdigest(DIGEST_CRC32) == "%08X" % zlib.crc32(DATA)
+
+
+@pytest.mark.parametrize("size", [0, 1, 0x10000, 0x10001, 0x25000])
+def test_update_fill_matches_fill_bytes(size):
+    digest = ImageDigest(DIGEST_CRC32)
+    digest.update(b"\x01\x02")
+    digest.update_fill(0xFF, size)
+    assert digest.length == 2 + size
+    assert digest.digest() == image_digest(b"\x01\x02" + b"\xFF" * size)
+
+
+def test_segmented_image_in_address_order():
+    image = SegmentedImage()
+    image.add(0x2000, DATA[1000:2000])
+    image.add(0x1000, DATA[:1000])
+    assert image_digest(image) == image_digest(DATA[:2000])
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError, match="不支持的校验算法"):
+        ImageDigest("md5")
+
+
+def test_register_digest_algorithm(monkeypatch):
+    import FirmwareDigest
+    monkeypatch.setattr(FirmwareDigest, "_algorithms", dict(FirmwareDigest._algorithms))
+    register_digest_algorithm("md5", hashlib.md5)
+    assert "md5" in digest_algorithms()
+    assert image_digest(DATA, "md5") == hashlib.md5(DATA).digest()
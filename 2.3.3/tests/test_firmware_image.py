@@ -0,0 +1,164 @@
+"""FirmwareImage：Intel HEX / S-record 解析与 SegmentedImage"""
+import io
+
+import pytest
+
+from FirmwareImage import SegmentedImage, load_firmware, parse_intel_hex, parse_srecord
+
+
+def ihex(record_type, address=0, data=b""):
+    """一条 Intel HEX 记录（含校验和）"""
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, record_type]) + bytes(data)
+    return ":" + (record + bytes([-sum(record) & 0xFF])).hex().upper()
+
+
+def srec(record_type, address=0, data=b""):
+    """一条 S-record 记录（含校验和），地址字节数按记录类型"""
+    size = {"0": 2, "1": 2, "2": 3, "3": 4, "5": 2, "6": 3, "7": 4, "8": 3, "9": 2}[record_type]
+    record = bytes([size + len(data) + 1]) + address.to_bytes(size, "big") + bytes(data)
+    return "S" + record_type + (record + bytes([~sum(record) & 0xFF])).hex().upper()
+
+
+def segments(image):
+    return [(segment.address, bytes(segment.data)) for segment in image]
+
+
+class TestIntelHex:
+
+    def test_contiguous_records_merge_into_one_segment(self):
+        lines = [ihex(0x00, 0x0000, b"\x01\x02\x03\x04"), ihex(0x00, 0x0004, b"\x05\x06"), ihex(0x01)]
+        assert segments(parse_intel_hex(lines)) == [(0x0000, b"\x01\x02\x03\x04\x05\x06")]
+
+    def test_records_after_eof_are_ignored(self):
+        lines = [ihex(0x00, 0x0000, b"\xAA"), ihex(0x01), ihex(0x00, 0x0010, b"\xBB")]
+        assert segments(parse_intel_hex(lines)) == [(0x0000, b"\xAA")]
+
+    def test_extended_linear_address(self):
+        lines = [ihex(0x04, 0, b"\x08\x00"), ihex(0x00, 0x1000, b"\x11\x22"),
+                 ihex(0x04, 0, b"\x08\x01"), ihex(0x00, 0x0000, b"\x33"), ihex(0x01)]
+        assert segments(parse_intel_hex(lines)) == [(0x08001000, b"\x11\x22"), (0x08010000, b"\x33")]
+
+    def test_extended_segment_address(self):
+        lines = [ihex(0x02, 0, b"\x12\x00"), ihex(0x00, 0x0010, b"\x44"), ihex(0x01)]
+        assert segments(parse_intel_hex(lines)) == [(0x12000 + 0x10, b"\x44")]
+
+    def test_start_segment_address(self):
+        image = parse_intel_hex([ihex(0x03, 0, b"\x12\x34\x00\x10"), ihex(0x01)])
+        assert image.start_address == (0x1234 << 4) + 0x0010
+
+    def test_start_linear_address(self):
+        image = parse_intel_hex([ihex(0x05, 0, b"\x08\x00\x01\x99"), ihex(0x01)])
+        assert image.start_address == 0x08000199
+
+    def test_bytes_lines_and_blank_lines(self):
+        text = "\n".join([ihex(0x00, 0x0100, b"\x01\x02"), "", ihex(0x01), ""]).encode("ascii")
+        assert segments(parse_intel_hex(io.BytesIO(text))) == [(0x0100, b"\x01\x02")]
+
+    def test_checksum_error_reports_line(self):
+        good = ihex(0x00, 0x0000, b"\x01\x02")
+        bad = good[:-2] + "%02X" % ((int(good[-2:], 16) + 1) & 0xFF)
+        with pytest.raises(ValueError, match="第2行：校验和错误"):
+            parse_intel_hex([good, bad])
+
+    def test_length_mismatch(self):
+        record = ihex(0x00, 0x0000, b"\x01\x02")
+        with pytest.raises(ValueError, match="第1行：记录长度错误"):
+            parse_intel_hex([":03" + record[3:]])
+
+    def test_invalid_hex_digits(self):
+        with pytest.raises(ValueError, match="十六进制格式错误"):
+            parse_intel_hex([":0Z000000"])
+
+    def test_missing_start_code(self):
+        with pytest.raises(ValueError, match="不是有效的记录"):
+            parse_intel_hex([ihex(0x01)[1:]])
+
+    def test_unknown_record_type(self):
+        with pytest.raises(ValueError, match="未知的记录类型 06"):
+            parse_intel_hex([ihex(0x06)])
+
+    def test_overlapping_records(self):
+        lines = [ihex(0x00, 0x0000, b"\x01\x02\x03\x04"), ihex(0x00, 0x0002, b"\x05")]
+        with pytest.raises(ValueError, match="重叠"):
+            parse_intel_hex(lines)
+
+    def test_out_of_order_records_are_inserted_and_merged(self):
+        lines = [ihex(0x00, 0x0010, b"\x03"), ihex(0x00, 0x0000, b"\x01"), ihex(0x00, 0x0001, b"\x02" * 15),
+                 ihex(0x01)]
+        assert segments(parse_intel_hex(lines)) == [(0x0000, b"\x01" + b"\x02" * 15 + b"\x03")]
+
+
+class TestSRecord:
+
+    def test_s1_s2_s3_data_records(self):
+        lines = [srec("0", 0, b"hdr"), srec("1", 0x1000, b"\x01\x02"), srec("2", 0x020000, b"\x03"),
+                 srec("3", 0x08000000, b"\x04\x05"), srec("5", 3)]
+        assert segments(parse_srecord(lines)) == [(0x1000, b"\x01\x02"), (0x020000, b"\x03"),
+                                                  (0x08000000, b"\x04\x05")]
+
+    def test_s0_s5_s6_are_ignored(self):
+        lines = [srec("0", 0, b"header"), srec("5", 0x0001), srec("6", 0x000001), srec("1", 0x0000, b"\xAA")]
+        assert segments(parse_srecord(lines)) == [(0x0000, b"\xAA")]
+
+    @pytest.mark.parametrize("record_type, address", [("7", 0x08000199), ("8", 0x012345), ("9", 0x1234)])
+    def test_start_address_records(self, record_type, address):
+        assert parse_srecord([srec(record_type, address)]).start_address == address
+
+    def test_checksum_error_reports_line(self):
+        good = srec("1", 0x0000, b"\x01")
+        bad = good[:-2] + "%02X" % ((int(good[-2:], 16) + 1) & 0xFF)
+        with pytest.raises(ValueError, match="第3行：校验和错误"):
+            parse_srecord([srec("0", 0, b"x"), srec("1", 0x0010, b"\x02"), bad])
+
+    def test_length_mismatch(self):
+        record = srec("1", 0x0000, b"\x01\x02")
+        with pytest.raises(ValueError, match="记录长度错误"):
+            parse_srecord([record[:2] + "09" + record[4:]])
+
+    def test_unknown_record_type(self):
+        record = srec("1", 0x0000, b"\x01")
+        with pytest.raises(ValueError, match="未知的记录类型 S4"):
+            parse_srecord(["S4" + record[2:]])
+
+    def test_overlapping_records(self):
+        lines = [srec("3", 0x08000000, b"\x01\x02\x03\x04"), srec("3", 0x08000003, b"\x05")]
+        with pytest.raises(ValueError, match="重叠"):
+            parse_srecord(lines)
+
+
+class TestSegmentedImage:
+
+    def test_fills_gaps_in_tobytes(self):
+        image = SegmentedImage()
+        image.add(0x100, b"\x01")
+        image.add(0x104, b"\x02")
+        assert image.tobytes() == b"\x01\xFF\xFF\xFF\x02"
+        assert (image.start, image.end, len(image)) == (0x100, 0x105, 2)
+
+    def test_insert_bridging_two_segments_merges_them(self):
+        image = SegmentedImage()
+        image.add(0x00, b"\x01")
+        image.add(0x02, b"\x03")
+        image.add(0x01, b"\x02")
+        assert segments(image) == [(0x00, b"\x01\x02\x03")]
+
+
+class TestLoadFirmware:
+
+    def test_dispatch_by_extension(self, tmp_path):
+        hex_path = tmp_path / "app.hex"
+        hex_path.write_text("\n".join([ihex(0x04, 0, b"\x08\x00"), ihex(0x00, 0, b"\x01\x02"), ihex(0x01)]))
+        s19_path = tmp_path / "app.s19"
+        s19_path.write_text(srec("1", 0x2000, b"\x03"))
+        assert segments(load_firmware(hex_path)) == [(0x08000000, b"\x01\x02")]
+        assert segments(load_firmware(s19_path)) == [(0x2000, b"\x03")]
+
+    def test_bin_file_is_one_segment_at_base_address(self, tmp_path):
+        path = tmp_path / "app.bin"
+        path.write_bytes(b"\x01\x02\x03")
+        assert segments(load_firmware(path, 0x08004000)) == [(0x08004000, b"\x01\x02\x03")]
+
+    def test_empty_bin_file(self, tmp_path):
+        path = tmp_path / "empty.bin"
+        path.write_bytes(b"")
+        assert len(load_firmware(path).segments) == 0
@@ -0,0 +1,160 @@
+"""UDS_service：ISO-TP 分帧编码与按流控帧发送"""
+import random
+import time
+
+import pytest
+
+import UDS_service
+from UDS_service import IsoTpFrameFormat, stmin_seconds
+
+
+def frame_bytes(message):
+    """IsoTpMessage 的各帧数据（CAN 为8字节，CANFD 按DLC）"""
+    frames = list(message.first) + list(message.consecutive or [])
+    if message.frame_format.fd:
+        return [bytes(frame.Data[:frame.DLC]) for frame in frames]
+    return [bytes(frame.Data[:frame.DataLen]) for frame in frames]
+
+
+def reassemble(frames, first_header):
+    return frames[0][first_header:] + b"".join(frame[1:] for frame in frames[1:])
+
+
+class TestEncode:
+
+    def test_single_frame_is_padded_to_eight_bytes(self):
+        message = IsoTpFrameFormat(padding=0xAA).encode(0x713, b"\x10\x02")
+        assert message.consecutive is None
+        assert frame_bytes(message) == [b"\x02\x10\x02\xAA\xAA\xAA\xAA\xAA"]
+
+    def test_first_and_consecutive_frames(self):
+        payload = bytes(range(19))
+        frames = frame_bytes(IsoTpFrameFormat().encode(0x713, payload))
+        assert frames[0][:2] == b"\x10\x13"
+        assert [frame[0] for frame in frames[1:]] == [0x21, 0x22]
+        assert reassemble(frames, 2)[:len(payload)] == payload
+        assert frames[-1] == b"\x22" + payload[13:] + b"\x00"
+
+    def test_sequence_numbers_wrap_after_f(self):
+        payload = random.Random(1).randbytes(6 + 7 * 20)
+        frames = frame_bytes(IsoTpFrameFormat().encode(0x713, payload))
+        assert [frame[0] for frame in frames[1:]] == [0x20 | (n & 0x0F) for n in range(1, 21)]
+        assert reassemble(frames, 2) == payload
+
+    def test_messages_over_4095_bytes_use_32_bit_first_frame(self):
+        payload = random.Random(2).randbytes(5000)
+        frames = frame_bytes(IsoTpFrameFormat().encode(0x713, payload))
+        assert frames[0][:6] == b"\x10\x00" + (5000).to_bytes(4, "big")
+        assert reassemble(frames, 6)[:5000] == payload
+
+    def test_canfd_single_frame_uses_escape_length_and_dlc_rounding(self):
+        fmt = IsoTpFrameFormat(fd=True, tx_dl=64, padding=0xCC)
+        frames = frame_bytes(fmt.encode(0x713, bytes(10)))
+        assert frames == [b"\x00\x0A" + bytes(10)]  # 12字节为合法DLC，不需要填充
+        frames = frame_bytes(fmt.encode(0x713, bytes(11)))
+        assert frames == [b"\x00\x0B" + bytes(11) + b"\xCC" * 3]  # 13字节取整为16
+
+    def test_canfd_multi_frame(self):
+        payload = random.Random(3).randbytes(200)
+        frames = frame_bytes(IsoTpFrameFormat(fd=True, tx_dl=64).encode(0x713, payload))
+        assert [len(frame) for frame in frames] == [64, 64, 64, 16]
+        assert reassemble(frames, 2)[:200] == payload
+
+    def test_canfd_rejects_invalid_tx_dl(self):
+        with pytest.raises(ValueError):
+            IsoTpFrameFormat(fd=True, tx_dl=10)
+
+
+@pytest.mark.parametrize("stmin, seconds", [(0x00, 0.0), (0x05, 0.005), (0x7F, 0.127), (0xF1, 0.0001),
+                                            (0xF9, 0.0009), (0x80, 0.127), (0xFA, 0.127)])
+def test_stmin_seconds(stmin, seconds):
+    assert stmin_seconds(stmin) == pytest.approx(seconds)
+
+
+class TestFlowControl:
+
+    def request(self, sim, payload):
+        return UDS_service.get_transport(sim.device, sim.channel).request(payload)
+
+    def test_block_size_limits_frames_per_flow_control(self, sim):
+        sim.ecu.block_size = 4
+        payload = b"\x2E\xF1\x90" + bytes(60)  # 9个连续帧
+        response = self.request(sim, payload)
+        stats = UDS_service.get_last_transfer_stats()
+        assert response.positive
+        assert stats.flow_controls == 3
+        assert stats.frames == 10
+        assert stats.block_size == 4
+        assert sim.ecu.dids[0xF190] == bytes(60)
+
+    def test_wait_frames_are_followed(self, sim):
+        sim.ecu.fc_wait = 2
+        sim.ecu.fc_wait_interval = 0.001
+        response = self.request(sim, b"\x2E\xF1\x90" + bytes(20))
+        stats = UDS_service.get_last_transfer_stats()
+        assert response.positive
+        assert stats.waits == 2
+
+    def test_too_many_wait_frames_abort(self, sim):
+        sim.ecu.fc_wait = UDS_service.ISOTP_MAX_WAIT_FRAMES + 1
+        sim.ecu.fc_wait_interval = 0.001
+        assert self.request(sim, b"\x2E\xF1\x90" + bytes(20)) is None
+        time.sleep(0.05)  # 等虚拟ECU发完剩余的流控帧，不留给下一个测试的请求
+
+    def test_overflow_aborts(self, sim):
+        sim.ecu.rx_buffer_size = 16
+        assert self.request(sim, b"\x2E\xF1\x90" + bytes(20)) is None
+
+    def test_stmin_is_respected(self, sim):
+        sim.ecu.stmin = 2
+        response = UDS_service.PythonIsoTpTransport(sim.device, sim.channel, device_pacing=False).request(
+            b"\x2E\xF1\x90" + bytes(30))
+        assert response.positive
+        assert sim.ecu.stats["stmin_violations"] == 0
+
+
+class TestAdapterTransport:
+    """适配器固件ISO-TP（CAN_UDS_Request / CAN_UDS_Response）"""
+
+    LONG_DID = 0xF1A0
+
+    @pytest.fixture
+    def adapter(self, sim):
+        return lambda **kwargs: UDS_service.set_transport(sim.device, sim.channel, "adapter", **kwargs)
+
+    def test_request_and_response(self, sim, adapter):
+        response = adapter().request(b"\x22\xF1\x90")
+        assert response.positive and response.response_id == sim.ecu.response_id
+        assert bytes(response.payload) == b"\x62\xF1\x90" + bytes(sim.ecu.dids[0xF190])
+        assert UDS_service.get_last_response() is response
+
+    def test_multi_frame_request(self, sim, adapter):
+        adapter()
+        data = random.Random(0).randbytes(3000)
+        assert UDS_service.download(sim.device, sim.channel, 0x08000000, data)
+        assert sim.ecu.read_memory(0x08000000, len(data)) == data
+
+    def test_response_pending_waits_p2_star(self, sim, adapter):
+        sim.ecu.pending[0x11] = 2
+        sim.ecu.pending_interval = 0.05
+        response = adapter().request(b"\x11\x01", UDS_service.ECUTiming(p2=0.03, p2_star=0.2))
+        assert response.positive and response.pending_count == 2
+        assert response.elapsed >= 0.1
+
+    def test_response_after_p2_star_times_out(self, sim, adapter):
+        sim.ecu.pending[0x11] = 1
+        sim.ecu.pending_interval = 0.2
+        response = adapter().request(b"\x11\x01", UDS_service.ECUTiming(p2=0.03, p2_star=0.05))
+        assert response.timed_out and response.pending_count == 1
+        time.sleep(0.2)  # 等虚拟ECU发完迟到的应答，不留给下一个测试
+
+    def test_response_longer_than_buffer_fails(self, sim, adapter):
+        sim.ecu.dids[self.LONG_DID] = bytes(range(256)) * 20
+        assert len(sim.ecu.dids[self.LONG_DID]) + 3 > UDS_service.AdapterIsoTpTransport.RESPONSE_BUFFER_SIZE
+        assert adapter().request(b"\x22\xF1\xA0") is None
+
+    def test_larger_response_buffer(self, sim, adapter):
+        value = bytes(range(256)) * 20
+        sim.ecu.dids[self.LONG_DID] = value
+        response = adapter(response_buffer_size=8192).request(b"\x22\xF1\xA0")
+        assert bytes(response.payload) == b"\x62\xF1\xA0" + value
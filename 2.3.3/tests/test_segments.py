@@ -0,0 +1,156 @@
+"""FirmwareImage.plan_segments / blank_runs 与 UDS_service.flash_segments：逐段擦除和下载、空白区跳过"""
+import random
+
+import pytest
+
+from FirmwareImage import BLANK_RUN_THRESHOLD, SegmentedImage, blank_runs, plan_segments
+import UDS_service
+
+APP_ADDRESS = 0x08000000
+
+
+def image(*segments):
+    result = SegmentedImage()
+    for address, data in segments:
+        result.add(address, data)
+    return result
+
+
+def plan_of(firmware, **kwargs):
+    kwargs.setdefault("sector_size", 0x800)
+    kwargs.setdefault("blank_threshold", 0)
+    return plan_segments(firmware, APP_ADDRESS, **kwargs)
+
+
+def segments(plan):
+    return [(address, bytes(data)) for address, data in plan.segments]
+
+
+class TestPlanSegments:
+
+    def test_contiguous_data_is_one_segment_at_address(self):
+        plan = plan_of(b"\x01" * 0x900)
+        assert segments(plan) == [(APP_ADDRESS, b"\x01" * 0x900)]
+        assert plan.erase_ranges == [(APP_ADDRESS, 0x1000)]
+
+    def test_small_gap_is_filled_and_merged(self):
+        plan = plan_of(image((APP_ADDRESS, b"\x01" * 4), (APP_ADDRESS + 0x14, b"\x02" * 4)), max_gap=0x10)
+        assert segments(plan) == [(APP_ADDRESS, b"\x01" * 4 + b"\xFF" * 0x10 + b"\x02" * 4)]
+        assert (plan.padded_bytes, plan.skipped_bytes) == (0x10, 0)
+
+    def test_padding_uses_erased_value(self):
+        plan = plan_of(image((APP_ADDRESS, b"\x01"), (APP_ADDRESS + 2, b"\x02")), erased_value=0x00)
+        assert segments(plan) == [(APP_ADDRESS, b"\x01\x00\x02")]
+
+    def test_large_gap_is_skipped(self):
+        plan = plan_of(image((APP_ADDRESS, b"\x01" * 4), (APP_ADDRESS + 0x10000, b"\x02" * 4)))
+        assert segments(plan) == [(APP_ADDRESS, b"\x01" * 4), (APP_ADDRESS + 0x10000, b"\x02" * 4)]
+        assert plan.skipped_bytes == 0x10000 - 4
+        assert plan.erase_ranges == [(APP_ADDRESS, 0x800), (APP_ADDRESS + 0x10000, 0x800)]
+
+    def test_max_gap_zero_does_not_merge(self):
+        plan = plan_of(image((APP_ADDRESS, b"\x01"), (APP_ADDRESS + 2, b"\x02")), max_gap=0)
+        assert len(plan.segments) == 2
+
+    def test_segments_in_one_sector_are_erased_once(self):
+        plan = plan_of(image((APP_ADDRESS + 0x10, b"\x01"), (APP_ADDRESS + 0x400, b"\x02"),
+                             (APP_ADDRESS + 0x7FF, b"\x03\x04")), max_gap=0)
+        assert len(plan.segments) == 3
+        assert plan.erase_ranges == [(APP_ADDRESS, 0x1000)]
+        assert plan.erase_bytes == 0x1000
+
+    def test_unaligned_segment_erases_covering_sectors(self):
+        plan = plan_of(image((APP_ADDRESS + 0x7F0, b"\x01" * 0x20)))
+        assert plan.erase_ranges == [(APP_ADDRESS, 0x1000)]
+
+    def test_empty_segments_are_ignored(self):
+        assert plan_of(b"").segments == []
+        assert plan_of(b"").erase_ranges == []
+
+
+class TestBlankRuns:
+
+    def test_runs_not_shorter_than_threshold(self):
+        data = b"\x01" * 10 + b"\xFF" * 16 + b"\x02" + b"\xFF" * 15 + b"\x03" + b"\xFF" * 40
+        assert blank_runs(data, 0xFF, 16) == [(10, 26), (43, 83)]
+
+    def test_run_at_start_and_whole_data(self):
+        assert blank_runs(b"\xFF" * 20 + b"\x01", 0xFF, 8) == [(0, 20)]
+        assert blank_runs(b"\xFF" * 100, 0xFF, 8) == [(0, 100)]
+
+    def test_erased_value(self):
+        data = b"\x01" + b"\x00" * 32 + b"\xFF" * 32
+        assert blank_runs(data, 0x00, 16) == [(1, 33)]
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_byte_by_byte_scan(self, seed):
+        rng = random.Random(seed)
+        data = bytearray(rng.randbytes(4000))
+        for _ in range(30):
+            start = rng.randrange(len(data))
+            data[start:start + rng.randint(1, 200)] = b"\xFF" * 200
+        data = bytes(data[:4000])
+        expected, start = [], None
+        for index, value in enumerate(data + b"\x00"):
+            if value == 0xFF and start is None:
+                start = index
+            elif value != 0xFF and start is not None:
+                if index - start >= 32:
+                    expected.append((start, index))
+                start = None
+        assert blank_runs(data, 0xFF, 32) == expected
+
+    def test_threshold_must_be_positive(self):
+        with pytest.raises(ValueError):
+            blank_runs(b"\xFF", 0xFF, 0)
+
+
+class TestPlanBlankRuns:
+
+    def test_off_by_default(self):
+        data = b"\x01" * 16 + b"\xFF" * 0x1000 + b"\x02" * 16
+        plan = plan_segments(data, APP_ADDRESS)
+        assert segments(plan) == [(APP_ADDRESS, data)]
+        assert plan.blank_ranges == []
+
+    def test_segment_is_split_at_blank_runs(self):
+        data = b"\x01" * 16 + b"\xFF" * 0x1000 + b"\x02" * 16 + b"\xFF" * 8 + b"\x03"
+        plan = plan_of(data, blank_threshold=BLANK_RUN_THRESHOLD)
+        assert segments(plan) == [(APP_ADDRESS, b"\x01" * 16), (APP_ADDRESS + 0x1010, data[0x1010:])]
+        assert plan.blank_ranges == [(APP_ADDRESS + 16, 0x1000)]
+        assert plan.erase_ranges == [(APP_ADDRESS, 0x1800)]
+        assert [address for address, _ in plan.layout()] == [APP_ADDRESS, APP_ADDRESS + 16, APP_ADDRESS + 0x1010]
+
+    def test_trailing_blank_run_is_not_downloaded(self):
+        plan = plan_of(b"\x01" * 4 + b"\xFF" * 0x800, blank_threshold=0x100)
+        assert segments(plan) == [(APP_ADDRESS, b"\x01" * 4)]
+        assert plan.blank_bytes == 0x800
+
+
+class TestFlashSegments:
+
+    def test_multi_segment_image(self, sim):
+        rng = random.Random(0)
+        firmware = image((APP_ADDRESS, rng.randbytes(3000)), (APP_ADDRESS + 0x10000, rng.randbytes(500)))
+        sim.ecu._flash_log[:] = [(APP_ADDRESS + 0x2000, 4, b"\xAA" * 4)]  # 段之间的空隙
+        assert UDS_service.flash_segments(sim.device, sim.channel, firmware, APP_ADDRESS, 0x800, blank_threshold=0)
+        for segment in firmware:
+            assert sim.ecu.read_memory(segment.address, len(segment.data)) == bytes(segment.data)
+        assert sim.ecu.read_memory(APP_ADDRESS + 0x2000, 4) == b"\xAA" * 4
+        assert sim.ecu.erased == [(APP_ADDRESS, 0x1000), (APP_ADDRESS + 0x10000, 0x800)]
+        assert UDS_service.get_last_segment_plan().download_bytes == 3500
+
+    def test_bytes_are_flashed_at_address(self, sim):
+        data = random.Random(1).randbytes(1000)
+        assert UDS_service.flash_segments(sim.device, sim.channel, data, APP_ADDRESS + 0x800, 0x800,
+                                          blank_threshold=0)
+        assert sim.ecu.read_memory(APP_ADDRESS + 0x800, len(data)) == data
+
+    def test_blank_runs_are_erased_not_downloaded(self, sim):
+        data = random.Random(2).randbytes(0x300) + b"\xFF" * 0x1000 + random.Random(3).randbytes(0x300)
+        sim.ecu._flash_log[:] = [(APP_ADDRESS, len(data), random.Random(4).randbytes(len(data)))]
+        assert UDS_service.flash_segments(sim.device, sim.channel, data, APP_ADDRESS, 0x800,
+                                          blank_threshold=BLANK_RUN_THRESHOLD)
+        assert sim.ecu.read_memory(APP_ADDRESS, len(data)) == data
+        plan = UDS_service.get_last_segment_plan()
+        assert (len(plan.segments), plan.download_bytes, plan.blank_bytes) == (2, 0x600, 0x1000)
@@ -0,0 +1,39 @@
+"""UDSController.firmware_update：逐段擦除后按段下载"""
+import random
+
+import pytest
+
+from FirmwareImage import SegmentedImage
+from UDSConsole import UDSConsole
+from UDSController import FIRMWARE_ADDRESS, UDSController
+
+SECTOR = 0x800
+
+
+@pytest.fixture
+def controller(sim):
+    controller = UDSController(UDSConsole())
+    assert controller.connect_device()
+    assert controller.usb_handler.DevHandles[0] == sim.device
+    controller.can_controller.CANChannel = sim.channel
+    return controller
+
+
+def test_data_without_address_is_flashed_to_firmware_address(sim, controller):
+    data = random.Random(0).randbytes(3000)
+    progress = []
+    assert controller.firmware_update(data, progress.append)
+    assert sim.ecu.erased == [(0x00080000, 2 * SECTOR)]
+    assert sim.ecu.read_memory(0x00080000, len(data)) == data
+    assert progress[-1] == 100 and progress == sorted(set(progress))
+
+
+def test_segments_erase_only_their_sectors(sim, controller):
+    first, second = random.Random(1).randbytes(100), random.Random(2).randbytes(SECTOR + 1)
+    image = SegmentedImage()
+    image.add(FIRMWARE_ADDRESS + 0x10, first)
+    image.add(FIRMWARE_ADDRESS + 0x10000, second)
+    assert controller.firmware_update(image)
+    assert sim.ecu.erased == [(FIRMWARE_ADDRESS, SECTOR), (FIRMWARE_ADDRESS + 0x10000, 2 * SECTOR)]
+    assert sim.ecu.read_memory(FIRMWARE_ADDRESS + 0x10, len(first)) == first
+    assert sim.ecu.read_memory(FIRMWARE_ADDRESS + 0x10000, len(second)) == second
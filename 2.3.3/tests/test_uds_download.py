@@ -0,0 +1,60 @@
+"""UDS_service：0x34 应答中 maxNumberOfBlockLength 的解析与 0x36 块大小"""
+import random
+
+import pytest
+
+import UDS_service
+from UDS_service import ISOTP_MAX_MESSAGE_LENGTH, parse_request_download_response, transfer_block_size
+
+APP_ADDRESS = 0x08000000
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (b"\x74\x20\x04\x02", 0x402),
+    (b"\x74\x10\x80", 0x80),
+    (b"\x74\x40\x00\x01\x00\x00", 0x10000),
+    (b"\x74\x10\x03", 3),
+])
+def test_parse_request_download_response(payload, expected):
+    assert parse_request_download_response(payload) == expected
+
+
+@pytest.mark.parametrize("payload", [
+    b"", b"\x74", b"\x7F\x34\x22", b"\x74\x00\x04", b"\x74\x20\x04",  # 格式错误
+    b"\x74\x10\x00", b"\x74\x10\x01", b"\x74\x20\x00\x02",  # 放不下1字节数据
+])
+def test_parse_request_download_response_rejects(payload):
+    assert parse_request_download_response(payload) is None
+
+
+class TestTransferBlockSize:
+
+    def test_subtracts_service_id_and_sequence_counter(self):
+        assert transfer_block_size(0x402) == 0x400
+        assert transfer_block_size(3) == 1
+
+    def test_clamped_to_isotp_message_length(self):
+        assert transfer_block_size(0x2000) == ISOTP_MAX_MESSAGE_LENGTH - 2
+        assert transfer_block_size(0x2000, max_message_length=0xFFFFFFFF) == 0x2000 - 2
+
+    def test_override(self):
+        assert transfer_block_size(0x402, 16) == 16
+
+    @pytest.mark.parametrize("max_block_length", [0, 1, 2])
+    def test_too_small_is_rejected(self, max_block_length):
+        with pytest.raises(ValueError):
+            transfer_block_size(max_block_length)
+
+
+class TestDownload:
+
+    def test_too_small_max_block_length_fails_request_download(self, sim):
+        sim.ecu.max_block_length = 2
+        assert UDS_service.download(sim.device, sim.channel, APP_ADDRESS, bytes(16)) is False
+
+    def test_large_max_block_length_is_clamped(self, sim):
+        sim.ecu.max_block_length = 0x2000
+        data = random.Random(0).randbytes(10000)
+        assert UDS_service.download(sim.device, sim.channel, APP_ADDRESS, data)
+        assert UDS_service.get_last_download_stats().block_size == ISOTP_MAX_MESSAGE_LENGTH - 2
+        assert sim.ecu.read_memory(APP_ADDRESS, len(data)) == data
@@ -0,0 +1,114 @@
+"""UDS_OTA / UDS_service：0x31 内存完整性检查与刷写流程"""
+import random
+
+import pytest
+
+import UDS_OTA
+import UDS_service
+from CANDispatcher import stop_dispatcher
+from FirmwareDigest import image_digest
+from UDS_service import check_memory_integrity
+
+APP_ADDRESS = 0x08000000
+INTEGRITY_ROUTINE = 0x0203
+
+# 会话、安全访问、指纹等步骤替换为成功（完整流程见 TestPerformUpdateCanFd）；
+# 擦除、下载和内存完整性检查在虚拟ECU上实际执行
+_STUBBED_STEPS = ("initialize_can", "wakeup", "enter_extended_session", "control_dtc_setting",
+                  "control_communication", "enter_programming_session", "unlock_security",
+                  "write_fingerprint_data", "_check_program_compatibility", "ecu_reset",
+                  "enter_default_session", "_clear_all_dtc")
+
+
+class Console:
+    """记录日志的 console（UDS_OTA 使用 log / debug / error）"""
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, message):
+        self.messages.append(message)
+
+    debug = error = log
+
+
+class TestCheckMemoryIntegrity:
+
+    def test_routine_status_ok(self, sim):
+        assert check_memory_integrity(sim.device, sim.channel) is True
+
+    @pytest.mark.parametrize("status", [b"\x01", b"\x02\x00", b""])
+    def test_routine_status_not_ok(self, sim, status):
+        sim.ecu.routine_results[INTEGRITY_ROUTINE] = status
+        assert check_memory_integrity(sim.device, sim.channel) is False
+
+    def test_digest_is_appended_to_request(self, sim):
+        requests = []
+        sim.ecu.routine_results[INTEGRITY_ROUTINE] = lambda payload: requests.append(bytes(payload)) or b"\x00"
+        digest = image_digest(b"firmware", "sha256")
+        assert check_memory_integrity(sim.device, sim.channel, digest=digest) is True
+        assert requests == [b"\x31\x01\x02\x03" + digest]
+
+
+class TestPerformUpdate:
+
+    @pytest.fixture
+    def ota(self, sim, monkeypatch):
+        monkeypatch.setattr(UDS_OTA, "sleep", lambda seconds: None)
+        ota = UDS_OTA.UDS_OTA(sim.device, sim.channel, console=Console(), integrity="crc32",
+                              memory_address=APP_ADDRESS)
+        for name in _STUBBED_STEPS:
+            monkeypatch.setattr(ota, name, lambda *args, **kwargs: True)
+        return ota
+
+    def test_success(self, sim, ota):
+        firmware = random.Random(0).randbytes(3000)
+        assert ota.perform_update(firmware) is True
+        assert sim.ecu.read_memory(APP_ADDRESS, len(firmware)) == firmware
+        assert ota.digest.digest() == image_digest(firmware, "crc32")
+
+    def test_integrity_mismatch_fails_update(self, sim, ota):
+        sim.ecu.routine_results[INTEGRITY_ROUTINE] = b"\x01"
+        assert ota.perform_update(random.Random(0).randbytes(3000)) is False
+        assert "内存完整性检查失败" in ota.console.messages
+
+
+class TestPerformUpdateCanFd:
+    """不替换任何步骤，整个刷写流程经 CANFD 连接在虚拟ECU上执行"""
+
+    @pytest.fixture
+    def canfd(self, sim):
+        from ctypes import byref
+        from usb2can import CAN_INIT_CONFIG, CAN_Init
+        from usb2canfd import CANFD_INIT_CONFIG, CANFD_Init
+        # 通道的调度器只能按一种报文类型接收，切换前后都停止调度器
+        stop_dispatcher(sim.device, sim.channel)
+        CANFD_Init(sim.device, sim.channel, byref(CANFD_INIT_CONFIG()))
+        UDS_service.set_transport(sim.device, sim.channel, "canfd")
+        yield sim
+        stop_dispatcher(sim.device, sim.channel)
+        CAN_Init(sim.device, sim.channel, byref(CAN_INIT_CONFIG()))
+
+    def test_success(self, canfd, monkeypatch):
+        sim = canfd
+        monkeypatch.setattr(UDS_OTA, "sleep", lambda seconds: None)
+        sim.ecu.key_func = UDS_OTA.calculate_key_from_seed
+        requests = []
+        handle_request = sim.ecu._handle_request
+
+        def record(payload, fd, t):
+            requests.append((payload[:2], fd))
+            handle_request(payload, fd, t)
+
+        monkeypatch.setattr(sim.ecu, "_handle_request", record)
+        firmware = random.Random(0).randbytes(3000)
+        ota = UDS_OTA.UDS_OTA(sim.device, sim.channel, console=Console(), integrity="crc32",
+                              memory_address=APP_ADDRESS)
+        assert ota.perform_update(firmware) is True, ota.console.messages
+        assert sim.ecu.read_memory(APP_ADDRESS, len(firmware)) == firmware
+        assert all(fd for _, fd in requests)
+        services = [bytes(prefix) for prefix, _ in requests]
+        for prefix in (b"\x10\x03", b"\x10\x83", b"\x85\x82", b"\x28\x83", b"\x10\x02", b"\x27\x01",
+                       b"\x27\x02", b"\x2E\xF1", b"\x11\x01", b"\x10\x81", b"\x14\xFF"):
+            assert prefix in services
+        assert sim.ecu.session == 0x01 and sim.ecu.security_level == 0
@@ -0,0 +1,47 @@
+"""UDS_OTA_Handler：经 python-can / isotp 下载数据段"""
+import random
+
+import isotp
+import pytest
+
+import UDS_OTA_Handler
+from FirmwareCompression import COMPRESSION_NONE, COMPRESSION_ZLIB
+from FirmwareDigest import ImageDigest, image_digest
+from usb_sim import SimCanBus
+
+APP_ADDRESS = 0x08000000
+DATA = random.Random(0).randbytes(1500) + bytes(1500)
+
+
+@pytest.fixture
+def stack(sim):
+    bus = SimCanBus(sim.channel)
+    yield bus, isotp.CanStack(bus=bus, address=isotp.Address(txid=0x713, rxid=0x71B))
+    bus.shutdown()
+
+
+def handler(bus, compression):
+    ota = UDS_OTA_Handler.UDS_OTA_Handler(None, 0, console=lambda *args: None, bus=bus, compression=compression)
+    ota.testWaitForTimeout = lambda ms: None
+    ota.digest = ImageDigest("crc32")
+    return ota
+
+
+def test_uncompressed_segment_is_sent_without_compressing(sim, stack, monkeypatch):
+    def compress_image(*args, **kwargs):
+        raise AssertionError("不压缩时不应调用 compress_image")
+
+    monkeypatch.setattr(UDS_OTA_Handler, "compress_image", compress_image)
+    bus, isotp_stack = stack
+    ota = handler(bus, COMPRESSION_NONE)
+    assert ota.download_segment(isotp_stack, APP_ADDRESS, DATA) == 0
+    assert sim.ecu.read_memory(APP_ADDRESS, len(DATA)) == DATA
+    assert ota.digest.digest() == image_digest(DATA, "crc32")
+
+
+def test_compressed_segment(sim, stack):
+    bus, isotp_stack = stack
+    ota = handler(bus, COMPRESSION_ZLIB)
+    assert ota.download_segment(isotp_stack, APP_ADDRESS, DATA) == 0
+    assert sim.ecu.read_memory(APP_ADDRESS, len(DATA)) == DATA
+    assert ota.digest.digest() == image_digest(DATA, "crc32")
@@ -0,0 +1,62 @@
+"""UDS_service：服务函数返回的 UDSResponse 与应答时间"""
+import UDS_service
+
+
+def test_pass_fail_services_return_the_response(sim):
+    response = UDS_service.ecu_reset(sim.device, sim.channel)
+    assert response and response.positive
+    assert bytes(response.payload[:2]) == b"\x51\x01"
+    assert response.response_id == sim.ecu.response_id
+    assert response.elapsed > 0
+    assert UDS_service.get_last_response() is response
+    assert UDS_service.control_dtc_setting(sim.device, sim.channel, 0x02).payload[0] == 0xC5
+    assert UDS_service.control_communication(sim.device, sim.channel, 0x03, 0x03).positive
+    assert UDS_service.enter_default_session(sim.device, sim.channel, "physical").positive
+
+
+def test_negative_response_is_false_but_keeps_timing(sim):
+    sim.ecu.script(b"\x11", b"\x7F\x11\x22")
+    response = UDS_service.ecu_reset(sim.device, sim.channel)
+    assert not response
+    assert response.nrc == 0x22
+    assert response.elapsed > 0
+
+
+def test_no_response_is_false(sim):
+    sim.ecu.script(b"\x85", None)
+    timing = UDS_service.ECUTiming(p2=0.02, p2_star=0.05)
+    response = UDS_service.control_dtc_setting(sim.device, sim.channel, 0x02, timing=timing)
+    assert not response and response.timed_out
+    assert response.elapsed >= 0.02
+
+
+def test_suppressed_positive_response_without_answer_is_true(sim):
+    timing = UDS_service.ECUTiming(p2=0.02, p2_star=0.05)
+    response = UDS_service.control_dtc_setting(sim.device, sim.channel, 0x82, timing=timing)
+    assert response and response.suppressed and response.timed_out
+    assert UDS_service.enter_default_session(sim.device, sim.channel, timing=timing)
+    assert UDS_service.send_diagnostic_session_control(sim.device, sim.channel, 0x83, "functional", timing=timing)
+    assert sim.ecu.session == 0x03
+
+
+def test_suppressed_request_still_reports_negative_response(sim):
+    sim.ecu.script(b"\x85", b"\x7F\x85\x22")
+    response = UDS_service.control_dtc_setting(sim.device, sim.channel, 0x82)
+    assert not response and response.nrc == 0x22
+
+
+def test_response_pending_extends_to_p2_star(sim):
+    sim.ecu.pending[0x11] = 2
+    sim.ecu.pending_interval = 0.03
+    timing = UDS_service.ECUTiming(p2=0.02, p2_star=0.2)
+    response = UDS_service.ecu_reset(sim.device, sim.channel, timing=timing)
+    assert response.positive
+    assert response.pending_count == 2
+    assert response.elapsed >= 0.06
+
+
+def test_data_services_record_last_response(sim):
+    seed = UDS_service.request_security_access(sim.device, sim.channel, 0x01)
+    response = UDS_service.get_last_response()
+    assert response.service_id == 0x27 and response.positive
+    assert bytes(seed) == bytes(response.payload[2:])
@@ -3,7 +3,6 @@
 更多帮助：www.usbxyz.com
 """
 from ctypes import *
-import platform
 from usb_device import *
 
 # 1.CAN信息帧的数据类型定义
@@ -210,3 +209,24 @@ def CAN_BL_Excute(DevHandle,CANIndex,NodeAddr,Type):
 
 def CAN_BL_SetNewBaudRate(DevHandle,CANIndex,NodeAddr,pInitConfig,NewBaudRate,TimeOut):
     return USB2XXXLib.CAN_BL_SetNewBaudRate(DevHandle,CANIndex,NodeAddr,pInitConfig,NewBaudRate,TimeOut)
+
+register_prototypes({
+    "CAN_Init": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CAN_Filter_Init": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CAN_StartGetMsg": (c_int, [c_uint, c_ubyte]),
+    "CAN_StopGetMsg": (c_int, [c_uint, c_ubyte]),
+    "CAN_SendMsg": (c_int, [c_uint, c_ubyte, c_void_p, c_uint]),
+    "CAN_GetMsg": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CAN_GetMsgWithSize": (c_int, [c_uint, c_ubyte, c_void_p, c_int]),
+    "CAN_ClearMsg": (c_int, [c_uint, c_ubyte]),
+    "CAN_GetStatus": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CAN_SetSchedule": (c_int, [c_uint, c_ubyte, c_void_p, c_void_p, c_void_p, c_ubyte]),
+    "CAN_StartSchedule": (c_int, [c_uint, c_ubyte, c_ubyte, c_ubyte, c_ubyte]),
+    "CAN_StopSchedule": (c_int, [c_uint, c_ubyte]),
+    "CAN_BL_Init": (c_int, [c_uint, c_int, c_void_p, c_void_p]),
+    "CAN_BL_NodeCheck": (c_int, [c_uint, c_int, c_ushort, c_void_p, c_void_p, c_uint]),
+    "CAN_BL_Erase": (c_int, [c_uint, c_int, c_ushort, c_uint, c_uint]),
+    "CAN_BL_Write": (c_int, [c_uint, c_int, c_ushort, c_uint, c_void_p, c_uint, c_uint]),
+    "CAN_BL_Excute": (c_int, [c_uint, c_int, c_ushort, c_uint]),
+    "CAN_BL_SetNewBaudRate": (c_int, [c_uint, c_int, c_ushort, c_void_p, c_uint, c_uint]),
+})
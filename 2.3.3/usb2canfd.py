@@ -3,7 +3,6 @@
 更多帮助：www.toomoss.com
 """
 from ctypes import *
-import platform
 from usb_device import *
 
 # 1.CANFD信息帧的数据类型定义
@@ -135,3 +134,17 @@ def CANFD_StartSchedule(DevHandle, CANIndex, MsgTabIndex,TimePrecMs, OrderSend):
 
 def CANFD_StopSchedule(DevHandle, CANIndex):
     return USB2XXXLib.CANFD_StopSchedule(DevHandle, CANIndex)
+
+register_prototypes({
+    "CANFD_Init": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CANFD_StartGetMsg": (c_int, [c_uint, c_ubyte]),
+    "CANFD_StopGetMsg": (c_int, [c_uint, c_ubyte]),
+    "CANFD_SendMsg": (c_int, [c_uint, c_ubyte, c_void_p, c_int]),
+    "CANFD_GetMsg": (c_int, [c_uint, c_ubyte, c_void_p, c_int]),
+    "CANFD_SetFilter": (c_int, [c_uint, c_ubyte, c_void_p, c_ubyte]),
+    "CANFD_GetDiagnostic": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CANFD_GetBusError": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "CANFD_SetSchedule": (c_int, [c_uint, c_ubyte, c_void_p, c_void_p, c_void_p, c_ubyte]),
+    "CANFD_StartSchedule": (c_int, [c_uint, c_ubyte, c_ubyte, c_ubyte, c_ubyte]),
+    "CANFD_StopSchedule": (c_int, [c_uint, c_ubyte]),
+})
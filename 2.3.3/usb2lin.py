@@ -3,7 +3,6 @@
 更多帮助：www.usbxyz.com
 """
 from ctypes import *
-import platform
 from usb_device import *
 
 # 定义函数返回错误代码
@@ -59,4 +58,13 @@ def LIN_SlaveSetIDMode(DevHandle,LINIndex,IDMode,pLINMsg,Len):
     return USB2XXXLib.LIN_SlaveSetIDMode(DevHandle,LINIndex,IDMode,pLINMsg,Len)
 
 def LIN_SlaveGetData(DevHandle,LINIndex,pLINMsg):
-    return USB2XXXLib.LIN_SlaveGetData(DevHandle,LINIndex,pLINMsg)
\ No newline at end of file
+    return USB2XXXLib.LIN_SlaveGetData(DevHandle,LINIndex,pLINMsg)
+
+register_prototypes({
+    "LIN_Init": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "LIN_SendBreak": (c_int, [c_uint, c_ubyte]),
+    "LIN_Write": (c_int, [c_uint, c_ubyte, c_void_p, c_uint]),
+    "LIN_Read": (c_int, [c_uint, c_ubyte, c_void_p, c_uint]),
+    "LIN_SlaveSetIDMode": (c_int, [c_uint, c_ubyte, c_ubyte, c_void_p, c_uint]),
+    "LIN_SlaveGetData": (c_int, [c_uint, c_ubyte, c_void_p]),
+})
@@ -2,12 +2,14 @@
 文件说明：USB2XXX设备操作相关函数集合
 更多帮助：www.toomoss.com
 使用说明：程序正常运行，需要将sdk/libs目录复制到程序目录下
+          库文件在第一次调用设备函数时才加载，查找顺序见 lib_search_dirs()
+          设置环境变量 USB2XXX_BACKEND=sim 时使用模拟后端（usb_sim），不加载库文件，无需连接适配器
 """
 
 from ctypes import *
-import platform
 import os
-import shutil
+import functools
+import threading
 
 # Device info define
 class DEVICE_INFO(Structure):
@@ -27,48 +29,140 @@ POWER_LEVEL_2V5     = 2 # 输出2.5V
 POWER_LEVEL_3V3     = 3 # 输出3.3V
 POWER_LEVEL_5V0     = 4 # 输出5.0V
 
-#复制库文件到程序目录下
-if(not os.path.exists("libs")):
-    if(os.path.exists("../../../../sdk/libs")):
-        shutil.copytree("../../../../sdk/libs", "./libs")
-    else:
-        print("libs does not exist,You need to manually copy the libs directory to the current directory")
-        exit()
-
-#根据系统自动导入对应的库文件，若没能识别到正确的系统，可以修改下面的源码
-if(platform.system()=="Windows"):
-    if "64bit" in platform.architecture():
-        windll.LoadLibrary(os.getcwd()+"/libs/windows/x86_64/libusb-1.0.dll" )
-        USB2XXXLib = windll.LoadLibrary(os.getcwd()+"/libs/windows/x86_64/USB2XXX.dll" )
-    else:
-        windll.LoadLibrary(os.getcwd()+"/libs/windows/x86/libusb-1.0.dll" )
-        USB2XXXLib = windll.LoadLibrary(os.getcwd()+"/libs/windows/x86/USB2XXX.dll" )
-elif(platform.system()=="Darwin"):
-    cdll.LoadLibrary(os.getcwd()+"/libs/mac_os/libusb-1.0.dylib" )
-    USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/mac_os/libUSB2XXX.dylib" )
-elif(platform.system()=="Linux"):
-    if 'armv7' in platform.machine():
-        cdll.LoadLibrary(os.getcwd()+"/libs/linux/armv7/libusb-1.0.so" )
-        USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/armv7/libUSB2XXX.so" )
-    elif 'mips64' in platform.machine():
-        cdll.LoadLibrary(os.getcwd()+"/libs/linux/mips64/libusb-1.0.so" )
-        USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/mips64/libUSB2XXX.so" )
-    elif 'aarch64' in platform.machine():
-        cdll.LoadLibrary(os.getcwd()+"/libs/linux/aarch64/libusb-1.0.so" )
-        USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/aarch64/libUSB2XXX.so" )
-    elif 'arm64' in platform.machine():
-        cdll.LoadLibrary(os.getcwd()+"/libs/linux/arm64/libusb-1.0.so" )
-        USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/arm64/libUSB2XXX.so" )
-    else:
-        if "64bit" in platform.architecture():
-            cdll.LoadLibrary(os.getcwd()+"/libs/linux/x86_64/libusb-1.0.so" )
-            USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/x86_64/libUSB2XXX.so" )
-        else:
-            cdll.LoadLibrary(os.getcwd()+"/libs/linux/x86/libusb-1.0.so" )
-            USB2XXXLib = cdll.LoadLibrary(os.getcwd()+"/libs/linux/x86/libUSB2XXX.so" )
+# 后端选择：native-USB2XXX库文件（默认），sim-模拟适配器和虚拟ECU
+USB2XXX_BACKEND = os.environ.get("USB2XXX_BACKEND", "native").lower()
+
+
+class USB2XXXLoadError(OSError):
+    """找不到或无法加载USB2XXX库文件"""
+
+
+def lib_search_dirs():
+    """
+    库文件查找目录（按顺序）：环境变量 USB2XXX_LIB_DIR、当前目录下的 libs、
+    本文件所在目录下的 libs、SDK中的 libs（原地使用，不再复制到程序目录）
+    """
+    dirs = []
+    if os.environ.get("USB2XXX_LIB_DIR"):
+        dirs.append(os.environ["USB2XXX_LIB_DIR"])
+    dirs.append(os.path.join(os.getcwd(), "libs"))
+    dirs.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "libs"))
+    dirs.append(os.path.abspath("../../../../sdk/libs"))
+    return dirs
+
+
+def _platform_lib_files():
+    """根据系统返回 (libs下的子目录, libusb文件名, USB2XXX库文件名)，若没能识别到正确的系统，可以修改下面的源码"""
+    import platform
+    system = platform.system()
+    machine = platform.machine()
+    if(system=="Windows"):
+        arch = "x86_64" if "64bit" in platform.architecture() else "x86"
+        return "windows/" + arch, "libusb-1.0.dll", "USB2XXX.dll"
+    elif(system=="Darwin"):
+        return "mac_os", "libusb-1.0.dylib", "libUSB2XXX.dylib"
+    elif(system=="Linux"):
+        for arch in ("armv7", "mips64", "aarch64", "arm64"):
+            if arch in machine:
+                return "linux/" + arch, "libusb-1.0.so", "libUSB2XXX.so"
+        arch = "x86_64" if "64bit" in platform.architecture() else "x86"
+        return "linux/" + arch, "libusb-1.0.so", "libUSB2XXX.so"
+    raise USB2XXXLoadError("unsupported system: " + system)
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_lib_paths(lib_dir=None):
+    """
+    查找库文件，返回 (libusb路径, USB2XXX库路径)，结果按 lib_dir 缓存
+    lib_dir 为 None 时依次在 lib_search_dirs() 中查找；目录变化后调用 resolve_lib_paths.cache_clear()
+    """
+    subdir, libusb_name, usb2xxx_name = _platform_lib_files()
+    dirs = [lib_dir] if lib_dir else lib_search_dirs()
+    for base in dirs:
+        folder = os.path.join(base, subdir)
+        usb2xxx_path = os.path.join(folder, usb2xxx_name)
+        if os.path.exists(usb2xxx_path):
+            return os.path.join(folder, libusb_name), usb2xxx_path
+    raise USB2XXXLoadError("libs does not exist, searched: " + ", ".join(dirs)
+                           + ". Copy the sdk/libs directory to the current directory or set USB2XXX_LIB_DIR")
+
+
+_native_lib = None
+_native_lib_lock = threading.RLock()
+
+# 函数原型 {函数名: (restype, argtypes)}，由各封装模块通过 register_prototypes 登记，
+# 库文件加载时一次性设置并把函数指针绑定到 USB2XXXLib 上
+_prototypes = {}
+
+# 每帧都会调用的函数只设置 restype，不声明 argtypes：CPython 中声明 argtypes 后每个参数都要经过 from_param 转换，
+# 实测单次调用多约 0.7~1.2 微秒（约为只设置 restype 时的2倍，见 benchmarks/bench_ctypes.py），只设置 restype 时与修改前相同。
+# 这些函数的参数都是整数和 byref()，未声明 argtypes 时按 C int 传递，句柄最高位为1时结果相同；
+# 参数类型由调用方保证，不做 ArgumentError 检查
+HOT_FUNCTIONS = frozenset(["CAN_SendMsg", "CAN_GetMsg", "CAN_GetMsgWithSize", "CANFD_SendMsg", "CANFD_GetMsg"])
+
+
+def register_prototypes(prototypes):
+    """登记函数原型，库文件已加载时立即生效"""
+    with _native_lib_lock:
+        _prototypes.update(prototypes)
+        if _native_lib is not None:
+            _bind_functions(prototypes)
+
+
+def _bind_functions(prototypes):
+    for name, (restype, argtypes) in prototypes.items():
+        try:
+            func = getattr(_native_lib, name)
+        except AttributeError:
+            continue  # 旧版本库文件中没有该函数，调用时再报错
+        func.restype = restype
+        if name not in HOT_FUNCTIONS:
+            func.argtypes = argtypes
+        setattr(_lazy_lib, name, func)
+
+
+def load_library(lib_dir=None):
+    """加载libusb和USB2XXX库（只加载一次）并绑定已登记的函数原型，失败时抛出 USB2XXXLoadError"""
+    global _native_lib
+    with _native_lib_lock:
+        if _native_lib is None:
+            libusb_path, usb2xxx_path = resolve_lib_paths(lib_dir)
+            loader = windll if os.name == "nt" else cdll
+            try:
+                if os.path.exists(libusb_path):
+                    loader.LoadLibrary(libusb_path)
+                _native_lib = loader.LoadLibrary(usb2xxx_path)
+            except OSError as e:
+                raise USB2XXXLoadError("failed to load " + usb2xxx_path + ": " + str(e)) from e
+            _bind_functions(_prototypes)
+        return _native_lib
+
+
+def is_library_loaded():
+    return _native_lib is not None
+
+
+class _LazyUSB2XXXLib:
+    """
+    USB2XXX库的延迟加载代理：导入本模块时不加载库文件，第一次调用库函数时才加载，
+    加载时已登记原型的函数全部绑定为代理对象的属性，其余函数在第一次访问时缓存，之后的调用不再经过 __getattr__
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        func = getattr(load_library(), name)
+        setattr(self, name, func)
+        return func
+
+
+_lazy_lib = _LazyUSB2XXXLib()
+
+if(USB2XXX_BACKEND == "sim"):
+    from usb_sim import get_sim_lib
+    USB2XXXLib = get_sim_lib()
 else:
-    print("unsupported system")
-    exit()
+    USB2XXXLib = _lazy_lib
 
 # Scan device
 def USB_ScanDevice(pDevHandle):
@@ -108,3 +202,17 @@ def DEV_GetTimestamp(DevHandle,BusType,pTimestamp):
 def DEV_ResetTimestamp(DevHandle):
     return USB2XXXLib.DEV_ResetTimestamp(DevHandle)
 
+# 函数原型：设备句柄按无符号数传递，指针参数统一为 c_void_p，兼容 byref(结构体)、byref(数组)和数组
+register_prototypes({
+    "USB_ScanDevice": (c_int, [c_void_p]),
+    "USB_OpenDevice": (c_int, [c_uint]),
+    "USB_ResetDevice": (c_int, [c_uint]),
+    "DEV_GetDeviceInfo": (c_int, [c_uint, c_void_p, c_void_p]),
+    "USB_CloseDevice": (c_int, [c_uint]),
+    "DEV_EraseUserData": (c_int, [c_uint]),
+    "DEV_WriteUserData": (c_int, [c_uint, c_int, c_void_p, c_int]),
+    "DEV_ReadUserData": (c_int, [c_uint, c_int, c_void_p, c_int]),
+    "DEV_SetPowerLevel": (c_int, [c_uint, c_ubyte]),
+    "DEV_GetTimestamp": (c_int, [c_uint, c_ubyte, c_void_p]),
+    "DEV_ResetTimestamp": (c_int, [c_uint]),
+})
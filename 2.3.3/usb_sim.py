@@ -0,0 +1,1235 @@
+"""
+文件说明：USB2XXX模拟后端（虚拟适配器 + 虚拟CAN总线 + 虚拟ECU）
+不连接Toomoss适配器时代替 USB2XXX.dll / libUSB2XXX.so，用于调试、性能分析和基准测试。
+    SimUSB2XXXLib：与 USB2XXXLib 同名同参数的函数集合（USB_ScanDevice、CAN_Init、CAN_SendMsg、
+                   CAN_GetMsg、CAN_SetSchedule、CANFD_*、DEV_GetTimestamp 等），未实现的函数返回 CAN_ERR_NOT_SUPPORT
+    VirtualBus   ：进程内虚拟CAN总线，设置波特率后按帧长计算每帧的传输时间
+    VirtualECU   ：可编程的虚拟ECU，按ISO-TP收发，应答 UDS_OTA_Handler.perform_ota_update 使用的刷写流程
+    CAN_UDS_Request / CAN_UDS_Response：模拟适配器固件中的ISO-TP（分帧、流控和STmin都在"固件"中完成）
+    SimCanBus    ：python-can 接口的虚拟总线节点，供 UDS_OTA_Handler（python-can + isotp）使用
+
+选择方法：导入 usb_device（或任何 usb2can / UDS 模块）之前设置环境变量
+    USB2XXX_BACKEND=sim            使用本模拟后端
+    USB2XXX_SIM_LATENCY_MS=1       虚拟ECU应答延迟（毫秒）
+    USB2XXX_SIM_BITRATE=500000     虚拟总线仲裁段波特率，0 表示不计传输时间
+    USB2XXX_SIM_DATA_BITRATE=2000000  CANFD数据段波特率（BRS）
+    USB2XXX_SIM_USB_LATENCY_MS=0.25   每次收发函数调用（一次USB传输）的耗时（毫秒），0 表示不计
+
+用法：
+    lib = usb_sim.get_sim_lib()
+    ecu = lib.ecus[0]
+    ecu.pending[0x31] = 2                      # 例程控制先回两次 NRC 0x78
+    ecu.script(b"\\x22\\xF1\\x95", b"\\x62\\xF1\\x95SIM")  # 固定应答
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from ctypes import c_ubyte, c_uint, c_ushort, c_void_p, cast, memmove, memset, addressof, sizeof, Array
+
+try:
+    import can
+except ImportError:
+    can = None
+
+# 与 usb2can 中的返回值定义一致（本模块在 usb_device 导入过程中加载，不能反向导入 usb2can）
+CAN_SUCCESS = 0
+CAN_ERR_NOT_SUPPORT = -1
+CAN_ERR_CMD_FAIL = -4
+
+# 与 usb2canfd 中的标志位定义一致
+CANFD_MSG_FLAG_RTR = 0x40000000
+CANFD_MSG_FLAG_IDE = 0x80000000
+CANFD_MSG_FLAG_ID_MASK = 0x1FFFFFFF
+CANFD_MSG_FLAG_BRS = 0x01
+CANFD_MSG_FLAG_FDF = 0x04
+CANFD_MSG_FLAG_RXD = 0x80
+
+TIMESTAMP_UNIT = 10e-6  # 报文时间戳单位（秒），与 CANFD_MSG 一致
+CANFD_DLC_SIZES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+NRC_SERVICE_NOT_SUPPORTED = 0x11
+NRC_SUB_FUNCTION_NOT_SUPPORTED = 0x12
+NRC_INCORRECT_LENGTH = 0x13
+NRC_REQUEST_SEQUENCE_ERROR = 0x24
+NRC_REQUEST_OUT_OF_RANGE = 0x31
+NRC_INVALID_KEY = 0x35
+NRC_TRANSFER_SUSPENDED = 0x71
+NRC_GENERAL_PROGRAMMING_FAILURE = 0x72
+NRC_WRONG_BLOCK_SEQUENCE_COUNTER = 0x73
+NRC_RESPONSE_PENDING = 0x78
+
+# 与 can_uds 中的返回值定义一致
+CAN_UDS_OK = 0
+CAN_UDS_TIMEOUT_A = -100
+CAN_UDS_TIMEOUT_Bs = -101
+CAN_UDS_TIMEOUT_Cr = -102
+CAN_UDS_WRONG_SN = -103
+CAN_UDS_INVALID_FS = -104
+CAN_UDS_WFT_OVRN = -106
+CAN_UDS_BUFFER_OVFLW = -107
+CAN_UDS_ERROR = -108
+
+
+def _types():
+    """延迟导入报文结构体（usb2can/usb2canfd 依赖 usb_device，不能在模块加载时导入）"""
+    from usb2can import CAN_MSG
+    from usb2canfd import CANFD_MSG
+    return CAN_MSG, CANFD_MSG
+
+
+def _address(p):
+    """取 ctypes 参数（byref、pointer、数组或整数地址）指向的内存地址"""
+    if p is None or isinstance(p, int):
+        return p
+    return cast(p, c_void_p).value
+
+
+def _capacity(p):
+    """未给出缓冲区大小时，按传入数组的长度确定最多可写入的帧数"""
+    obj = getattr(p, "_obj", p)
+    return len(obj) if isinstance(obj, Array) else 1
+
+
+def fd_dlc_size(length):
+    """把数据长度向上取整为CANFD合法的DLC字节数"""
+    for size in CANFD_DLC_SIZES:
+        if size >= length:
+            return size
+    raise ValueError(f"CANFD帧数据长度{length}超过64字节")
+
+
+def stmin_seconds(stmin):
+    """ISO-TP STmin 字节转换为秒：0x00~0x7F 为毫秒，0xF1~0xF9 为100~900微秒，其余按127毫秒处理"""
+    if stmin <= 0x7F:
+        return stmin / 1000.0
+    if 0xF1 <= stmin <= 0xF9:
+        return (stmin - 0xF0) / 10000.0
+    return 0.127
+
+
+class SimFrame:
+    """虚拟总线上传输的报文"""
+    __slots__ = ("id", "data", "extended", "remote", "fd", "brs")
+
+    def __init__(self, id, data, extended=False, remote=False, fd=False, brs=False):
+        self.id = id
+        self.data = bytes(data)
+        self.extended = extended
+        self.remote = remote
+        self.fd = fd
+        self.brs = brs
+
+    def __repr__(self):
+        return f"SimFrame(0x{self.id:X}, {self.data.hex(' ').upper()})"
+
+
+class VirtualBus:
+    """
+    进程内虚拟CAN总线
+    节点通过 attach() 挂到总线上，每帧报文投递给除发送者以外的全部节点，投递时附带到达时间。
+    bitrate 为0时报文立即到达；否则按帧长（不计位填充的近似值）串行占用总线，
+    后发的报文要等前一帧传输结束，从而可以得到接近真实总线的帧率上限。
+    """
+
+    def __init__(self, bitrate=0, data_bitrate=0):
+        self.bitrate = bitrate
+        self.data_bitrate = data_bitrate or bitrate
+        self.nodes = ()
+        self.frames = 0
+        self._busy_until = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, node):
+        with self._lock:
+            self.nodes = self.nodes + (node,)
+
+    def detach(self, node):
+        with self._lock:
+            self.nodes = tuple(n for n in self.nodes if n is not node)
+
+    def frame_time(self, frame):
+        """一帧报文占用总线的时间（秒）"""
+        if not self.bitrate:
+            return 0.0
+        header_bits = 67 if frame.extended else 47
+        data_bits = 8 * len(frame.data)
+        if frame.fd and frame.brs:
+            # 仲裁段按标称波特率，数据段（含CRC）按数据波特率
+            return 30.0 / self.bitrate + (header_bits - 30 + data_bits) / self.data_bitrate
+        return (header_bits + data_bits) / self.bitrate
+
+    def transmit(self, sender, frame, at=None):
+        """
+        发送一帧报文
+        :param at: 开始发送的时间（time.perf_counter()），None 表示立即
+        :return: 报文到达其他节点的时间
+        """
+        start = time.perf_counter() if at is None else at
+        with self._lock:
+            if self.bitrate:
+                start = max(start, self._busy_until)
+                end = start + self.frame_time(frame)
+                self._busy_until = end
+            else:
+                end = start
+            self.frames += 1
+            nodes = self.nodes
+        for node in nodes:
+            if node is not sender:
+                node.deliver(frame, end)
+        return end
+
+
+class _SimChannel:
+    """虚拟适配器的一个CAN通道，接收到的报文按到达时间排队，到达时间之前读不到"""
+
+    def __init__(self, device, index, bus, fd=False):
+        self.device = device
+        self.index = index
+        self.bus = bus
+        self.fd = fd
+        self.tx_frames = 0
+        self.tx_calls = 0
+        self.isotp = None
+        self.schedule = []
+        self.rx_frames = 0
+        self._rx = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        bus.attach(self)
+
+    def deliver(self, frame, t):
+        with self._lock:
+            heapq.heappush(self._rx, (t, next(self._seq), frame))
+
+    def take(self, limit, fd):
+        """取出已到达的报文（最多 limit 帧），CAN模式下丢弃数据超过8字节的CANFD报文"""
+        now = time.perf_counter()
+        frames = []
+        with self._lock:
+            rx = self._rx
+            while rx and rx[0][0] <= now and len(frames) < limit:
+                t, _, frame = heapq.heappop(rx)
+                if not fd and len(frame.data) > 8:
+                    continue
+                frames.append((t, frame))
+        self.rx_frames += len(frames)
+        return frames
+
+    def clear(self):
+        with self._lock:
+            self._rx = []
+
+    def close(self):
+        self.bus.detach(self)
+        if self.isotp is not None:
+            self.isotp.close()
+
+
+class _SimIsoTp:
+    """
+    适配器固件中的ISO-TP收发（CAN_UDS_Request / CAN_UDS_Response），作为独立的接收节点挂在总线上，
+    只接收应答ID的报文，不经过 CAN_GetMsg 的接收队列；发送的报文以所属通道的名义发出
+    """
+    N_BS = 1.0
+    N_CR = 1.0
+    MAX_WAIT_FRAMES = 10
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.bus = channel.bus
+        self.response_id = None
+        self._rx = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.bus.attach(self)
+
+    def deliver(self, frame, t):
+        if frame.id != self.response_id:
+            return
+        with self._cond:
+            heapq.heappush(self._rx, (t, next(self._seq), frame))
+            self._cond.notify_all()
+
+    def listen(self, response_id, clear=False):
+        with self._cond:
+            if clear or response_id != self.response_id:
+                self.response_id = response_id
+                self._rx = []
+
+    def get(self, timeout):
+        """取一帧已到达的应答报文，timeout 秒内没有返回None"""
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while True:
+                now = time.perf_counter()
+                if self._rx and self._rx[0][0] <= now:
+                    return heapq.heappop(self._rx)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._rx:
+                    wait = min(wait, self._rx[0][0] - now)
+                self._cond.wait(wait)
+
+    def transmit(self, request_id, data, extended, fd, brs, at=None):
+        size = fd_dlc_size(len(data)) if fd else 8
+        frame = SimFrame(request_id, bytes(data).ljust(size, b"\x00"), extended, fd=fd, brs=brs)
+        self.channel.tx_frames += 1
+        return self.bus.transmit(self.channel, frame, at)
+
+    def send(self, request_id, payload, extended, fd, brs, max_dlc):
+        """按ISO-TP发送一条请求，等待流控帧并按 BS/STmin 发送连续帧，返回 (CAN_UDS_* 错误码, 最后一帧结束时间)"""
+        length = len(payload)
+        frame_size = max_dlc if fd else 8
+        if length <= 7:
+            return CAN_UDS_OK, self.transmit(request_id, bytes([length]) + payload, extended, fd, brs)
+        if fd and length <= frame_size - 2:
+            return CAN_UDS_OK, self.transmit(request_id, bytes([0x00, length]) + payload, extended, fd, brs)
+        if length <= 0xFFF:
+            header = bytes([0x10 | (length >> 8), length & 0xFF])
+        else:
+            header = bytes([0x10, 0x00]) + length.to_bytes(4, "big")
+        offset = frame_size - len(header)
+        end = self.transmit(request_id, header + payload[:offset], extended, fd, brs)
+        chunk = frame_size - 1
+        sn = 1
+        waits = 0
+        while offset < length:
+            fc = self.get(max(0.0, end - time.perf_counter()) + self.N_BS)
+            if fc is None:
+                return CAN_UDS_TIMEOUT_Bs, end
+            if fc.data[0] >> 4 != 0x3:
+                continue
+            status = fc.data[0] & 0x0F
+            if status == 0x1:
+                waits += 1
+                if waits > self.MAX_WAIT_FRAMES:
+                    return CAN_UDS_WFT_OVRN, end
+                continue
+            if status == 0x2:
+                return CAN_UDS_BUFFER_OVFLW, end
+            if status != 0x0:
+                return CAN_UDS_INVALID_FS, end
+            waits = 0
+            block_size = fc.data[1] if len(fc.data) > 1 else 0
+            gap = stmin_seconds(fc.data[2]) if len(fc.data) > 2 else 0.0
+            at = time.perf_counter()
+            sent = 0
+            while offset < length and (block_size == 0 or sent < block_size):
+                end = self.transmit(request_id, bytes([0x20 | sn]) + payload[offset:offset + chunk], extended, fd, brs, at)
+                at = end + gap
+                offset += chunk
+                sn = (sn + 1) & 0x0F
+                sent += 1
+        return CAN_UDS_OK, end
+
+    def receive(self, request_id, extended, fd, brs, timeout):
+        """接收一条应答，多帧应答时回复流控帧（BS=0, STmin=0），返回 bytes 或 CAN_UDS_* 错误码"""
+        frame = None
+        deadline = time.perf_counter() + timeout
+        while frame is None or frame.data[0] >> 4 not in (0x0, 0x1):
+            frame = self.get(deadline - time.perf_counter())
+            if frame is None:
+                return CAN_UDS_TIMEOUT_A
+        data = frame.data
+        if data[0] >> 4 == 0x0:
+            length = data[0] & 0x0F
+            return data[2:2 + data[1]] if length == 0 and len(data) > 8 else data[1:1 + length]
+        length = ((data[0] & 0x0F) << 8) | data[1]
+        start = 2
+        if length == 0:
+            length = int.from_bytes(data[2:6], "big")
+            start = 6
+        buffer = bytearray(data[start:])
+        self.transmit(request_id, bytes([0x30, 0, 0]), extended, fd, brs)
+        sn = 1
+        while len(buffer) < length:
+            cf = self.get(self.N_CR)
+            if cf is None:
+                return CAN_UDS_TIMEOUT_Cr
+            if cf.data[0] >> 4 != 0x2:
+                continue
+            if cf.data[0] & 0x0F != sn:
+                return CAN_UDS_WRONG_SN
+            buffer.extend(cf.data[1:])
+            sn = (sn + 1) & 0x0F
+        return bytes(buffer[:length])
+
+    def close(self):
+        self.bus.detach(self)
+
+
+class _SimDevice:
+    def __init__(self, handle):
+        self.handle = handle
+        self.opened = False
+        self.channels = {}
+        self.timestamp_base = time.perf_counter()
+
+    def timestamp(self, t):
+        return max(0, int((t - self.timestamp_base) / TIMESTAMP_UNIT))
+
+
+class SimUSB2XXXLib:
+    """
+    模拟的 USB2XXX 函数库，函数名和参数与 USB2XXX.dll 一致，可直接作为 usb_device.USB2XXXLib 使用
+    同一编号的CAN通道（所有虚拟适配器）挂在同一条虚拟总线上，ecu_channels 中的每条总线各挂一个虚拟ECU
+    """
+
+    def __init__(self, device_count=1, bitrate=0, data_bitrate=0, ecu_latency=0.001,
+                 ecu_channels=(0, 1), blocking_send=True, usb_latency=0.0):
+        """
+        :param device_count: 虚拟适配器数量
+        :param bitrate: 虚拟总线仲裁段波特率，0 表示不计传输时间
+        :param data_bitrate: CANFD数据段波特率
+        :param ecu_latency: 虚拟ECU应答延迟（秒）
+        :param ecu_channels: 挂有虚拟ECU的通道
+        :param blocking_send: True-CAN_SendMsg 等到最后一帧传输结束才返回（与硬件一致）
+        :param usb_latency: 每次 CAN_SendMsg / CAN_GetMsg 等收发调用的USB传输耗时（秒），与一次提交的帧数无关
+        schedule_supported 设为 False 时调度表函数返回 CAN_ERR_NOT_SUPPORT，模拟不支持调度表的适配器
+        """
+        self.bitrate = bitrate
+        self.data_bitrate = data_bitrate
+        self.blocking_send = blocking_send
+        self.usb_latency = usb_latency
+        self.schedule_supported = True
+        self.buses = {}
+        self.devices = {}
+        self.ecus = {}
+        self._lock = threading.Lock()
+        for i in range(device_count):
+            handle = 0x5A000001 + i
+            self.devices[handle] = _SimDevice(handle)
+        for channel in ecu_channels:
+            self.add_ecu(channel, latency=ecu_latency)
+
+    def bus(self, channel):
+        """取（不存在时创建）第 channel 路CAN对应的虚拟总线"""
+        with self._lock:
+            bus = self.buses.get(channel)
+            if bus is None:
+                bus = self.buses[channel] = VirtualBus(self.bitrate, self.data_bitrate)
+            return bus
+
+    def add_ecu(self, channel=0, **kwargs):
+        """在第 channel 路虚拟总线上增加一个虚拟ECU，kwargs 见 VirtualECU"""
+        ecu = VirtualECU(self.bus(channel), **kwargs)
+        self.ecus[channel] = ecu
+        return ecu
+
+    def _channel(self, DevHandle, CANIndex, fd=None):
+        device = self.devices.get(int(DevHandle))
+        if device is None:
+            return None
+        channel = device.channels.get(int(CANIndex))
+        if channel is None and fd is not None:
+            channel = device.channels[int(CANIndex)] = _SimChannel(device, int(CANIndex), self.bus(int(CANIndex)), fd)
+        elif channel is not None and fd is not None:
+            channel.fd = fd
+        return channel
+
+    def _usb_transaction(self):
+        if self.usb_latency:
+            time.sleep(self.usb_latency)
+
+    def _wait_sent(self, end):
+        if self.blocking_send:
+            remaining = end - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def not_supported(*args):
+            return CAN_ERR_NOT_SUPPORT
+        not_supported.__name__ = name
+        return not_supported
+
+    # ---------------- 设备操作 ----------------
+    def USB_ScanDevice(self, pDevHandle):
+        handles = sorted(self.devices)
+        if pDevHandle is not None:
+            array = (c_uint * len(handles)).from_address(_address(pDevHandle))
+            for i, handle in enumerate(handles):
+                array[i] = handle
+        return len(handles)
+
+    def USB_OpenDevice(self, DevHandle):
+        device = self.devices.get(int(DevHandle))
+        if device is None:
+            return 0
+        device.opened = True
+        return 1
+
+    def USB_ResetDevice(self, DevHandle):
+        return 1 if int(DevHandle) in self.devices else 0
+
+    def USB_CloseDevice(self, DevHandle):
+        device = self.devices.get(int(DevHandle))
+        if device is None:
+            return 0
+        for channel in device.channels.values():
+            channel.close()
+        device.channels.clear()
+        device.opened = False
+        return 1
+
+    def DEV_GetDeviceInfo(self, DevHandle, pDevInfo, pFunctionStr):
+        from usb_device import DEVICE_INFO
+        if int(DevHandle) not in self.devices:
+            return 0
+        if pDevInfo is not None:
+            info = DEVICE_INFO.from_address(_address(pDevInfo))
+            info.FirmwareName = b"USB2XXX Simulator"
+            info.BuildDate = b"SIM"
+            info.HardwareVersion = 0x01000000
+            info.FirmwareVersion = 0x01000000
+            info.SerialNumber[0] = int(DevHandle)
+            info.SerialNumber[1] = 0
+            info.SerialNumber[2] = 0
+            info.Functions = 0
+        if pFunctionStr is not None:
+            text = b"CAN,CANFD\x00"
+            memmove(_address(pFunctionStr), text, len(text))
+        return 1
+
+    def DEV_GetTimestamp(self, DevHandle, BusType, pTimestamp):
+        device = self.devices.get(int(DevHandle))
+        if device is None:
+            return CAN_ERR_CMD_FAIL
+        c_uint.from_address(_address(pTimestamp)).value = device.timestamp(time.perf_counter()) & 0xFFFFFFFF
+        return CAN_SUCCESS
+
+    def DEV_ResetTimestamp(self, DevHandle):
+        device = self.devices.get(int(DevHandle))
+        if device is None:
+            return CAN_ERR_CMD_FAIL
+        device.timestamp_base = time.perf_counter()
+        return CAN_SUCCESS
+
+    # ---------------- CAN ----------------
+    def CAN_Init(self, DevHandle, CANIndex, pCanConfig):
+        return CAN_SUCCESS if self._channel(DevHandle, CANIndex, fd=False) else CAN_ERR_CMD_FAIL
+
+    def CAN_Filter_Init(self, DevHandle, CANIndex, pFilterConfig):
+        return CAN_SUCCESS
+
+    def CAN_StartGetMsg(self, DevHandle, CANIndex):
+        return CAN_SUCCESS
+
+    def CAN_StopGetMsg(self, DevHandle, CANIndex):
+        return CAN_SUCCESS
+
+    def CAN_SendMsg(self, DevHandle, CANIndex, pCanSendMsg, SendMsgNum):
+        CAN_MSG, _ = _types()
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        end = 0.0
+        for msg in (CAN_MSG * SendMsgNum).from_address(_address(pCanSendMsg)):
+            end = channel.bus.transmit(channel, self._can_frame(msg))
+        channel.tx_frames += SendMsgNum
+        channel.tx_calls += 1
+        self._wait_sent(end)
+        return SendMsgNum
+
+    def CAN_GetMsg(self, DevHandle, CANIndex, pCanGetMsg):
+        return self.CAN_GetMsgWithSize(DevHandle, CANIndex, pCanGetMsg, _capacity(pCanGetMsg))
+
+    def CAN_GetMsgWithSize(self, DevHandle, CANIndex, pCanGetMsg, BufferSize):
+        CAN_MSG, _ = _types()
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        frames = channel.take(BufferSize, fd=False)
+        if not frames:
+            time.sleep(0)  # 真实库函数经 ctypes 调用时会释放GIL，空读时让出GIL，避免轮询线程拖慢等待应答的线程
+            return 0
+        device = channel.device
+        for msg, (t, frame) in zip((CAN_MSG * len(frames)).from_address(_address(pCanGetMsg)), frames):
+            timestamp = device.timestamp(t)
+            msg.ID = frame.id
+            msg.TimeStamp = timestamp & 0xFFFFFFFF
+            msg.TimeStampHigh = (timestamp >> 32) & 0xFF
+            msg.RemoteFlag = frame.remote
+            msg.ExternFlag = frame.extended
+            msg.DataLen = len(frame.data)
+            msg.Data[:] = frame.data.ljust(8, b"\x00")
+        return len(frames)
+
+    def CAN_ClearMsg(self, DevHandle, CANIndex):
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        channel.clear()
+        return CAN_SUCCESS
+
+    def CAN_GetStatus(self, DevHandle, CANIndex, pCANStatus):
+        from usb2can import CAN_STATUS
+        memset(_address(pCANStatus), 0, sizeof(CAN_STATUS))
+        return CAN_SUCCESS
+
+    # ---------------- 调度表 ----------------
+    @staticmethod
+    def _can_frame(msg):
+        return SimFrame(msg.ID, bytes(msg.Data)[:min(msg.DataLen, 8)], bool(msg.ExternFlag), bool(msg.RemoteFlag))
+
+    @staticmethod
+    def _canfd_frame(msg):
+        return SimFrame(msg.ID & CANFD_MSG_FLAG_ID_MASK, bytes(msg.Data)[:min(msg.DLC, 64)],
+                        bool(msg.ID & CANFD_MSG_FLAG_IDE), bool(msg.ID & CANFD_MSG_FLAG_RTR),
+                        bool(msg.Flags & CANFD_MSG_FLAG_FDF), bool(msg.Flags & CANFD_MSG_FLAG_BRS))
+
+    def _set_schedule(self, DevHandle, CANIndex, msg_type, to_frame, pCanMsgTab, pMsgNum, pSendTimes, MsgTabNum):
+        """保存调度表：[(报文列表, 每帧之后的间隔毫秒列表, 发送次数)]，报文的 TimeStamp 为间隔"""
+        if not self.schedule_supported:
+            return CAN_ERR_NOT_SUPPORT
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        counts = list((c_ubyte * MsgTabNum).from_address(_address(pMsgNum)))
+        send_times = list((c_ushort * MsgTabNum).from_address(_address(pSendTimes)))
+        msgs = (msg_type * sum(counts)).from_address(_address(pCanMsgTab))
+        tables = []
+        index = 0
+        for count, times in zip(counts, send_times):
+            table = msgs[index:index + count]
+            tables.append(([to_frame(m) for m in table], [m.TimeStamp for m in table], times))
+            index += count
+        channel.schedule = tables
+        channel.tx_calls += 1
+        return CAN_SUCCESS
+
+    def _start_schedule(self, DevHandle, CANIndex, MsgTabIndex, TimePrecMs, OrderSend):
+        """
+        按顺序发送调度表（只模拟 OrderSend=1）：每帧传输结束后间隔 TimeStamp 毫秒（按 TimePrecMs 向上取整）
+        再发送下一帧，报文按预定时间投递到总线，函数立即返回，与适配器在后台发送一致
+        """
+        if not self.schedule_supported:
+            return CAN_ERR_NOT_SUPPORT
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None or MsgTabIndex >= len(channel.schedule):
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        frames, intervals, send_times = channel.schedule[MsgTabIndex]
+        precision = max(1, TimePrecMs)
+        at = time.perf_counter()
+        for _ in range(send_times):
+            for frame, interval in zip(frames, intervals):
+                end = channel.bus.transmit(channel, frame, at)
+                at = end + -(-interval // precision) * precision / 1000.0
+        channel.tx_frames += len(frames) * send_times
+        channel.tx_calls += 1
+        return CAN_SUCCESS
+
+    def CAN_SetSchedule(self, DevHandle, CANIndex, pCanMsgTab, pMsgNum, pSendTimes, MsgTabNum):
+        CAN_MSG, _ = _types()
+        return self._set_schedule(DevHandle, CANIndex, CAN_MSG, self._can_frame, pCanMsgTab, pMsgNum, pSendTimes,
+                                  MsgTabNum)
+
+    def CAN_StartSchedule(self, DevHandle, CANIndex, MsgTabIndex, TimePrecMs, OrderSend):
+        return self._start_schedule(DevHandle, CANIndex, MsgTabIndex, TimePrecMs, OrderSend)
+
+    def CAN_StopSchedule(self, DevHandle, CANIndex):
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        channel.schedule = []
+        return CAN_SUCCESS
+
+    def CANFD_SetSchedule(self, DevHandle, CANIndex, pCanMsgTab, pMsgNum, pSendTimes, MsgTabNum):
+        _, CANFD_MSG = _types()
+        return self._set_schedule(DevHandle, CANIndex, CANFD_MSG, self._canfd_frame, pCanMsgTab, pMsgNum, pSendTimes,
+                                  MsgTabNum)
+
+    def CANFD_StartSchedule(self, DevHandle, CANIndex, MsgTabIndex, TimePrecMs, OrderSend):
+        return self._start_schedule(DevHandle, CANIndex, MsgTabIndex, TimePrecMs, OrderSend)
+
+    def CANFD_StopSchedule(self, DevHandle, CANIndex):
+        return self.CAN_StopSchedule(DevHandle, CANIndex)
+
+    # ---------------- CANFD ----------------
+    def CANFD_Init(self, DevHandle, CANIndex, pCanConfig):
+        return CAN_SUCCESS if self._channel(DevHandle, CANIndex, fd=True) else CAN_ERR_CMD_FAIL
+
+    def CANFD_StartGetMsg(self, DevHandle, CANIndex):
+        return CAN_SUCCESS
+
+    def CANFD_StopGetMsg(self, DevHandle, CANIndex):
+        return CAN_SUCCESS
+
+    def CANFD_SetFilter(self, DevHandle, CANIndex, pCanFilter, Len):
+        return CAN_SUCCESS
+
+    def CANFD_SendMsg(self, DevHandle, CANIndex, pCanSendMsg, SendMsgNum):
+        _, CANFD_MSG = _types()
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        end = 0.0
+        for msg in (CANFD_MSG * SendMsgNum).from_address(_address(pCanSendMsg)):
+            end = channel.bus.transmit(channel, self._canfd_frame(msg))
+        channel.tx_frames += SendMsgNum
+        channel.tx_calls += 1
+        self._wait_sent(end)
+        return SendMsgNum
+
+    def CANFD_GetMsg(self, DevHandle, CANIndex, pCanGetMsg, BufferSize):
+        _, CANFD_MSG = _types()
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return CAN_ERR_CMD_FAIL
+        self._usb_transaction()
+        frames = channel.take(BufferSize, fd=True)
+        if not frames:
+            time.sleep(0)
+            return 0
+        device = channel.device
+        for msg, (t, frame) in zip((CANFD_MSG * len(frames)).from_address(_address(pCanGetMsg)), frames):
+            timestamp = device.timestamp(t)
+            msg.ID = (frame.id | (CANFD_MSG_FLAG_IDE if frame.extended else 0)
+                      | (CANFD_MSG_FLAG_RTR if frame.remote else 0))
+            msg.DLC = len(frame.data)
+            msg.Flags = (CANFD_MSG_FLAG_RXD | (CANFD_MSG_FLAG_FDF if frame.fd else 0)
+                         | (CANFD_MSG_FLAG_BRS if frame.brs else 0) | ((channel.index & 0x03) << 5))
+            msg.TimeStamp = timestamp & 0xFFFFFFFF
+            msg.TimeStampHigh = (timestamp >> 32) & 0xFF
+            msg.Data[:] = frame.data.ljust(64, b"\x00")
+        return len(frames)
+
+    def CANFD_GetDiagnostic(self, DevHandle, CANIndex, pCanDiagnostic):
+        from usb2canfd import CANFD_DIAGNOSTIC
+        memset(_address(pCanDiagnostic), 0, sizeof(CANFD_DIAGNOSTIC))
+        return CAN_SUCCESS
+
+    def CANFD_GetBusError(self, DevHandle, CANIndex, pCanBusError):
+        from usb2canfd import CANFD_BUS_ERROR
+        memset(_address(pCanBusError), 0, sizeof(CANFD_BUS_ERROR))
+        return CAN_SUCCESS
+
+    # ---------------- CAN UDS（适配器固件ISO-TP） ----------------
+    def _uds_node(self, DevHandle, CANIndex, pUDSAddr, new_request=False):
+        from can_uds import CAN_UDS_ADDR
+        channel = self._channel(DevHandle, CANIndex)
+        if channel is None:
+            return None, None
+        addr = CAN_UDS_ADDR.from_address(_address(pUDSAddr))
+        if addr.AddrFormats != 0:
+            return None, None  # 只模拟 normal 寻址
+        if channel.isotp is None:
+            channel.isotp = _SimIsoTp(channel)
+        channel.isotp.listen(addr.ResID, clear=new_request)
+        return channel.isotp, addr
+
+    def CAN_UDS_Request(self, DevHandle, CANIndex, pUDSAddr, pReqData, DataLen):
+        node, addr = self._uds_node(DevHandle, CANIndex, pUDSAddr, new_request=True)
+        if node is None:
+            return CAN_UDS_ERROR
+        self._usb_transaction()
+        payload = bytes((c_ubyte * DataLen).from_address(_address(pReqData)))
+        ret, end = node.send(addr.ReqID, payload, bool(addr.Flag & 0x01), bool(addr.Flag & 0x02),
+                             bool(addr.Flag & 0x04), addr.MaxDLC or 8)
+        node.channel.tx_calls += 1
+        self._wait_sent(end)
+        return ret
+
+    def CAN_UDS_Response(self, DevHandle, CANIndex, pUDSAddr, pResData, TimeOutMs):
+        node, addr = self._uds_node(DevHandle, CANIndex, pUDSAddr)
+        if node is None:
+            return CAN_UDS_ERROR
+        self._usb_transaction()
+        data = node.receive(addr.ReqID, bool(addr.Flag & 0x01), bool(addr.Flag & 0x02), bool(addr.Flag & 0x04),
+                            TimeOutMs / 1000.0)
+        if isinstance(data, int):
+            return data
+        if len(data) > _capacity(pResData):
+            return CAN_UDS_BUFFER_OVFLW
+        memmove(_address(pResData), data, len(data))
+        return len(data)
+
+
+class _Download:
+    """0x34 请求下载建立的传输状态"""
+
+    def __init__(self, address, size, data_format):
+        self.address = address
+        self.size = size
+        self.data_format = data_format
+        self.data = bytearray()
+        self.next_bsc = 1
+
+
+class VirtualECU:
+    """
+    虚拟ECU，挂在虚拟总线上，按ISO-TP（CAN 8字节 / CANFD 64字节）接收请求并应答
+    默认支持刷写流程用到的服务：0x10 0x11 0x14 0x22 0x27 0x28 0x2E 0x31 0x34 0x36 0x37 0x3E 0x85
+    可编程部分：
+        latency         ：应答延迟（秒），service_latency 可按服务单独设置
+        pending         ：{服务ID: 次数}，最终应答前先回若干次 NRC 0x78，间隔 pending_interval
+        script()        ：按请求前缀返回固定应答（bytes）、不应答（None）或由函数生成应答
+        handlers        ：{服务ID: 函数(payload) -> 应答}，可替换或增加服务
+        routine_results ：{例程ID: 状态字节}，默认返回 0x00（成功）
+        key_func        ：key_func(seed, level) 计算期望的密钥，None 表示接受任意密钥
+        strict          ：True 时对格式不正确的 0x34 / 超长的 0x36 返回 NRC 0x13
+        block_size/stmin：接收多帧请求时流控帧给出的 BS 和 STmin，连续帧间隔小于 STmin 计入 stats["stmin_violations"]，
+                          同一块内相邻连续帧的到达间隔累计在 stats["cf_gap_total"]（秒）/ stats["cf_gaps"]（次数）
+        fc_wait         ：每个流控帧 CTS 之前先发送的 WAIT 流控帧个数，间隔 fc_wait_interval
+        rx_buffer_size  ：多帧请求的最大长度，超过时以流控帧 OVFLW 拒绝，None 表示不限制
+        compression_methods：支持的压缩方法ID（dataFormatIdentifier 高4位），其它ID的 0x34 以 NRC 0x31 拒绝，
+                          压缩下载的数据在 0x37 时解压后保存
+    下载的数据按 0x34 的起始地址保存在 memory 中，擦除记录在 erased 中，read_memory 按擦除和下载的先后顺序读出flash内容
+    """
+
+    def __init__(self, bus, request_ids=(0x713, 0x7DF), response_id=0x71B, latency=0.001,
+                 p2=0.05, p2_star=5.0, max_block_length=0x402, block_size=0, stmin=0,
+                 key_func=None, strict=False):
+        self.bus = bus
+        self.request_ids = frozenset(request_ids)
+        self.response_id = response_id
+        self.latency = latency
+        self.service_latency = {}
+        self.pending = {}
+        self.pending_interval = 0.05
+        self.p2 = p2
+        self.p2_star = p2_star
+        self.max_block_length = max_block_length
+        self.block_size = block_size
+        self.stmin = stmin
+        self.key_func = key_func
+        self.strict = strict
+        self.fc_wait = 0
+        self.fc_wait_interval = 0.01
+        self.rx_buffer_size = None
+        self.compression_methods = {0x1, 0x2}
+        self.session = 0x01
+        self.security_level = 0
+        self.dids = {0xF190: b"SIMVIN00000000000", 0xF195: b"SIM-1.0"}
+        self.routine_results = {}
+        self.memory = {}
+        self.erased = []
+        self._flash_log = []
+        self.download = None
+        self.stats = {"requests": 0, "rx_frames": 0, "tx_frames": 0, "bytes_downloaded": 0, "sequence_errors": 0,
+                      "stmin_violations": 0, "cf_gap_total": 0.0, "cf_gaps": 0}
+        self.handlers = {
+            0x10: self._session_control,
+            0x11: self._ecu_reset,
+            0x14: self._clear_dtc,
+            0x22: self._read_did,
+            0x27: self._security_access,
+            0x28: self._communication_control,
+            0x2E: self._write_did,
+            0x31: self._routine_control,
+            0x34: self._request_download,
+            0x36: self._transfer_data,
+            0x37: self._transfer_exit,
+            0x3E: self._tester_present,
+            0x85: self._control_dtc_setting,
+        }
+        self._scripts = []
+        self._seed = None
+        self._rx = None
+        self._tx = None
+        self._lock = threading.RLock()
+        bus.attach(self)
+
+    def script(self, request_prefix, response):
+        """请求以 request_prefix 开头时返回 response（bytes / None 不应答 / 函数(payload)->bytes），后设置的优先"""
+        with self._lock:
+            self._scripts.insert(0, (bytes(request_prefix), response))
+
+    def clear_scripts(self):
+        with self._lock:
+            self._scripts = []
+
+    def image(self):
+        """已下载的数据 {起始地址: bytes}"""
+        with self._lock:
+            return dict(self.memory)
+
+    def read_memory(self, address, size, fill=0xFF):
+        """按擦除和下载的先后顺序读出 address 起 size 字节的flash内容，未写入的字节为 fill"""
+        flash = bytearray([fill]) * size
+        with self._lock:
+            log = list(self._flash_log)
+        for start, length, data in log:
+            lo, hi = max(start, address), min(start + length, address + size)
+            if lo < hi:
+                flash[lo - address:hi - address] = data[lo - start:hi - start] if data is not None else bytes(
+                    [fill]) * (hi - lo)
+        return bytes(flash)
+
+    def close(self):
+        self.bus.detach(self)
+
+    # ---------------- ISO-TP ----------------
+    def deliver(self, frame, t):
+        if frame.id not in self.request_ids or not frame.data:
+            return
+        with self._lock:
+            self.stats["rx_frames"] += 1
+            data = frame.data
+            pci = data[0] >> 4
+            if pci == 0x0:
+                length = data[0] & 0x0F
+                if length == 0 and len(data) > 8:
+                    payload = data[2:2 + data[1]]
+                else:
+                    payload = data[1:1 + length]
+                if payload:
+                    self._handle_request(payload, frame.fd, t)
+            elif pci == 0x1:
+                length = ((data[0] & 0x0F) << 8) | data[1]
+                start = 2
+                if length == 0:
+                    length = int.from_bytes(data[2:6], "big")
+                    start = 6
+                if self.rx_buffer_size is not None and length > self.rx_buffer_size:
+                    self._rx = None
+                    self._transmit(bytes([0x32, 0, 0]), frame.fd, t + self.latency)
+                    return
+                self._rx = [bytearray(data[start:]), length, 1, 0, frame.fd, None]
+                self._send_flow_control(frame.fd, t + self.latency)
+            elif pci == 0x2:
+                rx = self._rx
+                if rx is None:
+                    return
+                buffer, length, next_sn, block_count, fd, last_cf = rx
+                if (data[0] & 0x0F) != next_sn:
+                    # 序号错误，丢弃本次多帧接收
+                    self.stats["sequence_errors"] += 1
+                    self._rx = None
+                    return
+                if last_cf is not None:
+                    if t - last_cf < stmin_seconds(self.stmin) - 1e-6:
+                        self.stats["stmin_violations"] += 1
+                    self.stats["cf_gap_total"] += t - last_cf
+                    self.stats["cf_gaps"] += 1
+                rx[5] = t
+                buffer.extend(data[1:])
+                if len(buffer) >= length:
+                    self._rx = None
+                    self._handle_request(bytes(buffer[:length]), fd, t)
+                    return
+                rx[2] = (next_sn + 1) & 0x0F
+                rx[3] = block_count + 1
+                if self.block_size and rx[3] >= self.block_size:
+                    rx[3] = 0
+                    rx[5] = None
+                    self._send_flow_control(fd, t + self.latency)
+            elif pci == 0x3:
+                self._on_flow_control(data, t)
+
+    def _frame(self, data, fd):
+        size = fd_dlc_size(len(data)) if fd else 8
+        return SimFrame(self.response_id, bytes(data).ljust(size, b"\x00"), fd=fd, brs=fd)
+
+    def _transmit(self, data, fd, at):
+        self.stats["tx_frames"] += 1
+        return self.bus.transmit(self, self._frame(data, fd), at)
+
+    def _send_flow_control(self, fd, at):
+        for _ in range(self.fc_wait):
+            self._transmit(bytes([0x31, 0, 0]), fd, at)
+            at += self.fc_wait_interval
+        self._transmit(bytes([0x30, self.block_size, self.stmin]), fd, at)
+
+    def _send_payload(self, payload, fd, at):
+        length = len(payload)
+        if length <= 7:
+            self._transmit(bytes([length]) + payload, fd, at)
+            return
+        if fd and length <= 62:
+            self._transmit(bytes([0x00, length]) + payload, fd, at)
+            return
+        frame_size = 64 if fd else 8
+        if length <= 0xFFF:
+            header = bytes([0x10 | (length >> 8), length & 0xFF])
+        else:
+            header = bytes([0x10, 0x00]) + length.to_bytes(4, "big")
+        first = frame_size - len(header)
+        self._transmit(header + payload[:first], fd, at)
+        # 剩余数据等测试端的流控帧
+        self._tx = [payload, first, 1, fd]
+
+    def _on_flow_control(self, data, t):
+        tx = self._tx
+        if tx is None:
+            return
+        status = data[0] & 0x0F
+        if status == 0x1:
+            return  # WAIT，等下一个流控帧
+        if status != 0x0:
+            self._tx = None  # OVFLW 或非法状态，放弃发送
+            return
+        block_size = data[1] if len(data) > 1 else 0
+        gap = stmin_seconds(data[2]) if len(data) > 2 else 0.0
+        payload, offset, sn, fd = tx
+        chunk = 63 if fd else 7
+        at = t + self.latency
+        sent = 0
+        while offset < len(payload):
+            self._transmit(bytes([0x20 | sn]) + payload[offset:offset + chunk], fd, at)
+            offset += chunk
+            sn = (sn + 1) & 0x0F
+            sent += 1
+            at += gap
+            if block_size and sent >= block_size:
+                break
+        if offset >= len(payload):
+            self._tx = None
+        else:
+            tx[1] = offset
+            tx[2] = sn
+
+    # ---------------- UDS ----------------
+    def _handle_request(self, payload, fd, t):
+        self.stats["requests"] += 1
+        sid = payload[0]
+        response = None
+        for prefix, scripted in self._scripts:
+            if payload.startswith(prefix):
+                response = scripted(payload) if callable(scripted) else scripted
+                break
+        else:
+            handler = self.handlers.get(sid)
+            response = handler(payload) if handler else self._nrc(sid, NRC_SERVICE_NOT_SUPPORTED)
+        at = t + self.service_latency.get(sid, self.latency)
+        for _ in range(self.pending.get(sid, 0)):
+            self._send_payload(self._nrc(sid, NRC_RESPONSE_PENDING), fd, at)
+            at += self.pending_interval
+        if response is not None:
+            self._send_payload(bytes(response), fd, at)
+
+    @staticmethod
+    def _nrc(sid, code):
+        return bytes([0x7F, sid, code])
+
+    @staticmethod
+    def _suppressed(payload):
+        """子功能 bit7（suppressPosRspMsgIndicationBit）置位时不回正响应"""
+        return len(payload) > 1 and payload[1] & 0x80
+
+    def _session_control(self, payload):
+        if len(payload) < 2:
+            return self._nrc(0x10, NRC_INCORRECT_LENGTH)
+        session = payload[1] & 0x7F
+        if session not in (0x01, 0x02, 0x03):
+            return self._nrc(0x10, NRC_SUB_FUNCTION_NOT_SUPPORTED)
+        if session != self.session:
+            self.security_level = 0
+            self.download = None
+        self.session = session
+        if self._suppressed(payload):
+            return None
+        p2 = int(self.p2 * 1000)
+        p2_star = int(self.p2_star * 100)
+        return bytes([0x50, session]) + p2.to_bytes(2, "big") + p2_star.to_bytes(2, "big")
+
+    def _ecu_reset(self, payload):
+        self.session = 0x01
+        self.security_level = 0
+        self.download = None
+        if self._suppressed(payload):
+            return None
+        return bytes([0x51, payload[1] & 0x7F if len(payload) > 1 else 0x01])
+
+    def _clear_dtc(self, payload):
+        return b"\x54"
+
+    def _tester_present(self, payload):
+        return None if self._suppressed(payload) else b"\x7E\x00"
+
+    def _read_did(self, payload):
+        if len(payload) < 3:
+            return self._nrc(0x22, NRC_INCORRECT_LENGTH)
+        did = (payload[1] << 8) | payload[2]
+        value = self.dids.get(did)
+        if value is None:
+            return self._nrc(0x22, NRC_REQUEST_OUT_OF_RANGE)
+        return bytes([0x62]) + payload[1:3] + bytes(value)
+
+    def _write_did(self, payload):
+        if len(payload) < 4:
+            return self._nrc(0x2E, NRC_INCORRECT_LENGTH)
+        self.dids[(payload[1] << 8) | payload[2]] = bytes(payload[3:])
+        return bytes([0x6E]) + payload[1:3]
+
+    def _security_access(self, payload):
+        if len(payload) < 2:
+            return self._nrc(0x27, NRC_INCORRECT_LENGTH)
+        level = payload[1] & 0x7F
+        if level & 0x01:
+            # 请求种子，已解锁时种子为全0
+            self._seed = bytes(4) if self.security_level == level else os.urandom(4)
+            return bytes([0x67, level]) + self._seed
+        if self._seed is None:
+            return self._nrc(0x27, NRC_REQUEST_SEQUENCE_ERROR)
+        seed, self._seed = self._seed, None
+        if self.key_func is not None and bytes(payload[2:]) != bytes(self.key_func(seed, level - 1)):
+            return self._nrc(0x27, NRC_INVALID_KEY)
+        self.security_level = level - 1
+        return bytes([0x67, level])
+
+    def _communication_control(self, payload):
+        return None if self._suppressed(payload) else bytes([0x68, payload[1] & 0x7F if len(payload) > 1 else 0])
+
+    def _control_dtc_setting(self, payload):
+        return None if self._suppressed(payload) else bytes([0xC5, payload[1] & 0x7F if len(payload) > 1 else 0])
+
+    def _routine_control(self, payload):
+        if len(payload) < 4:
+            return self._nrc(0x31, NRC_INCORRECT_LENGTH)
+        routine_id = (payload[2] << 8) | payload[3]
+        if routine_id == 0xFF00:
+            # 擦除：[ALFID] + 地址 + 长度，不带ALFID时按4字节地址 + 4字节长度
+            option = payload[4:]
+            if len(option) == 8:
+                address, size = int.from_bytes(option[:4], "big"), int.from_bytes(option[4:], "big")
+            elif option:
+                address_len, size_len = option[0] & 0x0F, option[0] >> 4
+                address = int.from_bytes(option[1:1 + address_len], "big")
+                size = int.from_bytes(option[1 + address_len:1 + address_len + size_len], "big")
+            else:
+                address, size = 0, 0
+            self.erased.append((address, size))
+            self._flash_log.append((address, size, None))
+        result = self.routine_results.get(routine_id, b"\x00")
+        if callable(result):
+            result = result(payload)
+        return bytes([0x71]) + payload[1:4] + bytes(result)
+
+    def _request_download(self, payload):
+        if len(payload) < 3:
+            return self._nrc(0x34, NRC_INCORRECT_LENGTH)
+        data_format = payload[1]
+        address_len, size_len = payload[2] & 0x0F, payload[2] >> 4
+        fields = payload[3:]
+        if len(fields) < address_len + size_len and self.strict:
+            return self._nrc(0x34, NRC_INCORRECT_LENGTH)
+        address = int.from_bytes(fields[:address_len], "big") if fields[:address_len] else 0
+        size_bytes = fields[address_len:address_len + size_len]
+        size = int.from_bytes(size_bytes, "big") if size_bytes else 0
+        if data_format >> 4 and data_format >> 4 not in self.compression_methods:
+            return self._nrc(0x34, NRC_REQUEST_OUT_OF_RANGE)
+        self.download = _Download(address, size, data_format)
+        length_bytes = max(2, (self.max_block_length.bit_length() + 7) // 8)
+        return bytes([0x74, length_bytes << 4]) + self.max_block_length.to_bytes(length_bytes, "big")
+
+    def _transfer_data(self, payload):
+        download = self.download
+        if download is None:
+            return self._nrc(0x36, NRC_REQUEST_SEQUENCE_ERROR)
+        if len(payload) < 2:
+            return self._nrc(0x36, NRC_INCORRECT_LENGTH)
+        if self.strict and len(payload) > self.max_block_length:
+            return self._nrc(0x36, NRC_INCORRECT_LENGTH)
+        bsc = payload[1]
+        if bsc == download.next_bsc:
+            block = payload[2:]
+            if self.strict and download.size and len(download.data) + len(block) > download.size:
+                return self._nrc(0x36, NRC_TRANSFER_SUSPENDED)
+            download.data.extend(block)
+            download.next_bsc = (bsc + 1) & 0xFF
+            self.stats["bytes_downloaded"] += len(block)
+        elif bsc != (download.next_bsc - 1) & 0xFF:
+            # 上一块的重发直接回正响应，其余序号错误
+            return self._nrc(0x36, NRC_WRONG_BLOCK_SEQUENCE_COUNTER)
+        return bytes([0x76, bsc])
+
+    def _transfer_exit(self, payload):
+        download = self.download
+        if download is None:
+            return self._nrc(0x37, NRC_REQUEST_SEQUENCE_ERROR)
+        data = bytes(download.data)
+        if download.data_format >> 4:
+            from FirmwareCompression import decompress
+            try:
+                data = decompress(data, download.data_format >> 4)
+            except Exception:
+                self.download = None
+                return self._nrc(0x37, NRC_GENERAL_PROGRAMMING_FAILURE)
+            if self.strict and download.size and len(data) != download.size:
+                self.download = None
+                return self._nrc(0x37, NRC_GENERAL_PROGRAMMING_FAILURE)
+        self.memory[download.address] = data
+        self._flash_log.append((download.address, len(data), data))
+        self.download = None
+        return b"\x77"
+
+
+if can is not None:
+    class SimCanBus(can.BusABC):
+        """
+        python-can 接口的虚拟总线节点，与模拟适配器的同一路CAN挂在同一条虚拟总线上
+        用于 UDS_OTA_Handler 等基于 python-can / isotp 的代码：UDS_OTA_Handler(..., bus=SimCanBus(0))
+        """
+
+        def __init__(self, channel=0, lib=None, **kwargs):
+            super().__init__(channel=channel, **kwargs)
+            lib = lib or get_sim_lib()
+            self.channel_info = f"USB2XXX simulator: channel {channel}"
+            self._bus = lib.bus(channel)
+            self._rx = []
+            self._seq = itertools.count()
+            self._cond = threading.Condition()
+            self._bus.attach(self)
+
+        def deliver(self, frame, t):
+            with self._cond:
+                heapq.heappush(self._rx, (t, next(self._seq), frame))
+                self._cond.notify_all()
+
+        def send(self, msg, timeout=None):
+            frame = SimFrame(msg.arbitration_id, bytes(msg.data)[:msg.dlc], msg.is_extended_id,
+                             msg.is_remote_frame, msg.is_fd, msg.bitrate_switch)
+            self._bus.transmit(self, frame)
+
+        def _recv_internal(self, timeout=None):
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            with self._cond:
+                while True:
+                    now = time.perf_counter()
+                    rx = self._rx
+                    if rx and rx[0][0] <= now:
+                        t, _, frame = heapq.heappop(rx)
+                        return can.Message(timestamp=t, arbitration_id=frame.id, is_extended_id=frame.extended,
+                                           is_remote_frame=frame.remote, is_fd=frame.fd, bitrate_switch=frame.brs,
+                                           dlc=len(frame.data), data=frame.data, channel=self.channel_info), False
+                    wait = None if deadline is None else deadline - now
+                    if rx:
+                        wait = rx[0][0] - now if wait is None else min(wait, rx[0][0] - now)
+                    if wait is not None and wait <= 0:
+                        return None, False
+                    self._cond.wait(wait)
+
+        def shutdown(self):
+            self._bus.detach(self)
+            super().shutdown()
+
+
+_sim_lib = None
+_sim_lib_lock = threading.Lock()
+
+
+def get_sim_lib():
+    """取进程内唯一的模拟函数库，首次调用时按环境变量创建"""
+    global _sim_lib
+    with _sim_lib_lock:
+        if _sim_lib is None:
+            _sim_lib = SimUSB2XXXLib(
+                bitrate=int(os.environ.get("USB2XXX_SIM_BITRATE", "0")),
+                data_bitrate=int(os.environ.get("USB2XXX_SIM_DATA_BITRATE", "0")),
+                ecu_latency=float(os.environ.get("USB2XXX_SIM_LATENCY_MS", "1")) / 1000.0,
+                usb_latency=float(os.environ.get("USB2XXX_SIM_USB_LATENCY_MS", "0")) / 1000.0,
+            )
+        return _sim_lib